@@ -0,0 +1,177 @@
+#!/usr/bin/env python2.7
+#
+# Helper functions for the launcher-hosted artifact cache. Rather than each node downloading the Puppet
+# repository RPM, the Puppet/EPEL packages and Django from the internet, we prefetch them once into a
+# local cache directory, containing:
+#
+#   rpms/ - a yum repository holding the Puppet repository RPM, plus the packages installed by
+#       puppet.installPuppet and node.pp (and all of their dependencies).
+#   wheels/ - a pip "wheelhouse" holding the Python packages installed by node.pp.
+#
+# During a launch, the cache is served over HTTP from the launcher, and each node reaches it through a
+# reverse SSH tunnel (so the nodes don't need a route back to the launcher). Alternatively, the cache
+# can be published on any web server, and instance.config can point the nodes at its URL.
+#
+# Prefetching the RPMs requires the "yumdownloader" (from yum-utils) and "createrepo" tools, so it should
+# be run on a Centos 7 host with EPEL enabled. Usage:
+#
+#   artifacts.py [--instance-config <file>] [--cache-dir <dir>] prefetch
+#
+import sys, os, argparse, urllib2, subprocess, threading, posixpath, urllib
+import SimpleHTTPServer, SocketServer
+
+# local modules
+import config
+
+# The name of the yum repository (on each node) that points at the cache.
+CACHE_REPO_NAME = "linkoverflow-cache"
+
+# The location of the yum repository file on each node.
+CACHE_REPO_FILE = "/etc/yum.repos.d/" + CACHE_REPO_NAME + ".repo"
+
+#
+# Return the default location of the local artifact cache.
+#
+def getDefaultCacheDir():
+    '''Return the default artifact cache directory, within the local state directory.'''
+    return config.getStatePath("artifacts")
+
+#
+# Download all the artifacts needed to provision a node into cacheDir. This is idempotent: anything that's
+# already in the cache is kept, so it can be re-run to pick up new packages after changing instance.config.
+#
+def prefetch(cacheDir, instanceConfigDict):
+    '''Populate the artifact cache with the RPMs and Python wheels required by Puppet and node.pp.'''
+
+    rpmDir = os.path.join(cacheDir, "rpms")
+    wheelDir = os.path.join(cacheDir, "wheels")
+    for dirName in [rpmDir, wheelDir]:
+        if not os.path.isdir(dirName):
+            os.makedirs(dirName)
+
+    #
+    # First, the Puppet repository RPM (which installPuppet installs directly, by URL).
+    #
+    puppetURL = instanceConfigDict['Puppet_PuppetURL']
+    rpmFile = os.path.join(rpmDir, posixpath.basename(puppetURL))
+    if not os.path.isfile(rpmFile):
+        print "Downloading", puppetURL
+        try:
+            response = urllib2.urlopen(puppetURL)
+            with open(rpmFile + ".tmp", "wb") as outFile:
+                outFile.write(response.read())
+            os.rename(rpmFile + ".tmp", rpmFile)
+        except (urllib2.URLError, IOError) as mesg:
+            raise Exception("Unable to download {0}: {1}".format(puppetURL, mesg))
+
+    #
+    # Next, the RPM packages (and their dependencies), then generate the yum repository metadata.
+    # Finally, build wheels for the Python packages.
+    #
+    __runlocal__(["yumdownloader", "--resolve", "--destdir", rpmDir] + instanceConfigDict['Cache_Packages'])
+    __runlocal__(["createrepo", "--update", "--quiet", rpmDir])
+    __runlocal__(["pip", "wheel", "--wheel-dir", wheelDir] + instanceConfigDict['Cache_PythonPackages'])
+
+def __runlocal__(command):
+    '''Private helper, for running a local command, raising an exception if it fails.'''
+    print " ".join(command)
+    try:
+        status = subprocess.call(command)
+    except OSError as mesg:
+        raise Exception("Unable to run {0}: {1}".format(command[0], mesg))
+    if status != 0:
+        raise Exception("Command ({0}) failed with exit status {1}".format(" ".join(command), status))
+
+#
+# Serve the contents of cacheDir over HTTP, from a background thread. The server only listens on the
+# loopback interface; nodes reach it through the reverse SSH tunnel set up by fabricutils.executeOnHosts.
+# Return the server object (whose port is server.server_address[1]), which the caller should shutdown()
+# once the launch is complete.
+#
+def serveCache(cacheDir):
+    '''Start serving cacheDir over HTTP on a free local port, and return the server.'''
+
+    if not os.path.isdir(os.path.join(cacheDir, "rpms", "repodata")):
+        raise Exception("Artifact cache ({0}) hasn't been prefetched. Run \"artifacts.py prefetch\" first.".format(cacheDir))
+
+    class CacheRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+        '''Request handler that serves files from cacheDir (rather than the current directory).'''
+
+        def translate_path(self, path):
+            path = posixpath.normpath(urllib.unquote(path.split('?', 1)[0].split('#', 1)[0]))
+            return os.path.join(cacheDir, *[word for word in path.split('/') if word not in ('', '.', '..')])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = SocketServer.ThreadingTCPServer(("127.0.0.1", 0), CacheRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+#
+# Tell the Fabric tasks (in this process, and any worker processes forked from it later) to provision
+# from the artifact cache at cacheURL. If tunnelPort is provided, the URL refers to the launcher, and
+# each task runs with a reverse SSH tunnel from tunnelPort on the node back to the launcher.
+#
+def useCache(cacheURL, tunnelPort=None):
+    '''Make subsequent Fabric tasks install their packages from the artifact cache at cacheURL.'''
+    from fabric import api
+    api.env.artifact_cache_url = cacheURL.rstrip("/")
+    api.env.artifact_cache_tunnel_port = tunnelPort
+
+def getCacheURL():
+    '''Return the URL of the artifact cache (as seen from the nodes), or None if we're not using one.'''
+    from fabric import api
+    return api.env.get('artifact_cache_url')
+
+#
+# Return the contents of the yum repository file that points a node at the cache. We skip the repository
+# if it's unavailable, since the tunnel only exists while the launcher is connected (and baked images will
+# contain this file).
+#
+def getCacheRepoConfig(cacheURL):
+    '''Return the text of a yum .repo file for the artifact cache at cacheURL.'''
+    return ("[{0}]\n"
+            "name=LinkOverflow artifact cache\n"
+            "baseurl={1}/rpms\n"
+            "enabled=1\n"
+            "gpgcheck=0\n"
+            "skip_if_unavailable=1\n").format(CACHE_REPO_NAME, cacheURL)
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("artifacts.py"),
+                        usage="%(prog)s [-h] [--instance-config <file>] [--cache-dir <dir>] prefetch",
+                        description="Tool for prefetching the packages needed to provision a node into a local cache")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--cache-dir',
+                        default=None,
+                        help="Specify the location of the artifact cache (default is ~/.linkoverflow/artifacts)")
+    parser.add_argument('command',
+                        choices=['prefetch'],
+                        help="The operation to perform on the cache.")
+    return parser
+
+def main(argv=None):
+    '''Run an artifact cache operation, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        cacheDir = parsedArgs.cache_dir or getDefaultCacheDir()
+        prefetch(cacheDir, instanceConfigDict)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    print "\nArtifact cache in", cacheDir, "is ready. Use \"launch.py --artifact-cache\" to provision from it.\n"
+
+if __name__ == '__main__':
+    main()
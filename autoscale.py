@@ -0,0 +1,550 @@
+#!/usr/bin/env python2.7
+#
+# "autoscale.py" keeps the fleet sized to its load. It runs as a long-lived controller: every interval, it
+# samples the request latency (see prober.py) and CPU utilization of each node, and averages them over the
+# fleet. When the fleet has been overloaded (either metric above its high threshold) for a few samples in a
+# row, it launches more nodes, through the same path as launch.py (aws.launchEC2Instances, then the Puppet and
+# Django phases). When the fleet has been underused (both metrics below their low thresholds) for longer, it
+# drains the most recently added nodes (stopping their web servers gracefully) and terminates them.
+#
+# The gap between the high and low thresholds, and the number of samples in a row each needs, keep the
+# fleet from flapping between sizes. After scaling out, the controller waits (the scale-out cooldown) for the
+# new nodes to take their share of the load before scaling out again, and it waits longer (the scale-in
+# cooldown) after any change before scaling in.
+#
+# The fleet is the running instances started by launch.py (tagged with their launch ID) or by the controller
+# (tagged with the autoscaling group's name, as well as their launch ID), leaving out the nodes of other
+# autoscaling groups (see findFleetInstances). --launch-id limits the launch.py nodes to those of the given
+# launches. If there's a load balancer in front of the fleet (see lb.py), it's pointed at the new nodes once
+# they're serving, and nodes are taken out of it before they're drained. The controller talks to the fleet
+# through a backend, so it can also be run against a simulated fleet with synthetic load (see
+# --simulate), to try out thresholds before using them for real:
+#
+#   autoscale.py [--group <name>] [--launch-id <id>] [--min-nodes <n>] [--max-nodes <n>] [--interval <seconds>]
+#                [--cpu-high <fraction>] [--cpu-low <fraction>] [--latency-high <seconds>] ... <django_proj>
+#   autoscale.py --simulate <seconds:requests/second,...> [--node-capacity <requests/second>] ...
+#
+import sys, os, time, math, argparse
+
+# local modules
+import config, loadtest
+
+# The tag holding the name of the autoscaling group each node belongs to.
+GROUP_TAG = "LinkOverflow:AutoscaleGroup"
+DEFAULT_GROUP = "default"
+
+# Constant: the default scaling policy. CPU utilization is a fraction of the node's CPUs, and latency is the
+# 95th percentile time to first byte (in seconds). The periods are numbers of samples in a row, and the
+# cooldowns are in seconds. At most maxStep nodes are added or removed at once.
+DEFAULT_POLICY = {'minNodes': 1, 'maxNodes': None, 'cpuHigh': 0.70, 'cpuLow': 0.30, 'latencyHigh': 0.5, 'latencyLow': 0.1,
+                  'scaleOutPeriods': 2, 'scaleInPeriods': 5, 'scaleOutCooldown': 300, 'scaleInCooldown': 600, 'maxStep': 10}
+DEFAULT_INTERVAL = 60
+
+# The number of latency samples taken from each node, each time the fleet is sampled.
+LATENCY_SAMPLES = 3
+
+# The command each node runs to measure its CPU utilization: its CPU times, a second apart.
+CPU_SAMPLE_COMMAND = "head -1 /proc/stat; sleep 1; head -1 /proc/stat"
+
+#
+# The controller. Each step samples the fleet through the backend, decides whether to scale it, and does so.
+#
+class AutoscaleController(object):
+    '''Scales a fleet (through its backend) to keep its CPU utilization and latency within the policy.'''
+
+    def __init__(self, backend, policy=None, clock=time):
+        self.backend = backend
+        self.policy = dict(DEFAULT_POLICY, **(policy or {}))
+        self.clock = clock
+        self.highPeriods = 0
+        self.lowPeriods = 0
+        self.lastScaleOut = None
+        self.lastChange = None
+        if self.policy['maxNodes'] is not None and self.policy['maxNodes'] < self.policy['minNodes']:
+            raise Exception("Invalid fleet size limits: {0} to {1} nodes".format(self.policy['minNodes'], self.policy['maxNodes']))
+        if not (self.policy['cpuLow'] < self.policy['cpuHigh'] and self.policy['latencyLow'] < self.policy['latencyHigh']):
+            raise Exception("Each low threshold must be below its high threshold")
+
+    def step(self):
+        '''Sample the fleet, and scale it if the policy calls for it. Return a record of the step (see decide).'''
+        ipList = self.backend.listNodes()
+        (cpu, latency) = getFleetMetrics(self.backend.sampleMetrics(ipList))
+        now = self.clock.time()
+        (action, count, reason) = self.decide(len(ipList), cpu, latency, now)
+        if action == "out":
+            added = self.backend.launchNodes(count)
+            (self.lastScaleOut, self.lastChange) = (self.clock.time(), self.clock.time())
+            if len(added) < count:
+                reason += " (only {0} of {1} nodes were added)".format(len(added), count)
+            count = len(added)
+        elif action == "in":
+            self.backend.terminateNodes(ipList[-count:])
+            self.lastChange = self.clock.time()
+        if action is not None:
+            (self.highPeriods, self.lowPeriods) = (0, 0)
+        return {'time': now, 'nodes': len(ipList), 'cpu': cpu, 'latency': latency, 'action': action, 'count': count,
+                'reason': reason}
+
+    #
+    # Return the decision for a fleet of numNodes nodes with the given metrics (either of which may be None if
+    # it couldn't be measured), as a tuple of (action, count, reason), where action is "out" (add count nodes),
+    # "in" (remove count nodes) or None (leave the fleet as it is).
+    #
+    def decide(self, numNodes, cpu, latency, now):
+        '''Return the scaling decision (action, count, reason) for the fleet's current size and metrics.'''
+        policy = self.policy
+        maxNodes = policy['maxNodes'] if policy['maxNodes'] is not None else sys.maxint
+        if numNodes < policy['minNodes']:
+            return ("out", policy['minNodes'] - numNodes, "below the minimum of {0} nodes".format(policy['minNodes']))
+        if numNodes > maxNodes:
+            return ("in", numNodes - maxNodes, "above the maximum of {0} nodes".format(maxNodes))
+        if cpu is None and latency is None:
+            return (None, 0, "no metrics")
+
+        #
+        # Count the samples in a row that the fleet has been overloaded (or underused) for.
+        #
+        ratios = [value / threshold for (value, threshold) in [(cpu, policy['cpuHigh']), (latency, policy['latencyHigh'])]
+                  if value is not None]
+        high = max(ratios) > 1.0
+        low = all(value is None or value < threshold for (value, threshold) in [(cpu, policy['cpuLow']),
+                                                                                  (latency, policy['latencyLow'])])
+        self.highPeriods = self.highPeriods + 1 if high else 0
+        self.lowPeriods = self.lowPeriods + 1 if low else 0
+
+        #
+        # Scale out in proportion to the overload, to the size that would bring the CPU utilization down to the
+        # middle of its band (or the latency down to its threshold), so a surge is met in one step rather than
+        # one node at a time.
+        #
+        if high and self.highPeriods >= policy['scaleOutPeriods']:
+            if numNodes >= maxNodes:
+                return (None, 0, "overloaded, but at the maximum of {0} nodes".format(maxNodes))
+            if self.__coolingdown__(self.lastScaleOut, policy['scaleOutCooldown'], now):
+                return (None, 0, "overloaded, but cooling down after scaling out")
+            targets = [value / threshold for (value, threshold) in [(cpu, (policy['cpuLow'] + policy['cpuHigh']) / 2),
+                                                                       (latency, policy['latencyHigh'])] if value is not None]
+            count = max(1, int(math.ceil(numNodes * max(targets))) - numNodes)
+            return ("out", min(count, policy['maxStep'], maxNodes - numNodes), "overloaded for {0} samples".format(self.highPeriods))
+
+        #
+        # Scale in to the size that would bring the CPU utilization up to the middle of its band (or by a
+        # single node, if there's no CPU utilization to go by).
+        #
+        if low and self.lowPeriods >= policy['scaleInPeriods'] and numNodes > policy['minNodes']:
+            if self.__coolingdown__(self.lastChange, policy['scaleInCooldown'], now):
+                return (None, 0, "underused, but cooling down after the last change")
+            count = 1
+            if cpu is not None:
+                target = (policy['cpuLow'] + policy['cpuHigh']) / 2
+                count = max(1, numNodes - int(math.ceil(numNodes * cpu / target)))
+            return ("in", min(count, policy['maxStep'], numNodes - policy['minNodes']), "underused for {0} samples".format(self.lowPeriods))
+        return (None, 0, "overloaded" if high else "underused" if low else "within thresholds")
+
+    def __coolingdown__(self, lastTime, cooldown, now):
+        '''Private helper, returning True if less than cooldown seconds have passed since lastTime.'''
+        return lastTime is not None and now - lastTime < cooldown
+
+    #
+    # Step the controller every interval seconds, for duration seconds (or forever). Each step's record is
+    # passed to report. A step that fails (e.g. because EC2 couldn't be reached) is reported, and the
+    # controller carries on with the next.
+    #
+    def run(self, duration=None, interval=DEFAULT_INTERVAL, report=None):
+        '''Step the controller every interval seconds (for duration seconds, or forever), passing each record to report.'''
+        endTime = None if duration is None else self.clock.time() + duration
+        while endTime is None or self.clock.time() < endTime:
+            stepStartTime = self.clock.time()
+            try:
+                record = self.step()
+                if report is not None:
+                    report(record)
+            except Exception as mesg:
+                print >>sys.stderr, "Warning: unable to scale the fleet:", mesg
+            self.clock.sleep(max(interval - (self.clock.time() - stepStartTime), 0))
+
+#
+# Return the fleet's metrics, as a tuple of (cpu, latency), each the mean over the nodes that reported it (or
+# None if none did), given the per-node metrics (a dictionary mapping each node to its 'cpu' and 'latency').
+#
+def getFleetMetrics(metrics):
+    '''Return the fleet's mean (cpu, latency) from the per-node metrics.'''
+    fleetMetrics = []
+    for name in ['cpu', 'latency']:
+        values = [nodeMetrics[name] for nodeMetrics in metrics.values() if nodeMetrics.get(name) is not None]
+        fleetMetrics.append(sum(values) / len(values) if len(values) != 0 else None)
+    return tuple(fleetMetrics)
+
+def getCPUUtilization(output):
+    '''Return the CPU utilization (0.0 to 1.0) from the output of CPU_SAMPLE_COMMAND, or None if it's unreadable.'''
+    samples = [[int(value) for value in line.split()[1:]] for line in output.splitlines() if line.startswith("cpu ")]
+    if len(samples) != 2:
+        return None
+    deltas = [after - before for (before, after) in zip(samples[0], samples[1])]
+    idle = sum(deltas[3:5])
+    total = sum(deltas[:8])
+    return (total - idle) / float(total) if total > 0 else None
+
+#
+# Return the fleet's running instances (as dictionaries, see showstate.iterEC2Instances), oldest first. The
+# fleet is every running instance tagged with a launch ID (by launch.py) or an autoscaling group (by the
+# controller), less any load balancers (see lb.py). This is the one definition of the fleet, shared by the
+# controller, the load balancer and reconcile.py.
+#
+# If group is provided, the nodes of other autoscaling groups are left out. If launchIds are provided, the
+# only other nodes included (besides the group's own) are those of the given launches.
+#
+def findFleetInstances(ec2, group=None, launchIds=[]):
+    '''Return the fleet's running instances, oldest first.'''
+    import showstate, journal, lb
+    filters = {'instance-state-name': ["running"], 'tag-key': [journal.LAUNCH_ID_TAG, GROUP_TAG]}
+    instances = []
+    for instance in showstate.iterEC2Instances(ec2, filters):
+        tags = instance['tags']
+        if tags.get(lb.ROLE_TAG) == lb.LOAD_BALANCER_ROLE:
+            continue
+        if group is not None or launchIds:
+            inGroup = group is not None and tags.get(GROUP_TAG) == group
+            launched = tags.get(journal.LAUNCH_ID_TAG) in launchIds if launchIds else GROUP_TAG not in tags
+            if not (inGroup or launched):
+                continue
+        instances.append(instance)
+    return sorted(instances, key=lambda instance: (instance['launch_time'], instance['id']))
+
+#
+# The backend for a real fleet on EC2. New nodes are launched and provisioned in the same way as launch.py
+# (from the baked image and warm pool, if there are any), each scale-out being recorded in its own launch
+# journal, so "launch.py --resume" can finish one that was interrupted.
+#
+class EC2Backend(object):
+    '''Finds, measures, launches and terminates the nodes of a fleet on EC2.'''
+
+    def __init__(self, awsConfigDict, instanceConfigDict, djangoProj, group=DEFAULT_GROUP, launchIds=[],
+                 probePaths=None, poolSize=config.DEFAULT_POOL_SIZE, readyTimeout=config.DEFAULT_READY_TIMEOUT,
+                 awsSettingsFile=None, instanceConfigFile=None, collectStatic=True):
+        self.awsConfigDict = awsConfigDict
+        self.instanceConfigDict = instanceConfigDict
+        self.djangoProj = djangoProj
+        self.group = group
+        self.launchIds = launchIds
+        self.probePaths = probePaths
+        self.poolSize = poolSize
+        self.readyTimeout = readyTimeout
+        self.awsSettingsFile = awsSettingsFile
+        self.instanceConfigFile = instanceConfigFile
+        self.collectStatic = collectStatic
+        self.instanceIds = {}
+
+    def connect(self):
+        '''Return a new EC2 connection.'''
+        import aws
+        return aws.connectEC2(self.awsConfigDict['EC2_AccessKeyID'], self.awsConfigDict['EC2_SecretAccessKey'],
+                              self.awsConfigDict['EC2_AvailabilityZone'], self.awsConfigDict['EC2_Endpoint'])
+
+    def listNodes(self):
+        '''Return the IP addresses of the fleet's running nodes, oldest first.'''
+        ordered = [instance for instance in findFleetInstances(self.connect(), self.group, self.launchIds)
+                   if instance['ip_address']]
+        self.instanceIds = dict((instance['ip_address'], instance['id']) for instance in ordered)
+        return [instance['ip_address'] for instance in ordered]
+
+    def sampleMetrics(self, ipList):
+        '''Return the metrics of each node, as a dictionary mapping its IP address to its 'cpu' and 'latency'.'''
+        import prober, fabricutils
+        metrics = dict((ip, {'cpu': None, 'latency': None}) for ip in ipList)
+        if len(ipList) == 0:
+            return metrics
+        probeResults = prober.probeFleet(ipList, paths=self.probePaths or prober.DEFAULT_PATHS, readyTimeout=prober.DEFAULT_TIMEOUT,
+                                         samples=LATENCY_SAMPLES)
+        for (ip, result) in probeResults.items():
+            percentiles = prober.getPercentiles(result['latencies'])
+            if percentiles is not None:
+                metrics[ip]['latency'] = percentiles[1]
+        for result in fabricutils.executeOnHosts(__cpusampletask__, self.awsConfigDict['EC2_SSHKeyPairFile'], ipList,
+                                                 poolSize=self.poolSize, taskName="sample CPU utilization"):
+            if result['succeeded']:
+                metrics[result['host']]['cpu'] = result['value']
+        return metrics
+
+    def launchNodes(self, count):
+        '''Launch and provision count new nodes, and return the IP addresses of those that are serving.'''
+        import aws, pipeline, fabricutils, sshpool, prober, journal, images, warmpool
+        awsConfigDict = self.awsConfigDict
+        instanceConfigDict = self.instanceConfigDict
+
+        provisioningHash = config.getProvisioningHash(instanceConfigDict)
+        imageId = images.lookupImage(provisioningHash, awsConfigDict['EC2_AvailabilityZone']) or instanceConfigDict['EC2_ImageID']
+        phases = pipeline.getPhases(instanceConfigDict, self.djangoProj, skipPuppet=(imageId != instanceConfigDict['EC2_ImageID']),
+                                    collectStatic=self.collectStatic)
+        launchJournal = journal.createJournal(journal.newLaunchId(), self.djangoProj, count, imageId,
+                                              awsConfigDict['EC2_AvailabilityZone'])
+        tags = {journal.LAUNCH_ID_TAG: launchJournal.launchId, GROUP_TAG: self.group}
+
+        #
+        # Start provisioned instances from the warm pool first (see warmpool.py), then refill it in the background.
+        #
+        warmInstanceIds = []
+        if instanceConfigDict['Fleet_WarmPoolSize'] > 0:
+            try:
+                warmInstanceIds = warmpool.claimInstances(self.connect(), provisioningHash, instanceConfigDict['EC2_InstanceType'],
+                                                          count, tags=tags)
+                launchJournal.recordStarted(warmInstanceIds)
+                if self.awsSettingsFile is not None and self.instanceConfigFile is not None:
+                    warmpool.startBackgroundRefill(self.awsSettingsFile, self.instanceConfigFile, self.djangoProj)
+            except Exception as mesg:
+                print >>sys.stderr, "Warning: unable to use the warm pool:", mesg
+
+        def readyCallback(instanceId, ipAddress):
+            launchJournal.recordReady(instanceId, ipAddress)
+            if instanceId in warmInstanceIds:
+                launchJournal.recordPhases(ipAddress, warmpool.PROVISIONED_PHASES)
+
+        ipList = aws.launchEC2Instances(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'], count,
+                                        awsConfigDict['EC2_AvailabilityZone'], imageId, instanceConfigDict['EC2_InstanceType'],
+                                        awsConfigDict['EC2_SSHKeyPair'], readyCallback=readyCallback,
+                                        endpoint=awsConfigDict['EC2_Endpoint'], zones=awsConfigDict['EC2_Zones'],
+                                        chunkSize=instanceConfigDict['Fleet_ChunkSize'],
+                                        requestRate=instanceConfigDict['Fleet_RequestRate'], tags=tags,
+                                        startedCallback=launchJournal.recordStarted, adoptInstanceIds=warmInstanceIds)
+
+        sshpool.openPool()
+        try:
+            for (phaseName, phase, argument) in phases:
+                phaseIpList = [ip for ip in ipList if not launchJournal.hasCompleted(ip, phaseName)]
+                if len(phaseIpList) == 0:
+                    continue
+                results = phase(awsConfigDict['EC2_SSHKeyPairFile'], argument, phaseIpList, poolSize=self.poolSize)
+                launchJournal.recordPhaseResults(phaseName, results)
+                for failure in fabricutils.getFailures(results):
+                    print >>sys.stderr, "Error: failed to", phaseName, "on", fabricutils.formatFailure(failure)
+                    ipList.remove(failure['host'])
+        finally:
+            sshpool.closePool()
+
+        if len(ipList) != 0:
+            probeResults = prober.probeFleet(ipList, paths=self.probePaths or prober.DEFAULT_PATHS,
+                                             readyTimeout=self.readyTimeout, samples=0)
+            ipList = [ip for ip in ipList if probeResults[ip]['ready']]
+
+        #
+        # Terminate the instances that didn't make it (so a failing launch doesn't leave them running, unused).
+        #
+        failed = [instanceId for (instanceId, node) in sorted(launchJournal.state['Nodes'].items())
+                  if node['IPAddress'] not in ipList]
+        if len(failed) != 0:
+            print >>sys.stderr, "Terminating", len(failed), "instances that couldn't be provisioned:", " ".join(failed)
+            aws.terminateInstances(self.connect(), failed)
+        self.updateLoadBalancers()
+        return ipList
+
+    def terminateNodes(self, ipList):
+        '''Drain the nodes (stopping their web servers gracefully), then terminate them.'''
+        import aws, djangoutils, fabricutils
+        self.updateLoadBalancers(exclude=ipList)
+        for failure in fabricutils.getFailures(djangoutils.stopProject(self.awsConfigDict['EC2_SSHKeyPairFile'], ipList,
+                                                                       poolSize=self.poolSize)):
+            print >>sys.stderr, "Warning: unable to drain", fabricutils.formatFailure(failure)
+        aws.terminateInstances(self.connect(), [self.instanceIds[ip] for ip in ipList])
+
+    def updateLoadBalancers(self, exclude=[]):
+        '''Point the load balancers (if they're enabled) at the fleet's nodes, less those in exclude.'''
+        if not self.instanceConfigDict['LoadBalancer_Enabled']:
+            return
+        import lb, fabricutils
+        try:
+            results = lb.updateLoadBalancers(self.awsConfigDict, self.instanceConfigDict, exclude, self.poolSize)
+        except Exception as mesg:
+            print >>sys.stderr, "Warning: unable to update the load balancers:", mesg
+            return
+        for failure in fabricutils.getFailures(results):
+            print >>sys.stderr, "Warning: unable to update the load balancer on", fabricutils.formatFailure(failure)
+
+def __cpusampletask__():
+    '''Private fabric task, returning the node's CPU utilization.'''
+    import fabricutils
+    return getCPUUtilization(fabricutils.run(CPU_SAMPLE_COMMAND))
+
+#
+# A simulated fleet, standing in for EC2Backend (and for the clock), with synthetic load. The load (in requests
+# per second, spread evenly over the nodes) follows a profile (see loadtest.getProfile), and each node can
+# serve capacity requests per second. A node's CPU utilization is its share of the load over its capacity, and
+# its latency grows as it nears its capacity (as a queue's does). New nodes take bootTime seconds to launch
+# and provision. Simulated time only passes when the controller sleeps or launches nodes.
+#
+class SimulatedFleet(object):
+    '''A simulated fleet and clock, for running the controller against synthetic load.'''
+
+    def __init__(self, numNodes, loadProfile, capacity=100.0, baseLatency=0.05, bootTime=180):
+        self.loadProfile = loadProfile
+        self.capacity = capacity
+        self.baseLatency = baseLatency
+        self.bootTime = bootTime
+        self.now = 0.0
+        self.numLaunched = 0
+        self.nodes = []
+        self.terminated = []
+        self.__addnodes__(numNodes)
+
+    def __addnodes__(self, count):
+        '''Private helper, adding count new nodes to the fleet.'''
+        for index in range(count):
+            self.numLaunched += 1
+            self.nodes.append("10.0.{0}.{1}".format(self.numLaunched >> 8, self.numLaunched & 255))
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def getLoad(self):
+        '''Return the current load on the fleet, in requests per second.'''
+        return loadtest.getConcurrency(self.loadProfile, self.now)
+
+    def listNodes(self):
+        return list(self.nodes)
+
+    def sampleMetrics(self, ipList):
+        utilization = self.getLoad() / float(len(ipList) * self.capacity) if len(ipList) != 0 else 0.0
+        latency = self.baseLatency / (1.0 - min(utilization, 0.95))
+        return dict((ip, {'cpu': min(utilization, 1.0), 'latency': latency}) for ip in ipList)
+
+    def launchNodes(self, count):
+        self.now += self.bootTime
+        self.__addnodes__(count)
+        return self.nodes[-count:]
+
+    def terminateNodes(self, ipList):
+        self.nodes = [ip for ip in self.nodes if ip not in ipList]
+        self.terminated.extend(ipList)
+
+def formatRecord(record):
+    '''Return a record of a controller step as a line, for display.'''
+    return "{0:>8} {1:>6} {2:>6} {3:>9}  {4}".format(
+           time.strftime("%H:%M:%S", time.localtime(record['time'])) if record['time'] > 1e9 else "%.0f" % record['time'],
+           record['nodes'], "-" if record['cpu'] is None else "%.0f%%" % (record['cpu'] * 100),
+           "-" if record['latency'] is None else "%.1f" % (record['latency'] * 1000),
+           {"out": "add {0}: ", "in": "remove {0}: "}.get(record['action'], "").format(record['count']) + record['reason'])
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("autoscale.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--group <name>] "
+                            "[--launch-id <id>] [--min-nodes <n>] [--max-nodes <n>] [--cpu-high <fraction>] "
+                            "[--cpu-low <fraction>] [--latency-high <seconds>] [--latency-low <seconds>] "
+                            "[--scale-out-periods <n>] [--scale-in-periods <n>] [--scale-out-cooldown <seconds>] "
+                            "[--scale-in-cooldown <seconds>] [--max-step <n>] [--interval <seconds>] [--probe-path <path>] "
+                            "[--pool-size <n>] [--once] [--simulate <seconds:requests/second,...>] "
+                            "[--node-capacity <requests/second>] [<django_proj>]",
+                        description="Controller that scales the fleet to its load, adding and removing EC2 instances")
+    parser.add_argument('django_proj',
+                        nargs='?',
+                        help="Path to the Django project (the directory containing manage.py) to run on new nodes.")
+    parser.add_argument('--aws-settings',
+                        default=os.path.expanduser("~/.aws.settings"),
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory).")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--group',
+                        default=DEFAULT_GROUP,
+                        help="The name of the autoscaling group, which new nodes are tagged with (default is {0}).".format(DEFAULT_GROUP))
+    parser.add_argument('--launch-id',
+                        action='append',
+                        default=[],
+                        help="Only include the nodes of the given launch (and of the group) in the fleet (may be repeated).")
+    for (name, key, valueType, description) in [
+            ("min-nodes", 'minNodes', int, "The fewest nodes in the fleet"),
+            ("max-nodes", 'maxNodes', int, "The most nodes in the fleet (default is MaxInstances in instance.config)"),
+            ("cpu-high", 'cpuHigh', float, "Scale out when the fleet's CPU utilization is above this fraction"),
+            ("cpu-low", 'cpuLow', float, "Scale in when the fleet's CPU utilization is below this fraction (and latency is low)"),
+            ("latency-high", 'latencyHigh', float, "Scale out when the fleet's p95 latency is above this many seconds"),
+            ("latency-low", 'latencyLow', float, "Scale in when the fleet's p95 latency is below this many seconds (and CPU is low)"),
+            ("scale-out-periods", 'scaleOutPeriods', int, "The number of samples in a row the fleet must be overloaded for"),
+            ("scale-in-periods", 'scaleInPeriods', int, "The number of samples in a row the fleet must be underused for"),
+            ("scale-out-cooldown", 'scaleOutCooldown', float, "The seconds to wait after scaling out before scaling out again"),
+            ("scale-in-cooldown", 'scaleInCooldown', float, "The seconds to wait after any change before scaling in"),
+            ("max-step", 'maxStep', int, "The most nodes added or removed at once")]:
+        defaultText = "" if DEFAULT_POLICY[key] is None else " (default is {0})".format(DEFAULT_POLICY[key])
+        parser.add_argument('--' + name,
+                            dest=key,
+                            type=valueType,
+                            default=DEFAULT_POLICY[key],
+                            help=description + defaultText + ".")
+    parser.add_argument('--interval',
+                        type=float,
+                        default=DEFAULT_INTERVAL,
+                        help="How often to sample the fleet, in seconds (default is {0}).".format(DEFAULT_INTERVAL))
+    parser.add_argument('--probe-path',
+                        action='append',
+                        default=[],
+                        help="A path to measure the latency of (may be repeated, default is /).")
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=config.DEFAULT_POOL_SIZE,
+                        help="The maximum number of nodes that are worked on at the same time "
+                            "(default is {0}).".format(config.DEFAULT_POOL_SIZE))
+    parser.add_argument('--once',
+                        action='store_true',
+                        help="Sample the fleet and scale it once, then exit.")
+    parser.add_argument('--simulate',
+                        metavar='LOAD',
+                        help="Run against a simulated fleet instead, with load ramping through the given stages, each "
+                            "\"<seconds>:<requests per second>\", e.g. \"600:2000,1800:2000,600:200\".")
+    parser.add_argument('--node-capacity',
+                        type=float,
+                        default=100.0,
+                        help="With --simulate, the requests per second each simulated node can serve (default is 100).")
+    return parser
+
+def main(argv=None):
+    '''Run the autoscaling controller, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        policy = dict((key, getattr(parsedArgs, key)) for key in DEFAULT_POLICY)
+        if parsedArgs.simulate is not None:
+            loadProfile = loadtest.getProfile(ramp=parsedArgs.simulate)
+            backend = SimulatedFleet(policy['minNodes'], loadProfile, parsedArgs.node_capacity)
+            controller = AutoscaleController(backend, policy, clock=backend)
+        else:
+            if parsedArgs.django_proj is None:
+                raise Exception("The Django project is needed, to run on new nodes")
+            if not os.path.isfile(os.path.join(parsedArgs.django_proj, "manage.py")):
+                raise Exception("Django project directory ({0}) doesn't contain manage.py".format(parsedArgs.django_proj))
+            awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+            instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+            if policy['maxNodes'] is None:
+                policy['maxNodes'] = instanceConfigDict['Fleet_MaxInstances']
+            backend = EC2Backend(awsConfigDict, instanceConfigDict, parsedArgs.django_proj, parsedArgs.group,
+                                 parsedArgs.launch_id, parsedArgs.probe_path, parsedArgs.pool_size,
+                                 awsSettingsFile=parsedArgs.aws_settings, instanceConfigFile=parsedArgs.instance_config)
+            controller = AutoscaleController(backend, policy)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    def report(record):
+        print formatRecord(record)
+        sys.stdout.flush()
+
+    print "{0:>8} {1:>6} {2:>6} {3:>9}  {4}".format("Time", "Nodes", "CPU", "p95 (ms)", "Decision")
+    try:
+        if parsedArgs.once:
+            report(controller.step())
+        elif parsedArgs.simulate is not None:
+            controller.run(loadProfile[-1][0], parsedArgs.interval, report)
+            print "\nLaunched", backend.numLaunched - policy['minNodes'], "nodes and terminated", len(backend.terminated)
+        else:
+            controller.run(None, parsedArgs.interval, report)
+    except KeyboardInterrupt:
+        pass
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,168 @@
 #
 # Helper functions for issuing requests to EC2
 #
-import sys, boto.ec2, time
+import sys, boto.ec2, time, urlparse, random, threading
+
+from boto.ec2.regioninfo import RegionInfo
+
+# local modules
+import config, profiler
+
+# Polling parameters for waitForEC2Instances (all in seconds). We start polling quickly, then back off
+# while nothing changes, so that large launches don't get throttled by the EC2 API.
+POLL_MIN_INTERVAL = 2
+POLL_MAX_INTERVAL = 20
+POLL_BACKOFF_FACTOR = 1.5
+
+# DescribeInstanceStatus accepts at most this many instance IDs per request.
+MAX_IDS_PER_STATUS_REQUEST = 100
+
+# The number of launch requests that may be made in a quick burst, before being limited to the request rate.
+REQUEST_BURST = 5
+
+# Retry parameters for requests failing with an error expected to clear up by itself, with a random delay up to a doubling limit.
+RETRYABLE_ERRORS = ["RequestLimitExceeded", "InsufficientInstanceCapacity", "InsufficientCapacity", "Unavailable", "InternalError",
+                    "InvalidInstanceID.NotFound"]
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 30
+
+#
+# A token bucket, used to keep our requests to the EC2 API within its rate limits. Tokens are added at "rate"
+# per second, up to a maximum of "burst", and each request consumes a token (waiting for one if necessary).
+# The bucket may be shared by several threads.
+#
+class TokenBucket(object):
+    '''A thread-safe token bucket, limiting the rate of requests to EC2.'''
+
+    def __init__(self, rate, burst=REQUEST_BURST):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Wait until a request is permitted, then consume a token.'''
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+#
+# Launch a specified number of EC2 instances, with the provided parameters. If readyCallback is provided, it's
+# called with each instance's ID and IP address as soon as that instance passes its status checks. If endpoint
+# is provided, it's the URL of an alternative (e.g. stand-in) EC2 service to use. If startedCallback is provided,
+# it's called with the IDs of each batch of instances as soon as they're started, and any tags provided are
+# applied to the new instances.
+#
+# If adoptInstanceIds is provided, it's a list of instances from a previous launch: those still running are
+# waited for (and reported to readyCallback) along with the new instances, and only enough new instances are
+# started to make up numServers.
+#
+# The instances are requested in chunks of at most chunkSize, with the requests limited to requestRate per second.
+# If zones (a list of availability zones within the region) is provided, the instances are spread evenly across
+# those zones, which are launched into concurrently. A zone that runs out of capacity is dropped, and its
+# shortfall is made up in the other zones.
+#
+def launchEC2Instances(accessKeyId, secretAccessKey, numServers, availabilityZone, amiImage, instanceType, keyPairName,
+                       readyCallback=None, endpoint=None, zones=None, chunkSize=config.DEFAULT_LAUNCH_CHUNK_SIZE,
+                       requestRate=config.DEFAULT_REQUEST_RATE, tags=None, startedCallback=None, adoptInstanceIds=None):
+
+    ec2 = connectEC2(accessKeyId, secretAccessKey, availabilityZone, endpoint)
+    bucket = TokenBucket(requestRate)
+    adopted = []
+    if adoptInstanceIds:
+        adopted = adoptEC2Instances(ec2, adoptInstanceIds)
+    numServers -= len(adopted)
+
+    if numServers <= 0:
+        instances = []
+    elif not zones:
+        instances = startEC2Instances(ec2, numServers, amiImage, instanceType, keyPairName, chunkSize=chunkSize, bucket=bucket,
+                                      tags=tags, startedCallback=startedCallback)
+    else:
+        #
+        # Each zone is launched from its own thread (with its own connection, since boto connections can't be
+        # shared between threads), but all the zones share the same request rate.
+        #
+        connect = lambda: connectEC2(accessKeyId, secretAccessKey, availabilityZone, endpoint)
+        instances = __startinzones__(connect, numServers, zones, amiImage, instanceType, keyPairName, chunkSize, bucket,
+                                     tags, startedCallback)
+    if len(instances) < numServers:
+        print >>sys.stderr, "Warning: only", len(instances), "of", numServers, "EC2 instances could be launched."
+    instances = adopted + instances
+
+    #
+    # For each instance, determine the external IP address. IP addresses will typically be assigned to the instance
+    # within 10 seconds, but we wait until the VM has fully passed status checks, which might take many minutes.
+    # The end user shouldn't be permitted to connect to it with SSH until it's fully running, so this is where we need to wait.
+    # All pending instances are polled together, and each IP address is handed to the caller (via readyCallback) as
+    # soon as that instance is ready, rather than waiting for the slowest instance in the launch.
+    #
+    ipList = []
+    for (instance, ipAddress) in waitForEC2Instances(ec2, instances):
+        ipList.append(ipAddress)
+        if readyCallback is not None:
+            readyCallback(instance.id, ipAddress)
+
+    #
+    # On success, we know that these instances are alive. Return the list of IP addresses (which may be shorter
+    # than numServers if some instances couldn't be launched or timed out).
+    #
+    return ipList
+
+def __startinzones__(connect, numServers, zones, amiImage, instanceType, keyPairName, chunkSize, bucket,
+                     tags=None, startedCallback=None):
+    '''Private helper, launching numServers instances spread across zones (concurrently). Return the instances.'''
+
+    instances = []
+    errors = []
+    zones = list(zones)
+    while len(instances) < numServers and len(zones) != 0:
+
+        # share out the instances still required, as evenly as possible, across the zones still in use.
+        shortfall = numServers - len(instances)
+        counts = [shortfall // len(zones) + (1 if index < shortfall % len(zones) else 0) for index in range(len(zones))]
+        launched = {}
+
+        def startInZone(zone, count):
+            try:
+                launched[zone] = startEC2Instances(connect(), count, amiImage, instanceType, keyPairName,
+                                                   placement=zone, chunkSize=chunkSize, bucket=bucket,
+                                                   tags=tags, startedCallback=startedCallback)
+            except Exception as mesg:
+                launched[zone] = []
+                errors.append("{0}: {1}".format(zone, mesg))
+
+        threads = [threading.Thread(target=startInZone, args=(zone, count)) for (zone, count) in zip(zones, counts) if count != 0]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # drop only the zones that fell short (they're out of capacity), and try the rest of the shortfall in the
+        # others, including any that weren't given a share this time.
+        for (zone, count) in zip(zones, counts):
+            instances.extend(launched.get(zone, []))
+        zones = [zone for (zone, count) in zip(zones, counts) if count == 0 or len(launched[zone]) == count]
+
+    if len(instances) == 0 and len(errors) != 0:
+        raise Exception("\n".join(errors))
+    return instances
 
 #
-# Launch a specified number of EC2 instances, with the provided parameters.
+# Create a connection to EC2, in the region given by availabilityZone. If endpoint is provided, connect to that
+# URL instead (e.g. a stand-in EC2 service for testing), using availabilityZone as the region name.
 #
-def launchEC2Instances(accessKeyId, secretAccessKey, numServers, availabilityZone, amiImage, instanceType, keyPairName):
+def connectEC2(accessKeyId, secretAccessKey, availabilityZone, endpoint=None):
+    '''Return a boto connection to EC2, or raise an exception if we can't connect.'''
 
     #
     # Create a connection to EC2. This can fail for several different reasons. Make sure we provide a helpful
@@ -15,17 +171,38 @@ def launchEC2Instances(accessKeyId, secretAccessKey, numServers, availabilityZon
     # KW: [Code] We should remove the "probably due to..." section of the error messages since there could be other reasons for failure.
     #
     try:
-        ec2 = boto.ec2.connect_to_region(availabilityZone, aws_access_key_id=accessKeyId, aws_secret_access_key=secretAccessKey)
+        if endpoint is not None:
+            url = urlparse.urlparse(endpoint)
+            ec2 = boto.ec2.connection.EC2Connection(aws_access_key_id=accessKeyId, aws_secret_access_key=secretAccessKey,
+                                                    region=RegionInfo(name=availabilityZone, endpoint=url.hostname),
+                                                    port=url.port, path=url.path or "/", is_secure=(url.scheme == "https"))
+        else:
+            ec2 = boto.ec2.connect_to_region(availabilityZone, aws_access_key_id=accessKeyId, aws_secret_access_key=secretAccessKey)
     except boto.exception.EC2ResponseError as mesg:
         raise Exception("Unable to connect to EC2, probably due to incorrect access key.\nDetailed message from server was {0}".format(mesg))
 
     if ec2 is None:
         raise Exception("Unable to connect to EC2, probably due to incorrect availability zone: {0}".format(availabilityZone))
+    return ec2
+
+#
+# Ask EC2 to start a specified number of instances, with the provided parameters (in the given availability
+# zone, if placement is provided). Return the list of boto instances, without waiting for them to boot.
+#
+# The instances are requested in chunks of at most chunkSize. Each request accepts as many instances as EC2 has
+# capacity for (rather than failing unless it can have them all), and asks for the rest in the next request.
+# Requests are limited by bucket (a TokenBucket), if provided, and throttling or capacity errors are retried.
+# If we're still unable to launch all the instances, the ones we did launch are returned. Each batch of new
+# instances is tagged with tags (if provided), then passed to startedCallback (if provided) as a list of IDs.
+#
+def startEC2Instances(ec2, numServers, amiImage, instanceType, keyPairName, placement=None,
+                      chunkSize=config.DEFAULT_LAUNCH_CHUNK_SIZE, bucket=None, tags=None, startedCallback=None):
+    '''Start up to numServers EC2 instances, returning the list of instances.'''
 
     #
     # Validate that the requested KeyPair is defined.
     #
-    keyPair = ec2.get_key_pair(keyPairName)
+    keyPair = __retryrequest__(bucket, ec2.get_key_pair, keyPairName)
     if keyPair is None:
         raise Exception("AWS KeyPair {0} is not defined. Use the AWS console to create it.".format(keyPairName))
 
@@ -33,57 +210,154 @@ def launchEC2Instances(accessKeyId, secretAccessKey, numServers, availabilityZon
     # Ask EC2 to launch instances. There are numerous possible failures here, so the best we can do
     # is display the raw error message from EC2.
     #
+    instances = []
+    while len(instances) < numServers:
+        count = min(chunkSize, numServers - len(instances))
+        try:
+            reservation = __retryrequest__(bucket, ec2.run_instances, amiImage, min_count=1, max_count=count,
+                                           instance_type=instanceType, key_name=keyPairName, placement=placement)
+        except boto.exception.EC2ResponseError as mesg:
+            if len(instances) == 0:
+                raise Exception("Unable to launch EC2 instances.\nDetailed message from server was {0}".format(mesg))
+            print >>sys.stderr, "Warning: stopped launching EC2 instances{0} after {1} of {2}.\nDetailed message from server was {3}".format(
+                                " in " + placement if placement else "", len(instances), numServers, mesg)
+            break
+        instances.extend(reservation.instances)
+
+        instanceIds = [instance.id for instance in reservation.instances]
+        if tags:
+            try:
+                __retryrequest__(bucket, ec2.create_tags, instanceIds, tags)
+            except boto.exception.EC2ResponseError as mesg:
+                print >>sys.stderr, "Warning: unable to tag EC2 instances.\nDetailed message from server was {0}".format(mesg)
+        if startedCallback is not None:
+            startedCallback(instanceIds)
+    return instances
+
+#
+# Look up the instances (by ID) from a previous launch, and return those that are still pending or running.
+#
+def adoptEC2Instances(ec2, instanceIds):
+    '''Return the boto instances for those of instanceIds that are still pending or running.'''
     try:
-        reservation = ec2.run_instances(amiImage, min_count=numServers, max_count=numServers,
-                                        instance_type=instanceType, key_name=keyPairName)
+        with profiler.span("get_only_instances", "ec2", count=len(instanceIds)):
+            instances = ec2.get_only_instances(filters={'instance-id': instanceIds})
     except boto.exception.EC2ResponseError as mesg:
-        raise Exception("Unable to launch EC2 instances.\nDetailed message from server was {0}".format(mesg))
+        raise Exception("Unable to query EC2 instances.\nDetailed message from server was {0}".format(mesg))
+    return [instance for instance in instances if instance.state in ("pending", "running")]
 
-    #
-    # For each instance, determine the external IP address. IP addresses will typically be assigned to the instance
-    # within 10 seconds, but we wait until the VM has fully passed status checks, which might take many minutes.
-    # The end user shouldn't be permitted to connect to it with SSH until it's fully running, so this is where we need to wait.
-    # Note that even though this algorithm looks to be serialized, there's a good chance that the second (third, etc) instances
-    # will be ready immediately after the first instance is ready, since they're booting up in parallel. However, if one of
-    # the instances doesn't start up, this algorithm will fail (TODO: fix this)
-    #
-    # KW: [Code] We can refactor the while loop by checking for instance_status.status != "ok" instead of True.
-    #     This will increase performance by not performing another if-check.
-    #     Once instance_status equals "ok", the loop will break.
-    #     Timeout is set to 5 minutes.
-    #
-    ipList = []    
-    timeout = 300
-    for instance in reservation.instances:
-        statusSet = "initializing"
-        counter = 0
-        while statusSet != "ok":
-            if (counter == timeout):
-                print "\nTimeout while waiting for ", instance.id, " to start..."
-                break
-            time.sleep(5)
-            counter = counter + 5
-            newStatus = ec2.get_all_instance_status(instance_ids=[instance.id])
-            if len(newStatus) != 0:
-                statusSet = newStatus[0].instance_status.status            
-        instance.update()
-        ipList.append(instance.ip_address)
-
-
-    # KW: [Code] Original code below
-    #
-    # for instance in reservation.instances:
-    #     while True:
-    #         statusSet = ec2.get_all_instance_status(instance_ids=[instance.id])
-    #         if len(statusSet) != 0:
-    #             if statusSet[0].instance_status.status == "ok":
-    #                 break;
-    #             # TODO: need a timeout mechanism here, in case of failure.
-    #         time.sleep(5)
-    #     instance.update()
-    #     ipList.append(instance.ip_address)
-    
-    #
-    # On success, we know that all instances are alive. Return the list of IP addresses.
-    #
-    return ipList
+def __retryrequest__(bucket, request, *args, **kwargs):
+    '''Private helper, making a rate-limited EC2 request, and retrying it (with jittered backoff) on transient errors.'''
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            with profiler.span(request.__name__, "ec2", attempt=attempt):
+                return request(*args, **kwargs)
+        except boto.exception.EC2ResponseError as mesg:
+            if mesg.error_code not in RETRYABLE_ERRORS or attempt >= MAX_RETRIES:
+                raise
+        time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+        attempt += 1
+
+#
+# Wait for a set of EC2 instances to pass their status checks. This is a generator which yields an
+# (instance, ipAddress) tuple for each instance as soon as it's ready, in the order they become ready.
+# All pending instances are checked with a single DescribeInstanceStatus request per tick (rather than one
+# request per instance), and the polling interval backs off while nothing changes, or when EC2 tells us
+# we're being throttled. Instances that aren't ready within "timeout" seconds are reported and skipped.
+#
+def waitForEC2Instances(ec2, instances, timeout=300):
+    '''Yield (instance, ipAddress) for each of the instances, as soon as each one passes its status checks.'''
+
+    pending = dict((instance.id, instance) for instance in instances)
+    startTime = time.time()
+    deadline = startTime + timeout
+    interval = POLL_MIN_INTERVAL
+
+    while len(pending) != 0:
+        if time.time() >= deadline:
+            for instanceId in sorted(pending):
+                print "\nTimeout while waiting for ", instanceId, " to start..."
+            return
+
+        time.sleep(interval)
+
+        #
+        # Ask about all pending instances in as few requests as possible. If EC2 is throttling us,
+        # back off and try again on the next tick.
+        #
+        try:
+            readyIds = __getReadyInstanceIds__(ec2, sorted(pending))
+        except boto.exception.EC2ResponseError as mesg:
+            if mesg.error_code != "RequestLimitExceeded":
+                raise Exception("Unable to query EC2 instance status.\nDetailed message from server was {0}".format(mesg))
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+            continue
+
+        if len(readyIds) == 0:
+            interval = min(interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+            continue
+
+        #
+        # Refresh all the newly-ready instances in one request, so we learn their IP addresses. Once some
+        # instances are ready, others are usually close behind, so go back to polling quickly.
+        #
+        interval = POLL_MIN_INTERVAL
+        with profiler.span("get_only_instances", "ec2", count=len(readyIds)):
+            readyInstances = ec2.get_only_instances(instance_ids=readyIds)
+        for instance in readyInstances:
+            del pending[instance.id]
+            profiler.record("boot EC2 instance", "launch", startTime, time.time() - startTime, instance.ip_address,
+                            {'instanceId': instance.id})
+            yield (instance, instance.ip_address)
+
+def __getReadyInstanceIds__(ec2, instanceIds):
+    '''Private helper, returning the subset of instanceIds whose instance status is "ok".'''
+    readyIds = []
+    for first in range(0, len(instanceIds), MAX_IDS_PER_STATUS_REQUEST):
+        with profiler.span("get_all_instance_status", "ec2"):
+            statusSet = ec2.get_all_instance_status(instance_ids=instanceIds[first:first + MAX_IDS_PER_STATUS_REQUEST])
+        for status in statusSet:
+            if status.instance_status.status == "ok":
+                readyIds.append(status.id)
+    return readyIds
+
+#
+# Create an AMI from a (running) EC2 instance, and wait until it's available for launching new instances.
+# The instance is rebooted as part of creating the image, so that its file systems are consistent. Any tags
+# provided are applied to the new image. Return the new image's ID.
+#
+def createImage(ec2, instanceId, name, description, tags=None, timeout=1800):
+    '''Create an AMI from the given instance, and wait for it to become available. Return the image ID.'''
+
+    try:
+        with profiler.span("create_image", "ec2"):
+            imageId = ec2.create_image(instanceId, name, description=description)
+        if tags:
+            ec2.create_tags([imageId], tags)
+    except boto.exception.EC2ResponseError as mesg:
+        raise Exception("Unable to create image from instance {0}.\nDetailed message from server was {1}".format(instanceId, mesg))
+
+    deadline = time.time() + timeout
+    interval = POLL_MIN_INTERVAL
+    while time.time() < deadline:
+        time.sleep(interval)
+        interval = min(interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+        images = ec2.get_all_images(image_ids=[imageId])
+        if len(images) != 0 and images[0].state == "available":
+            return imageId
+        if len(images) != 0 and images[0].state == "failed":
+            raise Exception("Creation of image {0} from instance {1} failed.".format(imageId, instanceId))
+    raise Exception("Timeout while waiting for image {0} to become available.".format(imageId))
+
+#
+# Terminate a list of EC2 instances (by ID).
+#
+def terminateInstances(ec2, instanceIds):
+    '''Terminate the EC2 instances with the given IDs.'''
+    try:
+        ec2.terminate_instances(instance_ids=instanceIds)
+    except boto.exception.EC2ResponseError as mesg:
+        raise Exception("Unable to terminate EC2 instances.\nDetailed message from server was {0}".format(mesg))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2.7
+#
+# "bake.py" provisions a single EC2 instance with Puppet, then snapshots it into a new AMI (a "baked" image).
+# The image is recorded in a local catalog, keyed by a hash of the Puppet configuration, Puppet URL and base
+# image. Whenever that hash matches, launch.py launches new instances from the baked image and skips Puppet.
+#
+import sys, os, argparse, time
+
+# local modules (the modules that use boto and Fabric are slow to import, so they're imported where they're used)
+import config, images
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    defaultSettingsFile = os.path.expanduser("~/.aws.settings")
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("bake.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--force]",
+                        description="Tool for baking a pre-provisioned AMI, so that launch.py can skip Puppet")
+    parser.add_argument('--aws-settings',
+                        default=defaultSettingsFile,
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory). These settings contain "
+                            "important keys and should be kept secret at all times.")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--force',
+                        action='store_true',
+                        help="Bake a new image, even if the catalog already has one for the current configuration.")
+    return parser
+
+#
+# Provision a single instance from the base image, snapshot it into a new AMI, and return the new image ID.
+# The instance is always terminated afterwards, whether or not the bake succeeded.
+#
+def bakeImage(awsConfigDict, instanceConfigDict, provisioningHash):
+    '''Provision an instance with Puppet, and create an AMI from it. Return the new image ID.'''
+    import aws, puppet, fabricutils
+
+    ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'],
+                         awsConfigDict['EC2_SecretAccessKey'],
+                         awsConfigDict['EC2_AvailabilityZone'],
+                         awsConfigDict['EC2_Endpoint'])
+    instances = aws.startEC2Instances(ec2, 1, instanceConfigDict['EC2_ImageID'],
+                                      instanceConfigDict['EC2_InstanceType'], awsConfigDict['EC2_SSHKeyPair'])
+    instance = instances[0]
+    try:
+        ready = list(aws.waitForEC2Instances(ec2, instances))
+        if len(ready) == 0:
+            raise Exception("Instance {0} failed to start.".format(instance.id))
+        ipList = [ready[0][1]]
+
+        keyFile = awsConfigDict['EC2_SSHKeyPairFile']
+        for (phase, argument) in [(puppet.installPuppet, instanceConfigDict['Puppet_PuppetURL']),
+                                  (puppet.applyConfig, instanceConfigDict['Puppet_PuppetConfigFile'])]:
+            failures = fabricutils.getFailures(phase(keyFile, argument, ipList))
+            if len(failures) != 0:
+                raise Exception("Failed to provision " + fabricutils.formatFailure(failures[0]))
+
+        print "\nCreating image from instance", instance.id, "(may take several minutes)"
+        name = "linkoverflow-{0}-{1}".format(provisioningHash[:12], time.strftime("%Y%m%d%H%M%S", time.gmtime()))
+        return aws.createImage(ec2, instance.id, name,
+                               "LinkOverflow node, provisioned from {0}".format(instanceConfigDict['EC2_ImageID']),
+                               tags={'LinkOverflow:ProvisioningHash': provisioningHash})
+    finally:
+        aws.terminateInstances(ec2, [instance.id])
+
+def main(argv=None):
+    '''Bake an AMI for the current Puppet configuration, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        provisioningHash = config.getProvisioningHash(instanceConfigDict)
+        region = awsConfigDict['EC2_AvailabilityZone']
+
+        imageId = images.lookupImage(provisioningHash, region)
+        if imageId is not None and not parsedArgs.force:
+            print "\nImage", imageId, "is already baked for the current configuration (use --force to re-bake)\n"
+            sys.exit(0)
+
+        print "\nBaking a new image from", instanceConfigDict['EC2_ImageID'], "(may take several minutes)\n"
+        imageId = bakeImage(awsConfigDict, instanceConfigDict, provisioningHash)
+        images.recordImage(provisioningHash, region, imageId, instanceConfigDict)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    print "\nBaked image", imageId, "- launch.py will now use it and skip the Puppet phases\n"
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python2.7
+#
+# "benchmark.py" measures the performance of a launch, offline. It drives the real launch code paths
+# (aws.launchEC2Instances, then the puppet/djangoutils phases, as launch.py runs them), but with EC2 and SSH
+# replaced by in-process stand-ins:
+#
+#   SimulatedEC2 - takes the place of the boto EC2 connection. Instances boot after a configurable time
+#       (with random variation), and requests can be made to fail (with a throttling error) at random.
+#   SimulatedSSH - takes the place of Fabric's run/sudo/put. Each command costs a network round-trip, plus
+#       a configurable time per remote step, and a connection set-up time the first time each process
+#       talks to a host. Uploads cost time in proportion to their size.
+#
+# Simulated time runs faster than real time (see --time-scale), so a launch of hundreds of nodes can be
+# benchmarked on a laptop in a few minutes. For each fleet size, we report the (simulated) time taken, along
+# with the number of EC2 API requests, SSH round-trips and uploads. Results can be saved, and compared with
+# a previous run to check for regressions. Usage:
+#
+#   benchmark.py [--nodes 1,5,50,500] [--pipeline] [--save <file>] [--compare <file>] ...
+#
+import sys, os, argparse, json, random, time, tempfile, shutil, threading, multiprocessing, re
+
+import boto.exception
+from fabric import api
+from fabric.operations import _AttributeString
+
+# local modules
+import config, aws, pipeline, fabricutils, sshpool, remotescript
+
+# Constant: the fleet sizes benchmarked by default.
+DEFAULT_NODE_COUNTS = "1,5,50,500"
+
+# Constant: the relative increase (in simulated time or round-trips) that's reported as a regression by --compare.
+REGRESSION_TOLERANCE = 0.10
+
+#
+# A clock for simulated time, which runs 1/scale times faster than real time. It provides the time() and
+# sleep() functions of the time module, so it can stand in for it (e.g. as aws.time). Worker processes
+# forked from the benchmark share the same clock, since it's based on real time.
+#
+class SimulatedClock(object):
+    '''A clock running faster than real time, so simulated latencies take less (real) time.'''
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.origin = time.time()
+
+    def time(self):
+        '''Return the current simulated time.'''
+        return self.origin + (time.time() - self.origin) / self.scale
+
+    def sleep(self, seconds):
+        '''Sleep for the given number of simulated seconds.'''
+        time.sleep(seconds * self.scale)
+
+#
+# Stand-ins for the boto objects returned by SimulatedEC2.
+#
+class SimulatedInstance(object):
+    def __init__(self, instanceId, ipAddress, readyTime):
+        self.id = instanceId
+        self.ip_address = ipAddress
+        self.private_ip_address = ipAddress
+        self.state = "running"
+        self.readyTime = readyTime
+
+class SimulatedReservation(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+class SimulatedStatus(object):
+    def __init__(self, instanceId, status):
+        self.id = instanceId
+        self.instance_status = type('InstanceStatus', (object,), {'status': status})()
+
+#
+# A stand-in for a boto EC2 connection. Each request takes apiLatency (simulated) seconds, and fails with
+# a throttling error with probability apiFailureRate. Each instance passes its status checks bootTime
+# seconds (plus or minus up to bootJitter) after it's started, unless it's one of the bootFailureRate
+# fraction of instances that never do. The number of requests of each kind is counted in self.calls.
+#
+class SimulatedEC2(object):
+    '''An in-process stand-in for an EC2 connection, with configurable latency and failures.'''
+
+    def __init__(self, clock, bootTime, bootJitter, bootFailureRate, apiLatency, apiFailureRate):
+        self.clock = clock
+        self.bootTime = bootTime
+        self.bootJitter = bootJitter
+        self.bootFailureRate = bootFailureRate
+        self.apiLatency = apiLatency
+        self.apiFailureRate = apiFailureRate
+        self.instances = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def __request__(self, name):
+        '''Private helper, simulating the cost (and possible failure) of an API request.'''
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        self.clock.sleep(self.apiLatency)
+        if random.random() < self.apiFailureRate:
+            raise boto.exception.EC2ResponseError(503, "Service Unavailable", "<Response><Errors><Error><Code>"
+                                                  "RequestLimitExceeded</Code></Error></Errors></Response>")
+
+    def get_key_pair(self, keyPairName):
+        self.__request__("DescribeKeyPairs")
+        return keyPairName
+
+    def run_instances(self, imageId, min_count=1, max_count=1, instance_type=None, key_name=None, placement=None):
+        self.__request__("RunInstances")
+        instances = []
+        with self.lock:
+            for index in range(max_count):
+                number = len(self.instances) + 1
+                readyTime = None
+                if random.random() >= self.bootFailureRate:
+                    readyTime = self.clock.time() + max(0, self.bootTime + random.uniform(-self.bootJitter, self.bootJitter))
+                instance = SimulatedInstance("i-{0:08x}".format(number),
+                                             "10.{0}.{1}.{2}".format(number >> 16, (number >> 8) & 255, number & 255), readyTime)
+                self.instances[instance.id] = instance
+                instances.append(instance)
+        return SimulatedReservation(instances)
+
+    def create_tags(self, resourceIds, tags):
+        self.__request__("CreateTags")
+
+    def get_all_instance_status(self, instance_ids=None):
+        self.__request__("DescribeInstanceStatus")
+        now = self.clock.time()
+        return [SimulatedStatus(instanceId, "ok" if self.instances[instanceId].readyTime is not None and
+                                now >= self.instances[instanceId].readyTime else "initializing")
+                for instanceId in instance_ids]
+
+    def get_only_instances(self, instance_ids=None, filters=None):
+        self.__request__("DescribeInstances")
+        if filters is not None:
+            instance_ids = [instanceId for instanceId in filters.get('instance-id', []) if instanceId in self.instances]
+        return [self.instances[instanceId] for instanceId in instance_ids]
+
+    def terminate_instances(self, instance_ids=None):
+        self.__request__("TerminateInstances")
+        for instanceId in instance_ids:
+            self.instances[instanceId].state = "terminated"
+
+#
+# A stand-in for Fabric's remote operations. While installed, Fabric's run(), sudo() and put() are replaced,
+# so the tasks in puppet.py/djangoutils.py (and everything they use) run against simulated hosts. The
+# counters are shared with worker processes (they must be created before the workers are forked).
+#
+class SimulatedSSH(object):
+    '''An in-process stand-in for SSH connections to the nodes, with configurable latency.'''
+
+    def __init__(self, clock, connectTime, roundTripTime, stepTime, uploadRate):
+        self.clock = clock
+        self.connectTime = connectTime
+        self.roundTripTime = roundTripTime
+        self.stepTime = stepTime
+        self.uploadRate = uploadRate
+        self.connections = multiprocessing.Value('l', 0)
+        self.commands = multiprocessing.Value('l', 0)
+        self.uploads = multiprocessing.Value('l', 0)
+        self.uploadBytes = multiprocessing.Value('l', 0)
+        self.connectedHosts = set()
+        self.savedOperations = None
+
+    def install(self):
+        '''Replace Fabric's remote operations with the simulated ones.'''
+        self.savedOperations = (api.run, api.sudo, api.put)
+        (api.run, api.sudo, api.put) = (self.run, self.run, self.put)
+
+    def uninstall(self):
+        '''Restore Fabric's own remote operations.'''
+        (api.run, api.sudo, api.put) = self.savedOperations
+
+    def __roundtrip__(self):
+        '''Private helper, simulating a round-trip to the current host (connecting first, if necessary).'''
+        if api.env.host_string not in self.connectedHosts:
+            self.connectedHosts.add(api.env.host_string)
+            with self.connections.get_lock():
+                self.connections.value += 1
+            self.clock.sleep(self.connectTime)
+        self.clock.sleep(self.roundTripTime)
+
+    def run(self, command, **kwargs):
+        '''Simulate running a command. Remote scripts (see remotescript.py) report every step as succeeding.'''
+        self.__roundtrip__()
+        with self.commands.get_lock():
+            self.commands.value += 1
+
+        lines = []
+        for index in re.findall(r'echo "' + re.escape(remotescript.STEP_MARKER) + r' (\d+) ', command):
+            startTime = self.clock.time()
+            self.clock.sleep(self.stepTime)
+            lines.append("{0} {1} 0 {2:.3f} {3:.3f}".format(remotescript.STEP_MARKER, index, startTime, self.clock.time()))
+        result = _AttributeString("\n".join(lines))
+        (result.failed, result.succeeded, result.return_code, result.stderr) = (False, True, 0, "")
+        return result
+
+    def put(self, localPath, remotePath, **kwargs):
+        '''Simulate uploading a file, taking time in proportion to its size.'''
+        size = os.path.getsize(localPath)
+        self.__roundtrip__()
+        self.clock.sleep(float(size) / self.uploadRate)
+        with self.uploads.get_lock():
+            self.uploads.value += 1
+            self.uploadBytes.value += size
+        result = __listattr__([remotePath])
+        (result.failed, result.succeeded) = ([], True)
+        return result
+
+def __listattr__(values):
+    '''Private helper, returning a list which can carry attributes (like Fabric's put() result).'''
+    return type('AttributeList', (list,), {})(values)
+
+#
+# Create a small Django project (in a new temporary directory) to deploy, with numFiles files of fileSize
+# bytes each. Return the project's path.
+#
+def createProject(numFiles, fileSize):
+    '''Return the path of a new, temporary, Django project to deploy in the benchmark.'''
+    projectDir = os.path.join(tempfile.mkdtemp(), "benchproj")
+    os.makedirs(os.path.join(projectDir, "app"))
+    with open(os.path.join(projectDir, "manage.py"), "w") as outFile:
+        outFile.write("#!/usr/bin/env python\n")
+    for index in range(numFiles):
+        with open(os.path.join(projectDir, "app", "module{0}.py".format(index)), "w") as outFile:
+            outFile.write("#" * fileSize)
+    return projectDir
+
+#
+# Run a single benchmark: launch and provision numNodes nodes against the simulated EC2 and SSH, in the
+# same way as launch.py. Return a dictionary of measurements.
+#
+def runBenchmark(numNodes, parsedArgs, instanceConfigDict, projectDir):
+    '''Benchmark a launch of numNodes nodes, returning the measurements.'''
+
+    clock = SimulatedClock(parsedArgs.time_scale)
+    ec2 = SimulatedEC2(clock, parsedArgs.boot_time, parsedArgs.boot_jitter, parsedArgs.boot_failure_rate,
+                       parsedArgs.api_latency, parsedArgs.api_failure_rate)
+    ssh = SimulatedSSH(clock, parsedArgs.connect_time, parsedArgs.rtt, parsedArgs.step_time, parsedArgs.upload_rate)
+    phases = pipeline.getPhases(instanceConfigDict, projectDir)
+    phaseTimes = {}
+
+    (savedConnect, savedTime) = (aws.connectEC2, aws.time)
+    aws.connectEC2 = lambda *args, **kwargs: ec2
+    aws.time = clock
+    ssh.install()
+    startTime = clock.time()
+    realStartTime = time.time()
+    try:
+        with api.hide('everything'):
+            if parsedArgs.pipeline:
+                launchPipeline = pipeline.LaunchPipeline("keyFile", phases, parsedArgs.max_in_flight)
+                try:
+                    aws.launchEC2Instances("id", "secret", numNodes, "region", instanceConfigDict['EC2_ImageID'],
+                                           instanceConfigDict['EC2_InstanceType'], "keys",
+                                           readyCallback=lambda instanceId, ipAddress: launchPipeline.submit(ipAddress),
+                                           chunkSize=instanceConfigDict['Fleet_ChunkSize'],
+                                           requestRate=instanceConfigDict['Fleet_RequestRate'])
+                except:
+                    launchPipeline.terminate()
+                    raise
+                (ipList, failures) = launchPipeline.wait()
+            else:
+                ipList = aws.launchEC2Instances("id", "secret", numNodes, "region", instanceConfigDict['EC2_ImageID'],
+                                                instanceConfigDict['EC2_InstanceType'], "keys",
+                                                chunkSize=instanceConfigDict['Fleet_ChunkSize'],
+                                                requestRate=instanceConfigDict['Fleet_RequestRate'])
+                phaseTimes['boot'] = clock.time() - startTime
+                sshpool.openPool()
+                try:
+                    for (phaseName, phase, argument) in phases:
+                        phaseStartTime = clock.time()
+                        results = phase("keyFile", argument, ipList, poolSize=parsedArgs.pool_size)
+                        for failure in fabricutils.getFailures(results):
+                            ipList.remove(failure['host'])
+                        phaseTimes[phaseName] = clock.time() - phaseStartTime
+                finally:
+                    sshpool.closePool()
+    finally:
+        ssh.uninstall()
+        (aws.connectEC2, aws.time) = (savedConnect, savedTime)
+
+    return {'nodes': numNodes,
+            'provisioned': len(ipList),
+            'simulatedTime': clock.time() - startTime,
+            'realTime': time.time() - realStartTime,
+            'phaseTimes': phaseTimes,
+            'ec2Requests': sum(ec2.calls.values()),
+            'ec2RequestsByType': ec2.calls,
+            'sshConnections': ssh.connections.value,
+            'sshRoundTrips': ssh.commands.value + ssh.uploads.value,
+            'uploads': ssh.uploads.value,
+            'uploadBytes': ssh.uploadBytes.value}
+
+#
+# Compare a set of results with a baseline (from a previous run, saved with --save). Return a list of
+# messages describing each regression: a fleet size whose simulated time, or number of EC2 requests or
+# SSH round-trips, has grown by more than REGRESSION_TOLERANCE.
+#
+def findRegressions(results, baseline):
+    '''Return a list of regressions in results, compared with the baseline results.'''
+    baselineByNodes = dict((result['nodes'], result) for result in baseline)
+    regressions = []
+    for result in results:
+        previous = baselineByNodes.get(result['nodes'])
+        if previous is None:
+            continue
+        for key in ['simulatedTime', 'ec2Requests', 'sshRoundTrips']:
+            if result[key] > previous[key] * (1 + REGRESSION_TOLERANCE):
+                regressions.append("{0} nodes: {1} went from {2:.1f} to {3:.1f}".format(result['nodes'], key, previous[key], result[key]))
+    return regressions
+
+def formatResult(result):
+    '''Return a one-line summary of a benchmark result, for display to the user.'''
+    return "{0:>6} {1:>6} {2:>10.1f} {3:>9.1f} {4:>8} {5:>8} {6:>8} {7:>10.1f}".format(
+           result['nodes'], result['provisioned'], result['simulatedTime'], result['realTime'], result['ec2Requests'],
+           result['sshConnections'], result['sshRoundTrips'], result['uploadBytes'] / 1024.0)
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("benchmark.py"),
+                        usage="%(prog)s [-h] [--nodes <n,n,...>] [--pipeline] [--time-scale <scale>] [options] "
+                            "[--save <file>] [--compare <file>] [--json]",
+                        description="Tool for benchmarking launches offline, against simulated EC2 and SSH")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--nodes',
+                        default=DEFAULT_NODE_COUNTS,
+                        help="Comma-separated list of fleet sizes to benchmark (default is {0}).".format(DEFAULT_NODE_COUNTS))
+    parser.add_argument('--pipeline', action='store_true', help="Provision the nodes in pipelined mode (see launch.py).")
+    parser.add_argument('--pool-size', type=int, default=config.DEFAULT_POOL_SIZE,
+                        help="The number of nodes each phase is run on at the same time.")
+    parser.add_argument('--max-in-flight', type=int, default=config.DEFAULT_MAX_IN_FLIGHT,
+                        help="In --pipeline mode, the number of nodes provisioned at the same time.")
+    parser.add_argument('--time-scale', type=float, default=0.05,
+                        help="Real seconds per simulated second (default is 0.05, i.e. 20 times faster than real time).")
+    parser.add_argument('--boot-time', type=float, default=60.0, help="Simulated seconds for an instance to boot.")
+    parser.add_argument('--boot-jitter', type=float, default=20.0, help="Random variation (+/-) in the boot time.")
+    parser.add_argument('--boot-failure-rate', type=float, default=0.0,
+                        help="Fraction of instances that never pass their status checks.")
+    parser.add_argument('--api-latency', type=float, default=0.1, help="Simulated seconds per EC2 API request.")
+    parser.add_argument('--api-failure-rate', type=float, default=0.0,
+                        help="Fraction of EC2 API requests that fail with a throttling error.")
+    parser.add_argument('--connect-time', type=float, default=0.5, help="Simulated seconds to open an SSH connection.")
+    parser.add_argument('--rtt', type=float, default=0.05, help="Simulated seconds per SSH round-trip.")
+    parser.add_argument('--step-time', type=float, default=2.0, help="Simulated seconds per remote script step.")
+    parser.add_argument('--upload-rate', type=float, default=1024 * 1024,
+                        help="Simulated upload bandwidth per node (bytes per second).")
+    parser.add_argument('--project-files', type=int, default=50, help="Number of files in the deployed Django project.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed, so that runs are repeatable.")
+    parser.add_argument('--save', help="Save the results to this file (as JSON), for use with --compare.")
+    parser.add_argument('--compare', help="Compare the results with those saved in this file, and fail on regressions.")
+    parser.add_argument('--json', action='store_true', help="Show each result as a line of JSON, rather than as text.")
+    return parser
+
+def main(argv=None):
+    '''Run the launch benchmark, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        nodeCounts = [int(count) for count in parsedArgs.nodes.split(",")]
+        if parsedArgs.time_scale <= 0 or min(nodeCounts) < 1:
+            raise Exception("The time scale and fleet sizes must be positive")
+        baseline = None
+        if parsedArgs.compare is not None:
+            with open(parsedArgs.compare) as inFile:
+                baseline = json.load(inFile)
+    except (Exception, IOError) as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    random.seed(parsedArgs.seed)
+    projectDir = createProject(parsedArgs.project_files, 2048)
+    results = []
+    try:
+        if not parsedArgs.json:
+            print "\n{0:>6} {1:>6} {2:>10} {3:>9} {4:>8} {5:>8} {6:>8} {7:>10}".format(
+                  "Nodes", "Ready", "Sim. (s)", "Real (s)", "EC2 req", "SSH conn", "SSH RTs", "Upload KB")
+        for numNodes in nodeCounts:
+            result = runBenchmark(numNodes, parsedArgs, instanceConfigDict, projectDir)
+            results.append(result)
+            print json.dumps(result, sort_keys=True) if parsedArgs.json else formatResult(result)
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(os.path.dirname(projectDir))
+
+    if parsedArgs.save is not None:
+        with open(parsedArgs.save, "w") as outFile:
+            json.dump(results, outFile, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = findRegressions(results, baseline)
+        for regression in regressions:
+            print >>sys.stderr, "Regression:", regression
+        if len(regressions) != 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,63 @@
 #   - "instance.config" file (describing the VM instance(s) te be created)
 # Although these files have default names/locations, the user can overide them on the command line.
 #
-import sys, argparse, os, ConfigParser
+import sys, argparse, os, ConfigParser, hashlib, json
 
-# Constant: maximum number of EC2 instances we're prepared to create. This only exists for
-# the purposes of limiting the money spent :-)
+# Constant: maximum number of EC2 instances we're prepared to create, unless instance.config says otherwise.
+# This only exists for the purposes of limiting the money spent :-)
 MAX_EC2_INSTANCES = 5
 
+# Constant: default number of instances requested from EC2 in a single launch request.
+DEFAULT_LAUNCH_CHUNK_SIZE = 50
+
+# Constant: default (sustained) number of launch requests per second we make to the EC2 API.
+DEFAULT_REQUEST_RATE = 2.0
+
+# Constant: default number of provisioned, stopped, instances kept in the warm pool (see warmpool.py).
+DEFAULT_WARM_POOL_SIZE = 0
+
+# Constant: default number of seed instances the Django project is sent to when deploying, which then pass it on
+# to the others (see fanout.py). Zero means the project is sent to every instance directly.
+DEFAULT_FANOUT_SEEDS = 0
+
+# Constant: the ways the Django project's database can be migrated (see dbsnapshot.py): on every node, or once
+# (locally, or on the first node) and sent to the other nodes as a snapshot. The default is the first.
+DATABASE_SNAPSHOT_MODES = ["off", "local", "node"]
+
+# Constant: default number of instances that may be provisioned concurrently in --pipeline mode.
+DEFAULT_MAX_IN_FLIGHT = 5
+
+# Constant: default number of instances that Fabric tasks are run on concurrently.
+DEFAULT_POOL_SIZE = 10
+
+# Constant: the port the web server on each node listens on (see djangoutils.py).
+SERVER_PORT = 8080
+
+# Constant: default number of seconds we wait for the web server on each node to start answering requests.
+DEFAULT_READY_TIMEOUT = 300
+
+# Constant: the packages (RPMs, then Python packages) that are prefetched into the artifact cache, unless
+# instance.config says otherwise. These must cover everything installed by puppet.installPuppet and node.pp.
+DEFAULT_CACHE_PACKAGES = "puppet epel-release python-pip"
+DEFAULT_CACHE_PYTHON_PACKAGES = "Django==1.7.3 gunicorn==19.1.1 futures==3.0.3"
+
+# Constant: the default Puppet configuration for the load balancer (see lb.py), and the path it checks on each node.
+DEFAULT_LOAD_BALANCER_CONFIG_FILE = "lb.pp"
+DEFAULT_HEALTH_CHECK_PATH = "/"
+
+# Constant: the directory where we keep local state (such as the catalog of baked images) between runs.
+STATE_DIR = os.path.expanduser("~/.linkoverflow")
+
+# The name the current command was run as, shown in its usage messages (see getProgName). linkoverflow.py sets
+# it to "linkoverflow.py <command>"; it's None when the command is run as its own script.
+commandName = None
+
+# Constant: the name of the file (within the state directory) caching the parsed configuration files.
+# The version number is stored in the cache, and must be changed whenever the parsed dictionaries change
+# (e.g. a new setting is added), so that cached results from older versions aren't used.
+CONFIG_CACHE_NAME = "config-cache.json"
+CONFIG_CACHE_VERSION = 5
+
 
 #
 # Helper function for validating whether a file is only accessible to the owner of the file.
@@ -29,20 +80,59 @@ def checkFileIsPrivate(fileName):
     return None
 
 
+#
+# Return the path of a file (or directory) within our local state directory, creating the state directory
+# if necessary. The directory is only accessible by the current user, since it records details of the
+# user's EC2 resources.
+#
+def getStatePath(*names):
+    '''Return the path of a file within the local state directory (which is created if necessary).'''
+    if not os.path.isdir(STATE_DIR):
+        os.makedirs(STATE_DIR, 0700)
+    return os.path.join(STATE_DIR, *names)
+
+
+#
+# Return the name to show in the usage messages of the command implemented by scriptName: its subcommand (see
+# commandName) when it's run through linkoverflow.py, or scriptName when it's run as its own script.
+#
+def getProgName(scriptName):
+    '''Return the program name for a command's argument parser.'''
+    return commandName if commandName is not None else scriptName
+
+
+#
+# Return a hash identifying everything that goes into provisioning an instance with Puppet: the contents of
+# the Puppet configuration file, the Puppet repository URL and the base image. Two instances provisioned with
+# the same hash are interchangeable (as far as their installed software goes).
+#
+def getProvisioningHash(instanceConfigDict):
+    '''Return a hex string hash of the Puppet configuration, Puppet URL and base image ID.'''
+    digest = hashlib.sha1()
+    with open(instanceConfigDict['Puppet_PuppetConfigFile'], "rb") as configFile:
+        digest.update(configFile.read())
+    digest.update("\0" + instanceConfigDict['Puppet_PuppetURL'])
+    digest.update("\0" + instanceConfigDict['EC2_ImageID'])
+    return digest.hexdigest()
+
+
 #
 # Validate our command line arguments, and configuration files. Return a tuple containing the following
 # things:
 #
-#   (Number of instances, AWS settings dict, Instance Configuration dict)
+#   (Number of instances, Django project path, AWS settings dict, Instance Configuration dict, Launch options dict)
 #
 #
 # Where:
-#   Number of instances - An integer > 1, stating the number of EC2 instances to create.
+#   Number of instances - An integer > 1, stating the number of EC2 instances to create (or None when resuming
+#      a launch, in which case it comes from the launch journal).
 #   AWS settings - A dictionary containing AWS settings (typically private to each user. This includes the
 #      standard AWS connection keys, as well as the user's selected availability zone.
 #   Instance Configuration - A dictionary containing information about the VM instances we're going to create
 #      (such as AMI type, etc). This information is *not* per-user and should be version-controlled along
 #      with the product's source code, so the platform and the product will remain in-sync.
+#   Launch options - A dictionary of options controlling how the launch is performed (such as
+#      whether instances are provisioned in pipelined mode).
 # 
 # We throw an exception if an error is encountered.
 #
@@ -54,8 +144,10 @@ def checkFileIsPrivate(fileName):
 def create_parser():
     defaultSettingsFile = os.path.expanduser("~/.aws.settings")
     parser = argparse.ArgumentParser(
-                        prog="launch.py",
-                        usage="%(prog)s [-h] [--aws-config <file>] [--system-config <file>] <django_proj> <num_servers>",
+                        prog=getProgName("launch.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--pipeline] [--max-in-flight <n>] [--pool-size <n>] [--artifact-cache] "
+                            "[--resume <launch_id>] [--profile] [--probe-path <path>] [--ready-timeout <seconds>] [--no-probe] "
+                            "[--no-collect-static] <django_proj> [<num_servers>]",
                         description="Deployment tool for creating multiple AWS instances, then running "
                             "a Django application on all of them.")	
     parser.add_argument('--aws-settings',
@@ -72,29 +164,102 @@ def create_parser():
                         help="Path to the Django project (the directory containing manage.py)")	
     parser.add_argument('num_servers',
                         type=int,
-                        help="The number of AWS instances to create and install the application on.")
+                        nargs='?',
+                        help="The number of AWS instances to create and install the application on (required, "
+                            "unless resuming a previous launch).")
+    parser.add_argument('--pipeline',
+                        action='store_true',
+                        help="Provision each instance (install Puppet, apply configuration, deploy and run the Django "
+                            "project) as soon as it has booted, rather than waiting for all instances to finish each phase.")
+    parser.add_argument('--max-in-flight',
+                        type=int,
+                        default=DEFAULT_MAX_IN_FLIGHT,
+                        help="In --pipeline mode, the maximum number of instances being provisioned at the same time "
+                            "(default is {0}).".format(DEFAULT_MAX_IN_FLIGHT))
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=DEFAULT_POOL_SIZE,
+                        help="The maximum number of instances that each installation/deployment phase is run on "
+                            "at the same time (default is {0}).".format(DEFAULT_POOL_SIZE))
+    parser.add_argument('--artifact-cache',
+                        action='store_true',
+                        help="Serve the local artifact cache (prefetched with artifacts.py) to the instances, and "
+                            "install all packages from it rather than from the internet.")
+    parser.add_argument('--resume',
+                        metavar='LAUNCH_ID',
+                        help="Resume a previous launch that failed partway: adopt its instances, and only run the "
+                            "phases that didn't complete, on the nodes that didn't complete them.")
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help="Record how long each EC2 request, task, remote step and file transfer takes on each host, "
+                            "then write a trace file (for chrome://tracing or Perfetto) and show a summary.")
+    parser.add_argument('--probe-path',
+                        action='append',
+                        default=[],
+                        help="A path that must be served by each node's web server before the launch is complete "
+                            "(may be repeated, default is /).")
+    parser.add_argument('--ready-timeout',
+                        type=float,
+                        default=DEFAULT_READY_TIMEOUT,
+                        help="How long to wait for the web server on each node to be ready, in seconds "
+                            "(default is {0}).".format(DEFAULT_READY_TIMEOUT))
+    parser.add_argument('--no-probe',
+                        action='store_true',
+                        help="Don't check that the web servers are up (or measure their latency) at the end of the launch.")
+    parser.add_argument('--no-collect-static',
+                        action='store_true',
+                        help="Don't collect the project's static files into its release bundle (even if it has a STATIC_ROOT).")
     return parser
 
-def validateConfig():
-    '''Parse and validate command-line arguments, and ensure the expected configuration files are present
-    and contain the required configuration values'''
+def validateConfig(argv=None):
+    '''Parse and validate command-line arguments (argv, or sys.argv by default), and ensure the expected
+    configuration files are present and contain the required configuration values'''
         
     #
     # Parse command-line arguments. This uses the standard Python argparse module to collect and validate
     # input parameters.
     #    
     parser = create_parser()
-    parsedArgs = parser.parse_args()
+    parsedArgs = parser.parse_args(argv)
     
     #
-    # The number of instances to be created must be at least 1 (and for now, we limit to small maximum value - MAX_EC2_INSTANCES)
+    # The number of instances to be created must be at least 1 (the maximum is checked against instance.config below).
+    # When resuming a launch, the number of instances is taken from its journal instead.
     #
     # KW: [Test] Verify num_servers with values of -1, 0, 1, 5, 6
     #
     numServers = parsedArgs.num_servers
-    if (numServers < 1) or (numServers > MAX_EC2_INSTANCES):
+    if numServers is None and parsedArgs.resume is None:
+        raise Exception("The number of EC2 instances must be provided (unless resuming a launch with --resume)")
+    if numServers is not None and numServers < 1:
         raise Exception("Invalid number of EC2 instances requested: {0}".format(numServers))
 
+    #
+    # We need to provision at least one instance at a time, whether pipelined or not.
+    #
+    launchOptionsDict = {}
+    launchOptionsDict['Launch_Pipeline'] = parsedArgs.pipeline
+    launchOptionsDict['Launch_MaxInFlight'] = parsedArgs.max_in_flight
+    launchOptionsDict['Launch_PoolSize'] = parsedArgs.pool_size
+    launchOptionsDict['Launch_ArtifactCache'] = parsedArgs.artifact_cache
+    launchOptionsDict['Launch_Resume'] = parsedArgs.resume
+    launchOptionsDict['Launch_Profile'] = parsedArgs.profile
+    launchOptionsDict['Launch_Probe'] = not parsedArgs.no_probe
+    launchOptionsDict['Launch_ProbePaths'] = parsedArgs.probe_path or ["/"]
+    launchOptionsDict['Launch_ReadyTimeout'] = parsedArgs.ready_timeout
+    launchOptionsDict['Launch_CollectStatic'] = not parsedArgs.no_collect_static
+    launchOptionsDict['Launch_AWSSettingsFile'] = parsedArgs.aws_settings
+    launchOptionsDict['Launch_InstanceConfigFile'] = parsedArgs.instance_config
+    if parsedArgs.max_in_flight < 1:
+        raise Exception("Invalid maximum number of instances in flight: {0}".format(parsedArgs.max_in_flight))
+    if parsedArgs.pool_size < 1:
+        raise Exception("Invalid pool size: {0}".format(parsedArgs.pool_size))
+    if parsedArgs.ready_timeout <= 0:
+        raise Exception("Invalid ready timeout: {0}".format(parsedArgs.ready_timeout))
+    for path in parsedArgs.probe_path:
+        if not path.startswith("/"):
+            raise Exception("Invalid probe path {0} (should start with /)".format(path))
+
     #
     # Validate that "django_proj" is a directory that contains a manage.py file.
     #
@@ -104,34 +269,42 @@ def validateConfig():
     if not os.path.isfile(djangoProj + "/manage.py"):
         raise Exception("Directory {0} does not appear to be a valid Django project.".format(djangoProj))
 
+    awsConfigDict = readAWSSettings(parsedArgs.aws_settings)
+    instanceConfigDict = readInstanceConfig(parsedArgs.instance_config)
+
+    #
+    # To limit the money spent, we won't create more instances than instance.config permits (MaxInstances).
+    #
+    if numServers is not None and numServers > instanceConfigDict['Fleet_MaxInstances']:
+        raise Exception("Invalid number of EC2 instances requested: {0} (the maximum is {1}, see MaxInstances in {2})".format(
+                        numServers, instanceConfigDict['Fleet_MaxInstances'], parsedArgs.instance_config))
+
+    # All is good - return configuration to the caller in a tuple.
+    return (numServers, djangoProj, awsConfigDict, instanceConfigDict, launchOptionsDict)
+
+#
+# Read and validate the per-user AWS settings file, returning a dictionary of its settings. We throw an
+# exception if an error is encountered.
+#
+def readAWSSettings(fileName):
+    '''Read and validate the AWS settings file, returning the AWS settings dict.'''
+
     #
     # The AWS settings file must exist, and must be accessible *only* by the current user. This file contains
     # security keys and must remain protected.
     #
     # KW: [Test] Verify settings file permission that is accessible by everyone, by owner only, and not by owner. 	
     #
-    error = checkFileIsPrivate(parsedArgs.aws_settings)
+    error = checkFileIsPrivate(fileName)
     if error != None:
         raise Exception("AWS settings file " + error)
 
     #
     # now, read the key/values from the AWS settings file into the dictionary we'll return to our caller.
+    # (The parsed settings are cached, so this is only done when the file has changed.)
     #
-    # KW: [Test] Also verify if settings file is not present and invalid (e.g. contains missing properties).
-    #
-    awsConfigDict = {}
-    try:
-        awsConfigParser = ConfigParser.RawConfigParser()
-        awsConfigParser.read(parsedArgs.aws_settings)
-        awsConfigDict['EC2_AccessKeyID'] = awsConfigParser.get("EC2", "AccessKeyID")
-        awsConfigDict['EC2_SecretAccessKey'] = awsConfigParser.get("EC2", "SecretAccessKey")
-        awsConfigDict['EC2_AvailabilityZone'] = awsConfigParser.get("EC2", "AvailabilityZone")
-        awsConfigDict['EC2_SSHKeyPair'] = awsConfigParser.get("EC2", "SSHKeyPair")
-        awsConfigDict['EC2_SSHKeyPairFile'] = awsConfigParser.get("EC2", "SSHKeyPairFile")
+    awsConfigDict = readCachedConfig(fileName, __parseawssettings__)
 
-    except (ConfigParser.Error) as mesg:
-        raise Exception("AWS settings file ({0}): {1}".format(parsedArgs.aws_settings, mesg))
-    
     #
     # The SSH key file must exist and only be accessible to the owner.
     #
@@ -140,38 +313,185 @@ def validateConfig():
     error = checkFileIsPrivate(awsConfigDict['EC2_SSHKeyPairFile'])
     if error != None:
         raise Exception("SSH private key file " + error)
-    
+
+    return awsConfigDict
+
+#
+# Read and validate the instance configuration file, returning a dictionary of its settings. We throw an
+# exception if an error is encountered.
+#
+def readInstanceConfig(fileName):
+    '''Read and validate the instance configuration file, returning the instance configuration dict.'''
+
     #
     # The instance config file must exist and be readable.
     #
     # KW: [Test] Verify if config file is missing and not accessible by owner.
     #
-    if not os.access(parsedArgs.instance_config, os.R_OK):
-        raise Exception("Instance configuration file ({0}) is either missing or unreadable".format(parsedArgs.instance_config))
+    if not os.access(fileName, os.R_OK):
+        raise Exception("Instance configuration file ({0}) is either missing or unreadable".format(fileName))
     
     #
     # Read the key/values from the instance config file into the dictionary we'll return to our caller.
+    # (The parsed settings are cached, so this is only done when the file has changed.)
+    #
+    instanceConfigDict = readCachedConfig(fileName, __parseinstanceconfig__)
+
+    if instanceConfigDict['Fleet_ChunkSize'] < 1 or instanceConfigDict['Fleet_RequestRate'] <= 0:
+        raise Exception("Instance configuration file ({0}): ChunkSize and RequestRate must be positive".format(fileName))
+    if instanceConfigDict['Fleet_WarmPoolSize'] < 0:
+        raise Exception("Instance configuration file ({0}): WarmPoolSize must not be negative".format(fileName))
+    if instanceConfigDict['Fleet_FanOutSeeds'] < 0:
+        raise Exception("Instance configuration file ({0}): FanOutSeeds must not be negative".format(fileName))
+    if instanceConfigDict['Database_Snapshot'] not in DATABASE_SNAPSHOT_MODES:
+        raise Exception("Instance configuration file ({0}): Snapshot must be one of: {1}".format(fileName,
+                        ", ".join(DATABASE_SNAPSHOT_MODES)))
+    
+    # check for existence of puppet file (validity can only be checked later)
+    #
+    # KW: [Test] Verify missing and invalid Puppet file
+    #
+    if not os.path.isfile(instanceConfigDict['Puppet_PuppetConfigFile']):
+        raise Exception("PuppetConfigFile field does not provide a valid file name.")
+    if instanceConfigDict['LoadBalancer_Enabled'] and not os.path.isfile(instanceConfigDict['LoadBalancer_PuppetConfigFile']):
+        raise Exception("Instance configuration file ({0}): the load balancer's PuppetConfigFile ({1}) doesn't exist".format(
+                        fileName, instanceConfigDict['LoadBalancer_PuppetConfigFile']))
+    if not instanceConfigDict['LoadBalancer_HealthCheckPath'].startswith("/"):
+        raise Exception("Instance configuration file ({0}): HealthCheckPath must start with /".format(fileName))
+
+    return instanceConfigDict
+
+def __parseawssettings__(fileName):
+    '''Private helper, parsing the AWS settings file into the AWS settings dict.'''
+
+    #
+    # KW: [Test] Also verify if settings file is not present and invalid (e.g. contains missing properties).
+    #
+    awsConfigDict = {}
+    try:
+        awsConfigParser = ConfigParser.RawConfigParser()
+        awsConfigParser.read(fileName)
+        awsConfigDict['EC2_AccessKeyID'] = awsConfigParser.get("EC2", "AccessKeyID")
+        awsConfigDict['EC2_SecretAccessKey'] = awsConfigParser.get("EC2", "SecretAccessKey")
+        awsConfigDict['EC2_AvailabilityZone'] = awsConfigParser.get("EC2", "AvailabilityZone")
+        awsConfigDict['EC2_SSHKeyPair'] = awsConfigParser.get("EC2", "SSHKeyPair")
+        awsConfigDict['EC2_SSHKeyPairFile'] = awsConfigParser.get("EC2", "SSHKeyPairFile")
+
+        # Optional: the URL of an alternative (e.g. stand-in, for testing) EC2 endpoint.
+        awsConfigDict['EC2_Endpoint'] = None
+        if awsConfigParser.has_option("EC2", "Endpoint"):
+            awsConfigDict['EC2_Endpoint'] = awsConfigParser.get("EC2", "Endpoint")
+
+        # Optional: the availability zones (within the region) to spread the instances across.
+        awsConfigDict['EC2_Zones'] = __getoptional__(awsConfigParser, "EC2", "Zones", "").split()
+
+    except (ConfigParser.Error) as mesg:
+        raise Exception("AWS settings file ({0}): {1}".format(fileName, mesg))
+
+    return awsConfigDict
+
+def __parseinstanceconfig__(fileName):
+    '''Private helper, parsing the instance configuration file into the instance configuration dict.'''
+
     #
     # KW: [Test] Verify missing properties in configuration file (e.g. no Puppet_PuppetURL).
     #
     instanceConfigDict = {}
     try:
         instanceConfigParser = ConfigParser.RawConfigParser()
-        instanceConfigParser.read(parsedArgs.instance_config)
+        instanceConfigParser.read(fileName)
         instanceConfigDict['EC2_ImageID'] = instanceConfigParser.get("EC2", "ImageID")
         instanceConfigDict['EC2_InstanceType'] = instanceConfigParser.get("EC2", "InstanceType")
         instanceConfigDict['Puppet_PuppetURL'] = instanceConfigParser.get("Puppet", "PuppetURL")
         instanceConfigDict['Puppet_PuppetConfigFile'] = instanceConfigParser.get("Puppet", "PuppetConfigFile")
-    except (ConfigParser.Error) as mesg:
-        raise Exception("Instance configuration file ({0}): {1}".format(parsedArgs.instance_config, mesg))
-    
-    # check for existence of puppet file (validity can only be checked later)
-    #
-    # KW: [Test] Verify missing and invalid Puppet file
-    #
-    if not os.path.isfile(instanceConfigDict['Puppet_PuppetConfigFile']):
-        raise Exception("PuppetConfigFile field does not provide a valid file name.")
 
-    # All is good - return configuration to the caller in a tuple.
-    return (numServers, djangoProj, awsConfigDict, instanceConfigDict)
+        # Optional: the artifact cache (see artifacts.py). The URL of a published cache, and the packages to prefetch.
+        instanceConfigDict['Cache_URL'] = __getoptional__(instanceConfigParser, "Cache", "URL", None)
+        instanceConfigDict['Cache_Packages'] = __getoptional__(instanceConfigParser, "Cache", "Packages",
+                                                               DEFAULT_CACHE_PACKAGES).split()
+        instanceConfigDict['Cache_PythonPackages'] = __getoptional__(instanceConfigParser, "Cache", "PythonPackages",
+                                                                     DEFAULT_CACHE_PYTHON_PACKAGES).split()
+
+        # Optional: the limits on the size of the fleet, and how quickly it's launched.
+        instanceConfigDict['Fleet_MaxInstances'] = int(__getoptional__(instanceConfigParser, "Fleet", "MaxInstances",
+                                                                       MAX_EC2_INSTANCES))
+        instanceConfigDict['Fleet_ChunkSize'] = int(__getoptional__(instanceConfigParser, "Fleet", "ChunkSize",
+                                                                    DEFAULT_LAUNCH_CHUNK_SIZE))
+        instanceConfigDict['Fleet_RequestRate'] = float(__getoptional__(instanceConfigParser, "Fleet", "RequestRate",
+                                                                        DEFAULT_REQUEST_RATE))
+        instanceConfigDict['Fleet_WarmPoolSize'] = int(__getoptional__(instanceConfigParser, "Fleet", "WarmPoolSize",
+                                                                       DEFAULT_WARM_POOL_SIZE))
+        instanceConfigDict['Fleet_FanOutSeeds'] = int(__getoptional__(instanceConfigParser, "Fleet", "FanOutSeeds",
+                                                                      DEFAULT_FANOUT_SEEDS))
+
+        # Optional: how the Django project's database is migrated (see dbsnapshot.py).
+        instanceConfigDict['Database_Snapshot'] = __getoptional__(instanceConfigParser, "Database", "Snapshot",
+                                                                  DATABASE_SNAPSHOT_MODES[0])
+
+        # Optional: the load balancer in front of the fleet (see lb.py), which is off unless Enabled.
+        instanceConfigDict['LoadBalancer_Enabled'] = (instanceConfigParser.has_option("LoadBalancer", "Enabled") and
+                                                      instanceConfigParser.getboolean("LoadBalancer", "Enabled"))
+        instanceConfigDict['LoadBalancer_PuppetConfigFile'] = __getoptional__(instanceConfigParser, "LoadBalancer",
+                                                                              "PuppetConfigFile",
+                                                                              DEFAULT_LOAD_BALANCER_CONFIG_FILE)
+        instanceConfigDict['LoadBalancer_InstanceType'] = __getoptional__(instanceConfigParser, "LoadBalancer", "InstanceType",
+                                                                          instanceConfigDict['EC2_InstanceType'])
+        instanceConfigDict['LoadBalancer_HealthCheckPath'] = __getoptional__(instanceConfigParser, "LoadBalancer",
+                                                                             "HealthCheckPath", DEFAULT_HEALTH_CHECK_PATH)
+    except (ConfigParser.Error, ValueError) as mesg:
+        raise Exception("Instance configuration file ({0}): {1}".format(fileName, mesg))
+
+    return instanceConfigDict
+
+#
+# Return the result of reader(fileName), which parses a configuration file into a dictionary. The result is
+# cached on disk (in CONFIG_CACHE_NAME) along with the file's modification time and size, so the file is only
+# parsed again once it has changed. The cache holds secrets from the AWS settings file, so (like that file)
+# it's only accessible by the current user, and it's ignored (then replaced) if it has become accessible by
+# anyone else. If the cache can't be used, the file is simply parsed.
+#
+def readCachedConfig(fileName, reader):
+    '''Return reader(fileName), reusing the result from a previous run if the file hasn't changed since.'''
+    try:
+        stat = os.stat(fileName)
+    except OSError:
+        return reader(fileName)
+    key = "{0}:{1}".format(reader.__name__, os.path.abspath(fileName))
+    stamp = [stat.st_mtime, stat.st_size]
+
+    cacheFile = getStatePath(CONFIG_CACHE_NAME)
+    cache = {}
+    if checkFileIsPrivate(cacheFile) is None:
+        try:
+            with open(cacheFile) as inFile:
+                cache = json.load(inFile, object_hook=__decodestrings__)
+        except (IOError, ValueError):
+            cache = {}
+    if cache.get('Version') != CONFIG_CACHE_VERSION:
+        cache = {'Version': CONFIG_CACHE_VERSION, 'Files': {}}
+    entry = cache['Files'].get(key)
+    if entry is not None and entry['Stamp'] == stamp:
+        return entry['Value']
+
+    value = reader(fileName)
+    cache['Files'][key] = {'Stamp': stamp, 'Value': value}
+    try:
+        outFile = os.fdopen(os.open(cacheFile + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), "w")
+        with outFile:
+            json.dump(cache, outFile, sort_keys=True)
+        os.rename(cacheFile + ".tmp", cacheFile)
+    except (IOError, OSError):
+        pass
+    return value
+
+def __decodestrings__(dictionary):
+    '''Private helper, converting the (unicode) strings loaded from JSON back to plain strings.'''
+    decode = lambda value: value.encode("utf-8") if isinstance(value, unicode) else value
+    return dict((decode(key), [decode(item) for item in value] if isinstance(value, list) else decode(value))
+                for (key, value) in dictionary.items())
 
+def __getoptional__(configParser, section, option, default):
+    '''Private helper, returning an optional configuration value (or the default if it's not present).'''
+    if configParser.has_option(section, option):
+        return configParser.get(section, option)
+    return default
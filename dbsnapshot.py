@@ -0,0 +1,163 @@
+#
+# Helper functions for migrating a Django project's (SQLite) database once, rather than on every node. The
+# migrations are run on a fresh database, either locally or on a single builder node, and the resulting
+# database file (the snapshot) is kept in our local state directory, keyed by a hash of the project's
+# migrations. Each node that doesn't have a database yet is sent the snapshot, rather than migrating its own.
+#
+# Next to each node's database, a stamp file records the hash of the migrations it has been migrated to, so
+# "manage.py migrate" is only run when the migrations have changed since (e.g. on a node whose database
+# holds data, and which is being redeployed with new migrations). Both are kept in the project's shared
+# directory on the node (see release.getSharedPath), so they're the same whichever release is current.
+#
+import sys, os, re, hashlib, shutil, subprocess, tempfile, pipes
+
+# local modules
+import config, fabricutils, projectsync
+
+# The directory (within our local state directory) that snapshots are kept in.
+SNAPSHOTS_DIR = "snapshots"
+
+# The suffix of the stamp file, next to each node's database, holding the hash of the migrations it's migrated to.
+MIGRATED_SUFFIX = ".migrated"
+
+# The number of characters of the hash used to identify a snapshot.
+MIGRATIONS_HASH_LENGTH = 16
+
+#
+# Return the name of the project's SQLite database file (relative to the project directory), by looking at
+# the settings that "django-admin.py startproject" creates, or None if the project doesn't use a SQLite
+# database in its own directory (in which case it can't be snapshotted).
+#
+def getDatabaseFile(djangoProjPath):
+    '''Return the name of the Django project's SQLite database file, or None.'''
+    for name in sorted(os.listdir(djangoProjPath)):
+        settingsFile = os.path.join(djangoProjPath, name, "settings.py")
+        if os.path.isfile(settingsFile):
+            with open(settingsFile) as inFile:
+                settings = inFile.read()
+            if "django.db.backends.sqlite3" not in settings:
+                return None
+            match = re.search(r"os\.path\.join\(\s*BASE_DIR\s*,\s*['\"]([\w.-]+)['\"]\s*\)", settings)
+            return match.group(1) if match else None
+    return None
+
+#
+# Return the names of the project's files that make up its database on each node (the database, and its
+# stamp file), which are shared by all its releases (see release.getInstallCommand), or an empty list if
+# the project doesn't use a SQLite database in its own directory.
+#
+def getDatabaseFiles(djangoProjPath):
+    '''Return the names of the Django project's database and stamp files, or an empty list.'''
+    databaseFile = getDatabaseFile(djangoProjPath)
+    if databaseFile is None:
+        return []
+    return [databaseFile, databaseFile + MIGRATED_SUFFIX]
+
+#
+# Return the hash identifying the state of the project's migrations: the content of every migration module,
+# and of the settings (which decide the installed applications, whose migrations are also run).
+#
+def getMigrationsHash(djangoProjPath):
+    '''Return the hash of the Django project's migrations.'''
+    manifest = projectsync.buildManifest(djangoProjPath)
+    digest = hashlib.sha1()
+    for path in sorted(manifest):
+        if path.endswith(".py") and ("/migrations/" in path or path.endswith("/settings.py")):
+            digest.update("{0} {1}\n".format(path, manifest[path]['sha1']))
+    return digest.hexdigest()[:MIGRATIONS_HASH_LENGTH]
+
+#
+# Return the database snapshot for the project, making it (see mode) if it isn't already in our local state
+# directory, as a tuple of (migrationsHash, databaseFile, snapshotPath), or None if mode is "off" or the
+# project's database can't be snapshotted. When made on a node, the first node in ipList (which must already
+# have the project deployed) is used.
+#
+def getSnapshot(keyFile, djangoProjPath, ipList, mode, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Return the (migrationsHash, databaseFile, snapshotPath) of the project's database snapshot, or None.'''
+
+    if mode not in config.DATABASE_SNAPSHOT_MODES:
+        raise Exception("Invalid database snapshot mode: {0}".format(mode))
+    databaseFile = getDatabaseFile(djangoProjPath)
+    if mode == "off" or databaseFile is None:
+        return None
+    migrationsHash = getMigrationsHash(djangoProjPath)
+    snapshotPath = config.getStatePath(SNAPSHOTS_DIR, migrationsHash + ".sqlite3")
+    if os.path.isfile(snapshotPath):
+        return (migrationsHash, databaseFile, snapshotPath)
+
+    if not os.path.isdir(os.path.dirname(snapshotPath)):
+        os.makedirs(os.path.dirname(snapshotPath), 0700)
+
+    #
+    # The snapshot is written to a temporary file, then renamed into place, so one that's only partly made (or
+    # made by two launches at the same time) is never used.
+    #
+    tempPath = snapshotPath + ".tmp{0}".format(os.getpid())
+    try:
+        if mode == "local":
+            __migratelocally__(djangoProjPath, databaseFile, tempPath)
+        else:
+            results = fabricutils.executeOnHosts(__migrateonnodetask__, keyFile, ipList[:1], djangoProjPath, databaseFile,
+                                                 tempPath, poolSize=poolSize, taskName="make database snapshot")
+            for failure in fabricutils.getFailures(results):
+                raise Exception("Unable to make the database snapshot on {0}".format(fabricutils.formatFailure(failure)))
+        os.rename(tempPath, snapshotPath)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+    return (migrationsHash, databaseFile, snapshotPath)
+
+def __migratelocally__(djangoProjPath, databaseFile, snapshotPath):
+    '''Private helper, migrating a fresh database for the project locally, and saving it as snapshotPath.'''
+    buildDir = tempfile.mkdtemp()
+    try:
+        projectDir = os.path.join(buildDir, "project")
+        shutil.copytree(djangoProjPath, projectDir, symlinks=True,
+                        ignore=shutil.ignore_patterns("*.pyc", databaseFile, databaseFile + MIGRATED_SUFFIX))
+        process = subprocess.Popen([sys.executable, "manage.py", "migrate", "--noinput"], cwd=projectDir,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            raise Exception("Unable to migrate the Django project's database locally:\n" + output.strip())
+        shutil.copy(os.path.join(projectDir, databaseFile), snapshotPath)
+    finally:
+        shutil.rmtree(buildDir)
+
+def __migrateonnodetask__(djangoProjPath, databaseFile, snapshotPath):
+    '''Private fabric task, for migrating a fresh database on a node, and fetching it as snapshotPath.'''
+
+    #
+    # Migrate a copy of the deployed project, without its database (which may hold the node's own data).
+    #
+    remoteDir = os.path.basename(os.path.normpath(djangoProjPath))
+    buildDir = fabricutils.run("mktemp -d").strip()
+    try:
+        fabricutils.run("tar -C {0}/ --exclude=./{1} --exclude=./{1}{2} -cf - . | tar -C {3} -xf - && "
+                        "cd {3} && python manage.py migrate --noinput".format(pipes.quote(remoteDir), pipes.quote(databaseFile),
+                                                                              MIGRATED_SUFFIX, pipes.quote(buildDir)))
+        fabricutils.get(buildDir + "/" + databaseFile, snapshotPath)
+    finally:
+        fabricutils.run("rm -rf {0}".format(pipes.quote(buildDir)))
+
+#
+# Return a shell command (run in the home directory) that migrates the database of the project in remoteDir,
+# unless its stamp file shows it has already been migrated to migrationsHash. databasePath is the path of the
+# shared database (see release.getSharedPath), which the stamp file is next to.
+#
+def getMigrateCommand(remoteDir, databasePath, migrationsHash):
+    '''Return the shell command that migrates the database (if it isn't already up to date), then stamps it.'''
+    stampFile = pipes.quote(databasePath + MIGRATED_SUFFIX)
+    return ('if [ -f {0} ] && [ "$(cat {1} 2>/dev/null)" = {2} ]; then echo "Database is already migrated"; '
+            'else (cd {3} && python manage.py migrate) && echo {2} > {1}; fi').format(pipes.quote(databasePath), stampFile,
+                                                                                      migrationsHash, pipes.quote(remoteDir))
+
+#
+# Return a shell command (run in the home directory) that installs the snapshot (already sent to the node as
+# remoteSnapshot) as the shared database at databasePath, unless there's already a database, then removes
+# the snapshot.
+#
+def getInstallSnapshotCommand(databasePath, migrationsHash, remoteSnapshot):
+    '''Return the shell command that installs the database snapshot, if the node doesn't have a database.'''
+    return ("[ -f {0} ] || {{ mkdir -p \"$(dirname {0})\" && cp {2} {0}.tmp && mv {0}.tmp {0} && echo {3} > {1}; }}; "
+            "status=$?; rm -f {2}; exit $status").format(pipes.quote(databasePath), pipes.quote(databasePath + MIGRATED_SUFFIX),
+                                                         pipes.quote(remoteSnapshot), migrationsHash)
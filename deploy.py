@@ -0,0 +1,220 @@
+#!/usr/bin/env python2.7
+#
+# "deploy.py" ships a new version of the Django project to the instances that are already running, rather
+# than launching new ones. The fleet's nodes are found on EC2 (the same fleet autoscale.py, lb.py and
+# reconcile.py manage, see autoscale.findFleetInstances), optionally limited to some launches or tags, and
+# updated in waves: each node in a wave is switched to the project's new release (see release.py), its
+# database is migrated and its web server restarted, and the wave must be serving again (see prober.py)
+# before the next one starts. The rest of the fleet keeps serving while a wave is updated. If too many nodes
+# in a wave fail, the rollout stops, leaving the remaining nodes on the old version.
+#
+#   deploy.py [--wave-size <n>] [--max-failures <n>] [--group <name>] [--launch-id <id>] [--tag <key=value>]
+#             [--no-collect-static] <django_proj>
+#
+import sys, os, argparse, functools, time
+
+# local modules (the modules that use Fabric are slow to import, so they're imported where they're used)
+import config, prober, release, autoscale
+
+# Constant: by default, each wave updates this fraction of the fleet (but always at least one node).
+DEFAULT_WAVE_FRACTION = 0.25
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    defaultSettingsFile = os.path.expanduser("~/.aws.settings")
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("deploy.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--wave-size <n>] "
+                            "[--max-failures <n>] [--group <name>] [--launch-id <id>] [--tag <key=value>] [--pool-size <n>] "
+                            "[--probe-path <path>] [--ready-timeout <seconds>] [--no-collect-static] <django_proj>",
+                        description="Tool for deploying a new version of a Django project to the running EC2 instances, "
+                            "a wave at a time")
+    parser.add_argument('--aws-settings',
+                        default=defaultSettingsFile,
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory). These settings contain "
+                            "important keys and should be kept secret at all times.")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('django_proj',
+                        type=str,
+                        help="Path to the Django project (the directory containing manage.py)")
+    parser.add_argument('--wave-size',
+                        type=int,
+                        help="The number of nodes updated at the same time (default is a quarter of the fleet).")
+    parser.add_argument('--max-failures',
+                        type=int,
+                        default=0,
+                        help="Stop the rollout if more than this many nodes in a wave fail (default is 0).")
+    parser.add_argument('--group',
+                        default=autoscale.DEFAULT_GROUP,
+                        help="The name of the autoscaling group the fleet's nodes are tagged with "
+                            "(default is {0}).".format(autoscale.DEFAULT_GROUP))
+    parser.add_argument('--launch-id',
+                        action='append',
+                        default=[],
+                        help="Only include the nodes of the given launch (and of the group) in the fleet (may be repeated).")
+    parser.add_argument('--tag',
+                        action='append',
+                        default=[],
+                        help="Only deploy to the fleet's nodes with the given tag value (may be repeated).")
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=config.DEFAULT_POOL_SIZE,
+                        help="The maximum number of nodes in a wave that are worked on at the same time "
+                            "(default is {0}).".format(config.DEFAULT_POOL_SIZE))
+    parser.add_argument('--probe-path',
+                        action='append',
+                        default=[],
+                        help="A path that each node must serve before it's considered healthy (may be repeated, default is /).")
+    parser.add_argument('--ready-timeout',
+                        type=float,
+                        default=config.DEFAULT_READY_TIMEOUT,
+                        help="How long to wait for each node's web server to be healthy, in seconds "
+                            "(default is {0}).".format(config.DEFAULT_READY_TIMEOUT))
+    parser.add_argument('--no-collect-static',
+                        action='store_true',
+                        help="Don't collect the project's static files into its release bundle (even if it has a STATIC_ROOT).")
+    return parser
+
+#
+# Find the IP addresses of the fleet's nodes (see autoscale.findFleetInstances), optionally limited to those
+# with the given tags (given as "key=value"; a node matches a key given more than once if it has any of its
+# values).
+#
+def findRunningInstances(awsConfigDict, group=None, launchIds=[], tags=[]):
+    '''Return the sorted list of IP addresses of the fleet's matching nodes.'''
+    import aws
+    tagFilters = {}
+    for tag in tags:
+        if "=" not in tag:
+            raise Exception("Invalid tag filter {0} (should be key=value)".format(tag))
+        (key, value) = tag.split("=", 1)
+        tagFilters.setdefault(key, []).append(value)
+    ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'],
+                         awsConfigDict['EC2_AvailabilityZone'], awsConfigDict['EC2_Endpoint'])
+    return sorted(instance['ip_address'] for instance in autoscale.findFleetInstances(ec2, group, launchIds)
+                  if instance['ip_address'] and all(instance['tags'].get(key) in values for (key, values) in tagFilters.items()))
+
+def planWaves(ipList, waveSize=None):
+    '''Split ipList into a list of waves of (at most) waveSize nodes (by default, a quarter of the fleet).'''
+    if waveSize is None:
+        waveSize = max(1, int(len(ipList) * DEFAULT_WAVE_FRACTION))
+    if waveSize < 1:
+        raise Exception("Invalid wave size: {0}".format(waveSize))
+    return [ipList[index:index + waveSize] for index in range(0, len(ipList), waveSize)]
+
+#
+# Update a single wave of nodes: send the project, then migrate its database and restart the web server,
+# then wait for the web server to be serving again. Each node only goes on to the next step if it succeeded
+# at the previous one, and a node that was already running the release (with its web server up) is left as
+# it is, so deploying the same version again does nothing. (If restartOnly is True, the nodes already have
+# the release, and are only restarted.)
+# If collectStatic is False, the project's static files aren't collected into its release bundle.
+# Return a dictionary mapping each node that failed to a description of the failure.
+#
+def deployWave(keyFile, djangoProj, wave, poolSize=config.DEFAULT_POOL_SIZE, instanceType=None,
+               probePaths=prober.DEFAULT_PATHS, readyTimeout=config.DEFAULT_READY_TIMEOUT, fanoutSeeds=0, snapshotMode="off",
+               restartOnly=False, collectStatic=True):
+    '''Deploy the project to the nodes in wave, and return the failures (as a dictionary of IP address to error).'''
+    import djangoutils, fabricutils
+    failures = {}
+    remaining = list(wave)
+    steps = [("deploy", functools.partial(djangoutils.deployProject, fanoutSeeds=fanoutSeeds, collectStatic=collectStatic)),
+             ("restart", functools.partial(djangoutils.runProject, instanceType=instanceType, snapshotMode=snapshotMode))]
+    for (stepName, step) in steps[1:] if restartOnly else steps:
+        results = step(keyFile, djangoProj, remaining, poolSize=poolSize)
+        for failure in fabricutils.getFailures(results):
+            failures[failure['host']] = "failed to {0}: {1}".format(stepName, fabricutils.formatFailure(failure))
+            remaining.remove(failure['host'])
+        if stepName == "deploy":
+            unchanged = set(result['host'] for result in results if result['succeeded'] and result['value'] == "unchanged")
+            remaining = [ipAddress for ipAddress in remaining if ipAddress not in unchanged]
+        if len(remaining) == 0:
+            return failures
+
+    probeResults = prober.probeFleet(remaining, paths=probePaths, readyTimeout=readyTimeout, samples=0)
+    for ipAddress in remaining:
+        if not probeResults[ipAddress]['ready']:
+            failures[ipAddress] = "web server isn't healthy: {0}".format(probeResults[ipAddress]['error'])
+    return failures
+
+#
+# Roll the deployment out, a wave at a time, by calling deployWave(wave) for each wave (which returns the
+# failures, as deployWave does above). If more than maxFailures nodes in a wave fail, the rollout stops.
+# Return a tuple of (the nodes that were updated, the failures, the nodes that weren't attempted).
+#
+def rollingDeploy(waves, deployWave, maxFailures=0):
+    '''Deploy to each wave in turn, stopping if a wave has too many failures.'''
+    updated = []
+    failures = {}
+    for (index, wave) in enumerate(waves):
+        print "\nWave {0} of {1}: updating {2}".format(index + 1, len(waves), " ".join(wave))
+        sys.stdout.flush()
+        startTime = time.time()
+        waveFailures = deployWave(wave)
+        for ipAddress in sorted(waveFailures):
+            print >>sys.stderr, "Error:", ipAddress, waveFailures[ipAddress]
+        updated.extend(ip for ip in wave if ip not in waveFailures)
+        failures.update(waveFailures)
+        print "Wave {0} of {1}: {2} of {3} nodes updated in {4:.1f}s".format(index + 1, len(waves),
+              len(wave) - len(waveFailures), len(wave), time.time() - startTime)
+        if len(waveFailures) > maxFailures:
+            print >>sys.stderr, "\nStopping the rollout: {0} nodes failed in wave {1} (at most {2} allowed)".format(
+                                len(waveFailures), index + 1, maxFailures)
+            return (updated, failures, [ip for remaining in waves[index + 1:] for ip in remaining])
+    return (updated, failures, [])
+
+def main(argv=None):
+    '''Deploy the Django project to the running instances, a wave at a time, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        djangoProj = parsedArgs.django_proj
+        if not os.path.isfile(os.path.join(djangoProj, "manage.py")):
+            raise Exception("Django project directory ({0}) doesn't contain manage.py".format(djangoProj))
+        if parsedArgs.max_failures < 0:
+            raise Exception("Invalid maximum number of failures: {0}".format(parsedArgs.max_failures))
+
+        ipList = findRunningInstances(awsConfigDict, parsedArgs.group, parsedArgs.launch_id, parsedArgs.tag)
+        if len(ipList) == 0:
+            raise Exception("There are no running instances to deploy to")
+        waves = planWaves(ipList, parsedArgs.wave_size)
+        (releaseId, bundlePath) = release.buildRelease(djangoProj, collectStatic=not parsedArgs.no_collect_static)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    print "\nDeploying", djangoProj, "(release {0}) to".format(releaseId), len(ipList), "running instances, in", len(waves), "waves"
+
+    #
+    # All the waves share a pool of SSH sessions (see sshpool.py), so each node is only connected to once.
+    #
+    import sshpool
+    sshpool.openPool()
+    try:
+        (updated, failures, skipped) = rollingDeploy(waves,
+                                           functools.partial(deployWave, awsConfigDict['EC2_SSHKeyPairFile'], djangoProj,
+                                                             poolSize=parsedArgs.pool_size,
+                                                             instanceType=instanceConfigDict['EC2_InstanceType'],
+                                                             probePaths=parsedArgs.probe_path or prober.DEFAULT_PATHS,
+                                                             readyTimeout=parsedArgs.ready_timeout,
+                                                             fanoutSeeds=instanceConfigDict['Fleet_FanOutSeeds'],
+                                                             snapshotMode=instanceConfigDict['Database_Snapshot'],
+                                                             collectStatic=not parsedArgs.no_collect_static),
+                                           parsedArgs.max_failures)
+    finally:
+        sshpool.closePool()
+
+    print "\nUpdated", len(updated), "of", len(ipList), "instances"
+    if len(skipped) != 0:
+        print >>sys.stderr, "Not updated (still running the previous version):", " ".join(skipped)
+    if len(failures) != 0 or len(skipped) != 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
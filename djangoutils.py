@@ -1,69 +1,229 @@
 #
 # Helper functions for interacting with Django, running on one or more EC2 instances.
 #
-import os
+import sys, os, pipes
 
-from fabric import api
+# local modules
+import config, fabricutils, release, remotescript, fanout, dbsnapshot
 
+# The directory (on each node, created by node.pp) holding the web server's logs and process ID file.
+SERVER_LOG_DIR = "/var/log/linkoverflow"
+SERVER_PID_FILE = SERVER_LOG_DIR + "/server.pid"
+
+# Gunicorn settings: the number of threads per (gthread) worker process, and how long (in seconds) to keep
+# idle client connections open for reuse.
+SERVER_THREADS_PER_WORKER = 4
+SERVER_KEEP_ALIVE = 5
+
+# The memory (in MB) of the instance types we expect to use, the memory to leave for the rest of the system,
+# and the memory to allow for each worker process. On small instances, memory (rather than the number of
+# CPUs) limits the number of workers we can run.
+INSTANCE_MEMORY_MB = {'t2.nano': 512, 't2.micro': 1024, 't2.small': 2048, 't2.medium': 4096, 't2.large': 8192,
+                      'm3.medium': 3840, 'm3.large': 7680, 'm3.xlarge': 15360, 'm3.2xlarge': 30720,
+                      'm4.large': 8192, 'm4.xlarge': 16384, 'm4.2xlarge': 32768,
+                      'c4.large': 3840, 'c4.xlarge': 7680, 'c4.2xlarge': 15360}
+RESERVED_MEMORY_MB = 256
+WORKER_MEMORY_MB = 128
+
+#
+# Copy a full django project over to a set of EC2 instances. The task is run on
+# all instances in parallel, and a per-host result is returned for each (see
+# fabricutils.executeOnHosts), so the caller can decide how to handle failures.
+#
+# The project is built into a release bundle (once, locally), which is only sent
+# to the instances that don't already have it, and each instance is switched over
+# to the new release atomically (see release.py). If fanoutSeeds is non-zero (and
+# there are more instances than that), the launcher only sends the bundle to that
+# many instances, and the rest fetch it from each other (see fanout.py). In
+# pipelined mode, each instance is deployed to on its own, so it's always sent the
+# bundle directly. If collectStatic is False, the project's static files aren't
+# collected into the bundle (see release.buildRelease).
 #
-# Copy a full django project over to a set of EC2 instances. On error, this
-# whole function will abort. TODO: fix this to instead throw an exception
-# to the caller.
+# Each host's result value is the one release.installRelease returns, except that
+# a node that was already running the release, but whose web server isn't running,
+# is reported as "stopped" rather than "unchanged" (so it's still restarted).
 #
 # KW: [Test] Verify there is enough storage space at remote machine for us to copy over all required files
 #     [Test] Verify that Django Project files are copied over at the correct location afterwards.
 #     [Process] Perhaps also do a CRC check on each file at remote machine to verify file correctness.
 #
-def deployProject(keyFile, djangoProjPath, ipList):
-    '''Copy a full Django project over to a set of EC2 instances.'''
-    
-    api.env.user = "centos"
-    api.env.hosts = ipList
-    api.env.key_filename = keyFile
-    results = api.execute(__deployprojecttask__, djangoProjPath)
+def deployProject(keyFile, djangoProjPath, ipList, poolSize=config.DEFAULT_POOL_SIZE, fanoutSeeds=0, collectStatic=True):
+    '''Copy a full Django project over to a set of EC2 instances, returning the list of per-host results.'''
+
+    # build the release once, rather than once per host (an unchanged project isn't rebuilt).
+    (releaseId, bundlePath) = release.buildRelease(djangoProjPath, collectStatic)
+    if fanoutSeeds == 0 or len(ipList) <= fanoutSeeds:
+        return fabricutils.executeOnHosts(__deployprojecttask__, keyFile, ipList, djangoProjPath, releaseId, bundlePath,
+                                          poolSize=poolSize, taskName="deploy Django project")
+
+    #
+    # Switch the instances that already have the release over to it, then distribute the bundle to the rest
+    # through their peers, and install it from there. An instance that fails at any point keeps its failure.
+    #
+    results = dict((result['host'], result) for result in
+                   fabricutils.executeOnHosts(__deployprojecttask__, keyFile, ipList, djangoProjPath, releaseId, None,
+                                              poolSize=poolSize, taskName="deploy Django project"))
+    missingIpList = [ipAddress for ipAddress in ipList if results[ipAddress]['succeeded'] and results[ipAddress]['value'] is None]
+    if len(missingIpList) != 0:
+        (distributeResults, rounds) = fanout.distributeFile(keyFile, bundlePath, missingIpList, fanoutSeeds, poolSize)
+        for result in distributeResults:
+            results[result['host']] = result
+        stagedIpList = [result['host'] for result in distributeResults if result['succeeded']]
+        stagedArchive = fanout.getStagedPath(os.path.basename(bundlePath))
+        for result in fabricutils.executeOnHosts(__deployprojecttask__, keyFile, stagedIpList, djangoProjPath, releaseId,
+                                                 None, stagedArchive, poolSize=poolSize, taskName="deploy Django project"):
+            results[result['host']] = result
+    return [results[ipAddress] for ipAddress in ipList]
 
-def __deployprojecttask__(djangoProjPath):
+def __deployprojecttask__(djangoProjPath, releaseId, bundlePath, stagedArchive=None):
     '''Private fabric task, for installing a Django project on a node'''
 
     #
-    # Copy all the files (with their correct access mode) from our local
-    # working directory into the remote instance's local directory. This
-    # will automatically overwrite any existing files.
-    # TODO: this operation will not remove "deleted" files from the target
-    # instance. This will need to be fixed to avoid stale files sitting around.
-    api.put(djangoProjPath, '', mirror_local_mode=True)
+    # Install the release under the releases directory of the remote instance's home
+    # directory, and point the project directory (named after our local working
+    # directory) at it.
+    #
+    remoteDir = os.path.basename(os.path.normpath(djangoProjPath))
+    result = release.installRelease(releaseId, bundlePath, remoteDir, stagedArchive, dbsnapshot.getDatabaseFiles(djangoProjPath))
+    if result == "unchanged" and fabricutils.run(getServerRunningCommand(SERVER_PID_FILE)).strip() != "yes":
+        return "stopped"
+    return result
 
 #
 # Given a list of IP addresses and the path to a Django project, start up the
-# Django project's internal web server. On error, this whole function will
-# abort. TODO: fix this to instead throw an exception to the caller.
+# Django project's web server (see getRunProjectSteps). The number of server
+# processes depends on each node's CPU count, limited by the memory of
+# instanceType. The task is run on all instances in parallel, and a per-host
+# result is returned for each.
+#
+# Unless snapshotMode is "off", the database is migrated once (see dbsnapshot.py),
+# and the instances that don't have a database yet are sent the migrated one. If
+# the snapshot can't be made, each instance migrates its own database instead.
 #
 # KW: [Test] Verify database is up and running afterwards. This can be done programmatically via SQL command-line.
 #     [Test] Verify web app server is running. We can automate this by checking if the service is listening to the correct HTTP ports after it has started.
 #
-def runProject(keyFile, djangoProjectPath, ipList):
-    '''Start a Django web project running on a set of EC2 instances.'''
-    
-    api.env.user = "centos"
-    api.env.hosts = ipList
-    api.env.key_filename = keyFile
-    results = api.execute(__runprojecttask__, djangoProjectPath)
+def runProject(keyFile, djangoProjectPath, ipList, poolSize=config.DEFAULT_POOL_SIZE, instanceType=None, snapshotMode="off"):
+    '''Start a Django web project running on a set of EC2 instances, returning the list of per-host results.'''
+
+    snapshot = None
+    try:
+        snapshot = dbsnapshot.getSnapshot(keyFile, djangoProjectPath, ipList, snapshotMode, poolSize=poolSize)
+    except Exception as mesg:
+        print >>sys.stderr, "Warning: migrating each node's database separately:", mesg
+    return fabricutils.executeOnHosts(__runprojecttask__, keyFile, ipList, djangoProjectPath, instanceType, snapshot,
+                                      poolSize=poolSize, taskName="run Django project")
     
-def __runprojecttask__(djangoProjPath):
+def __runprojecttask__(djangoProjPath, instanceType, snapshot=None):
     '''Private fabric task, for running a Django project web server on a node'''
-    
+
     #
-    # Create (migrate) the underlying database (in our case, SQLite), then start the default
-    # web server running. Note that we need to disconnect stdin/stdout/stderr so that Fabric
-    # can run the server in the background. TODO: fix this so we can capture log/error output
-    # in a file.
+    # Only send the database snapshot if the node doesn't have a database yet.
+    #
+    remoteSnapshot = None
+    if snapshot is not None:
+        (migrationsHash, databaseFile, snapshotPath) = snapshot
+        remoteDir = os.path.basename(os.path.normpath(djangoProjPath))
+        if fabricutils.run("[ -f {0} ] || echo missing".format(pipes.quote(remoteDir + "/" + databaseFile))).strip() == "missing":
+            remoteSnapshot = "/tmp/" + os.path.basename(snapshotPath)
+            fabricutils.put(snapshotPath, remoteSnapshot)
+    return remotescript.runSteps(getRunProjectSteps(djangoProjPath, instanceType, remoteSnapshot))
+
+#
+# Stop the web server on a set of EC2 instances (e.g. before they're terminated). Gunicorn shuts down
+# gracefully when it's stopped, finishing the requests in progress before it exits, so the nodes are
+# drained rather than cut off. A per-host result is returned for each (see fabricutils.executeOnHosts).
+#
+def stopProject(keyFile, ipList, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Stop the web server on a set of EC2 instances, returning the list of per-host results.'''
+    return fabricutils.executeOnHosts(__stopprojecttask__, keyFile, ipList, poolSize=poolSize, taskName="stop web server")
+
+def __stopprojecttask__():
+    '''Private fabric task, for stopping the web server on a node'''
+    fabricutils.run(getStopServerCommand(SERVER_PID_FILE))
+
+#
+# Return the name of the project's WSGI application (as "package.wsgi:application"), by looking for the
+# wsgi.py that "django-admin.py startproject" creates, or None if the project doesn't have one.
+#
+def getWSGIApplication(djangoProjPath):
+    '''Return the Gunicorn application name for the Django project, or None if there's no wsgi.py.'''
+    for name in sorted(os.listdir(djangoProjPath)):
+        if os.path.isfile(os.path.join(djangoProjPath, name, "wsgi.py")):
+            return name + ".wsgi:application"
+    return None
+
+#
+# Return the maximum number of worker processes that fit in the memory of instanceType, or None if we
+# don't know how much memory it has.
+#
+def getMaxWorkers(instanceType):
+    '''Return the most web server workers an instance of instanceType can hold, or None if unknown.'''
+    memory = INSTANCE_MEMORY_MB.get(instanceType)
+    if memory is None:
+        return None
+    return max(1, (memory - RESERVED_MEMORY_MB) // WORKER_MEMORY_MB)
+
+#
+# Return the list of steps (see remotescript.py) that start a Django project running on a node.
+#
+def getRunProjectSteps(djangoProjPath, instanceType=None, remoteSnapshot=None):
+    '''Return the remote steps for migrating the database, then (re)starting the web server.'''
+
+    #
+    # Create (migrate) the underlying database (in our case, SQLite), stop the server if it's already
+    # running (e.g. we're redeploying), then start the server running. The server is started in the
+    # background, detached from stdin/stdout/stderr, so that Fabric can return, and its output is
+    # logged in SERVER_LOG_DIR.
+    #
+    # We run the project under Gunicorn (installed by node.pp), with 2 workers per CPU plus one (as the
+    # Gunicorn documentation recommends), limited by the memory of the instance type, each with several
+    # threads (the gthread worker, which needs the futures package installed by node.pp). Idle client
+    # connections are kept open for reuse. If the project doesn't have a wsgi.py, we fall back to Django's
+    # single-process development server.
+    #
+    # If the project uses a SQLite database (kept in the project's shared directory, see release.py), migrate
+    # is skipped when the database has already been migrated to the current migrations, and if a database
+    # snapshot (see dbsnapshot.py) has been sent to the node (as remoteSnapshot), it's installed first, unless
+    # the node already has a database.
     #
     # KW: [Test] Verify database is migrated propery to remote machine afterwards
     #
-    remoteDir = os.path.basename(djangoProjPath)
-    api.run("cd " + remoteDir + " && python manage.py migrate")
-    api.run("cd " + remoteDir + " && (nohup python manage.py runserver 0.0.0.0:8080 >& /dev/null </dev/null &)", pty=False)
-    
-    # TODO: there is surely more to do here, but I'm running out of spare time :-(
-    
+    remoteDir = os.path.basename(os.path.normpath(djangoProjPath))
+    pidFile = SERVER_PID_FILE
+    application = getWSGIApplication(djangoProjPath)
+    if application is not None:
+        workers = "$((2 * $(nproc) + 1))"
+        maxWorkers = getMaxWorkers(instanceType)
+        if maxWorkers is not None:
+            workers = "$(w={0}; [ $w -gt {1} ] && w={1}; echo $w)".format(workers, maxWorkers)
+        server = ("exec gunicorn --bind 0.0.0.0:{0} --workers {1} --worker-class gthread --threads {2} --keep-alive {3} --pid {4} "
+                  "--access-logfile {5}/access.log --error-logfile {5}/error.log {6}").format(
+                  config.SERVER_PORT, workers, SERVER_THREADS_PER_WORKER, SERVER_KEEP_ALIVE, pidFile, SERVER_LOG_DIR,
+                  pipes.quote(application))
+    else:
+        server = "echo $$ > {0}; exec python manage.py runserver --noreload 0.0.0.0:{1}".format(pidFile, config.SERVER_PORT)
+
+    steps = []
+    migrate = "python manage.py migrate"
+    migrateDir = remoteDir
+    databaseFile = dbsnapshot.getDatabaseFile(djangoProjPath)
+    if databaseFile is not None:
+        migrationsHash = dbsnapshot.getMigrationsHash(djangoProjPath)
+        databasePath = release.getSharedPath(remoteDir, databaseFile)
+        if remoteSnapshot is not None:
+            steps.append(remotescript.step("install database snapshot",
+                         dbsnapshot.getInstallSnapshotCommand(databasePath, migrationsHash, remoteSnapshot)))
+        (migrate, migrateDir) = (dbsnapshot.getMigrateCommand(remoteDir, databasePath, migrationsHash), None)
+
+    return steps + [remotescript.step("migrate database", migrate, cwd=migrateDir),
+                    remotescript.step("stop web server", getStopServerCommand(pidFile)),
+                    remotescript.step("start web server", server, cwd=remoteDir, background=True, logFile=SERVER_LOG_DIR + "/server.log")]
+
+def getStopServerCommand(pidFile):
+    '''Return a shell command that stops the web server (if it's running), and waits for it to exit.'''
+    return remotescript.getStopCommand(pidFile)
 
+def getServerRunningCommand(pidFile):
+    '''Return a shell command that writes "yes" if the web server is running.'''
+    return "if [ -f {0} ] && kill -0 $(cat {0}) 2>/dev/null; then echo yes; fi".format(pidFile)
@@ -0,0 +1,168 @@
+#
+# Helper functions shared by the modules that use Fabric to run tasks on EC2 instances (puppet.py and
+# djangoutils.py). Tasks are run on all the hosts in parallel (with a bounded pool of worker processes),
+# and a structured result is collected for each host, so that one failing host is reported without
+# aborting, or hiding the results of, the others.
+#
+import os, time
+
+from fabric import api
+
+# local modules
+import config, profiler
+
+# The number of lines of output to keep (per host) when reporting a failure.
+OUTPUT_TAIL_LINES = 10
+
+# The Fabric environment settings that tasks depend on, which must be passed along to the worker processes
+# of a session pool (since they may have been started before the settings were made).
+SHARED_ENV_KEYS = ['artifact_cache_url', 'artifact_cache_tunnel_port']
+
+# The session pool (see sshpool.py) that tasks are run through, or None to use Fabric's own parallel mode.
+sessionPool = None
+
+#
+# Exception raised by run()/sudo() when a remote command exits with a non-zero status. Unlike Fabric's
+# own abort, this preserves the exit status and output, so they can be included in the host's result.
+#
+class RemoteCommandError(Exception):
+
+    def __init__(self, command, exitStatus, output):
+        Exception.__init__(self, "Remote command ({0}) failed with exit status {1}".format(command, exitStatus))
+        self.exitStatus = exitStatus
+        self.output = output
+
+#
+# Wrappers around Fabric's run() and sudo(), for use within tasks. These raise RemoteCommandError
+# (rather than aborting the whole process) if the command fails.
+#
+def run(command, **kwargs):
+    '''Run a command on the current host, raising RemoteCommandError if it fails.'''
+    with api.settings(warn_only=True):
+        result = api.run(command, **kwargs)
+    if result.failed:
+        raise RemoteCommandError(command, result.return_code, result.stderr or result)
+    return result
+
+def sudo(command, **kwargs):
+    '''Run a command as root on the current host, raising RemoteCommandError if it fails.'''
+    with api.settings(warn_only=True):
+        result = api.sudo(command, **kwargs)
+    if result.failed:
+        raise RemoteCommandError(command, result.return_code, result.stderr or result)
+    return result
+
+#
+# Run a Fabric task on each of the hosts in ipList, with up to poolSize hosts being worked on at the same
+# time. Any additional arguments are passed through to the task. The task's name (taskName, or the name of
+# the function) is used to label its timing spans (see profiler.py). Return a list of per-host results (in
+# the same order as ipList), each of which is a dictionary containing:
+#
+#   host - The IP address of the host.
+#   succeeded - True if the task completed without error.
+#   exitStatus - 0 on success, the exit status of the failing remote command, or None if the task failed
+#       for some other reason (e.g. we couldn't connect).
+#   duration - The time (in seconds) taken to run the task on this host.
+#   outputTail - The last few lines of error output (or the error message) if the task failed.
+#   value - The value returned by the task.
+#
+def executeOnHosts(task, keyFile, ipList, *args, **kwargs):
+    '''Run a Fabric task on each of the hosts in ipList, in parallel, and return a list of per-host results.'''
+
+    poolSize = kwargs.pop('poolSize', config.DEFAULT_POOL_SIZE)
+    taskName = kwargs.pop('taskName', task.__name__)
+
+    api.env.user = "centos"
+    api.env.key_filename = keyFile
+
+    #
+    # If there's a session pool, run the task over each host's existing SSH session.
+    #
+    if sessionPool is not None and sessionPool.isUsable():
+        return sessionPool.execute(taskName, task, keyFile, ipList, args, kwargs, poolSize)
+
+    #
+    # A single host is run in this process: there's nothing to gain from forking, and we may already
+    # be running inside a worker process (e.g. in pipelined mode), which isn't permitted to fork.
+    #
+    if len(ipList) > 1:
+        hostTask = api.parallel(pool_size=poolSize)(__hosttask__)
+    else:
+        hostTask = api.serial(__hosttask__)
+    results = api.execute(hostTask, taskName, task, *args, hosts=ipList, **kwargs)
+    return [results[ipAddress] for ipAddress in ipList]
+
+def getSharedEnvSettings():
+    '''Return the current values of the Fabric environment settings that tasks depend on.'''
+    return dict((key, api.env[key]) for key in SHARED_ENV_KEYS if key in api.env)
+
+def __hosttask__(taskName, task, *args, **kwargs):
+    '''Private fabric task, for running a task on one host and recording the outcome.'''
+
+    result = {'host': api.env.host, 'succeeded': False, 'exitStatus': None, 'outputTail': "", 'value': None}
+    startTime = time.time()
+    try:
+        #
+        # If we're serving the artifact cache from the launcher, nodes reach it through a reverse tunnel.
+        #
+        tunnelPort = api.env.get('artifact_cache_tunnel_port')
+        if tunnelPort is not None:
+            with api.remote_tunnel(tunnelPort):
+                result['value'] = task(*args, **kwargs)
+        else:
+            result['value'] = task(*args, **kwargs)
+        result['succeeded'] = True
+        result['exitStatus'] = 0
+    except RemoteCommandError as mesg:
+        result['exitStatus'] = mesg.exitStatus
+        result['outputTail'] = "\n".join(str(mesg.output).splitlines()[-OUTPUT_TAIL_LINES:])
+
+    # Fabric aborts (e.g. on connection failures) by raising SystemExit, which we report like any other error.
+    except (Exception, SystemExit) as mesg:
+        result['outputTail'] = str(mesg) or "Aborted."
+
+    result['duration'] = time.time() - startTime
+    profiler.record(taskName, "task", startTime, result['duration'], api.env.host,
+                    {'succeeded': result['succeeded'], 'exitStatus': result['exitStatus']})
+    return result
+
+#
+# Wrappers around Fabric's put() and get(), for use within tasks. These record the time taken by the transfer
+# (see profiler.py), and raise an exception if it fails.
+#
+def put(localPath, remotePath, **kwargs):
+    '''Copy a local file to the current host, raising an exception if the transfer fails.'''
+    with profiler.span("upload " + os.path.basename(localPath), "transfer", api.env.host) as args:
+        args['bytes'] = os.path.getsize(localPath)
+        result = api.put(localPath, remotePath, **kwargs)
+    if len(result.failed) != 0:
+        raise Exception("Failed to copy {0} to remote node.".format(localPath))
+    return result
+
+def get(remotePath, localPath, **kwargs):
+    '''Copy a file from the current host, raising an exception if the transfer fails.'''
+    with profiler.span("download " + os.path.basename(remotePath), "transfer", api.env.host):
+        result = api.get(remotePath, localPath, **kwargs)
+    if len(result.failed) != 0:
+        raise Exception("Failed to copy {0} from remote node.".format(remotePath))
+    return result
+
+#
+# Given the list of results from executeOnHosts, return the results of the hosts that failed.
+#
+def getFailures(results):
+    '''Return the subset of executeOnHosts results for hosts on which the task failed.'''
+    return [result for result in results if not result['succeeded']]
+
+#
+# Format a failed host's result into a (possibly multi-line) message suitable for showing to the user.
+#
+def formatFailure(result):
+    '''Describe a failed executeOnHosts result, for display to the user.'''
+    if result['exitStatus'] is None:
+        mesg = "{0}: failed after {1:.1f}s".format(result['host'], result['duration'])
+    else:
+        mesg = "{0}: failed with exit status {1} after {2:.1f}s".format(result['host'], result['exitStatus'], result['duration'])
+    for line in result['outputTail'].splitlines():
+        mesg += "\n    " + line
+    return mesg
@@ -0,0 +1,191 @@
+#
+# Helper functions for distributing a file (such as a release bundle, see release.py) to a large number of
+# nodes. Rather than uploading the file from the launcher to every node (so the time taken grows with the
+# size of the fleet), the launcher only uploads it to a few seed nodes. Every node that has the file then
+# serves it (over HTTP, on the internal network) to other nodes, so the number of nodes holding the file
+# roughly doubles with each transfer, and a fleet of N nodes is covered in about log2(N) transfer times.
+#
+# The nodes fetch from each other by their private addresses, on FANOUT_PORT, which the instances' security
+# group must allow between them (the default security group does). Every node checks the file's SHA-1 hash
+# before serving it on, and any node that couldn't get the file from its peers is sent it directly.
+#
+import os, pipes
+
+from fabric import api
+
+# local modules
+import config, fabricutils, projectsync, remotescript
+
+# The directory (relative to the home directory on each node) that distributed files are stored in, and served from.
+FANOUT_DIR = ".linkoverflow-fanout"
+
+# The port the nodes serve distributed files to each other on.
+FANOUT_PORT = 8081
+
+# The default number of seed nodes the launcher uploads to, and how long (in seconds) each node waits for
+# its peer to have the file.
+DEFAULT_SEEDS = 3
+DEFAULT_TIMEOUT = 300
+
+# How often (in seconds) each node checks whether its peer has the file yet.
+POLL_INTERVAL = 0.5
+
+# The program each node serves its files with. It must run under both Python 2 (as installed on the nodes)
+# and Python 3, and handles several requests at a time, so checking for the file doesn't hold up a transfer.
+SERVER_PROGRAM = """import sys
+try:
+    from SimpleHTTPServer import SimpleHTTPRequestHandler as Handler
+    from SocketServer import ThreadingTCPServer as Server
+except ImportError:
+    from http.server import SimpleHTTPRequestHandler as Handler
+    from socketserver import ThreadingTCPServer as Server
+Handler.log_message = lambda *args: None
+Server.allow_reuse_address = True
+Server(("", int(sys.argv[1])), Handler).serve_forever()
+"""
+
+#
+# Plan the distribution tree for ipList (in order). The first numSeeds nodes are seeds, which are sent the file
+# by the launcher. Then, in each round, every node that already has the file passes it on to one more node.
+# Return a dictionary mapping each node to a tuple of (peer, previous), where peer is the node it fetches the
+# file from (or None for a seed), and previous is the node its peer passed the file to before it (or None). A
+# node only starts fetching once its previous node has the file, so each node sends one copy at a time.
+#
+def planTree(ipList, numSeeds=DEFAULT_SEEDS):
+    '''Return the distribution plan for ipList, as a dictionary of node to (peer, previous).'''
+    if numSeeds < 1:
+        raise Exception("Invalid number of seed nodes: {0}".format(numSeeds))
+    plan = dict((ipAddress, (None, None)) for ipAddress in ipList[:numSeeds])
+    holders = list(ipList[:numSeeds])
+    lastSent = {}
+    index = numSeeds
+    while index < len(ipList):
+        for peer in list(holders):
+            if index == len(ipList):
+                break
+            ipAddress = ipList[index]
+            plan[ipAddress] = (peer, lastSent.get(peer))
+            lastSent[peer] = ipAddress
+            holders.append(ipAddress)
+            index += 1
+    return plan
+
+def getRound(plan, ipAddress):
+    '''Return the number of transfers, one after another, it takes the file to reach ipAddress (1 for a seed).'''
+    (peer, previous) = plan[ipAddress]
+    if peer is None:
+        return 1
+    return max(getRound(plan, peer), getRound(plan, previous) if previous is not None else 0) + 1
+
+def getStagedPath(fileName):
+    '''Return the path (relative to the home directory) at which each node stores a distributed file.'''
+    return FANOUT_DIR + "/" + fileName
+
+#
+# Return the steps (see remotescript.py) for a node to fetch fileName from peerUrl, once each of the URLs in
+# waitUrls is serving it, check its hash, then start serving it on port. A node with no peerUrl (i.e. a
+# seed) has already been sent the file (as getStagedPath(fileName + ".part")), so just checks it and serves it.
+#
+def getFetchSteps(fileName, sha1, peerUrl=None, waitUrls=[], port=FANOUT_PORT, timeout=DEFAULT_TIMEOUT):
+    '''Return the remote steps for fetching, checking, then serving a distributed file.'''
+    stagedPath = pipes.quote(getStagedPath(fileName))
+    partPath = pipes.quote(getStagedPath(fileName + ".part"))
+    steps = []
+    if peerUrl is not None:
+        steps.append(remotescript.step("wait for peer",
+                     "deadline=$(($(date +%s) + {0})); for url in {1}; do "
+                     "until curl -sfI --max-time 5 \"$url\" >/dev/null; do "
+                     "[ $(date +%s) -lt $deadline ] || {{ echo \"Timed out waiting for $url\" >&2; exit 1; }}; "
+                     "sleep {2}; done; done".format(int(timeout), " ".join(pipes.quote(url) for url in waitUrls), POLL_INTERVAL)))
+        steps.append(remotescript.step("fetch " + fileName,
+                     "mkdir -p {0} && curl -sf --max-time {1} -o {2} {3}".format(pipes.quote(FANOUT_DIR), int(timeout), partPath,
+                                                                                 pipes.quote(peerUrl))))
+    steps.append(remotescript.step("check " + fileName,
+                 "{0} && mv -f {1} {2}".format(getCheckCommand(sha1, partPath), partPath, stagedPath)))
+    steps.append(remotescript.step("stop file server", remotescript.getStopCommand(getStagedPath("server.pid"))))
+    steps.append(remotescript.step("start file server",
+                 "echo $$ > server.pid && exec python -c {0} {1}".format(pipes.quote(SERVER_PROGRAM), port),
+                 cwd=FANOUT_DIR, background=True))
+    return steps
+
+def getCheckCommand(sha1, path):
+    '''Return a shell command that fails unless the SHA-1 hash of the file at path (already quoted) is sha1.'''
+    return "printf '%s  %s\\n' {0} {1} | sha1sum -c --quiet -".format(sha1, path)
+
+#
+# Return the private (internal network) address of each node in ipList, as a dictionary. The nodes that
+# couldn't be reached are left out.
+#
+def getPeerAddresses(keyFile, ipList, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Return a dictionary mapping each reachable node in ipList to its private address.'''
+    results = fabricutils.executeOnHosts(__peeraddresstask__, keyFile, ipList, poolSize=poolSize,
+                                         taskName="find peer address")
+    return dict((result['host'], result['value']) for result in results if result['succeeded'] and result['value'])
+
+def __peeraddresstask__():
+    '''Private fabric task, returning the node's private address.'''
+    return fabricutils.run("hostname -I | awk '{print $1}'").strip()
+
+#
+# Distribute the file localPath to every node in ipList (see above), storing it on each at getStagedPath(name
+# of the file). The launcher uploads the file to numSeeds seeds, and the rest of the nodes fetch it from
+# each other. Any node that couldn't get the file from its peers is then sent it directly. Return a tuple
+# of (results, rounds): the per-host results (as for fabricutils.executeOnHosts), and the number of transfers
+# (one after another) it took the file to reach the last node.
+#
+def distributeFile(keyFile, localPath, ipList, numSeeds=DEFAULT_SEEDS, poolSize=config.DEFAULT_POOL_SIZE,
+                   timeout=DEFAULT_TIMEOUT):
+    '''Distribute localPath to every node in ipList through their peers, returning the per-host results.'''
+
+    fileName = os.path.basename(localPath)
+    sha1 = projectsync.hashFile(localPath)
+    peerAddresses = getPeerAddresses(keyFile, ipList, poolSize)
+    plan = planTree([ipAddress for ipAddress in ipList if ipAddress in peerAddresses], numSeeds)
+    peerUrls = dict((ipAddress, "http://{0}:{1}/{2}".format(address, FANOUT_PORT, fileName))
+                    for (ipAddress, address) in peerAddresses.items())
+
+    #
+    # Every node fetches the file at the same time (as far as poolSize allows), each waiting for its own peer.
+    # Since a node's peer (and previous node) always come before it in the plan, they're never held up by it.
+    #
+    orderedIpList = sorted(plan, key=lambda ipAddress: ipList.index(ipAddress))
+    try:
+        results = dict((result['host'], result) for result in
+                       fabricutils.executeOnHosts(__fetchtask__, keyFile, orderedIpList, localPath, sha1, plan, peerUrls,
+                                                  timeout, poolSize=poolSize, taskName="distribute " + fileName))
+    finally:
+        fabricutils.executeOnHosts(__stopservertask__, keyFile, orderedIpList, poolSize=poolSize,
+                                   taskName="stop file server")
+
+    #
+    # Send the file directly to the nodes that didn't get it (including those we couldn't find the address of).
+    #
+    retryIpList = [ipAddress for ipAddress in ipList if ipAddress not in results or not results[ipAddress]['succeeded']]
+    if len(retryIpList) != 0:
+        for result in fabricutils.executeOnHosts(__sendtask__, keyFile, retryIpList, localPath, sha1, poolSize=poolSize,
+                                                 taskName="send " + fileName):
+            results[result['host']] = result
+    rounds = max([getRound(plan, ipAddress) for ipAddress in plan] + [0])
+    return ([results[ipAddress] for ipAddress in ipList], rounds)
+
+def __fetchtask__(localPath, sha1, plan, peerUrls, timeout):
+    '''Private fabric task, for getting a distributed file onto a node (from the launcher, or a peer).'''
+    (peer, previous) = plan[api.env.host]
+    fileName = os.path.basename(localPath)
+    if peer is None:
+        fabricutils.run("mkdir -p {0}".format(pipes.quote(FANOUT_DIR)))
+        fabricutils.put(localPath, getStagedPath(fileName + ".part"))
+        return remotescript.runSteps(getFetchSteps(fileName, sha1))
+    waitUrls = [peerUrls[node] for node in [peer, previous] if node is not None]
+    return remotescript.runSteps(getFetchSteps(fileName, sha1, peerUrls[peer], waitUrls, timeout=timeout))
+
+def __sendtask__(localPath, sha1):
+    '''Private fabric task, for sending a distributed file to a node directly, and checking it.'''
+    stagedPath = getStagedPath(os.path.basename(localPath))
+    fabricutils.run("mkdir -p {0}".format(pipes.quote(FANOUT_DIR)))
+    fabricutils.put(localPath, stagedPath)
+    fabricutils.run(getCheckCommand(sha1, pipes.quote(stagedPath)))
+
+def __stopservertask__():
+    '''Private fabric task, for stopping the node's file server.'''
+    fabricutils.run(remotescript.getStopCommand(getStagedPath("server.pid")))
@@ -0,0 +1,56 @@
+#
+# Helper functions for maintaining the local catalog of "baked" AMIs. A baked image is a snapshot of an
+# instance that has already been provisioned with Puppet, so new instances launched from it can skip the
+# Puppet phases entirely. Images are keyed by the provisioning hash (see config.getProvisioningHash), so
+# any change to the Puppet configuration, Puppet URL or base image means the catalog entry no longer applies.
+#
+import os, json, time
+
+# local modules
+import config
+
+# The name of the catalog file, within our local state directory.
+CATALOG_FILE_NAME = "images.json"
+
+#
+# Load the image catalog, which is a dictionary mapping each provisioning hash to a dictionary describing
+# the image baked for it. If there's no catalog yet, return an empty one.
+#
+def loadCatalog():
+    '''Return the image catalog dictionary (empty if no images have been baked).'''
+    catalogFile = config.getStatePath(CATALOG_FILE_NAME)
+    if not os.path.isfile(catalogFile):
+        return {}
+    try:
+        with open(catalogFile) as inFile:
+            return json.load(inFile)
+    except ValueError as mesg:
+        raise Exception("Image catalog ({0}) is corrupt: {1}".format(catalogFile, mesg))
+
+def saveCatalog(catalog):
+    '''Save the image catalog dictionary, replacing the previous catalog atomically.'''
+    catalogFile = config.getStatePath(CATALOG_FILE_NAME)
+    with open(catalogFile + ".tmp", "w") as outFile:
+        json.dump(catalog, outFile, indent=2, sort_keys=True)
+    os.rename(catalogFile + ".tmp", catalogFile)
+
+#
+# Look up the baked image for a provisioning hash, in the given region (AMIs are specific to a region).
+# Return the image ID, or None if there's no matching image.
+#
+def lookupImage(provisioningHash, region):
+    '''Return the ID of the image baked for provisioningHash in the given region, or None.'''
+    entry = loadCatalog().get(provisioningHash)
+    if entry is None or entry['Region'] != region:
+        return None
+    return entry['ImageID']
+
+def recordImage(provisioningHash, region, imageId, instanceConfigDict):
+    '''Record a newly-baked image in the catalog, replacing any previous image for the same hash.'''
+    catalog = loadCatalog()
+    catalog[provisioningHash] = {'ImageID': imageId,
+                                 'Region': region,
+                                 'BaseImageID': instanceConfigDict['EC2_ImageID'],
+                                 'PuppetURL': instanceConfigDict['Puppet_PuppetURL'],
+                                 'Created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    saveCatalog(catalog)
@@ -0,0 +1,140 @@
+#
+# Helper functions for maintaining the launch journal. Each launch is given an ID, and its journal (in
+# ~/.linkoverflow/launches/<launch-id>.json) records the instances that were started, the IP address of
+# each one once it's ready, and the provisioning phases each node has completed. If a launch fails partway,
+# "launch.py --resume <launch-id>" uses the journal to adopt the existing instances, and to re-run only the
+# unfinished phases on only the unfinished nodes (rather than booting a whole new set of instances).
+#
+# The instances are also tagged with their launch ID (see LAUNCH_ID_TAG), so they can be found with
+# "showstate.py --tag LinkOverflow:LaunchId=<launch-id>".
+#
+import os, json, time, threading, binascii
+
+# local modules
+import config
+
+# The tag applied to each EC2 instance, recording the launch it belongs to.
+LAUNCH_ID_TAG = "LinkOverflow:LaunchId"
+
+# The name of the directory (within our local state directory) holding the journals.
+JOURNAL_DIR_NAME = "launches"
+
+#
+# Return a new, unique, launch ID. These sort in the order the launches were started.
+#
+def newLaunchId():
+    '''Return a new launch ID, made from the current time and a random suffix.'''
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + "-" + binascii.hexlify(os.urandom(3))
+
+def getJournalFile(launchId):
+    '''Return the path of the journal file for launchId (creating the journal directory if necessary).'''
+    journalDir = config.getStatePath(JOURNAL_DIR_NAME)
+    if not os.path.isdir(journalDir):
+        os.makedirs(journalDir, 0700)
+    return os.path.join(journalDir, launchId + ".json")
+
+#
+# Create a journal for a new launch, recording the settings needed to resume it, and save it.
+#
+def createJournal(launchId, djangoProj, numServers, imageId, region):
+    '''Return a new (saved) Journal for the launch.'''
+    journal = Journal(launchId, {'LaunchID': launchId,
+                                 'DjangoProject': os.path.abspath(djangoProj),
+                                 'NumServers': numServers,
+                                 'ImageID': imageId,
+                                 'Region': region,
+                                 'Created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                 'Nodes': {}})
+    journal.save()
+    return journal
+
+def loadJournal(launchId):
+    '''Return the Journal of a previous launch, or raise an exception if there isn't one.'''
+    journalFile = getJournalFile(launchId)
+    if not os.path.isfile(journalFile):
+        raise Exception("There's no journal for launch {0} (expected {1})".format(launchId, journalFile))
+    try:
+        with open(journalFile) as inFile:
+            return Journal(launchId, json.load(inFile))
+    except ValueError as mesg:
+        raise Exception("Launch journal ({0}) is corrupt: {1}".format(journalFile, mesg))
+
+#
+# The journal of a single launch. Its state is a dictionary (saved as JSON) holding the launch settings,
+# and a 'Nodes' dictionary, mapping each instance ID to a dictionary containing:
+#
+#   IPAddress - The IP address of the instance, or None if it hasn't yet passed its status checks.
+#   CompletedPhases - The names of the provisioning phases completed on the node (see pipeline.getPhases).
+#   Error - A description of the last failure on the node, or None.
+#
+# Every change is saved immediately, so that the journal survives the launcher failing. Changes may be
+# made from several threads (e.g. the LaunchPipeline's result handler), so they're serialized by a lock.
+#
+class Journal(object):
+    '''The on-disk record of a launch's instances, and of each node's progress through the phases.'''
+
+    def __init__(self, launchId, state):
+        self.launchId = launchId
+        self.state = state
+        self.lock = threading.RLock()
+
+    def save(self):
+        '''Save the journal, replacing the previous version atomically.'''
+        with self.lock:
+            journalFile = getJournalFile(self.launchId)
+            with open(journalFile + ".tmp", "w") as outFile:
+                json.dump(self.state, outFile, indent=2, sort_keys=True)
+            os.rename(journalFile + ".tmp", journalFile)
+
+    def recordStarted(self, instanceIds):
+        '''Record that the instances have been started (but aren't yet ready).'''
+        with self.lock:
+            for instanceId in instanceIds:
+                self.state['Nodes'][instanceId] = {'IPAddress': None, 'CompletedPhases': [], 'Error': None}
+            self.save()
+
+    def recordReady(self, instanceId, ipAddress):
+        '''Record that an instance has passed its status checks, and its IP address.'''
+        with self.lock:
+            self.state['Nodes'][instanceId]['IPAddress'] = ipAddress
+            self.save()
+
+    def recordPhases(self, ipAddress, phaseNames, error=None):
+        '''Record that a node has completed the named phases, and the error it then failed with (if any).'''
+        with self.lock:
+            node = self.getNode(ipAddress)
+            node['CompletedPhases'].extend(name for name in phaseNames if name not in node['CompletedPhases'])
+            node['Error'] = error
+            self.save()
+
+    def recordPhaseResults(self, phaseName, results):
+        '''Record the outcome of a phase on each host (given the results of fabricutils.executeOnHosts).'''
+        with self.lock:
+            for result in results:
+                node = self.getNode(result['host'])
+                if result['succeeded']:
+                    if phaseName not in node['CompletedPhases']:
+                        node['CompletedPhases'].append(phaseName)
+                    node['Error'] = None
+                else:
+                    node['Error'] = "failed to {0}: {1}".format(phaseName, result['outputTail'])
+            self.save()
+
+    def getNode(self, ipAddress):
+        '''Return the state of the node with the given IP address.'''
+        for node in self.state['Nodes'].values():
+            if node['IPAddress'] == ipAddress:
+                return node
+        raise Exception("Launch {0} has no instance with IP address {1}".format(self.launchId, ipAddress))
+
+    def getInstanceIds(self):
+        '''Return the IDs of all the instances started by the launch.'''
+        return sorted(self.state['Nodes'])
+
+    def hasCompleted(self, ipAddress, phaseName):
+        '''Return True if the node has already completed the named phase.'''
+        return phaseName in self.getNode(ipAddress)['CompletedPhases']
+
+    def getRemainingPhases(self, ipAddress, phases):
+        '''Return the subset of phases (see pipeline.getPhases) that the node hasn't yet completed.'''
+        return [phase for phase in phases if not self.hasCompleted(ipAddress, phase[0])]
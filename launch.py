@@ -2,81 +2,323 @@
 #
 # "launch.py" is a tool for deploying applications onto the AWS cloud.
 #
-import sys
+import sys, time
 
 # local modules
-import config, aws, puppet, djangoutils
+import config, images, journal, profiler
 
-#
-# Start by fetching/validating the command-line arguments, and ensuring that the configuration files
-# are present and contain the necessary settings (AWS keys, etc). If we receive an Exception,
-# we don't have a valid configuration and we'll simply abort the launch.
-#
-# KW: [Test] Verify with valid and invalid arguments. Invalid argument types can be found in config.py
-#
-try:
-    (numServers, djangoProj, awsConfigDict, instanceConfigDict) = config.validateConfig()
-except Exception as mesg:
-    print >>sys.stderr, "Error:", mesg
-    sys.exit(1)
+def main(argv=None):
+    '''Launch and provision the EC2 instances, given the command line arguments (sys.argv by default).'''
 
-#
-# At this point, we know our configuration is good. 
-#
-print "\nCreating", numServers, "EC2 instances"
-print "- In AWS Availability Zone:", awsConfigDict['EC2_AvailabilityZone']
-print "- Using EC2 Instance Image:", instanceConfigDict['EC2_ImageID']
-print "- And EC2 Instance Type:", instanceConfigDict['EC2_InstanceType']
-print "- Loading Django project from:", djangoProj
+    #
+    # Start by fetching/validating the command-line arguments, and ensuring that the configuration files
+    # are present and contain the necessary settings (AWS keys, etc). If we receive an Exception,
+    # we don't have a valid configuration and we'll simply abort the launch.
+    #
+    # KW: [Test] Verify with valid and invalid arguments. Invalid argument types can be found in config.py
+    #
+    try:
+        (numServers, djangoProj, awsConfigDict, instanceConfigDict, launchOptionsDict) = config.validateConfig(argv)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
 
-#
-# Now, launch the VMs on EC2. This will return a list of the external IP addresses
-# of the new instances, or an exception if there's a problem.
-#
-print "\nPlease wait for EC2 instances to start up... (may take several minutes)\n"
-
-try:
-    ipList = aws.launchEC2Instances(awsConfigDict['EC2_AccessKeyID'],
-                       awsConfigDict['EC2_SecretAccessKey'],
-                       numServers,
-                       awsConfigDict['EC2_AvailabilityZone'],
-                       instanceConfigDict['EC2_ImageID'],
-                       instanceConfigDict['EC2_InstanceType'],
-                       awsConfigDict['EC2_SSHKeyPair'])
-
-# handle error case
-except Exception as mesg:
-    print >>sys.stderr, "Error:", mesg
-    sys.exit(1)
+    #
+    # The modules that use boto and Fabric are slow to import, so we only import them once we know the
+    # configuration is good (so that --help, and configuration errors, are reported quickly).
+    #
+    import aws, pipeline, fabricutils, artifacts, sshpool, prober, warmpool, release
 
-#
-# We've installed the base OS image on these instances, but have not installed custom packages.
-# We use Puppet for this purpose. First we must install the puppet tool itself, and then copy
-# over the puppet configuration file. Finally, we run the puppet tool to apply the changes.
-# TODO: this is *serialized* and needs to be made parallel.
-#
-# KW: [Process] We should output the username and hostname after Fabric has connected to the remote systems to help debug in case there are problems.
-#
-try:
-    puppet.installPuppet(awsConfigDict['EC2_SSHKeyPairFile'], instanceConfigDict['Puppet_PuppetURL'], ipList)
-    puppet.applyConfig(awsConfigDict['EC2_SSHKeyPairFile'], instanceConfigDict['Puppet_PuppetConfigFile'], ipList)
-except Exception as mesg:
-    print >>sys.stderr, "Error: ", mesg    
-    sys.exit(1)
-    
-#
-# Now, deploy the Django project to each node, and start the server running.
-#
-djangoutils.deployProject(awsConfigDict['EC2_SSHKeyPairFile'], djangoProj, ipList)
-djangoutils.runProject(awsConfigDict['EC2_SSHKeyPairFile'], djangoProj, ipList)
+    #
+    # If we're resuming a launch that failed partway, load its journal. The instances it started are adopted,
+    # and we launch the same number of instances, from the same image, as the original launch.
+    #
+    launchJournal = None
+    if launchOptionsDict['Launch_Resume'] is not None:
+        try:
+            launchJournal = journal.loadJournal(launchOptionsDict['Launch_Resume'])
+        except Exception as mesg:
+            print >>sys.stderr, "Error:", mesg
+            sys.exit(1)
+        numServers = launchJournal.state['NumServers']
+        print "\nResuming launch", launchJournal.launchId, "with", len(launchJournal.getInstanceIds()), "existing instances"
 
-#
-# we got a list of IP addresses, display them for the user and tell them how to SSH
-#
-print "\nIP Addresses of newly created instances:"
-for ip in ipList:
-    print " ", ip
-print "\nTo connect to these servers, use:\n  ssh -i {0} centos@<ip-address>".format(awsConfigDict['EC2_SSHKeyPairFile'])
-print "Or point your web browser to http://<ip-address>:8080\n"
+    #
+    # At this point, we know our configuration is good. 
+    #
+    print "\nCreating", numServers, "EC2 instances"
+    print "- In AWS Availability Zone:", awsConfigDict['EC2_AvailabilityZone']
+    if len(awsConfigDict['EC2_Zones']) != 0:
+        print "- Spread across zones:", " ".join(awsConfigDict['EC2_Zones'])
+    print "- Using EC2 Instance Image:", instanceConfigDict['EC2_ImageID']
+    print "- And EC2 Instance Type:", instanceConfigDict['EC2_InstanceType']
+    print "- Loading Django project from:", djangoProj
+
+    #
+    # Build the project's release bundle (see release.py) before launching anything, so a project that
+    # doesn't build is reported before we start paying for instances. The deploy phase reuses the bundle.
+    #
+    try:
+        (releaseId, bundlePath) = release.buildRelease(djangoProj, launchOptionsDict['Launch_CollectStatic'])
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+    print "- Release:", releaseId
+
+    #
+    # If we've previously baked an image (see bake.py) for the current Puppet configuration, launch
+    # from that instead of the base image, and skip the Puppet phases.
+    #
+    provisioningHash = config.getProvisioningHash(instanceConfigDict)
+    if launchJournal is not None:
+        imageId = launchJournal.state['ImageID']
+    else:
+        imageId = images.lookupImage(provisioningHash, awsConfigDict['EC2_AvailabilityZone'])
+    if imageId is not None and imageId != instanceConfigDict['EC2_ImageID']:
+        print "- Using baked image", imageId, "(Puppet configuration is already applied)"
+    else:
+        imageId = instanceConfigDict['EC2_ImageID']
+    phases = pipeline.getPhases(instanceConfigDict, djangoProj, skipPuppet=(imageId != instanceConfigDict['EC2_ImageID']),
+                                collectStatic=launchOptionsDict['Launch_CollectStatic'])
+
+    #
+    # Record the launch in a journal, so that if it fails partway, it can be resumed (with --resume) rather than
+    # started again from scratch.
+    #
+    if launchJournal is None:
+        try:
+            launchJournal = journal.createJournal(journal.newLaunchId(), djangoProj, numServers, imageId,
+                                                  awsConfigDict['EC2_AvailabilityZone'])
+        except (OSError, IOError) as mesg:
+            print >>sys.stderr, "Error: unable to create launch journal:", mesg
+            sys.exit(1)
+    print "- Launch ID:", launchJournal.launchId
+
+    #
+    # If requested, profile the launch. Timing spans are collected from all the processes involved, and written
+    # out (as a trace file and a summary table) when the launch ends, whether or not it succeeded.
+    #
+    if launchOptionsDict['Launch_Profile']:
+        profiler.enable(config.getStatePath("profiles", launchJournal.launchId))
+    launchStartTime = time.time()
+
+    def writeProfile():
+        if not profiler.isEnabled():
+            return
+        profiler.record("launch", "launch", launchStartTime, time.time() - launchStartTime)
+        spans = profiler.collect(remove=True)
+        traceFile = config.getStatePath("profiles", launchJournal.launchId + ".trace.json")
+        profiler.writeTrace(spans, traceFile)
+        print "\nProfile of launch", launchJournal.launchId, "(trace written to {0}):\n".format(traceFile)
+        print profiler.formatSummary(profiler.summarize(spans))
+
+    #
+    # Tell the user how to pick up where this launch left off, if it fails.
+    #
+    def abortLaunch():
+        writeProfile()
+        print >>sys.stderr, "\nTo retry the unfinished phases on the unfinished nodes, use:"
+        print >>sys.stderr, "  launch.py --resume {0} {1}".format(launchJournal.launchId, djangoProj)
+        sys.exit(1)
+
+    #
+    # If requested, provision from the artifact cache rather than the internet: either a published cache
+    # (whose URL is in instance.config), or the local cache, served from here through reverse SSH tunnels.
+    #
+    cacheServer = None
+    try:
+        if instanceConfigDict['Cache_URL'] is not None:
+            artifacts.useCache(instanceConfigDict['Cache_URL'])
+            print "- Installing packages from artifact cache:", instanceConfigDict['Cache_URL']
+        elif launchOptionsDict['Launch_ArtifactCache']:
+            cacheServer = artifacts.serveCache(artifacts.getDefaultCacheDir())
+            cachePort = cacheServer.server_address[1]
+            artifacts.useCache("http://127.0.0.1:{0}".format(cachePort), tunnelPort=cachePort)
+            print "- Installing packages from local artifact cache:", artifacts.getDefaultCacheDir()
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    #
+    # If there's a warm pool (see warmpool.py), start instances from it first: they're already provisioned, so
+    # they only need to be started, and their Puppet phases are skipped. New instances are only launched for the
+    # remainder. (When resuming, the launch's own instances are adopted instead.) Once we've claimed what we need,
+    # the pool is refilled by a background process, which carries on after this launch has finished.
+    #
+    warmInstanceIds = []
+    if instanceConfigDict['Fleet_WarmPoolSize'] > 0 and launchOptionsDict['Launch_Resume'] is None:
+        try:
+            with profiler.span("claim warm pool instances", "launch"):
+                warmInstanceIds = warmpool.claimInstances(aws.connectEC2(awsConfigDict['EC2_AccessKeyID'],
+                                                                         awsConfigDict['EC2_SecretAccessKey'],
+                                                                         awsConfigDict['EC2_AvailabilityZone'],
+                                                                         awsConfigDict['EC2_Endpoint']),
+                                                          provisioningHash, instanceConfigDict['EC2_InstanceType'], numServers,
+                                                          tags={journal.LAUNCH_ID_TAG: launchJournal.launchId})
+            if len(warmInstanceIds) != 0:
+                launchJournal.recordStarted(warmInstanceIds)
+            print "- Started", len(warmInstanceIds), "instances from the warm pool"
+            logFileName = warmpool.startBackgroundRefill(launchOptionsDict['Launch_AWSSettingsFile'],
+                                                         launchOptionsDict['Launch_InstanceConfigFile'], djangoProj)
+            print "- Refilling the warm pool in the background (see {0})".format(logFileName)
+        except Exception as mesg:
+            print >>sys.stderr, "Warning: unable to use the warm pool:", mesg
+
+    #
+    # Now, launch the VMs on EC2. This will return a list of the external IP addresses
+    # of the new instances, or an exception if there's a problem.
+    #
+    print "\nPlease wait for EC2 instances to start up... (may take several minutes)\n"
+
+    #
+    # In pipelined mode, each instance is handed to the pipeline as soon as it's ready, and is then
+    # provisioned (Puppet, then Django) independently of the others. Each node's progress is recorded in
+    # the journal as it finishes, and (when resuming) only the phases it didn't complete are run.
+    #
+    launchPipeline = None
+    if launchOptionsDict['Launch_Pipeline']:
+        if instanceConfigDict['Fleet_FanOutSeeds'] > 0:
+            print "- Sending the release to each node directly (FanOutSeeds doesn't apply in --pipeline mode)\n"
+        launchPipeline = pipeline.LaunchPipeline(awsConfigDict['EC2_SSHKeyPairFile'],
+                           phases,
+                           launchOptionsDict['Launch_MaxInFlight'],
+                           resultCallback=launchJournal.recordPhases)
+
+    def readyCallback(instanceId, ipAddress):
+        launchJournal.recordReady(instanceId, ipAddress)
+        if instanceId in warmInstanceIds:
+            launchJournal.recordPhases(ipAddress, warmpool.PROVISIONED_PHASES)
+        if launchPipeline is not None:
+            launchPipeline.submit(ipAddress, launchJournal.getRemainingPhases(ipAddress, phases))
+
+    ec2StartTime = time.time()
+    try:
+        ipList = aws.launchEC2Instances(awsConfigDict['EC2_AccessKeyID'],
+                           awsConfigDict['EC2_SecretAccessKey'],
+                           numServers,
+                           awsConfigDict['EC2_AvailabilityZone'],
+                           imageId,
+                           instanceConfigDict['EC2_InstanceType'],
+                           awsConfigDict['EC2_SSHKeyPair'],
+                           readyCallback=readyCallback,
+                           endpoint=awsConfigDict['EC2_Endpoint'],
+                           zones=awsConfigDict['EC2_Zones'],
+                           chunkSize=instanceConfigDict['Fleet_ChunkSize'],
+                           requestRate=instanceConfigDict['Fleet_RequestRate'],
+                           tags={journal.LAUNCH_ID_TAG: launchJournal.launchId},
+                           startedCallback=launchJournal.recordStarted,
+                           adoptInstanceIds=launchJournal.getInstanceIds())
+
+    # handle error case
+    except Exception as mesg:
+        if launchPipeline is not None:
+            launchPipeline.terminate()
+        print >>sys.stderr, "Error:", mesg
+        abortLaunch()
+    profiler.record("launch EC2 instances", "launch", ec2StartTime, time.time() - ec2StartTime)
+
+    if launchPipeline is not None:
+
+        #
+        # Wait for the remaining nodes to make their way through the pipeline. A failure on one node
+        # doesn't affect the others, so report it and carry on with the nodes that succeeded.
+        #
+        (ipList, failures) = launchPipeline.wait()
+        for ipAddress in sorted(failures):
+            print >>sys.stderr, "Error: failed to provision", ipAddress + ",", failures[ipAddress]
+        if len(ipList) == 0:
+            abortLaunch()
+
+    else:
+
+        #
+        # We've installed the base OS image on these instances, but have not installed custom packages.
+        # We use Puppet for this purpose. First we must install the puppet tool itself, and then copy
+        # over the puppet configuration file. Finally, we run the puppet tool to apply the changes.
+        # Then we deploy the Django project to each node, and start the server running. (If we launched
+        # from a baked image, Puppet has already been applied, so those phases are skipped.)
+        #
+        # Each phase is run on all nodes in parallel. A node that fails a phase is reported, and is
+        # dropped from the remaining phases, but doesn't stop the other nodes from being provisioned.
+        # Each phase is only run on the nodes that haven't already completed it (in a previous attempt at the
+        # launch), and the outcome on each node is recorded in the journal.
+        #
+        # KW: [Process] We should output the username and hostname after Fabric has connected to the remote systems to help debug in case there are problems.
+        #
+        # All the phases share a pool of SSH sessions, so each node is only connected to once.
+        #
+        keyFile = awsConfigDict['EC2_SSHKeyPairFile']
+        poolSize = launchOptionsDict['Launch_PoolSize']
+        sshpool.openPool()
+        try:
+            for (phaseName, phase, argument) in phases:
+                phaseIpList = [ip for ip in ipList if not launchJournal.hasCompleted(ip, phaseName)]
+                if len(phaseIpList) == 0:
+                    continue
+                with profiler.span(phaseName, "launch", nodes=len(phaseIpList)):
+                    results = phase(keyFile, argument, phaseIpList, poolSize=poolSize)
+                launchJournal.recordPhaseResults(phaseName, results)
+                for failure in fabricutils.getFailures(results):
+                    print >>sys.stderr, "Error: failed to", phaseName, "on", fabricutils.formatFailure(failure)
+                    ipList.remove(failure['host'])
+                if len(ipList) == 0:
+                    abortLaunch()
+        finally:
+            sshpool.closePool()
+
+    #
+    # The web server on each node is started in the background, so check that they've all come up (waiting
+    # while migrations finish and the workers start), and measure how quickly they respond. A node whose web
+    # server never answers is reported, and isn't included in the list of provisioned instances.
+    #
+    if launchOptionsDict['Launch_Probe']:
+        print "\nWaiting for the web servers to be ready...\n"
+        with profiler.span("probe web servers", "launch", nodes=len(ipList)):
+            probeResults = prober.probeFleet(ipList, paths=launchOptionsDict['Launch_ProbePaths'],
+                                             readyTimeout=launchOptionsDict['Launch_ReadyTimeout'])
+        print prober.formatReport(probeResults)
+        for ipAddress in sorted(probeResults):
+            if not probeResults[ipAddress]['ready']:
+                print >>sys.stderr, "Error: web server on", ipAddress, "isn't ready:", probeResults[ipAddress]['error']
+                launchJournal.recordPhases(ipAddress, [], "web server isn't ready: {0}".format(probeResults[ipAddress]['error']))
+                ipList.remove(ipAddress)
+        if len(ipList) == 0:
+            abortLaunch()
+
+    #
+    # If there's a load balancer in front of the fleet (see lb.py), create it if it doesn't exist yet, and point
+    # it at the fleet's nodes (including the new ones). This is done before the artifact cache is shut down, as
+    # the load balancer's Puppet is installed from it too. The nodes are still usable directly if this fails.
+    #
+    lbIpList = []
+    if instanceConfigDict['LoadBalancer_Enabled']:
+        import lb
+        print "\nUpdating the load balancer...\n"
+        try:
+            with profiler.span("update load balancer", "launch"):
+                lbIpList = lb.ensureLoadBalancer(awsConfigDict, instanceConfigDict, launchOptionsDict['Launch_PoolSize'])
+        except Exception as mesg:
+            print >>sys.stderr, "Warning: unable to update the load balancer:", mesg
+
+    if cacheServer is not None:
+        cacheServer.shutdown()
+    writeProfile()
+
+    if len(ipList) < numServers:
+        print >>sys.stderr, "\nWarning: only", len(ipList), "of", numServers, "instances were provisioned. To retry the rest, use:"
+        print >>sys.stderr, "  launch.py --resume {0} {1}".format(launchJournal.launchId, djangoProj)
 
+    #
+    # we got a list of IP addresses, display them for the user and tell them how to SSH
+    #
+    print "\nIP Addresses of newly created instances:"
+    for ip in ipList:
+        print " ", ip
+    print "\nTo connect to these servers, use:\n  ssh -i {0} centos@<ip-address>".format(awsConfigDict['EC2_SSHKeyPairFile'])
+    if len(lbIpList) != 0:
+        print "Point your web browser to the load balancer, at http://{0}/\n".format(lbIpList[0])
+    else:
+        print "Or point your web browser to http://<ip-address>:8080\n"
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#
+# Puppet configuration file for the load balancer (see lb.py), installing the following things on top of
+# a base Centos 7.x x86_64 image:
+#
+# - HAProxy 1.8.x (from Software Collections, as the base repository's 1.5.x can't reuse connections
+#   to the nodes across clients)
+#
+# The HAProxy configuration itself (the list of nodes) changes as nodes are added and removed, so it's
+# written by lb.py rather than here, and re-applying this file leaves it alone.
+#
+
+#
+# Defaults
+#
+Package { allow_virtual => true } # avoids annoying error messages.
+
+#
+# The Software Collections repository is required so we can install HAProxy 1.8.x (via yum). (The artifact
+# cache only covers node.pp, so these are always installed from the internet.)
+#
+package { 'centos-release-scl' :
+  ensure => installed
+}
+
+package { 'rh-haproxy18-haproxy' :
+  ensure => installed,
+  require => [ Package['centos-release-scl'] ]
+}
+
+#
+# Socat is used by lb.py to read the health of each node from HAProxy's statistics socket.
+#
+package { 'socat' :
+  ensure => installed
+}
+
+#
+# SELinux only lets HAProxy connect to the standard web ports, and the nodes' web servers are on 8080.
+#
+selboolean { 'haproxy_connect_any' :
+  value => on,
+  persistent => true
+}
+
+#
+# Run HAProxy (with the package's placeholder configuration, until lb.py writes the real one), and start
+# it at boot.
+#
+service { 'rh-haproxy18-haproxy' :
+  ensure => running,
+  enable => true,
+  require => [ Package['rh-haproxy18-haproxy'], Selboolean['haproxy_connect_any'] ]
+}
@@ -0,0 +1,298 @@
+#!/usr/bin/env python2.7
+#
+# "lb.py" puts a load balancer in front of the fleet, so its combined capacity can be used through one endpoint
+# (rather than pointing browsers at individual nodes). The load balancer is HAProxy, on its own instance, which is
+# provisioned with its own Puppet configuration (lb.pp, next to node.pp) and tagged with LOAD_BALANCER_ROLE.
+#
+# Its list of nodes is generated from the running instances of the fleet (those launched by launch.py or
+# autoscale.py), and it sends each request to the node with the fewest active connections. It checks each node's
+# web server every few seconds, and stops sending requests to a node that fails the check (until it passes again).
+# Connections to the nodes are kept alive, and reused for requests from other clients.
+#
+# Whenever nodes are added or removed, the configuration is generated again, and if it has changed, HAProxy is
+# reloaded gracefully (the old process finishes the requests it has, while the new one takes new connections).
+# When enabled in instance.config, launch.py and autoscale.py do this themselves; otherwise:
+#
+#   lb.py create      Launch and provision a load balancer (if there isn't one), and point it at the fleet.
+#   lb.py update      Point the load balancers at the fleet's current nodes.
+#   lb.py status      Show the health of each node, as seen by the load balancers.
+#
+import sys, os, argparse, tempfile
+
+# local modules (the modules that use boto and Fabric are slow to import, so they're imported where they're used)
+import config, autoscale
+
+# The tag marking load balancer instances (with LOAD_BALANCER_ROLE as its value). Load balancers aren't tagged
+# with a launch ID, so they're never taken for nodes of the fleet.
+ROLE_TAG = "LinkOverflow:Role"
+LOAD_BALANCER_ROLE = "loadbalancer"
+
+# The port the load balancer serves on.
+LISTEN_PORT = 80
+
+# Where HAProxy (as installed by lb.pp) keeps its configuration and statistics socket, and its service name.
+HAPROXY_CONFIG_FILE = "/etc/opt/rh/rh-haproxy18/haproxy/haproxy.cfg"
+HAPROXY_STATS_SOCKET = "/var/opt/rh/rh-haproxy18/lib/haproxy/stats"
+HAPROXY_BINARY = "/opt/rh/rh-haproxy18/root/usr/sbin/haproxy"
+HAPROXY_SERVICE = "rh-haproxy18-haproxy"
+
+# The name of the configuration file while it's being uploaded and checked (in the home directory).
+UPLOAD_FILE_NAME = "haproxy.cfg.new"
+
+# Health checks: how often each node is checked, and how many checks in a row it must fail (or pass) to be
+# taken out of (or put back into) service. Like prober.py, any answer other than a server error is healthy.
+CHECK_INTERVAL = "2s"
+CHECK_FALL = 3
+CHECK_RISE = 2
+
+# The most connections the load balancer accepts, and how long idle client connections are kept open. (Idle
+# connections to the nodes are kept until Gunicorn closes them, after djangoutils.SERVER_KEEP_ALIVE seconds.)
+MAX_CONNECTIONS = 20000
+CLIENT_KEEP_ALIVE = "10s"
+
+#
+# Generate HAProxy's configuration, balancing across the given nodes (a list of (name, address) pairs, with the
+# name being the node's instance ID). The nodes are sorted, so the same fleet always gives the same configuration.
+#
+def getHAProxyConfig(backends, healthCheckPath=config.DEFAULT_HEALTH_CHECK_PATH, port=LISTEN_PORT,
+                     backendPort=config.SERVER_PORT):
+    '''Return the text of the HAProxy configuration for the given (name, address) backends.'''
+    lines = ["# Generated by lb.py from the fleet's running instances. Changes made here will be overwritten.",
+             "global",
+             "    log 127.0.0.1 local2",
+             "    chroot /var/opt/rh/rh-haproxy18/lib/haproxy",
+             "    user haproxy",
+             "    group haproxy",
+             "    maxconn {0}".format(MAX_CONNECTIONS),
+             "    stats socket {0} mode 600 level admin".format(HAPROXY_STATS_SOCKET),
+             "",
+             "defaults",
+             "    mode http",
+             "    log global",
+             "    option httplog",
+             "    option dontlognull",
+             "    option forwardfor",
+             "    option http-keep-alive",
+             "    option redispatch",
+             "    retries 3",
+             "    maxconn {0}".format(MAX_CONNECTIONS),
+             "    timeout connect 5s",
+             "    timeout client 60s",
+             "    timeout server 60s",
+             "    timeout check 5s",
+             "    timeout http-keep-alive {0}".format(CLIENT_KEEP_ALIVE),
+             "",
+             "frontend web",
+             "    bind *:{0}".format(port),
+             "    default_backend nodes",
+             "",
+             "backend nodes",
+             "    balance leastconn",
+             "    http-reuse safe",
+             "    option httpchk GET {0} HTTP/1.1\\r\\nHost:\\ localhost".format(healthCheckPath),
+             "    http-check expect rstatus ^[1234]",
+             "    default-server inter {0} fall {1} rise {2}".format(CHECK_INTERVAL, CHECK_FALL, CHECK_RISE)]
+    for (name, address) in sorted(backends):
+        lines.append("    server {0} {1}:{2} check".format(name, address, backendPort))
+    return "\n".join(lines) + "\n"
+
+#
+# Return the shell command that installs the uploaded configuration, if it differs from the current one, and
+# reloads HAProxy. The configuration is checked first, so a bad one never replaces a good one.
+#
+def getInstallCommand(uploadFile=UPLOAD_FILE_NAME):
+    '''Return the command installing the uploaded HAProxy configuration, and reloading HAProxy if it changed.'''
+    return ("if cmp -s {0} {1}; then rm -f {0}; "
+            "else {2} -c -q -f {0} && install -o root -g root -m 0644 {0} {1} && rm -f {0} && "
+            "systemctl reload-or-restart {3}; fi").format(uploadFile, HAPROXY_CONFIG_FILE, HAPROXY_BINARY, HAPROXY_SERVICE)
+
+#
+# Parse the output of HAProxy's "show stat" command (CSV, with a header line starting with "# "), returning a
+# list of the nodes, each a dictionary with its name, status (e.g. "UP" or "DOWN"), current and total connections.
+#
+def parseStats(output):
+    '''Return the nodes listed in HAProxy's statistics.'''
+    lines = output.strip().splitlines()
+    if len(lines) == 0 or not lines[0].startswith("# "):
+        raise Exception("Unexpected output from HAProxy: {0}".format(output.strip()[:200]))
+    fields = lines[0][2:].split(",")
+    nodes = []
+    for line in lines[1:]:
+        row = dict(zip(fields, line.split(",")))
+        if row.get('pxname') != "nodes" or row.get('svname') in ("FRONTEND", "BACKEND"):
+            continue
+        nodes.append({'name': row['svname'], 'status': row['status'], 'current': int(row['scur'] or 0),
+                      'total': int(row['stot'] or 0)})
+    return nodes
+
+#
+# Find the running load balancers, and the running nodes of the fleet (see autoscale.findFleetInstances, which
+# includes every autoscaling group). The load balancers reach the nodes over the internal network, so the nodes' private
+# addresses are used. Nodes whose public or private address (or instance ID) is in exclude are left out.
+#
+def findLoadBalancers(ec2):
+    '''Return the public IP addresses of the running load balancers.'''
+    import showstate
+    filters = {'instance-state-name': ["running"], 'tag:' + ROLE_TAG: [LOAD_BALANCER_ROLE]}
+    return sorted(instance['ip_address'] for instance in showstate.iterEC2Instances(ec2, filters) if instance['ip_address'])
+
+def findBackends(ec2, exclude=[]):
+    '''Return the (instance ID, private IP address) of each of the fleet's running nodes.'''
+    backends = []
+    for instance in autoscale.findFleetInstances(ec2):
+        if not instance['private_ip_address']:
+            continue
+        if exclude and set([instance['id'], instance['ip_address'], instance['private_ip_address']]) & set(exclude):
+            continue
+        backends.append((instance['id'], instance['private_ip_address']))
+    return sorted(backends)
+
+#
+# Point the running load balancers at the fleet's current nodes (less those in exclude, e.g. nodes about to be
+# terminated). Return the list of per-host results (see fabricutils.executeOnHosts), which is empty if there
+# are no load balancers.
+#
+def updateLoadBalancers(awsConfigDict, instanceConfigDict, exclude=[], poolSize=config.DEFAULT_POOL_SIZE):
+    '''Regenerate the load balancers' configuration from the fleet, and reload them if it has changed.'''
+    import aws, fabricutils
+    ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'],
+                         awsConfigDict['EC2_AvailabilityZone'], awsConfigDict['EC2_Endpoint'])
+    lbIpList = findLoadBalancers(ec2)
+    if len(lbIpList) == 0:
+        return []
+    configText = getHAProxyConfig(findBackends(ec2, exclude), instanceConfigDict['LoadBalancer_HealthCheckPath'])
+    return fabricutils.executeOnHosts(__updatetask__, awsConfigDict['EC2_SSHKeyPairFile'], lbIpList, configText,
+                                      poolSize=poolSize, taskName="update load balancer")
+
+def __updatetask__(configText):
+    '''Private fabric task, for installing the HAProxy configuration on the load balancer.'''
+    import fabricutils, remotescript
+    (handle, localFile) = tempfile.mkstemp(prefix="haproxy-", suffix=".cfg")
+    try:
+        with os.fdopen(handle, "w") as outFile:
+            outFile.write(configText)
+        fabricutils.put(localFile, UPLOAD_FILE_NAME)
+    finally:
+        os.remove(localFile)
+    return remotescript.runSteps([remotescript.step("install load balancer configuration", getInstallCommand(), sudo=True)])
+
+#
+# Launch and provision a load balancer: install Puppet, then apply the load balancer's Puppet configuration.
+# Return its public IP address. The instance is terminated if it can't be provisioned.
+#
+def createLoadBalancer(awsConfigDict, instanceConfigDict):
+    '''Launch and provision a new load balancer, returning its IP address.'''
+    import aws, puppet, fabricutils
+    instanceIds = []
+    ipList = aws.launchEC2Instances(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'], 1,
+                                    awsConfigDict['EC2_AvailabilityZone'], instanceConfigDict['EC2_ImageID'],
+                                    instanceConfigDict['LoadBalancer_InstanceType'], awsConfigDict['EC2_SSHKeyPair'],
+                                    endpoint=awsConfigDict['EC2_Endpoint'], tags={ROLE_TAG: LOAD_BALANCER_ROLE},
+                                    startedCallback=instanceIds.extend)
+    keyFile = awsConfigDict['EC2_SSHKeyPairFile']
+    failures = []
+    if len(ipList) != 0:
+        failures = fabricutils.getFailures(puppet.installPuppet(keyFile, instanceConfigDict['Puppet_PuppetURL'], ipList))
+        if len(failures) == 0:
+            failures = fabricutils.getFailures(puppet.applyConfig(keyFile, instanceConfigDict['LoadBalancer_PuppetConfigFile'],
+                                                                  ipList))
+    if len(ipList) == 0 or len(failures) != 0:
+        if len(instanceIds) != 0:
+            aws.terminateInstances(aws.connectEC2(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'],
+                                                  awsConfigDict['EC2_AvailabilityZone'], awsConfigDict['EC2_Endpoint']),
+                                   instanceIds)
+        raise Exception("Unable to provision the load balancer{0}".format(
+                        ": " + fabricutils.formatFailure(failures[0]) if len(failures) != 0 else ""))
+    return ipList[0]
+
+#
+# Make sure there's a load balancer (creating one if there isn't), and point it at the fleet. This is what
+# launch.py does when the load balancer is enabled. Return the load balancers' IP addresses.
+#
+def ensureLoadBalancer(awsConfigDict, instanceConfigDict, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Create a load balancer if there isn't one, then update the load balancers. Return their IP addresses.'''
+    import fabricutils
+    results = updateLoadBalancers(awsConfigDict, instanceConfigDict, poolSize=poolSize)
+    if len(results) == 0:
+        createLoadBalancer(awsConfigDict, instanceConfigDict)
+        results = updateLoadBalancers(awsConfigDict, instanceConfigDict, poolSize=poolSize)
+    failures = fabricutils.getFailures(results)
+    if len(failures) != 0:
+        raise Exception("Unable to update the load balancer on " + fabricutils.formatFailure(failures[0]))
+    return [result['host'] for result in results]
+
+def __statustask__():
+    '''Private fabric task, returning the nodes listed in HAProxy's statistics.'''
+    import fabricutils
+    return parseStats(fabricutils.sudo("echo 'show stat' | socat stdio unix-connect:{0}".format(HAPROXY_STATS_SOCKET)))
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("lb.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--pool-size <n>] "
+                            "{create,update,status}",
+                        description="Create, update and show the load balancer in front of the fleet")
+    parser.add_argument('action',
+                        choices=["create", "update", "status"],
+                        help="create a load balancer (if there isn't one) and point it at the fleet, point the load "
+                            "balancers at the fleet's current nodes, or show the health of each node.")
+    parser.add_argument('--aws-settings',
+                        default=os.path.expanduser("~/.aws.settings"),
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory).")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=config.DEFAULT_POOL_SIZE,
+                        help="The maximum number of load balancers that are worked on at the same time "
+                            "(default is {0}).".format(config.DEFAULT_POOL_SIZE))
+    return parser
+
+def main(argv=None):
+    '''Create, update or show the load balancers, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        if parsedArgs.action == "create":
+            if not os.path.isfile(instanceConfigDict['LoadBalancer_PuppetConfigFile']):
+                raise Exception("The load balancer's PuppetConfigFile ({0}) doesn't exist".format(
+                                instanceConfigDict['LoadBalancer_PuppetConfigFile']))
+            lbIpList = ensureLoadBalancer(awsConfigDict, instanceConfigDict, parsedArgs.pool_size)
+            print "Load balancer:", " ".join(lbIpList)
+            print "Point your web browser to http://{0}/".format(lbIpList[0])
+            return
+
+        import aws, fabricutils
+        ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'],
+                             awsConfigDict['EC2_AvailabilityZone'], awsConfigDict['EC2_Endpoint'])
+        lbIpList = findLoadBalancers(ec2)
+        if len(lbIpList) == 0:
+            raise Exception("There are no load balancers (use \"lb.py create\" to create one)")
+        if parsedArgs.action == "update":
+            results = updateLoadBalancers(awsConfigDict, instanceConfigDict, poolSize=parsedArgs.pool_size)
+        else:
+            results = fabricutils.executeOnHosts(__statustask__, awsConfigDict['EC2_SSHKeyPairFile'], lbIpList,
+                                                 poolSize=parsedArgs.pool_size, taskName="read load balancer status")
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    for result in results:
+        if not result['succeeded']:
+            print >>sys.stderr, "Error: failed to", parsedArgs.action, "load balancer", fabricutils.formatFailure(result)
+        elif parsedArgs.action == "update":
+            print "Updated load balancer", result['host']
+        else:
+            print "Load balancer", result['host']
+            print "  {0:<22} {1:<10} {2:>8} {3:>10}".format("Node", "Status", "Active", "Total")
+            for node in result['value']:
+                print "  {0:<22} {1:<10} {2:>8} {3:>10}".format(node['name'], node['status'], node['current'], node['total'])
+    if len(fabricutils.getFailures(results)) != 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
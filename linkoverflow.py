@@ -0,0 +1,99 @@
+#!/usr/bin/env python2.7
+#
+# "linkoverflow.py" is the single entry point for all of the deployment tools, each of which is run as a
+# subcommand:
+#
+#   linkoverflow.py <command> [<arguments>...]
+#
+# Each subcommand is implemented by the main() function of its own module (e.g. "linkoverflow.py launch"
+# runs launch.main), and accepts the same arguments as running that module as a script. The module is only
+# imported when its subcommand is run, and the modules avoid importing boto and Fabric until they're needed,
+# so quick commands (such as --help, "validate" or a cached "state") don't pay for those imports.
+#
+import sys, os, argparse, importlib
+
+# local modules
+import config
+
+# Constant: the subcommands, mapping each name to the module implementing it, and a description for --help.
+COMMANDS = [("launch", "launch", "Create EC2 instances, then deploy and run the Django project on them"),
+            ("state", "showstate", "Show the state of the EC2 instances"),
+            ("validate", None, "Check the AWS settings and instance configuration files"),
+            ("build", "release", "Build a release bundle of the Django project, ready to be deployed"),
+            ("deploy", "deploy", "Deploy a new version of the Django project to the running instances, in waves"),
+            ("reconcile", "reconcile", "Bring the fleet to its desired state, doing only the work that's needed"),
+            ("probe", "prober", "Check that the web servers are up, and measure their latency"),
+            ("loadtest", "loadtest", "Drive HTTP load against the web servers, and report their throughput and latency"),
+            ("autoscale", "autoscale", "Scale the fleet to its load, adding and removing EC2 instances"),
+            ("lb", "lb", "Create, update or show the load balancer in front of the fleet"),
+            ("warmpool", "warmpool", "Show, refill or drain the pool of provisioned, stopped, instances"),
+            ("bake", "bake", "Bake an AMI with the current Puppet configuration already applied"),
+            ("artifacts", "artifacts", "Prefetch the packages needed to provision a node into a local cache"),
+            ("benchmark", "benchmark", "Benchmark a launch against simulated EC2 and SSH")]
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog="linkoverflow.py",
+                        usage="%(prog)s [-h] <command> [<arguments>...]",
+                        description="Tools for deploying the LinkOverflow project onto the AWS cloud. "
+                            "Use \"%(prog)s <command> --help\" for the arguments of each command.",
+                        epilog="commands:\n" + "\n".join("  {0:<12}{1}".format(name, description)
+                                                         for (name, module, description) in COMMANDS),
+                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command',
+                        choices=[name for (name, module, description) in COMMANDS],
+                        metavar='command',
+                        help="The command to run (see below).")
+    parser.add_argument('arguments',
+                        nargs=argparse.REMAINDER,
+                        help="The arguments of the command.")
+    return parser
+
+def create_validate_parser():
+    parser = argparse.ArgumentParser(
+                        prog="linkoverflow.py validate",
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>]",
+                        description="Check that the AWS settings and instance configuration files are valid")
+    parser.add_argument('--aws-settings',
+                        default=os.path.expanduser("~/.aws.settings"),
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory).")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    return parser
+
+#
+# The "validate" subcommand: read both configuration files (which checks that they're complete, and that the
+# secret files are private), and summarize them.
+#
+def validate(argv=None):
+    '''Check the configuration files, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_validate_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    print "AWS settings ({0}): region {1}, key pair {2}".format(parsedArgs.aws_settings, awsConfigDict['EC2_AvailabilityZone'],
+                                                               awsConfigDict['EC2_SSHKeyPair'])
+    print "Instance configuration ({0}): image {1}, instance type {2}, at most {3} instances".format(parsedArgs.instance_config,
+          instanceConfigDict['EC2_ImageID'], instanceConfigDict['EC2_InstanceType'], instanceConfigDict['Fleet_MaxInstances'])
+
+def main(argv=None):
+    '''Run the subcommand given on the command line (sys.argv by default).'''
+    parsedArgs = create_parser().parse_args(argv)
+    moduleName = dict((name, module) for (name, module, description) in COMMANDS)[parsedArgs.command]
+    if moduleName is None:
+        validate(parsedArgs.arguments)
+    else:
+        config.commandName = "linkoverflow.py " + parsedArgs.command
+        importlib.import_module(moduleName).main(parsedArgs.arguments)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,628 @@
+#!/usr/bin/env python2.7
+#
+# "loadtest.py" drives HTTP load against every node of a fleet, to measure how much traffic it can take. Each
+# node's web server (port 8080) is sent requests over a number of concurrent connections; each connection makes
+# one request after another (reusing the connection, as browsers and load balancers do), from a single event
+# loop (using non-blocking sockets), optionally split across several worker processes.
+#
+# The requests are drawn at random from a weighted mix of paths, and the number of connections per node follows
+# a ramp profile (e.g. ramp up to 50 connections over 30 seconds, hold for a minute, then ramp down). The
+# throughput, error rate and latency percentiles (p50, p99 and p999, from a histogram of the time to each
+# complete response) are reported for each node and for the whole fleet, and the report is saved as JSON (in
+# ~/.linkoverflow/loadtests by default) so runs can be compared:
+#
+#   loadtest.py [--request <[method ]path[:weight]>] [--concurrency <n>] [--duration <seconds>]
+#               [--ramp <seconds:n,...>] [--processes <n>] [--compare <report>]
+#               (--launch-id <id> | --running | <ip-address> ...)
+#
+import sys, os, time, math, json, bisect, random, socket, asyncore, argparse
+
+# local modules
+import config
+
+# Constant: default settings for load tests. All times are in seconds, and the concurrency is per node.
+DEFAULT_PORT = config.SERVER_PORT
+DEFAULT_CONCURRENCY = 10
+DEFAULT_DURATION = 30.0
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_PROCESSES = 1
+
+# The directory (within our local state directory) that reports are saved in.
+LOADTESTS_DIR = "loadtests"
+
+# Latencies are counted in a histogram of exponentially sized buckets, each about 4% wider than the last, so
+# percentiles are accurate to within a bucket, whatever the number of requests. Latencies below the minimum
+# share the first bucket.
+HISTOGRAM_BUCKETS_PER_DOUBLING = 16
+HISTOGRAM_MIN_LATENCY = 0.0001
+
+# The most we read from a socket at once, and the largest response header we accept.
+RECEIVE_SIZE = 65536
+MAX_HEADER_SIZE = 65536
+
+# How often (in seconds) in-progress requests are checked for timeouts, and how long the worker processes are
+# given to start, so they all begin at the same time.
+TIMEOUT_CHECK_INTERVAL = 0.1
+START_DELAY = 0.5
+
+#
+# A single connection to a node, run by asyncore, making one request after another. The response's length is
+# found from its header (Content-Length, chunked encoding, or the end of the connection), so the connection
+# can be reused for the next request, unless keepAlive is False or the server asks to close it.
+#
+class LoadConnection(asyncore.dispatcher):
+    '''A non-blocking HTTP connection, recording the status and latency of each request it makes.'''
+
+    def __init__(self, host, port, keepAlive, socketMap, onComplete):
+        asyncore.dispatcher.__init__(self, map=socketMap)
+        self.host = host
+        self.port = port
+        self.keepAlive = keepAlive
+        self.onComplete = onComplete
+        self.isOpen = True
+        self.method = None
+        self.outgoing = ""
+        self.requestsMade = 0
+        self.connectError = None
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect((host, port))
+        except socket.error as mesg:
+            self.connectError = str(mesg)
+
+    def startRequest(self, method, path, timeout):
+        '''Send a request on the connection. onComplete is called once it has completed (or failed).'''
+        self.method = method
+        self.path = path
+        self.outgoing = "{0} {1} HTTP/1.1\r\nHost: {2}:{3}\r\nUser-Agent: linkoverflow-loadtest\r\n{4}{5}\r\n".format(
+                        method, path, self.host, self.port, "" if self.keepAlive else "Connection: close\r\n",
+                        "" if method in ("GET", "HEAD") else "Content-Length: 0\r\n")
+        self.header = ""
+        self.status = None
+        self.remaining = None
+        self.chunked = False
+        self.tail = ""
+        self.received = 0
+        self.closeAfter = not self.keepAlive
+        self.startTime = time.time()
+        self.deadline = self.startTime + timeout
+        self.requestsMade += 1
+        if self.connectError is not None:
+            self.finish(self.connectError)
+
+    def writable(self):
+        return self.method is not None and (not self.connected or len(self.outgoing) != 0)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self.outgoing)
+        self.outgoing = self.outgoing[sent:]
+
+    def handle_read(self):
+        data = self.recv(RECEIVE_SIZE)
+        if len(data) == 0 or self.method is None:
+            return
+        self.received += len(data)
+        if self.status is None:
+            self.header += data
+            end = self.header.find("\r\n\r\n")
+            if end < 0:
+                if len(self.header) > MAX_HEADER_SIZE:
+                    self.finish("Response header too large")
+                return
+            (header, data) = (self.header[:end], self.header[end + 4:])
+            self.__parseheader__(header)
+            if self.status is None:
+                self.finish("No HTTP response")
+                return
+            self.tail = "\r\n"
+
+        #
+        # Count off the body, to find the end of the response.
+        #
+        if self.chunked:
+            self.tail = (self.tail + data)[-7:]
+            if self.tail == "\r\n0\r\n\r\n":
+                self.finish()
+        elif self.remaining is not None:
+            self.remaining -= len(data)
+            if self.remaining <= 0:
+                self.finish()
+
+    def __parseheader__(self, header):
+        '''Private helper, reading the status, and how the end of the body is marked, from the response header.'''
+        lines = header.split("\r\n")
+        words = lines[0].split()
+        if len(words) < 2 or not words[0].startswith("HTTP/") or not words[1].isdigit():
+            return
+        self.status = int(words[1])
+        headers = dict((name.strip().lower(), value.strip().lower())
+                       for (name, separator, value) in (line.partition(":") for line in lines[1:]))
+        connection = headers.get("connection", "")
+        if connection == "close" or (words[0] == "HTTP/1.0" and connection != "keep-alive"):
+            self.closeAfter = True
+        if self.method == "HEAD" or self.status in (204, 304) or self.status < 200:
+            self.remaining = 0
+        elif "chunked" in headers.get("transfer-encoding", ""):
+            self.chunked = True
+        elif headers.get("content-length", "").isdigit():
+            self.remaining = int(headers["content-length"])
+        else:
+            self.closeAfter = True
+
+    def handle_close(self):
+        if self.method is not None and self.status is not None and self.remaining is None and not self.chunked:
+            self.finish()
+        else:
+            self.finish("Connection closed")
+        self.disconnect()
+
+    def handle_error(self):
+        self.finish(str(sys.exc_info()[1]) or "Connection failed")
+        self.disconnect()
+
+    def checkTimeout(self, now):
+        '''Abandon the request in progress if it has taken longer than its timeout.'''
+        if self.method is not None and now >= self.deadline:
+            self.finish("Timed out")
+            self.disconnect()
+
+    def finish(self, error=None):
+        '''Complete the request in progress, and report it (closing the connection if it can't be reused).'''
+        if self.method is None:
+            return
+        (self.method, endTime) = (None, time.time())
+        if error is not None or self.closeAfter:
+            self.disconnect()
+
+        #
+        # A reused connection that the server closed before answering (e.g. when its keep-alive timeout ran
+        # out just as we sent the request) isn't counted as a failed request.
+        #
+        counted = not (error is not None and self.requestsMade > 1 and self.received == 0)
+        self.onComplete(self, self.status if error is None else None, endTime - self.startTime, self.received,
+                        error, counted)
+
+    def disconnect(self):
+        '''Close the connection.'''
+        if self.isOpen:
+            self.isOpen = False
+            self.close()
+
+#
+# One worker's share of a load test: runs the connections to every node in ipList (its share of the
+# concurrency given by profile, see getConcurrency) from startTime until the end of the profile, then returns
+# a tuple of (nodeResults, timeline). Requests still in progress at the end aren't counted.
+#
+class LoadWorker(object):
+    '''Runs a worker's share of a load test, collecting the per-node results.'''
+
+    def __init__(self, ipList, port, mix, profile, startTime, share=(0, 1), keepAlive=True, timeout=DEFAULT_TIMEOUT):
+        self.ipList = ipList
+        self.port = port
+        self.mix = mix
+        self.cumulativeWeights = []
+        for (method, path, weight) in mix:
+            self.cumulativeWeights.append((self.cumulativeWeights or [0])[-1] + weight)
+        self.profile = profile
+        self.startTime = startTime
+        self.endTime = startTime + profile[-1][0]
+        self.share = share
+        self.keepAlive = keepAlive
+        self.timeout = timeout
+        self.random = random.Random()
+        self.socketMap = {}
+        self.connections = dict((ip, []) for ip in ipList)
+        self.target = 0
+        self.results = dict((ip, newNodeResult()) for ip in ipList)
+        self.timeline = {}
+
+    def run(self):
+        '''Run the load test, and return the tuple of (nodeResults, timeline).'''
+        time.sleep(max(self.startTime - time.time(), 0))
+        nextTimeoutCheck = 0
+        try:
+            while True:
+                now = time.time()
+                if now >= self.endTime:
+                    break
+                self.target = getConcurrency(self.profile, now - self.startTime, self.share)
+                #
+                # Open connections until each node has its target. A connection that fails straight away
+                # isn't replaced until the next time round, so a node that's down isn't flooded.
+                #
+                for ip in self.ipList:
+                    for index in range(self.target - len(self.connections[ip])):
+                        connection = LoadConnection(ip, self.port, self.keepAlive, self.socketMap, self.onComplete)
+                        self.connections[ip].append(connection)
+                        self.startRequest(connection)
+
+                if len(self.socketMap) == 0:
+                    time.sleep(0.01)
+                    continue
+                asyncore.loop(timeout=0.01, use_poll=True, map=self.socketMap, count=1)
+
+                if now >= nextTimeoutCheck:
+                    for ip in self.ipList:
+                        for connection in list(self.connections[ip]):
+                            connection.checkTimeout(now)
+                    nextTimeoutCheck = now + TIMEOUT_CHECK_INTERVAL
+        finally:
+            for ip in self.ipList:
+                for connection in self.connections[ip]:
+                    connection.disconnect()
+        return (self.results, self.timeline)
+
+    def startRequest(self, connection):
+        '''Send the connection's next request, drawn at random from the mix.'''
+        index = bisect.bisect_right(self.cumulativeWeights, self.random.random() * self.cumulativeWeights[-1])
+        (method, path, weight) = self.mix[min(index, len(self.mix) - 1)]
+        connection.startRequest(method, path, self.timeout)
+
+    def onComplete(self, connection, status, latency, received, error, counted):
+        '''Record a completed request, then make the connection's next request (or let the connection go).'''
+        now = time.time()
+        if counted and now <= self.endTime:
+            recordRequest(self.results[connection.host], status, latency, received, error)
+            second = self.timeline.setdefault(int(now - self.startTime), [0, 0])
+            second[0] += 1
+            second[1] += 1 if isError(status) else 0
+
+        #
+        # The connection is replaced (by the main loop) if it was closed, and let go if there are now more
+        # connections than the profile calls for.
+        #
+        connections = self.connections[connection.host]
+        if connection.isOpen and len(connections) <= self.target and now < self.endTime:
+            self.startRequest(connection)
+        else:
+            connection.disconnect()
+            connections.remove(connection)
+
+def __runworker__(args):
+    '''Private helper, running a LoadWorker in a worker process.'''
+    return LoadWorker(*args).run()
+
+def isError(status):
+    '''Return True if a request with the given status (None if there was no response) counts as an error.'''
+    return status is None or status >= 400
+
+#
+# Return the results of a node (or of a worker's share of one), as a dictionary counting its requests, errors,
+# bytes received, statuses and failures (keyed by their descriptions), and latencies (as a histogram).
+#
+def newNodeResult():
+    '''Return an empty node result.'''
+    return {'requests': 0, 'errors': 0, 'bytes': 0, 'statuses': {}, 'failures': {}, 'histogram': {},
+            'latencySum': 0.0, 'maxLatency': 0.0}
+
+def recordRequest(result, status, latency, received, error=None):
+    '''Add a completed request to the node result. Latencies are only recorded for requests with a response.'''
+    result['requests'] += 1
+    result['bytes'] += received
+    if isError(status):
+        result['errors'] += 1
+    if status is None:
+        result['failures'][error] = result['failures'].get(error, 0) + 1
+        return
+    result['statuses'][str(status)] = result['statuses'].get(str(status), 0) + 1
+    bucket = getBucket(latency)
+    result['histogram'][bucket] = result['histogram'].get(bucket, 0) + 1
+    result['latencySum'] += latency
+    result['maxLatency'] = max(result['maxLatency'], latency)
+
+def mergeNodeResults(result, other):
+    '''Add the counts of another node result (e.g. from another worker) to result, and return it.'''
+    for key in ['requests', 'errors', 'bytes', 'latencySum']:
+        result[key] += other[key]
+    for key in ['statuses', 'failures', 'histogram']:
+        for (name, count) in other[key].items():
+            result[key][name] = result[key].get(name, 0) + count
+    result['maxLatency'] = max(result['maxLatency'], other['maxLatency'])
+    return result
+
+def getBucket(latency):
+    '''Return the histogram bucket of a latency (in seconds).'''
+    return int(math.floor(math.log(max(latency, HISTOGRAM_MIN_LATENCY), 2) * HISTOGRAM_BUCKETS_PER_DOUBLING))
+
+def getBucketLimit(bucket):
+    '''Return the upper limit (in seconds) of the latencies in a histogram bucket.'''
+    return 2 ** ((bucket + 1) / float(HISTOGRAM_BUCKETS_PER_DOUBLING))
+
+def getHistogramPercentile(histogram, fraction, maxLatency=None):
+    '''Return the given percentile (0.0 to 1.0) of the latencies in a (non-empty) histogram, by nearest rank.'''
+    rank = max(int(math.ceil(fraction * sum(histogram.values()))), 1)
+    for bucket in sorted(histogram):
+        rank -= histogram[bucket]
+        if rank <= 0:
+            limit = getBucketLimit(bucket)
+            return limit if maxLatency is None else min(limit, maxLatency)
+
+#
+# Return the number of connections (per node) at the given time (in seconds) into the profile, which is a list
+# of (time, concurrency) points, from time 0, between which the concurrency changes linearly. When the load
+# is split between several workers, share is (index, count), and only the worker's share is returned.
+#
+def getConcurrency(profile, elapsed, share=(0, 1)):
+    '''Return the (worker's share of the) number of connections per node at the given time into the profile.'''
+    value = profile[-1][1]
+    for (start, end) in zip(profile, profile[1:]):
+        if elapsed < end[0]:
+            fraction = (elapsed - start[0]) / float(end[0] - start[0])
+            value = start[1] + (end[1] - start[1]) * max(fraction, 0.0)
+            break
+    total = int(round(value))
+    (index, count) = share
+    return total // count + (1 if index < total % count else 0)
+
+#
+# Return the profile (see getConcurrency) for a test. Without a ramp, the concurrency is constant for the
+# duration. A ramp is a comma separated list of stages, each "<seconds>:<concurrency>", during which the
+# concurrency changes steadily (from 0, or the previous stage's) to the given value, e.g. "30:50,60:50,10:0".
+#
+def getProfile(concurrency=DEFAULT_CONCURRENCY, duration=DEFAULT_DURATION, ramp=None):
+    '''Return the profile of a test, as a list of (time, concurrency) points.'''
+    if ramp is None:
+        if concurrency < 1 or duration <= 0:
+            raise Exception("Invalid concurrency or duration: {0}, {1}".format(concurrency, duration))
+        return [(0.0, concurrency), (float(duration), concurrency)]
+    profile = [(0.0, 0)]
+    for stage in ramp.split(","):
+        try:
+            (seconds, value) = stage.split(":")
+            (seconds, value) = (float(seconds), int(value))
+        except ValueError:
+            raise Exception("Invalid ramp stage: {0} (expected <seconds>:<concurrency>)".format(stage))
+        if seconds <= 0 or value < 0:
+            raise Exception("Invalid ramp stage: {0}".format(stage))
+        profile.append((profile[-1][0] + seconds, value))
+    return profile
+
+#
+# Return the request mix for a test, as a list of (method, path, weight), from a list of specifications, each
+# "[<method> ]<path>[:<weight>]" (e.g. "/", "/search?q=django:3" or "POST /vote:0.5"). The weight of each
+# request is how often it's made, relative to the others (1 by default).
+#
+def getRequestMix(specs):
+    '''Return the request mix given by the specifications, as a list of (method, path, weight).'''
+    mix = []
+    for spec in specs or ["/"]:
+        (method, separator, path) = spec.strip().rpartition(" ")
+        (request, separator, suffix) = path.rpartition(":")
+        try:
+            weight = float(suffix)
+        except ValueError:
+            (weight, request) = (1.0, path)
+        method = method.strip().upper() or "GET"
+        if not request.startswith("/") or weight <= 0:
+            raise Exception("Invalid request: {0} (expected [<method> ]<path>[:<weight>])".format(spec))
+        mix.append((method, request, weight))
+    return mix
+
+#
+# Run a load test against every node in ipList, and return its report: a dictionary holding the settings of
+# the test, and the results (see getSummary) of each node, and of the whole fleet, and the timeline (the
+# target concurrency per node, and the number of completed requests and errors, in each second of the test).
+#
+def runLoadTest(ipList, port=DEFAULT_PORT, mix=None, profile=None, processes=DEFAULT_PROCESSES, keepAlive=True,
+                timeout=DEFAULT_TIMEOUT):
+    '''Drive HTTP load against every node in ipList, and return the report.'''
+    mix = mix or getRequestMix([])
+    profile = profile or getProfile()
+    if processes < 1:
+        raise Exception("Invalid number of processes: {0}".format(processes))
+    startTime = time.time()
+    if processes == 1:
+        workerResults = [LoadWorker(ipList, port, mix, profile, startTime, (0, 1), keepAlive, timeout).run()]
+    else:
+        import multiprocessing
+        startTime += START_DELAY
+        pool = multiprocessing.Pool(processes)
+        try:
+            workerResults = pool.map(__runworker__, [(ipList, port, mix, profile, startTime, (index, processes), keepAlive,
+                                                      timeout) for index in range(processes)])
+        finally:
+            pool.terminate()
+
+    nodeResults = dict((ip, newNodeResult()) for ip in ipList)
+    timeline = {}
+    for (workerNodes, workerTimeline) in workerResults:
+        for (ip, result) in workerNodes.items():
+            mergeNodeResults(nodeResults[ip], result)
+        for (second, (requests, errors)) in workerTimeline.items():
+            counts = timeline.setdefault(second, [0, 0])
+            counts[0] += requests
+            counts[1] += errors
+
+    duration = profile[-1][0]
+    fleetResult = newNodeResult()
+    for result in nodeResults.values():
+        mergeNodeResults(fleetResult, result)
+    return {'startTime': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(startTime)), 'duration': duration, 'port': port,
+            'mix': [list(request) for request in mix], 'profile': [list(point) for point in profile],
+            'processes': processes, 'keepAlive': keepAlive,
+            'nodes': dict((ip, getSummary(result, duration)) for (ip, result) in nodeResults.items()),
+            'fleet': getSummary(fleetResult, duration),
+            'timeline': [{'second': second, 'concurrency': getConcurrency(profile, second + 0.5),
+                          'requests': timeline.get(second, [0, 0])[0], 'errors': timeline.get(second, [0, 0])[1]}
+                         for second in range(int(math.ceil(duration)))]}
+
+#
+# Return the summary of a node result, over a test of the given duration: the number of requests and errors,
+# the error rate, throughput (requests per second), the statuses and failures, and the latency (mean, p50,
+# p99, p999 and max, in seconds), along with the histogram (as a list of [upper limit, count]).
+#
+def getSummary(result, duration):
+    '''Return the summary of a node result, for the report.'''
+    histogram = result['histogram']
+    latency = None
+    if len(histogram) != 0:
+        latency = {'mean': result['latencySum'] / sum(histogram.values()), 'max': result['maxLatency']}
+        for (name, fraction) in [('p50', 0.50), ('p99', 0.99), ('p999', 0.999)]:
+            latency[name] = getHistogramPercentile(histogram, fraction, result['maxLatency'])
+    return {'requests': result['requests'], 'errors': result['errors'],
+            'errorRate': result['errors'] / float(result['requests']) if result['requests'] else 0.0,
+            'throughput': result['requests'] / duration, 'bytes': result['bytes'],
+            'statuses': result['statuses'], 'failures': result['failures'], 'latency': latency,
+            'histogram': [[getBucketLimit(bucket), histogram[bucket]] for bucket in sorted(histogram)]}
+
+def saveReport(report, fileName=None):
+    '''Save the report as JSON (by default, in the local state directory), and return the name of the file.'''
+    if fileName is None:
+        fileName = config.getStatePath(LOADTESTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    if os.path.dirname(fileName) and not os.path.isdir(os.path.dirname(fileName)):
+        os.makedirs(os.path.dirname(fileName), 0700)
+    tempFile = fileName + ".tmp"
+    with open(tempFile, "w") as outFile:
+        json.dump(report, outFile, indent=2, sort_keys=True)
+    os.rename(tempFile, fileName)
+    return fileName
+
+def loadReport(fileName):
+    '''Return a report saved by saveReport.'''
+    with open(fileName) as inFile:
+        return json.load(inFile)
+
+def formatReport(report):
+    '''Return the results of a report as a table (one line per node, plus the whole fleet), for display.'''
+    lines = [__formatline__("Node", "Requests", "Req/s", "Errors", ("p50 (ms)", "p99 (ms)", "p999 (ms)", "max (ms)"))]
+    for ip in sorted(report['nodes']):
+        lines.append(__formatsummary__(ip, report['nodes'][ip]))
+    lines.append(__formatsummary__("all ({0})".format(len(report['nodes'])), report['fleet']))
+    return "\n".join(lines)
+
+def __formatsummary__(name, summary):
+    latency = summary['latency']
+    percentiles = ("-", "-", "-", "-")
+    if latency is not None:
+        percentiles = tuple("%.1f" % (latency[key] * 1000) for key in ['p50', 'p99', 'p999', 'max'])
+    return __formatline__(name, summary['requests'], "%.1f" % summary['throughput'],
+                          "{0} ({1:.1%})".format(summary['errors'], summary['errorRate']), percentiles)
+
+def __formatline__(name, requests, throughput, errors, percentiles):
+    return "{0:<16} {1:>9} {2:>9} {3:>14} {4:>9} {5:>9} {6:>9} {7:>9}".format(name, requests, throughput, errors,
+                                                                           *percentiles)
+
+#
+# Return a comparison of the fleet results of two reports (e.g. before and after a change), for display.
+#
+def formatComparison(previous, current):
+    '''Return a table comparing the fleet throughput, error rate and latency of two reports.'''
+    lines = ["{0:<12} {1:>10} {2:>10} {3:>9}".format("Fleet", "Previous", "Current", "Change")]
+    rows = [("Req/s", lambda summary: summary['throughput'], "%.1f"),
+            ("Error rate", lambda summary: summary['errorRate'] * 100, "%.2f%%")]
+    for key in ['p50', 'p99', 'p999']:
+        rows.append((key + " (ms)", lambda summary, key=key: summary['latency'] and summary['latency'][key] * 1000, "%.1f"))
+    for (name, getValue, valueFormat) in rows:
+        (before, after) = (getValue(previous['fleet']), getValue(current['fleet']))
+        change = "-"
+        if before and after is not None:
+            change = "{0:+.1%}".format((after - before) / before)
+        lines.append("{0:<12} {1:>10} {2:>10} {3:>9}".format(name, "-" if before is None else valueFormat % before,
+                                                             "-" if after is None else valueFormat % after, change))
+    return "\n".join(lines)
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("loadtest.py"),
+                        usage="%(prog)s [-h] [--port <port>] [--request <[method ]path[:weight]>] [--concurrency <n>] "
+                            "[--duration <seconds>] [--ramp <seconds:n,...>] [--processes <n>] [--timeout <seconds>] "
+                            "[--no-keep-alive] [--output <file>] [--compare <report>] [--aws-settings <file>] "
+                            "[--tag <key=value>] (--launch-id <id> | --running | <ip-address> ...)",
+                        description="Tool for driving HTTP load against each node, and reporting its throughput and latency")
+    parser.add_argument('ip_addresses',
+                        nargs='*',
+                        help="The IP addresses of the nodes to load.")
+    parser.add_argument('--launch-id',
+                        action='append',
+                        default=[],
+                        help="Load all the nodes of the given launch (as reported by launch.py, may be repeated).")
+    parser.add_argument('--running',
+                        action='store_true',
+                        help="Load all the fleet's running nodes (found on EC2, optionally limited by --tag).")
+    parser.add_argument('--tag',
+                        action='append',
+                        default=[],
+                        help="With --running, only load nodes with the given tag value (may be repeated).")
+    parser.add_argument('--aws-settings',
+                        default=os.path.expanduser("~/.aws.settings"),
+                        help="With --running, specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory).")
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help="The port the web server listens on (default is {0}).".format(DEFAULT_PORT))
+    parser.add_argument('--request',
+                        action='append',
+                        default=[],
+                        help="A request to make, as \"[<method> ]<path>[:<weight>]\", where the weight is how often "
+                            "it's made relative to the others (may be repeated, default is /).")
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=DEFAULT_CONCURRENCY,
+                        help="The number of concurrent connections to each node (default is {0}).".format(DEFAULT_CONCURRENCY))
+    parser.add_argument('--duration',
+                        type=float,
+                        default=DEFAULT_DURATION,
+                        help="How long to run the test for, in seconds (default is {0}).".format(DEFAULT_DURATION))
+    parser.add_argument('--ramp',
+                        help="Ramp the concurrency through stages instead (overriding --concurrency and --duration), "
+                            "each \"<seconds>:<concurrency>\", e.g. \"30:50,60:50,10:0\".")
+    parser.add_argument('--processes',
+                        type=int,
+                        default=DEFAULT_PROCESSES,
+                        help="The number of worker processes to split the load between (default is {0}).".format(DEFAULT_PROCESSES))
+    parser.add_argument('--timeout',
+                        type=float,
+                        default=DEFAULT_TIMEOUT,
+                        help="The timeout for each request, in seconds (default is {0}).".format(DEFAULT_TIMEOUT))
+    parser.add_argument('--no-keep-alive',
+                        action='store_true',
+                        help="Open a new connection for every request.")
+    parser.add_argument('--output',
+                        help="The file to save the report in (default is a new file in ~/.linkoverflow/{0}).".format(LOADTESTS_DIR))
+    parser.add_argument('--compare',
+                        help="Compare the results with a previously saved report.")
+    return parser
+
+def main(argv=None):
+    '''Run a load test against each node, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        ipList = list(parsedArgs.ip_addresses)
+        if len(parsedArgs.launch_id) != 0:
+            import journal
+            for launchId in parsedArgs.launch_id:
+                launchJournal = journal.loadJournal(launchId)
+                ipList += [node['IPAddress'] for node in launchJournal.state['Nodes'].values() if node['IPAddress']]
+        if parsedArgs.running:
+            import deploy
+            ipList += deploy.findRunningInstances(config.readAWSSettings(parsedArgs.aws_settings), tags=parsedArgs.tag)
+        ipList = sorted(set(ipList))
+        if len(ipList) == 0:
+            raise Exception("No nodes to load (provide IP addresses, --launch-id or --running)")
+
+        mix = getRequestMix(parsedArgs.request)
+        profile = getProfile(parsedArgs.concurrency, parsedArgs.duration, parsedArgs.ramp)
+        previous = loadReport(parsedArgs.compare) if parsedArgs.compare is not None else None
+
+        print "\nLoading {0} nodes for {1:g} seconds (at most {2} connections per node)...\n".format(
+              len(ipList), profile[-1][0], max(value for (seconds, value) in profile))
+        report = runLoadTest(ipList, parsedArgs.port, mix, profile, parsedArgs.processes, not parsedArgs.no_keep_alive,
+                             parsedArgs.timeout)
+        fileName = saveReport(report, parsedArgs.output)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    print formatReport(report)
+    if previous is not None:
+        print "\n" + formatComparison(previous, report)
+    print "\nReport saved in", fileName
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@
 #
 # - Python 2.7.x
 # - Django 1.7.x
+# - Gunicorn 19.1.x (the web server the Django project is run under), and the futures package its
+#   threaded workers need on Python 2
 #
 
 #
@@ -11,20 +13,33 @@
 #
 Package { allow_virtual => true } # avoids annoying error messages.
 
+#
+# When provisioning from the launcher's artifact cache (see artifacts.py), the launcher sets the
+# "artifact_cache_url" fact, and yum packages must only be installed from the cache's repository.
+# (Pip is pointed at the cached wheels through its environment, so needs nothing extra here.)
+#
+if $::artifact_cache_url {
+  $yum_install_options = [ '--disablerepo=*', '--enablerepo=linkoverflow-cache' ]
+} else {
+  $yum_install_options = []
+}
+
 #
 # Install Python 2.7.x. Note that the base Centos Linux image already has this version, so
 # this puppet rule will simply ensure that it's present. We don't want the version
 # of Python changing underneath us.
 #
 package { 'python' :
-  ensure => "2.7.5-16.el7"
+  ensure => "2.7.5-16.el7",
+  install_options => $yum_install_options
 }
 
 #
 # The additional EPEL repository is required so we can install PIP (via yum)
 #
 package { 'epel-release' :
-  ensure => installed
+  ensure => installed,
+  install_options => $yum_install_options
 }
 
 #
@@ -32,6 +47,7 @@ package { 'epel-release' :
 #
 package { 'python-pip' :
   ensure => installed,
+  install_options => $yum_install_options,
   require => [ Package['python'], Package['epel-release'] ]
 }
 
@@ -53,3 +69,32 @@ package { "django" :
   provider => pip,
   require => [ Package['python-pip'], File['/bin/pip-python']]
 }
+
+#
+# Install the Gunicorn web server, which runs the Django project with several worker processes
+# (see djangoutils.getRunProjectSteps), rather than Django's single-process development server.
+#
+package { "gunicorn" :
+  ensure => "19.1.1",
+  provider => pip,
+  require => [ Package['python-pip'], File['/bin/pip-python']]
+}
+
+#
+# Gunicorn's threaded ("gthread") workers are built on concurrent.futures, which Python 2 doesn't have.
+#
+package { "futures" :
+  ensure => "3.0.3",
+  provider => pip,
+  require => [ Package['python-pip'], File['/bin/pip-python']]
+}
+
+#
+# The web server's logs (and process ID file) are kept here.
+#
+file { '/var/log/linkoverflow' :
+  ensure => directory,
+  owner => 'centos',
+  group => 'centos',
+  mode => '0755'
+}
@@ -0,0 +1,111 @@
+#
+# Helper functions for provisioning EC2 instances as a pipeline. Rather than waiting for every instance
+# to finish each phase (install Puppet, apply the Puppet configuration, deploy the Django project, run the
+# Django project) before starting the next, each instance moves through all of the phases on its own, as
+# soon as it has booted.
+#
+import multiprocessing, functools
+
+from fabric import network
+
+# local modules
+import puppet, djangoutils, fabricutils
+
+#
+# Return the list of provisioning phases to run on each node, in order. Each phase is a tuple of
+# (phaseName, function, argument), where the function is one of the puppet/djangoutils entry points,
+# called as function(keyFile, argument, ipList). If the nodes are launched from a baked image, Puppet
+# has already been applied, so the Puppet phases are skipped. The Django project is run with a number of
+# server processes that suits the instance type. If collectStatic is False, the project's static files
+# aren't collected into its release bundle.
+#
+def getPhases(instanceConfigDict, djangoProj, skipPuppet=False, collectStatic=True):
+    '''Return the list of (phaseName, function, argument) provisioning phases.'''
+    phases = []
+    if not skipPuppet:
+        phases.append(("install Puppet", puppet.installPuppet, instanceConfigDict['Puppet_PuppetURL']))
+        phases.append(("apply Puppet configuration", puppet.applyConfig, instanceConfigDict['Puppet_PuppetConfigFile']))
+    phases.append(("deploy Django project", functools.partial(djangoutils.deployProject, fanoutSeeds=instanceConfigDict['Fleet_FanOutSeeds'],
+                                                              collectStatic=collectStatic),
+                   djangoProj))
+    phases.append(("run Django project", functools.partial(djangoutils.runProject, instanceType=instanceConfigDict['EC2_InstanceType'],
+                                                           snapshotMode=instanceConfigDict['Database_Snapshot']),
+                   djangoProj))
+    return phases
+
+#
+# Run all of the provisioning phases on a single node. This is called in a separate worker process
+# (one per node in flight), so that Fabric's global state isn't shared between nodes. Return a tuple
+# of (ipAddress, completedPhaseNames, errorMessage), where errorMessage is None on success.
+#
+def provisionNode(keyFile, phases, ipAddress):
+    '''Run each of the provisioning phases (see getPhases) on a single node.'''
+
+    ipList = [ipAddress]
+    completed = []
+    try:
+        for (phaseName, phase, argument) in phases:
+            failures = fabricutils.getFailures(phase(keyFile, argument, ipList))
+            if len(failures) != 0:
+                return (ipAddress, completed, "failed to {0}: {1}".format(phaseName, fabricutils.formatFailure(failures[0])))
+            completed.append(phaseName)
+
+    # Fabric aborts by raising SystemExit, which would otherwise kill the worker process.
+    except (Exception, SystemExit) as mesg:
+        return (ipAddress, completed, str(mesg) or "Provisioning aborted.")
+
+    finally:
+        network.disconnect_all()
+
+    return (ipAddress, completed, None)
+
+#
+# A LaunchPipeline provisions nodes as they're submitted to it, with at most maxInFlight nodes being
+# provisioned at the same time. The submit() method is intended to be used as the readyCallback for
+# aws.launchEC2Instances, so that each node starts provisioning the moment it's ready. If resultCallback is
+# provided, it's called (from a background thread) with the result of provisionNode as each node finishes.
+#
+class LaunchPipeline(object):
+    '''Provision each submitted node through all of the launch phases, with a cap on the number in flight.'''
+
+    def __init__(self, keyFile, phases, maxInFlight, resultCallback=None):
+        self.keyFile = keyFile
+        self.phases = phases
+        self.resultCallback = resultCallback
+        self.pool = multiprocessing.Pool(processes=maxInFlight)
+        self.pending = []
+
+    def submit(self, ipAddress, phases=None):
+        '''Start provisioning the node with the given IP address, as soon as a worker is free. If phases is
+        provided, only those phases are run on the node (e.g. those it didn't complete in a previous launch).'''
+        print "Instance", ipAddress, "is ready, provisioning..."
+        if phases is None:
+            phases = self.phases
+        self.pending.append(self.pool.apply_async(provisionNode, (self.keyFile, phases, ipAddress),
+                                                  callback=self.__onresult__))
+
+    def __onresult__(self, result):
+        '''Private callback, passing each node's result on to the resultCallback (if any).'''
+        if self.resultCallback is not None:
+            self.resultCallback(*result)
+
+    def wait(self):
+        '''Wait for all submitted nodes to finish. Return a tuple of (list of provisioned IP addresses,
+        dict mapping each failed IP address to its error message).'''
+        self.pool.close()
+        self.pool.join()
+
+        ipList = []
+        failures = {}
+        for result in self.pending:
+            (ipAddress, completed, error) = result.get()
+            if error is None:
+                ipList.append(ipAddress)
+            else:
+                failures[ipAddress] = error
+        return (ipList, failures)
+
+    def terminate(self):
+        '''Abandon any nodes that are still being provisioned.'''
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python2.7
+#
+# "prober.py" checks that the web server on each node of a fleet is up, and measures how quickly it responds.
+# Every node is probed concurrently, from a single event loop (using non-blocking sockets), so hundreds of
+# nodes can be checked in about the time it takes to check one.
+#
+# Each node is first probed until it answers every path with an HTTP response (any status below 500),
+# retrying with backoff while the server is still starting (e.g. while migrate is still running). Once it's
+# ready, each path is requested a few more times, and the time to the first byte of each response is recorded.
+# launch.py uses this to make sure the nodes it reports are actually serving. It can also be run by hand:
+#
+#   prober.py [--port <port>] [--probe-path <path>] [--probe-timeout <seconds>] [--ready-timeout <seconds>]
+#             [--probe-samples <n>] (--launch-id <id> | <ip-address> ...)
+#
+import sys, time, random, socket, asyncore, argparse
+
+# local modules
+import config, profiler
+
+# Constant: default settings for probing. All times are in seconds.
+DEFAULT_PORT = config.SERVER_PORT
+DEFAULT_PATHS = ["/"]
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_READY_TIMEOUT = config.DEFAULT_READY_TIMEOUT
+DEFAULT_SAMPLES = 5
+
+# Constant: the most requests we have in progress at the same time (each needs a socket).
+MAX_CONCURRENT_REQUESTS = 256
+
+# Retry parameters for nodes that aren't ready yet. The delay doubles (with some random variation) after
+# each failed attempt, up to the maximum.
+RETRY_INITIAL_DELAY = 1.0
+RETRY_MAX_DELAY = 10.0
+
+#
+# A single HTTP request, run by asyncore. We only need the status line, so the connection is closed as soon
+# as it has arrived.
+#
+class ProbeRequest(asyncore.dispatcher):
+    '''A non-blocking HTTP GET request, recording the response status and the time to its first byte.'''
+
+    def __init__(self, host, port, path, timeout, socketMap):
+        asyncore.dispatcher.__init__(self, map=socketMap)
+        self.host = host
+        self.path = path
+        self.request = ("GET {0} HTTP/1.1\r\nHost: {1}:{2}\r\nUser-Agent: linkoverflow-prober\r\n"
+                        "Connection: close\r\n\r\n").format(path, host, port)
+        self.response = ""
+        self.startTime = time.time()
+        self.deadline = self.startTime + timeout
+        self.firstByteTime = None
+        self.error = None
+        self.done = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect((host, port))
+        except socket.error as mesg:
+            self.finish(str(mesg))
+
+    def writable(self):
+        return not self.done and (not self.connected or len(self.request) != 0)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self.request)
+        self.request = self.request[sent:]
+
+    def handle_read(self):
+        data = self.recv(4096)
+        if len(data) != 0 and self.firstByteTime is None:
+            self.firstByteTime = time.time()
+        self.response += data
+        if "\r\n" in self.response or len(data) == 0:
+            self.finish()
+
+    def handle_close(self):
+        self.finish()
+
+    def handle_error(self):
+        self.finish(str(sys.exc_info()[1]) or "Connection failed")
+
+    def checkTimeout(self, now):
+        '''Abandon the request if it has taken longer than its timeout.'''
+        if not self.done and now >= self.deadline:
+            self.finish("Timed out")
+
+    def finish(self, error=None):
+        '''Complete the request, closing its connection.'''
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        if error is None and self.getStatus() is None:
+            self.error = "No HTTP response"
+        self.close()
+
+    def getStatus(self):
+        '''Return the HTTP status code of the response, or None if there wasn't a valid response.'''
+        words = self.response.split("\r\n", 1)[0].split()
+        if len(words) >= 2 and words[0].startswith("HTTP/") and words[1].isdigit():
+            return int(words[1])
+        return None
+
+    def getLatency(self):
+        '''Return the time (in seconds) from starting the request to the first byte of the response.'''
+        return self.firstByteTime - self.startTime
+
+#
+# Probe every node in ipList, and return a dictionary mapping each IP address to its result, which is a
+# dictionary containing:
+#
+#   ready - True if the node answered every path (with a status below 500) within readyTimeout.
+#   readyAfter - The time (in seconds) it took for the node to become ready, or None.
+#   attempts - The number of requests made before the node was ready.
+#   status - The status of the node's last response, or None.
+#   error - A description of the last failure (if the node isn't ready), or None.
+#   latencies - The time to first byte (in seconds) of each sample request, once the node was ready.
+#   errors - The number of sample requests that failed, once the node was ready.
+#
+def probeFleet(ipList, port=DEFAULT_PORT, paths=DEFAULT_PATHS, timeout=DEFAULT_TIMEOUT, readyTimeout=DEFAULT_READY_TIMEOUT,
+               samples=DEFAULT_SAMPLES, maxConcurrent=MAX_CONCURRENT_REQUESTS):
+    '''Wait for the web server on each node to be ready, then sample its latency. Return the per-node results.'''
+
+    startTime = time.time()
+    readyDeadline = startTime + readyTimeout
+    results = dict((ip, {'ready': False, 'readyAfter': None, 'attempts': 0, 'status': None, 'error': None,
+                         'latencies': [], 'errors': 0}) for ip in ipList)
+    nodes = dict((ip, {'pathIndex': 0, 'samplesLeft': samples * len(paths), 'nextTime': startTime,
+                       'delay': RETRY_INITIAL_DELAY, 'request': None}) for ip in ipList)
+    socketMap = {}
+    active = []
+
+    while True:
+        now = time.time()
+
+        #
+        # Start a request on each node that's due one (either it isn't ready yet, and it's time to retry,
+        # or it's ready and there are still samples to take), as long as there are sockets to spare.
+        #
+        for ip in ipList:
+            if len(active) >= maxConcurrent:
+                break
+            (node, result) = (nodes[ip], results[ip])
+            if node['request'] is not None or now < node['nextTime']:
+                continue
+            if not result['ready'] and now < readyDeadline:
+                result['attempts'] += 1
+            elif not (result['ready'] and node['samplesLeft'] > 0):
+                continue
+            node['request'] = ProbeRequest(ip, port, paths[node['pathIndex'] % len(paths)], timeout, socketMap)
+            active.append(node['request'])
+
+        if len(active) == 0:
+            if all(results[ip]['ready'] and nodes[ip]['samplesLeft'] == 0 for ip in ipList) or now >= readyDeadline:
+                break
+            time.sleep(0.05)
+            continue
+
+        asyncore.loop(timeout=0.05, use_poll=True, map=socketMap, count=1)
+
+        #
+        # Deal with the requests that have completed (or timed out).
+        #
+        now = time.time()
+        for request in list(active):
+            request.checkTimeout(now)
+            if not request.done:
+                continue
+            active.remove(request)
+            (node, result) = (nodes[request.host], results[request.host])
+            node['request'] = None
+            status = request.getStatus()
+            succeeded = request.error is None and status < 500
+            result['status'] = status
+
+            if not result['ready']:
+                if succeeded:
+                    node['pathIndex'] += 1
+                    if node['pathIndex'] == len(paths):
+                        result['ready'] = True
+                        result['error'] = None
+                        result['readyAfter'] = now - startTime
+                        profiler.record("web server ready", "probe", startTime, result['readyAfter'], request.host,
+                                        {'attempts': result['attempts']})
+                else:
+                    result['error'] = request.error or "HTTP status {0}".format(status)
+                    node['nextTime'] = now + node['delay'] * random.uniform(0.5, 1.0)
+                    node['delay'] = min(node['delay'] * 2, RETRY_MAX_DELAY)
+            else:
+                node['samplesLeft'] -= 1
+                node['pathIndex'] += 1
+                if succeeded:
+                    result['latencies'].append(request.getLatency())
+                    profiler.record("GET " + request.path, "probe", request.startTime, request.getLatency(), request.host,
+                                    {'status': status})
+                else:
+                    result['errors'] += 1
+
+    return results
+
+#
+# Return the percentiles (p50, p95 and max, in seconds) of a list of latencies, or None if it's empty.
+#
+def getPercentiles(latencies):
+    '''Return a tuple of (p50, p95, max) of the latencies, or None if there aren't any.'''
+    if len(latencies) == 0:
+        return None
+    latencies = sorted(latencies)
+    return (profiler.percentile(latencies, 0.50), profiler.percentile(latencies, 0.95), latencies[-1])
+
+def formatReport(results):
+    '''Return the results of probeFleet as a table (one line per node, plus the whole fleet), for display.'''
+    lines = [__formatline__("Node", "Ready (s)", "Attempts", ("p50 (ms)", "p95 (ms)", "max (ms)"), "Errors")]
+    allLatencies = []
+    for ip in sorted(results):
+        result = results[ip]
+        allLatencies.extend(result['latencies'])
+        if result['ready']:
+            lines.append(__formatline__(ip, "%.1f" % result['readyAfter'], result['attempts'],
+                                        __formatlatencies__(result['latencies']), result['errors']))
+        else:
+            lines.append(__formatline__(ip, "no", result['attempts'], __formatlatencies__([]), result['error']))
+    numReady = len([result for result in results.values() if result['ready']])
+    lines.append(__formatline__("all ({0}/{1})".format(numReady, len(results)), "", "", __formatlatencies__(allLatencies),
+                                sum(result['errors'] for result in results.values())))
+    return "\n".join(lines)
+
+def __formatline__(name, readyAfter, attempts, percentiles, errors):
+    return "{0:<16} {1:>9} {2:>8} {3:>9} {4:>9} {5:>9}  {6}".format(name, readyAfter, attempts, percentiles[0],
+                                                                  percentiles[1], percentiles[2], errors)
+
+def __formatlatencies__(latencies):
+    percentiles = getPercentiles(latencies)
+    if percentiles is None:
+        return ("-", "-", "-")
+    return tuple("%.1f" % (value * 1000) for value in percentiles)
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("prober.py"),
+                        usage="%(prog)s [-h] [--port <port>] [--probe-path <path>] [--probe-timeout <seconds>] "
+                            "[--ready-timeout <seconds>] [--probe-samples <n>] (--launch-id <id> | <ip-address> ...)",
+                        description="Tool for checking that the web server on each node is up, and measuring its latency")
+    parser.add_argument('ip_addresses',
+                        nargs='*',
+                        help="The IP addresses of the nodes to probe.")
+    parser.add_argument('--launch-id',
+                        help="Probe all the nodes of the given launch (as reported by launch.py).")
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help="The port the web server listens on (default is {0}).".format(DEFAULT_PORT))
+    parser.add_argument('--probe-path',
+                        action='append',
+                        default=[],
+                        help="A path to request from each node (may be repeated, default is /).")
+    parser.add_argument('--probe-timeout',
+                        type=float,
+                        default=DEFAULT_TIMEOUT,
+                        help="The timeout for each request, in seconds (default is {0}).".format(DEFAULT_TIMEOUT))
+    parser.add_argument('--ready-timeout',
+                        type=float,
+                        default=DEFAULT_READY_TIMEOUT,
+                        help="How long to wait for each node to be ready, in seconds (default is {0}).".format(DEFAULT_READY_TIMEOUT))
+    parser.add_argument('--probe-samples',
+                        type=int,
+                        default=DEFAULT_SAMPLES,
+                        help="The number of times to request each path once a node is ready, to measure its latency "
+                            "(default is {0}).".format(DEFAULT_SAMPLES))
+    return parser
+
+def main(argv=None):
+    '''Probe the web server on each node, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        ipList = parsedArgs.ip_addresses
+        if parsedArgs.launch_id is not None:
+            import journal
+            launchJournal = journal.loadJournal(parsedArgs.launch_id)
+            ipList = ipList + [node['IPAddress'] for node in launchJournal.state['Nodes'].values() if node['IPAddress']]
+        if len(ipList) == 0:
+            raise Exception("No nodes to probe (provide IP addresses, or --launch-id)")
+
+        print "\nProbing", len(ipList), "nodes...\n"
+        results = probeFleet(ipList, parsedArgs.port, parsedArgs.probe_path or DEFAULT_PATHS, parsedArgs.probe_timeout,
+                             parsedArgs.ready_timeout, parsedArgs.probe_samples)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    print formatReport(results)
+    if not all(result['ready'] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#
+# Helper functions for profiling a launch. When profiling is enabled (with "launch.py --profile"), timing
+# spans are recorded around the EC2 API calls, every Fabric task on every host, every step of the remote
+# scripts and every file transfer. At the end of the launch, the spans are written as a Chrome trace (which
+# can be loaded into chrome://tracing or https://ui.perfetto.dev), and summarized as a table of percentiles.
+#
+# Tasks are run in several different processes (Fabric's parallel workers, the SSH session pool and the
+# launch pipeline), so each process appends its spans to its own file in a shared directory, and the files
+# are collected once the launch is complete. Worker processes inherit the directory when they're forked.
+#
+import os, json, time, math, contextlib, shutil
+
+# The directory that spans are written to, or None if profiling is disabled.
+spanDir = None
+
+# The categories of span, in the order they're shown in the summary.
+CATEGORIES = ["launch", "ec2", "task", "step", "transfer", "probe"]
+
+#
+# Enable profiling, with spans written to files in directory (which is created if necessary).
+#
+def enable(directory):
+    '''Start recording timing spans, in the given directory.'''
+    global spanDir
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    spanDir = directory
+
+def isEnabled():
+    '''Return True if profiling is enabled.'''
+    return spanDir is not None
+
+#
+# Record a single span: the named operation (of the given category) started at startTime and took duration
+# seconds, on host (or on the launcher if host is None). args is a dictionary of extra details to show in
+# the trace. This does nothing unless profiling is enabled.
+#
+def record(name, category, startTime, duration, host=None, args=None):
+    '''Record a timing span (if profiling is enabled).'''
+    if spanDir is None:
+        return
+    span = {'name': name, 'category': category, 'start': startTime, 'duration': duration, 'host': host, 'args': args or {}}
+    with open(os.path.join(spanDir, "spans-{0}.jsonl".format(os.getpid())), "a") as outFile:
+        outFile.write(json.dumps(span) + "\n")
+
+@contextlib.contextmanager
+def span(name, category, host=None, **args):
+    '''Context manager, recording a span for the time taken by the enclosed block. The block is given the
+    args dictionary, so it can add details that are only known at the end.'''
+    startTime = time.time()
+    try:
+        yield args
+    finally:
+        record(name, category, startTime, time.time() - startTime, host, args)
+
+#
+# Collect all the spans recorded (by all processes) so far, sorted by start time. If remove is True, the
+# span files are deleted afterwards, and profiling is disabled.
+#
+def collect(remove=False):
+    '''Return the list of recorded spans.'''
+    global spanDir
+    spans = []
+    if spanDir is None:
+        return spans
+    for fileName in os.listdir(spanDir):
+        if fileName.startswith("spans-") and fileName.endswith(".jsonl"):
+            with open(os.path.join(spanDir, fileName)) as inFile:
+                spans.extend(json.loads(line) for line in inFile if line.strip())
+    if remove:
+        shutil.rmtree(spanDir)
+        spanDir = None
+    return sorted(spans, key=lambda span: span['start'])
+
+#
+# Write a list of spans as a Chrome trace file. Each host is shown as its own track (with the launcher's
+# own work on the first track), and times are relative to the start of the first span.
+#
+def writeTrace(spans, fileName):
+    '''Write the spans to fileName in Chrome trace event (JSON) format.'''
+    hosts = [None] + sorted(set(span['host'] for span in spans if span['host'] is not None))
+    trackIds = dict((host, index) for (index, host) in enumerate(hosts))
+    origin = spans[0]['start'] if len(spans) != 0 else 0
+
+    events = [{'name': "process_name", 'ph': "M", 'pid': 1, 'tid': 0, 'args': {'name': "launch.py"}}]
+    for host in hosts:
+        events.append({'name': "thread_name", 'ph': "M", 'pid': 1, 'tid': trackIds[host], 'args': {'name': host or "launcher"}})
+    for span in spans:
+        events.append({'name': span['name'], 'cat': span['category'], 'ph': "X", 'pid': 1, 'tid': trackIds[span['host']],
+                       'ts': int((span['start'] - origin) * 1e6), 'dur': int(span['duration'] * 1e6), 'args': span['args']})
+
+    with open(fileName + ".tmp", "w") as outFile:
+        json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, outFile)
+    os.rename(fileName + ".tmp", fileName)
+
+#
+# Summarize a list of spans: for each (category, name), the number of spans, the median, 95th percentile
+# and maximum duration (in seconds), and the host with the slowest span (or None for the launcher). Return
+# a list of dictionaries, in category order.
+#
+def summarize(spans):
+    '''Return the per-operation summary of the spans.'''
+    groups = {}
+    for span in spans:
+        groups.setdefault((span['category'], span['name']), []).append(span)
+
+    rows = []
+    for ((category, name), group) in groups.items():
+        durations = sorted(span['duration'] for span in group)
+        slowest = max(group, key=lambda span: span['duration'])
+        rows.append({'category': category, 'name': name, 'count': len(group),
+                     'p50': percentile(durations, 0.50), 'p95': percentile(durations, 0.95), 'max': durations[-1],
+                     'slowestHost': slowest['host']})
+    order = lambda row: (CATEGORIES.index(row['category']) if row['category'] in CATEGORIES else len(CATEGORIES), row['name'])
+    return sorted(rows, key=order)
+
+def percentile(sortedValues, fraction):
+    '''Return the given percentile (0.0 to 1.0) of a sorted, non-empty, list of values (by nearest rank).'''
+    index = int(math.ceil(fraction * len(sortedValues))) - 1
+    return sortedValues[min(max(index, 0), len(sortedValues) - 1)]
+
+def formatSummary(rows):
+    '''Return the summary (from summarize) as a table, for display to the user.'''
+    lines = ["{0:<9} {1:<36} {2:>6} {3:>9} {4:>9} {5:>9}  {6}".format("Category", "Operation", "Count", "p50 (s)",
+                                                                      "p95 (s)", "max (s)", "Slowest host")]
+    for row in rows:
+        lines.append("{0:<9} {1:<36} {2:>6} {3:>9.2f} {4:>9.2f} {5:>9.2f}  {6}".format(
+                     row['category'], row['name'][:36], row['count'], row['p50'], row['p95'], row['max'],
+                     row['slowestHost'] or "-"))
+    return "\n".join(lines)
@@ -0,0 +1,90 @@
+#
+# Helper functions for incrementally updating a copy of a directory tree (such as a release of a Django
+# project, see release.py) on a remote node. Rather than re-uploading every file, we compare a manifest of
+# content hashes for the new files with the manifest of the copy the node already has. Only the files that
+# have changed are sent (as a single compressed archive), along with the list of files that no longer exist,
+# which are removed from the node.
+#
+import os, hashlib, tarfile, tempfile
+
+# The name of the manifest file, stored at the top of the directory.
+MANIFEST_FILE_NAME = ".linkoverflow-manifest.json"
+
+# The name of the file (at the top of each archive built by buildArchive) listing the stale files, one per line.
+STALE_FILE_NAME = ".linkoverflow-stale"
+
+#
+# Build a manifest for the files under localPath. The manifest is a dictionary mapping each file's
+# path (relative to localPath, using "/" as the separator) to a dictionary containing its content
+# hash and access mode.
+#
+def buildManifest(localPath):
+    '''Return a manifest of content hashes and access modes for all the files under localPath.'''
+
+    manifest = {}
+    for (dirPath, dirNames, fileNames) in os.walk(localPath):
+        dirNames.sort()
+        for fileName in sorted(fileNames):
+            filePath = os.path.join(dirPath, fileName)
+            relPath = os.path.relpath(filePath, localPath).replace(os.sep, "/")
+            if relPath == MANIFEST_FILE_NAME or not os.path.isfile(filePath):
+                continue
+            manifest[relPath] = {'sha1': hashFile(filePath), 'mode': os.stat(filePath).st_mode & 07777}
+    return manifest
+
+def hashFile(filePath):
+    '''Return the SHA-1 hash of a file's content, as a hex string.'''
+    digest = hashlib.sha1()
+    with open(filePath, "rb") as inFile:
+        for block in iter(lambda: inFile.read(65536), ""):
+            digest.update(block)
+    return digest.hexdigest()
+
+#
+# Compare the local manifest with the remote one, and return a tuple of (changedFiles, staleFiles):
+# the files that need to be sent (because they're new, or their content or mode has changed), and the
+# files that need to be removed from the remote node (because they no longer exist locally). Both are
+# sorted lists of relative paths.
+#
+def diffManifests(localManifest, remoteManifest):
+    '''Return a tuple of (changedFiles, staleFiles), given the local and remote manifests.'''
+    changedFiles = sorted(path for path in localManifest if localManifest[path] != remoteManifest.get(path))
+    staleFiles = sorted(path for path in remoteManifest if path not in localManifest)
+    return (changedFiles, staleFiles)
+
+#
+# Build a compressed (tar.gz) archive containing the named files, taken from the archive sourceArchive (such
+# as a release bundle), plus a file listing staleFiles (see STALE_FILE_NAME). Return the name of the
+# (temporary) archive file, which the caller is responsible for deleting.
+#
+def buildArchive(sourceArchive, fileNames, staleFiles=[]):
+    '''Write the named files from sourceArchive (and the list of stale files) into a temporary tar.gz archive,
+    returning its name.'''
+
+    (fd, archiveName) = tempfile.mkstemp(suffix=".tar.gz")
+    os.close(fd)
+    (fd, staleName) = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "w") as staleFile:
+            staleFile.write("".join(fileName + "\n" for fileName in staleFiles))
+        wanted = set(fileNames)
+        with tarfile.open(sourceArchive) as source:
+            archive = tarfile.open(archiveName, "w:gz")
+            try:
+                for member in source:
+                    if member.name in wanted:
+                        archive.addfile(member, source.extractfile(member) if member.isfile() else None)
+                archive.add(staleName, arcname=STALE_FILE_NAME)
+            finally:
+                archive.close()
+    finally:
+        os.remove(staleName)
+    return archiveName
+
+#
+# Return the shell command (run in remoteDir) that removes the stale files listed in an archive built by
+# buildArchive, once it has been unpacked there, along with the list itself.
+#
+def getRemoveStaleCommand():
+    '''Return the command removing the stale files listed by an unpacked archive.'''
+    return "tr '\\n' '\\0' < {0} | xargs -0 -r rm -f -- && rm -f {0}".format(STALE_FILE_NAME)
@@ -1,28 +1,52 @@
 #
 # Helper functions for interacting with Puppet, running on one or more EC2 instances.
 #
-import os
+import os, posixpath, pipes, hashlib
 
-from fabric import api
+# local modules
+import config, fabricutils, artifacts, remotescript
+
+# The file each node records the hash of its last successfully applied Puppet configuration in (see
+# getConfigHash), so that reconcile.py can tell which nodes need it applied again.
+PUPPET_MARKER_FILE = "/var/lib/linkoverflow/puppet-config.sha1"
 
 #
-# Ensure that the specified list of EC2 instances has Puppet installed.
+# Ensure that the specified list of EC2 instances has Puppet installed. If we're using an artifact cache
+# (see artifacts.py), Puppet is installed from the cache rather than from the internet.
 #
 # KW: [Test] Verify valid/correct puppetURL and throw some error if it is incorrect.
 #     [Test] Also verify that Puppet files are installed at the expected file location. 
 #
-def installPuppet(keyFile, puppetURL, ipList):
-    '''Install the Puppet application on the specified list of Linux instances, if it's not already installed'''
-    
-    api.env.user = "centos"
-    api.env.hosts = ipList
-    api.env.key_filename = keyFile
-    results = api.execute(__installpuppettask__, puppetURL)
+def installPuppet(keyFile, puppetURL, ipList, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Install the Puppet application on the specified list of Linux instances, if it's not already installed.
+    Return the list of per-host results (see fabricutils.executeOnHosts).'''
+
+    return fabricutils.executeOnHosts(__installpuppettask__, keyFile, ipList, puppetURL, poolSize=poolSize,
+                                      taskName="install Puppet")
 
 def __installpuppettask__(puppetURL):
     '''Private fabric task, for installing the puppet package on the remote node.'''
-    api.run("sudo rpm -i --force --quiet " + puppetURL)
-    api.run("sudo yum -y -q install puppet")
+    return remotescript.runSteps(getInstallPuppetSteps(puppetURL, artifacts.getCacheURL()))
+
+#
+# Return the list of steps (see remotescript.py) that install Puppet on a node. When using the artifact
+# cache, we first add a yum repository for it, and then only install from that repository.
+#
+def getInstallPuppetSteps(puppetURL, cacheURL=None):
+    '''Return the remote steps for installing Puppet, from puppetURL or the artifact cache at cacheURL.'''
+
+    steps = []
+    yumOptions = ""
+    if cacheURL is not None:
+        puppetURL = cacheURL + "/rpms/" + posixpath.basename(puppetURL)
+        steps.append(remotescript.step("configure artifact cache repository",
+                                       "printf '%s' {0} > {1}".format(pipes.quote(artifacts.getCacheRepoConfig(cacheURL)),
+                                                                      artifacts.CACHE_REPO_FILE), sudo=True))
+        yumOptions = "--disablerepo='*' --enablerepo=" + artifacts.CACHE_REPO_NAME + " "
+
+    steps.append(remotescript.step("install Puppet repository", "rpm -i --force --quiet " + puppetURL, sudo=True))
+    steps.append(remotescript.step("install Puppet", "yum -y -q " + yumOptions + "install puppet", sudo=True))
+    return steps
 
 
 #
@@ -32,23 +56,43 @@ def __installpuppettask__(puppetURL):
 #
 # KW: [Process] We should display any exceptions or errors thrown by Puppet after applying the configuration.
 #     
-def applyConfig(keyFile, configFileName, ipList):
-    '''Apply a puppet configuration (configFileName) to the nodes listed in ipList.'''
-
-    # set up the Fabric configuration parameters, then invoke the task for each node.
-    api.env.user = "centos"
-    api.env.hosts = ipList
-    api.env.key_filename = keyFile
-    results = api.execute(__applyConfigTask__, configFileName)
+def applyConfig(keyFile, configFileName, ipList, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Apply a puppet configuration (configFileName) to the nodes listed in ipList. Return the list of
+    per-host results (see fabricutils.executeOnHosts).'''
+
+    # invoke the task for each node, in parallel.
+    return fabricutils.executeOnHosts(__applyConfigTask__, keyFile, ipList, configFileName, poolSize=poolSize,
+                                      taskName="apply Puppet configuration")
     
 def __applyConfigTask__(configFileName):
     '''Private fabric task, for installing and applying the puppet configuration on each node.'''
        
     # copy puppet configuration to home directory of centos user.
     baseName = os.path.basename(configFileName)
-    result = api.put(configFileName, baseName)
-    if len(result.failed) != 0:
-        raise Exception("Failed to copy puppet configuration file {0} to remote node.".format(configFileName))
+    fabricutils.put(configFileName, baseName)
     
-    # as root, apply the configuration
-    api.run("sudo puppet apply {0}".format(baseName))
+    #
+    # When using the artifact cache, tell node.pp about it (as the "artifact_cache_url" fact), and point
+    # pip at the cached wheels.
+    #
+    environment = ""
+    cacheURL = artifacts.getCacheURL()
+    if cacheURL is not None:
+        environment = "FACTER_artifact_cache_url={0} PIP_NO_INDEX=1 PIP_FIND_LINKS={1} ".format(
+                          pipes.quote(cacheURL), pipes.quote(cacheURL + "/wheels"))
+
+    # as root, apply the configuration, then record which configuration the node has
+    return remotescript.runSteps([remotescript.step("apply Puppet configuration",
+                                                    "{0}puppet apply {1}".format(environment, baseName), sudo=True),
+                                  remotescript.step("record Puppet configuration",
+                                                    "mkdir -p {0} && echo {1} > {2}".format(posixpath.dirname(PUPPET_MARKER_FILE),
+                                                                                            getConfigHash(configFileName),
+                                                                                            PUPPET_MARKER_FILE), sudo=True)])
+
+#
+# Return the hash of a Puppet configuration file's content, as recorded on each node it's applied to.
+#
+def getConfigHash(configFileName):
+    '''Return the hex string SHA-1 hash of the Puppet configuration file.'''
+    with open(configFileName, "rb") as configFile:
+        return hashlib.sha1(configFile.read()).hexdigest()
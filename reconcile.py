@@ -0,0 +1,552 @@
+#!/usr/bin/env python2.7
+#
+# "reconcile.py" brings the fleet to a desired state, doing only the work that's needed to get there (where
+# launch.py always launches new instances, and runs every phase on each of them). The desired state is:
+#
+#   - the number of nodes (given on the command line),
+#   - their image and instance type (ImageID and InstanceType in instance.config; an image baked from ImageID
+#     by bake.py is as good as ImageID itself),
+#   - the Puppet configuration applied to them (a hash of PuppetConfigFile),
+#   - the version of the Django project they're running (its release ID, see release.py).
+#
+# The actual state comes from EC2 (the fleet's running instances, with their images, instance types and tags)
+# and from markers on each node, all read in one round-trip per node: the hash of the Puppet configuration it
+# last applied (see puppet.PUPPET_MARKER_FILE), the release its project directory points at, and whether its
+# web server is running. The fleet is the same one autoscale.py and lb.py manage (see
+# autoscale.findFleetInstances): the running instances started by launch.py or tagged with the autoscaling
+# group's name, leaving out the nodes of other groups, with --launch-id limiting the launch.py nodes to those
+# of the given launches. A node whose state still can't be read after a retry is left alone: it counts towards
+# the fleet's size, but no action is taken on it (it's reported instead), as it may only be slow to answer.
+#
+# Comparing the two gives a graph of actions, each depending on the actions that must finish before it:
+#
+#   launch      Launch and provision the nodes the fleet is short of (as autoscale.py does, tagged with the group).
+#   puppet      Apply the Puppet configuration to a node whose configuration is out of date.
+#   deploy      Switch a node to the release, and restart it (after its Puppet configuration is applied).
+#   restart     Restart a node with the right release whose web server isn't running, or whose Puppet
+#               configuration was applied.
+#   terminate   Drain and terminate a surplus node, or one that can't be fixed in place (the wrong image or
+#               instance type), once the nodes replacing it have been launched.
+#
+# The graph is run with as much concurrency as is safe: every action whose dependencies have finished is
+# started straight away, with the ready actions of each kind run together (in parallel across their nodes), and
+# each batch run in its own process, so (for example) nodes are launched while others are being redeployed.
+# The one limit is that at most --max-unavailable nodes are being restarted at once, so the fleet keeps
+# serving. An action whose dependency failed is skipped. With --dry-run, the plan is shown but not run.
+#
+#   reconcile.py [--group <name>] [--launch-id <id>] [--max-unavailable <n>] [--dry-run] [--no-collect-static]
+#                <django_proj> <num_servers>
+#
+import sys, os, time, argparse, multiprocessing, Queue
+
+# local modules (the modules that use Fabric are slow to import, so they're imported where they're used)
+import config, release, images, autoscale, deploy, prober
+
+# The kinds of action, in the order they're shown in a plan.
+LAUNCH = "launch"
+PUPPET = "puppet"
+DEPLOY = "deploy"
+RESTART = "restart"
+TERMINATE = "terminate"
+ACTION_KINDS = [LAUNCH, PUPPET, DEPLOY, RESTART, TERMINATE]
+
+# The kinds of action that take a node out of service while they run (limited by --max-unavailable).
+DISRUPTIVE_KINDS = [DEPLOY, RESTART]
+
+# How often (in seconds) the graph checks on a batch's process, in case it died without reporting.
+BATCH_CHECK_INTERVAL = 1.0
+
+# The number of characters of each hash shown in a plan.
+SHORT_HASH_LENGTH = 12
+
+# The marker lines written by the node state command (see getNodeStateCommand).
+STATE_MARKER = "@@LINKOVERFLOW-STATE"
+
+# The number of times a node's state is read before it's left as unknown (see readNodeStates).
+STATE_READ_ATTEMPTS = 2
+
+#
+# The graph of actions. Each action is a dictionary with its ID, kind, node (host, for actions on a single node),
+# count (for launches), the IDs of the actions it depends on (deps), the reason it's needed, and once it has run,
+# its state ("succeeded", "failed" or "skipped"), error, and start and end times.
+#
+class ActionGraph(object):
+    '''A graph of actions, run with as much concurrency as their dependencies allow.'''
+
+    def __init__(self):
+        self.actions = {}
+        self.order = []
+
+    def add(self, kind, host=None, count=None, deps=[], reason=None, **details):
+        '''Add an action, and return its ID.'''
+        actionId = kind if host is None else "{0}:{1}".format(kind, host)
+        if actionId in self.actions:
+            raise Exception("Duplicate action: {0}".format(actionId))
+        for dep in deps:
+            if dep not in self.actions:
+                raise Exception("Action {0} depends on an unknown action: {1}".format(actionId, dep))
+        action = dict(details, id=actionId, kind=kind, host=host, count=count, deps=list(deps), reason=reason,
+                      state=None, error=None, start=None, end=None)
+        self.actions[actionId] = action
+        self.order.append(actionId)
+        return actionId
+
+    def __len__(self):
+        return len(self.actions)
+
+    def getStage(self, actionId):
+        '''Return the action's stage: 1 if it has no dependencies, otherwise one more than its latest dependency.'''
+        return 1 + max([self.getStage(dep) for dep in self.actions[actionId]['deps']] or [0])
+
+    def getOrdered(self):
+        '''Return the actions in the order they're shown: by stage, then kind, then node.'''
+        return sorted((self.actions[actionId] for actionId in self.order),
+                      key=lambda action: (self.getStage(action['id']), ACTION_KINDS.index(action['kind']), self.order.index(action['id'])))
+
+    #
+    # Run the graph. runners maps each kind of action to a function taking a list of actions (of that kind) and
+    # returning a dictionary mapping each action's ID to its error (or None if it succeeded). Each batch is run in
+    # its own process, so the runners may use Fabric and boto freely. If report is provided, it's called with each
+    # action as it finishes (or is skipped). Return True if every action succeeded.
+    #
+    def run(self, runners, maxUnavailable=None, report=None):
+        '''Run every action, each as soon as its dependencies have succeeded.'''
+        results = multiprocessing.Queue()
+        running = {}
+        pending = list(self.order)
+        while len(pending) != 0 or len(running) != 0:
+
+            # Skip the actions that can no longer be run (and those depending on them, in turn)
+            #
+            skipped = True
+            while skipped:
+                skipped = False
+                for actionId in list(pending):
+                    action = self.actions[actionId]
+                    failedDeps = [dep for dep in action['deps'] if self.actions[dep]['state'] in ("failed", "skipped")]
+                    if len(failedDeps) != 0:
+                        action['state'] = "skipped"
+                        action['error'] = "skipped, as {0} didn't succeed".format(failedDeps[0])
+                        pending.remove(actionId)
+                        skipped = True
+                        if report is not None:
+                            report(action)
+
+            # Start a batch of each kind of action that's ready, taking no more nodes out of service than allowed
+            #
+            unavailable = sum(len(batch) for batch in running.values() if self.actions[batch[0]]['kind'] in DISRUPTIVE_KINDS)
+            batches = {}
+            for actionId in list(pending):
+                action = self.actions[actionId]
+                if not all(self.actions[dep]['state'] == "succeeded" for dep in action['deps']):
+                    continue
+                if action['kind'] in DISRUPTIVE_KINDS:
+                    if maxUnavailable is not None and unavailable >= maxUnavailable:
+                        continue
+                    unavailable += 1
+                batches.setdefault(action['kind'], []).append(actionId)
+                pending.remove(actionId)
+            for kind in ACTION_KINDS:
+                if kind not in batches:
+                    continue
+                startTime = time.time()
+                for actionId in batches[kind]:
+                    self.actions[actionId]['start'] = startTime
+                process = multiprocessing.Process(target=__runbatch__,
+                                                  args=(results, runners[kind], [dict(self.actions[actionId]) for actionId in batches[kind]]))
+                process.start()
+                running[process] = batches[kind]
+
+            if len(running) == 0:
+                if len(pending) != 0:
+                    raise Exception("Actions can't be run (their dependencies form a cycle): {0}".format(", ".join(pending)))
+                break
+
+            # Wait for a batch to finish (or its process to die)
+            #
+            try:
+                (pid, errors) = results.get(timeout=BATCH_CHECK_INTERVAL)
+                process = [process for process in running if process.pid == pid][0]
+            except Queue.Empty:
+                dead = [process for process in running if not process.is_alive() and process.exitcode != 0]
+                if len(dead) == 0:
+                    continue
+                process = dead[0]
+                errors = dict((actionId, "worker process exited with status {0}".format(process.exitcode))
+                              for actionId in running[process])
+            process.join()
+            endTime = time.time()
+            for actionId in running.pop(process):
+                action = self.actions[actionId]
+                action['end'] = endTime
+                action['error'] = errors.get(actionId, "no result")
+                action['state'] = "succeeded" if action['error'] is None else "failed"
+                if report is not None:
+                    report(action)
+        return all(self.actions[actionId]['state'] == "succeeded" for actionId in self.order)
+
+def __runbatch__(results, runner, actions):
+    '''Private helper, run in a worker process: run a batch of actions, and send back their errors.'''
+    try:
+        errors = runner(actions)
+    except (Exception, SystemExit) as mesg:
+        errors = dict((action['id'], str(mesg) or "Aborted.") for action in actions)
+    results.put((os.getpid(), errors))
+
+#
+# Return the desired state of the fleet: numServers nodes, from the images in imageIds (the base image, and
+# those baked from it), of the configured instance type, with the Puppet configuration's hash and the project's
+# release (built with its static files collected, unless collectStatic is False).
+#
+def getDesiredSpec(instanceConfigDict, djangoProj, numServers, region, collectStatic=True):
+    '''Return the desired fleet spec (a dictionary).'''
+    import puppet
+    (releaseId, bundlePath) = release.buildRelease(djangoProj, collectStatic)
+    imageIds = [instanceConfigDict['EC2_ImageID']]
+    for (provisioningHash, entry) in sorted(images.loadCatalog().items()):
+        if entry['BaseImageID'] == instanceConfigDict['EC2_ImageID'] and entry['Region'] == region:
+            imageIds.append(entry['ImageID'])
+    return {'Count': numServers,
+            'ImageID': instanceConfigDict['EC2_ImageID'],
+            'ImageIDs': imageIds,
+            'InstanceType': instanceConfigDict['EC2_InstanceType'],
+            'PuppetHash': puppet.getConfigHash(instanceConfigDict['Puppet_PuppetConfigFile']),
+            'ReleaseID': releaseId,
+            'Project': os.path.basename(os.path.normpath(djangoProj))}
+
+#
+# Return the shell command (run in the home directory of a node) that writes the node's markers, each on a
+# line of the form "@@LINKOVERFLOW-STATE <name>=<value>", and parse its output into a dictionary. The markers
+# are puppetMarkerFile and pidFile (by default, puppet.PUPPET_MARKER_FILE and djangoutils.SERVER_PID_FILE).
+#
+def getNodeStateCommand(projectName, puppetMarkerFile=None, pidFile=None):
+    '''Return the command writing the node's markers (see parseNodeState).'''
+    import puppet, djangoutils
+    puppetMarkerFile = puppetMarkerFile or puppet.PUPPET_MARKER_FILE
+    pidFile = pidFile or djangoutils.SERVER_PID_FILE
+    return ("echo {0} puppetHash=$(cat {1} 2>/dev/null); "
+            "echo {0} puppetInstalled=$(command -v puppet >/dev/null && echo yes); "
+            "echo {0} release=$(readlink {2}); "
+            "echo {0} serving=$({3})").format(STATE_MARKER, puppetMarkerFile, projectName,
+                                               djangoutils.getServerRunningCommand(pidFile))
+
+def parseNodeState(output):
+    '''Return the node's state (puppetHash, puppetInstalled, release and serving), given the node state command's output.'''
+    values = {}
+    for line in output.splitlines():
+        words = line.strip().split(None, 1)
+        if len(words) == 2 and words[0] == STATE_MARKER and "=" in words[1]:
+            (name, value) = words[1].split("=", 1)
+            values[name] = value.strip()
+    releaseLink = values.get('release') or ""
+    return {'puppetHash': values.get('puppetHash') or None,
+            'puppetInstalled': values.get('puppetInstalled') == "yes",
+            'release': os.path.basename(releaseLink) if releaseLink.startswith(release.RELEASES_DIR + "/") else None,
+            'serving': values.get('serving') == "yes"}
+
+def __nodestatetask__(projectName):
+    '''Private fabric task, returning the node's state.'''
+    import fabricutils
+    return parseNodeState(fabricutils.run(getNodeStateCommand(projectName)))
+
+#
+# Return the actual state of the fleet: a list with a dictionary for each running node (see
+# autoscale.findFleetInstances), holding its instance ID, IP address, image, instance type and launch time
+# (from EC2), and its state (see readNodeStates).
+#
+def getActualNodes(awsConfigDict, group, launchIds, projectName, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Return the fleet's running nodes, with their state.'''
+    import aws
+    ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'], awsConfigDict['EC2_SecretAccessKey'],
+                         awsConfigDict['EC2_AvailabilityZone'], awsConfigDict['EC2_Endpoint'])
+    nodes = [{'id': instance['id'], 'ip': instance['ip_address'], 'imageId': instance['image_id'],
+              'instanceType': instance['instance_type'], 'launchTime': instance['launch_time'], 'error': None,
+              'puppetHash': None, 'puppetInstalled': False, 'release': None, 'serving': False}
+             for instance in autoscale.findFleetInstances(ec2, group, launchIds) if instance['ip_address']]
+    if len(nodes) != 0:
+        readNodeStates(awsConfigDict['EC2_SSHKeyPairFile'], nodes, projectName, poolSize)
+    return nodes
+
+#
+# Read the markers of the nodes (see parseNodeState) into their dictionaries, all at once, reading those that
+# failed again (up to STATE_READ_ATTEMPTS times in all). A node whose state couldn't be read is left with its
+# error, and its state unknown. (The connections are closed after each read, as the actions are run in worker
+# processes, which mustn't share them.)
+#
+def readNodeStates(keyFile, nodes, projectName, poolSize=config.DEFAULT_POOL_SIZE):
+    '''Read each node's state, or the error if it couldn't be read.'''
+    import fabricutils
+    from fabric import network
+    for attempt in range(STATE_READ_ATTEMPTS):
+        try:
+            results = fabricutils.executeOnHosts(__nodestatetask__, keyFile, [node['ip'] for node in nodes], projectName,
+                                                 poolSize=poolSize, taskName="read node state")
+        finally:
+            network.disconnect_all()
+        failed = []
+        for (node, result) in zip(nodes, results):
+            if result['succeeded']:
+                node.update(result['value'])
+                node['error'] = None
+            else:
+                node['error'] = fabricutils.formatFailure(result)
+                failed.append(node)
+        nodes = failed
+        if len(nodes) == 0:
+            break
+
+#
+# Return the reason a node must be replaced (rather than fixed in place), or None if it needn't be.
+#
+def getReplaceReason(spec, node):
+    '''Return why the node must be replaced, or None.'''
+    if node['imageId'] not in spec['ImageIDs']:
+        return "image is {0}, not {1}".format(node['imageId'], spec['ImageID'])
+    if node['instanceType'] != spec['InstanceType']:
+        return "instance type is {0}, not {1}".format(node['instanceType'], spec['InstanceType'])
+    return None
+
+#
+# Return the list of (kind, reason) actions needed to bring a node (that's being kept) to the desired state.
+#
+def getNodeActions(spec, node):
+    '''Return the actions the node needs, as (kind, reason) tuples.'''
+    actions = []
+    if node['puppetHash'] != spec['PuppetHash']:
+        actions.append((PUPPET, "Puppet configuration is {0}, not {1}".format(__short__(node['puppetHash']),
+                                                                              __short__(spec['PuppetHash']))))
+    if node['release'] != spec['ReleaseID']:
+        actions.append((DEPLOY, "release is {0}, not {1}".format(__short__(node['release']), __short__(spec['ReleaseID']))))
+    elif not node['serving']:
+        actions.append((RESTART, "web server isn't running"))
+    elif len(actions) != 0:
+        actions.append((RESTART, "to pick up the Puppet configuration"))
+    return actions
+
+def __short__(value):
+    '''Private helper, shortening a hash (or None) for display.'''
+    return "none" if value is None else value[:SHORT_HASH_LENGTH]
+
+#
+# Compare the desired and actual states, and return the graph of actions that brings the fleet to the desired
+# state. The nodes whose state is unknown are left alone (but count towards the fleet's size). The nodes that
+# can be fixed in place are kept (those needing the least work first, then the oldest), up to the desired count
+# less the unknown nodes, and the rest are terminated. The fleet's shortfall is launched, and the nodes being replaced are only
+# terminated once the launch has succeeded.
+#
+def planActions(spec, nodes):
+    '''Return the ActionGraph that brings the nodes to the desired spec.'''
+    graph = ActionGraph()
+    unknown = [node for node in nodes if node['error'] is not None]
+    nodes = [node for node in nodes if node['error'] is None]
+    replaced = [(node, getReplaceReason(spec, node)) for node in nodes if getReplaceReason(spec, node) is not None]
+    fixable = [node for node in nodes if getReplaceReason(spec, node) is None]
+    fixable.sort(key=lambda node: len(getNodeActions(spec, node)))
+    kept = fixable[:max(0, spec['Count'] - len(unknown))]
+    surplus = fixable[len(kept):]
+
+    launchId = None
+    if len(kept) + len(unknown) < spec['Count']:
+        shortfall = spec['Count'] - len(kept) - len(unknown)
+        launchId = graph.add(LAUNCH, count=shortfall, reason="the fleet has {0} of {1} nodes".format(len(kept) + len(unknown),
+                                                                                                      spec['Count']))
+    for node in kept:
+        deps = []
+        for (kind, reason) in getNodeActions(spec, node):
+            deps = [graph.add(kind, node['ip'], deps=deps, reason=reason, instanceId=node['id'],
+                              puppetInstalled=node['puppetInstalled'])]
+    for (node, reason) in replaced:
+        graph.add(TERMINATE, node['ip'], deps=[launchId] if launchId is not None else [], reason=reason, instanceId=node['id'])
+    for node in surplus:
+        graph.add(TERMINATE, node['ip'], reason="the fleet has more than {0} nodes".format(spec['Count']), instanceId=node['id'])
+    return graph
+
+#
+# Describe the desired and actual states, and the plan.
+#
+def formatSpec(spec):
+    '''Return a description of the desired fleet spec.'''
+    return "{0} nodes of {1} from {2}, with Puppet configuration {3} and release {4}".format(
+           spec['Count'], spec['InstanceType'], spec['ImageID'], __short__(spec['PuppetHash']), __short__(spec['ReleaseID']))
+
+def describeAction(action):
+    '''Return a description of the action.'''
+    if action['kind'] == LAUNCH:
+        return "launch {0} node{1}".format(action['count'], "" if action['count'] == 1 else "s")
+    return {PUPPET: "apply Puppet configuration on", DEPLOY: "redeploy", RESTART: "restart",
+            TERMINATE: "terminate"}[action['kind']] + " " + action['host']
+
+def formatPlan(graph):
+    '''Return the plan (the graph's actions, by stage), as a table.'''
+    if len(graph) == 0:
+        return "Nothing to do: the fleet is in the desired state."
+    lines = ["{0:>5}  {1:<42} {2}".format("Stage", "Action", "Reason")]
+    for action in graph.getOrdered():
+        lines.append("{0:>5}  {1:<42} {2}".format(graph.getStage(action['id']), describeAction(action), action['reason']))
+    return "\n".join(lines)
+
+#
+# The runners for the real fleet (see ActionGraph.run). New nodes are launched, and nodes terminated, through
+# autoscale.EC2Backend, so they're provisioned and drained (and the load balancer updated) in the same way.
+#
+def getRunners(awsConfigDict, instanceConfigDict, djangoProj, group, probePaths, poolSize, readyTimeout,
+               awsSettingsFile=None, instanceConfigFile=None, collectStatic=True):
+    '''Return the dictionary of runners, one for each kind of action.'''
+    import fabricutils, puppet
+    keyFile = awsConfigDict['EC2_SSHKeyPairFile']
+    backend = autoscale.EC2Backend(awsConfigDict, instanceConfigDict, djangoProj, group, probePaths=probePaths, poolSize=poolSize,
+                                   readyTimeout=readyTimeout, awsSettingsFile=awsSettingsFile, instanceConfigFile=instanceConfigFile,
+                                   collectStatic=collectStatic)
+
+    def launch(actions):
+        ipList = backend.launchNodes(actions[0]['count'])
+        if len(ipList) < actions[0]['count']:
+            return {actions[0]['id']: "only {0} of {1} nodes were launched".format(len(ipList), actions[0]['count'])}
+        return {actions[0]['id']: None}
+
+    def applyPuppet(actions):
+        errors = dict((action['id'], None) for action in actions)
+        hosts = dict((action['host'], action['id']) for action in actions)
+        missing = [action['host'] for action in actions if not action['puppetInstalled']]
+        phases = [("install Puppet", missing, puppet.installPuppet, instanceConfigDict['Puppet_PuppetURL']),
+                  ("apply Puppet configuration", sorted(hosts), puppet.applyConfig, instanceConfigDict['Puppet_PuppetConfigFile'])]
+        for (phaseName, ipList, phase, argument) in phases:
+            ipList = [ip for ip in ipList if errors[hosts[ip]] is None]
+            if len(ipList) == 0:
+                continue
+            for failure in fabricutils.getFailures(phase(keyFile, argument, ipList, poolSize=poolSize)):
+                errors[hosts[failure['host']]] = "failed to {0}: {1}".format(phaseName, fabricutils.formatFailure(failure))
+        return errors
+
+    def redeploy(actions, restartOnly=False):
+        failures = deploy.deployWave(keyFile, djangoProj, [action['host'] for action in actions], poolSize=poolSize,
+                                     instanceType=instanceConfigDict['EC2_InstanceType'], probePaths=probePaths,
+                                     readyTimeout=readyTimeout, fanoutSeeds=instanceConfigDict['Fleet_FanOutSeeds'],
+                                     snapshotMode=instanceConfigDict['Database_Snapshot'], restartOnly=restartOnly,
+                                     collectStatic=collectStatic)
+        return dict((action['id'], failures.get(action['host'])) for action in actions)
+
+    def terminate(actions):
+        backend.instanceIds = dict((action['host'], action['instanceId']) for action in actions)
+        backend.terminateNodes([action['host'] for action in actions])
+        return dict((action['id'], None) for action in actions)
+
+    return {LAUNCH: launch, PUPPET: applyPuppet, DEPLOY: redeploy,
+            RESTART: lambda actions: redeploy(actions, restartOnly=True), TERMINATE: terminate}
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("reconcile.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--group <name>] "
+                            "[--launch-id <id>] [--max-unavailable <n>] [--pool-size <n>] [--probe-path <path>] "
+                            "[--ready-timeout <seconds>] [--dry-run] [--no-collect-static] <django_proj> <num_servers>",
+                        description="Bring the fleet to the desired state, doing only the work that's needed")
+    parser.add_argument('django_proj',
+                        help="Path to the Django project (the directory containing manage.py) the nodes should be running.")
+    parser.add_argument('num_servers',
+                        type=int,
+                        help="The number of nodes the fleet should have.")
+    parser.add_argument('--aws-settings',
+                        default=os.path.expanduser("~/.aws.settings"),
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory).")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--group',
+                        default=autoscale.DEFAULT_GROUP,
+                        help="The name of the autoscaling group the fleet's nodes are tagged with "
+                            "(default is {0}).".format(autoscale.DEFAULT_GROUP))
+    parser.add_argument('--launch-id',
+                        action='append',
+                        default=[],
+                        help="Only include the nodes of the given launch (and of the group) in the fleet (may be repeated).")
+    parser.add_argument('--max-unavailable',
+                        type=int,
+                        help="The most nodes that are being redeployed or restarted at once (default is a quarter "
+                            "of the fleet, but at least one).")
+    parser.add_argument('--pool-size',
+                        type=int,
+                        default=config.DEFAULT_POOL_SIZE,
+                        help="The maximum number of nodes that are worked on at the same time, by each batch of actions "
+                            "(default is {0}).".format(config.DEFAULT_POOL_SIZE))
+    parser.add_argument('--probe-path',
+                        action='append',
+                        default=[],
+                        help="A path that must be served before a redeployed or restarted node counts as healthy "
+                            "(may be repeated, default is /).")
+    parser.add_argument('--ready-timeout',
+                        type=float,
+                        default=config.DEFAULT_READY_TIMEOUT,
+                        help="How long to wait for each node's web server to be healthy, in seconds "
+                            "(default is {0}).".format(config.DEFAULT_READY_TIMEOUT))
+    parser.add_argument('--dry-run', '--plan',
+                        dest='dry_run',
+                        action='store_true',
+                        help="Only show the plan, without running it.")
+    parser.add_argument('--no-collect-static',
+                        action='store_true',
+                        help="Don't collect the project's static files into its release bundle (even if it has a STATIC_ROOT).")
+    return parser
+
+def main(argv=None):
+    '''Bring the fleet to the desired state, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        djangoProj = parsedArgs.django_proj
+        if not os.path.isfile(os.path.join(djangoProj, "manage.py")):
+            raise Exception("Django project directory ({0}) doesn't contain manage.py".format(djangoProj))
+        if parsedArgs.num_servers < 0 or parsedArgs.num_servers > instanceConfigDict['Fleet_MaxInstances']:
+            raise Exception("The number of servers must be between 0 and {0} (MaxInstances in {1})".format(
+                            instanceConfigDict['Fleet_MaxInstances'], parsedArgs.instance_config))
+        maxUnavailable = parsedArgs.max_unavailable
+        if maxUnavailable is None:
+            maxUnavailable = max(1, int(parsedArgs.num_servers * deploy.DEFAULT_WAVE_FRACTION))
+        if maxUnavailable < 1:
+            raise Exception("Invalid maximum number of unavailable nodes: {0}".format(maxUnavailable))
+
+        spec = getDesiredSpec(instanceConfigDict, djangoProj, parsedArgs.num_servers, awsConfigDict['EC2_AvailabilityZone'],
+                              not parsedArgs.no_collect_static)
+        print "\nDesired:", formatSpec(spec)
+        nodes = getActualNodes(awsConfigDict, parsedArgs.group, parsedArgs.launch_id, spec['Project'], parsedArgs.pool_size)
+        graph = planActions(spec, nodes)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    current = len([node for node in nodes if node['error'] is None and getReplaceReason(spec, node) is None and
+                   len(getNodeActions(spec, node)) == 0])
+    print "Actual: ", len(nodes), "running nodes, of which", current, "are in the desired state\n"
+    for node in nodes:
+        if node['error'] is not None:
+            print >>sys.stderr, "Warning: leaving {0} alone, as its state couldn't be read: {1}".format(node['id'], node['error'])
+    print formatPlan(graph)
+    if parsedArgs.dry_run or len(graph) == 0:
+        return
+
+    def report(action):
+        if action['state'] == "succeeded":
+            print "Done:", describeAction(action), "({0:.1f}s)".format(action['end'] - action['start'])
+        else:
+            print >>sys.stderr, "Error: failed to {0}: {1}".format(describeAction(action), action['error'])
+        sys.stdout.flush()
+
+    print "\nRunning", len(graph), "actions, with at most", maxUnavailable, "nodes out of service at once...\n"
+    runners = getRunners(awsConfigDict, instanceConfigDict, djangoProj, parsedArgs.group,
+                         parsedArgs.probe_path or prober.DEFAULT_PATHS, parsedArgs.pool_size, parsedArgs.ready_timeout,
+                         parsedArgs.aws_settings, parsedArgs.instance_config, not parsedArgs.no_collect_static)
+    try:
+        succeeded = graph.run(runners, maxUnavailable, report)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+    completed = len([action for action in graph.actions.values() if action['state'] == "succeeded"])
+    print "\nCompleted", completed, "of", len(graph), "actions"
+    if not succeeded:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python2.7
+#
+# "release.py" builds release bundles of a Django project, and installs them on the nodes. Rather than
+# sending the project's source to each node (where every worker then compiles it on its first start), the
+# project is built once, locally: its modules are compiled to bytecode, its static files are collected (if
+# the project has a STATIC_ROOT), and the result is packed, with a manifest of its files, into a single
+# compressed archive.
+#
+# Each bundle is identified by a hash of the project's content, so building an unchanged project reuses the
+# bundle that's already in our local state directory. On each node, the bundle is unpacked into its own
+# directory (~/releases/<release id>), and the project directory (~/<project name>) is a symbolic link to
+# the current release, which is switched atomically. Deploying a release that a node already has doesn't
+# send anything, and deploying the release a node is already running does nothing at all. A node that's
+# running another release is only sent the files that differ from it (see projectsync.py), and the new release
+# is made from a copy of the current one.
+#
+# The project's SQLite database isn't part of any release. Each node keeps it (and its migration stamp, see
+# dbsnapshot.py) in a shared directory (~/shared/<project name>), and every release has a symbolic link to
+# it, so the data survives redeploys and rollbacks.
+#
+#   release.py [--no-collect-static] <django_proj>
+#
+import sys, os, argparse, json, hashlib, tarfile, tempfile, shutil, py_compile, subprocess, re, pipes
+
+# local modules
+import config, projectsync
+
+# The directory holding the release bundles, both within our local state directory and (relative to the
+# home directory) on each node.
+RELEASES_DIR = "releases"
+
+# The directory (relative to the home directory on each node) holding each project's files that are shared by
+# all its releases, in a subdirectory named after the project.
+SHARED_DIR = "shared"
+
+# The name of the file (at the top of each bundle, alongside its manifest, see projectsync.py) holding the release ID.
+RELEASE_FILE_NAME = ".linkoverflow-release"
+
+# The version of the bundle format, which is part of each release ID (so changing the way bundles are built
+# gives every project a new release ID).
+BUNDLE_FORMAT_VERSION = 1
+
+# The number of characters of the content hash used as a release ID.
+RELEASE_ID_LENGTH = 16
+
+# The number of releases kept on each node (including the current one), and in our local state directory.
+# Older releases are removed when a new one is installed (or built).
+KEEP_RELEASES = 3
+KEEP_LOCAL_RELEASES = 10
+
+# The compiled files of the local project, which are left out of the bundle (it's compiled afresh), and its
+# SQLite databases (with their journals and migration stamps, see dbsnapshot.MIGRATED_SUFFIX), which are left
+# out because each node has its own.
+COMPILED_SUFFIXES = (".pyc", ".pyo")
+DATABASE_SUFFIXES = (".sqlite3", ".sqlite3-journal", ".sqlite3.migrated")
+
+# The line written by the remote command when the node already has the release, and it doesn't need to be
+# sent, and the line it writes otherwise (followed by the node's current release, and that release's manifest).
+PRESENT_MARKER = "@@LINKOVERFLOW-RELEASE-PRESENT"
+CURRENT_MARKER = "@@LINKOVERFLOW-RELEASE-CURRENT"
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("release.py"),
+                        usage="%(prog)s [-h] [--no-collect-static] <django_proj>",
+                        description="Tool for building a release bundle of a Django project, ready to be deployed")
+    parser.add_argument('django_proj',
+                        type=str,
+                        help="Path to the Django project (the directory containing manage.py)")
+    parser.add_argument('--no-collect-static',
+                        action='store_true',
+                        help="Don't collect the project's static files into the bundle (even if it has a STATIC_ROOT).")
+    return parser
+
+#
+# Return the manifest (see projectsync.buildManifest) of the project's source files, leaving out any compiled
+# files and databases left over from running the project locally.
+#
+def getSourceManifest(djangoProjPath):
+    '''Return the manifest of the Django project's source files.'''
+    manifest = projectsync.buildManifest(djangoProjPath)
+    return dict((path, entry) for (path, entry) in manifest.items() if not path.endswith(COMPILED_SUFFIXES + DATABASE_SUFFIXES))
+
+#
+# Return the release ID for a project with the given source manifest. The ID covers the content and access
+# mode of every file, as well as the bundle format and the Python version the bytecode is compiled with.
+#
+def getReleaseId(sourceManifest, collectStatic=True):
+    '''Return the content-addressed release ID for the given source manifest.'''
+    digest = hashlib.sha1()
+    digest.update(json.dumps({'Files': sourceManifest, 'Format': BUNDLE_FORMAT_VERSION,
+                              'Python': list(sys.version_info[:2]), 'CollectStatic': collectStatic}, sort_keys=True))
+    return digest.hexdigest()[:RELEASE_ID_LENGTH]
+
+#
+# Return True if the project's settings (in the package alongside its wsgi.py, see djangoutils.py) set a
+# STATIC_ROOT, so its static files can be collected.
+#
+def hasStaticRoot(djangoProjPath):
+    '''Return True if the Django project's settings configure a STATIC_ROOT.'''
+    for name in sorted(os.listdir(djangoProjPath)):
+        settingsFile = os.path.join(djangoProjPath, name, "settings.py")
+        if os.path.isfile(settingsFile):
+            with open(settingsFile) as inFile:
+                if re.search(r'^STATIC_ROOT\s*=', inFile.read(), re.MULTILINE):
+                    return True
+    return False
+
+#
+# Build the release bundle for a Django project, unless it has already been built, and return a tuple of
+# (releaseId, bundlePath). The bundles are kept in our local state directory, and only the most recent
+# KEEP_LOCAL_RELEASES are kept.
+#
+def buildRelease(djangoProjPath, collectStatic=True):
+    '''Return the release ID and bundle of the Django project, building the bundle if necessary.'''
+
+    releaseId = getReleaseId(getSourceManifest(djangoProjPath), collectStatic)
+    bundlePath = config.getStatePath(RELEASES_DIR, releaseId + ".tar.gz")
+    if os.path.isfile(bundlePath):
+        os.utime(bundlePath, None)
+        return (releaseId, bundlePath)
+
+    if not os.path.isdir(os.path.dirname(bundlePath)):
+        os.makedirs(os.path.dirname(bundlePath), 0700)
+
+    #
+    # Build the release in a copy of the project, so the project itself isn't touched. The bundle is written
+    # to a temporary file, then renamed into place, so a build that fails partway (or two builds of the same
+    # release at the same time) never leave a partial bundle behind.
+    #
+    buildDir = tempfile.mkdtemp()
+    try:
+        releaseDir = os.path.join(buildDir, "release")
+        shutil.copytree(djangoProjPath, releaseDir, symlinks=True,
+                        ignore=shutil.ignore_patterns(*["*" + suffix for suffix in COMPILED_SUFFIXES + DATABASE_SUFFIXES]))
+        if collectStatic and hasStaticRoot(releaseDir):
+            __collectstatic__(releaseDir)
+        __compileproject__(releaseDir)
+        with open(os.path.join(releaseDir, RELEASE_FILE_NAME), "w") as outFile:
+            outFile.write(releaseId + "\n")
+        with open(os.path.join(releaseDir, projectsync.MANIFEST_FILE_NAME), "w") as outFile:
+            json.dump(projectsync.buildManifest(releaseDir), outFile, sort_keys=True)
+
+        tempPath = bundlePath + ".tmp{0}".format(os.getpid())
+        archive = tarfile.open(tempPath, "w:gz")
+        try:
+            for name in sorted(os.listdir(releaseDir)):
+                archive.add(os.path.join(releaseDir, name), arcname=name)
+        finally:
+            archive.close()
+        os.rename(tempPath, bundlePath)
+    finally:
+        shutil.rmtree(buildDir)
+
+    __prunelocalreleases__()
+    return (releaseId, bundlePath)
+
+def __compileproject__(releaseDir):
+    '''Private helper, compiling each of the Python modules in releaseDir to bytecode.'''
+    for (dirPath, dirNames, fileNames) in os.walk(releaseDir):
+        for fileName in fileNames:
+            if fileName.endswith(".py"):
+                try:
+                    py_compile.compile(os.path.join(dirPath, fileName), doraise=True)
+                except py_compile.PyCompileError as error:
+                    raise Exception("Unable to compile the Django project:\n" + error.msg.replace(releaseDir + os.sep, "").rstrip())
+
+def __collectstatic__(releaseDir):
+    '''Private helper, collecting the static files of the project in releaseDir.'''
+    process = subprocess.Popen([sys.executable, "manage.py", "collectstatic", "--noinput"], cwd=releaseDir,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise Exception("Unable to collect the Django project's static files (use --no-collect-static to skip this):\n" +
+                        output.strip())
+
+def __prunelocalreleases__():
+    '''Private helper, removing all but the most recently used KEEP_LOCAL_RELEASES bundles.'''
+    releasesDir = config.getStatePath(RELEASES_DIR)
+    bundles = [os.path.join(releasesDir, name) for name in os.listdir(releasesDir) if name.endswith(".tar.gz")]
+    for bundlePath in sorted(bundles, key=os.path.getmtime, reverse=True)[KEEP_LOCAL_RELEASES:]:
+        os.remove(bundlePath)
+
+#
+# Return the path (relative to the home directory on each node) of the shared copy of the named file of the
+# project in remoteDir (see getInstallCommand).
+#
+def getSharedPath(remoteDir, fileName):
+    '''Return the path on each node of the project's shared copy of fileName.'''
+    return SHARED_DIR + "/" + remoteDir + "/" + fileName
+
+#
+# Return a shell command (run in the home directory) that makes the release releaseId the current one, by
+# switching the remoteDir symbolic link to point at it. If remoteArchive is provided, the release is first
+# unpacked from it (unless the node already has it), and the archive is removed; otherwise, the command only
+# switches to the release if the node already has it, writing PRESENT_MARKER (followed by the release it's
+# switching from) if it does. If it doesn't, the command writes CURRENT_MARKER (followed by the current
+# release, if there is one), then the current release's manifest (see projectsync.py).
+#
+# If baseRelease is provided, remoteArchive only holds the files that differ from that release (see
+# projectsync.buildArchive), so the new release is made from a copy of baseRelease, with the archive unpacked
+# over it and the stale files removed.
+#
+# sharedFiles are the names of the project's files (its SQLite database and migration stamp) that are kept in
+# the shared directory (see getSharedPath) rather than in a release. The release gets a symbolic link to each
+# of them, replacing any copy it has of its own. A file that's still in the current release, or the release
+# itself (from a deploy made before the files were shared), is moved into the shared directory first, unless
+# the shared directory already has it.
+#
+# When switching, if remoteDir is still a plain directory (from an older deploy), it's moved aside into
+# RELEASES_DIR. Old releases (beyond the most recent KEEP_RELEASES) are then removed. Switching to the current
+# release does nothing.
+#
+def getInstallCommand(releaseId, remoteDir, remoteArchive=None, sharedFiles=[], baseRelease=None):
+    '''Return the shell command that unpacks (optionally) and switches to the given release.'''
+    release = pipes.quote(RELEASES_DIR + "/" + releaseId)
+    project = pipes.quote(remoteDir)
+    switch = ('[ "$(readlink {1})" = {0} ] || {{ '
+              'if [ -d {1} ] && [ ! -L {1} ]; then mv {1} {2}/unversioned-$(date +%s); fi; '
+              'ln -sfn {0} {1}.new && mv -T {1}.new {1} && '
+              '(cd {2} && ls -1t | grep -v -x -e {3} | tail -n +{4} | xargs -r rm -rf); }}').format(
+              release, project, RELEASES_DIR, pipes.quote(releaseId), KEEP_RELEASES)
+    if len(sharedFiles) != 0:
+        shared = pipes.quote(getSharedPath(remoteDir, ""))
+        switch = ('mkdir -p {2} && for f in {3}; do '
+                  'for src in {1}/"$f" {0}/"$f"; do '
+                  'if [ -f "$src" ] && [ ! -L "$src" ] && [ ! -e {2}"$f" ]; then mv "$src" {2}; fi; done; '
+                  'ln -sfn ../../{2}"$f" {0}/"$f" || exit 1; done && {4}').format(
+                  release, project, shared, " ".join(pipes.quote(fileName) for fileName in sharedFiles), switch)
+    if remoteArchive is None:
+        return ('if [ -f {0}/{1} ]; then echo {2} "$(readlink {3})"; {4}; '
+                'else current=$(readlink {3}); echo {5} "$current"; '
+                '{{ [ -n "$current" ] && cat "$current"/{6} 2>/dev/null; }} || true; fi').format(
+                release, RELEASE_FILE_NAME, PRESENT_MARKER, project, switch, CURRENT_MARKER, projectsync.MANIFEST_FILE_NAME)
+
+    if baseRelease is None:
+        prepare = "mkdir -p {0}.tmp && tar xzpf {1} -C {0}.tmp".format(release, pipes.quote(remoteArchive))
+    else:
+        prepare = "cp -a {2} {0}.tmp && tar xzpf {1} -C {0}.tmp && (cd {0}.tmp && {3})".format(
+                  release, pipes.quote(remoteArchive), pipes.quote(baseRelease), projectsync.getRemoveStaleCommand())
+    unpack = "[ -f {0}/{1} ] || {{ rm -rf {0}.tmp && {2} && rm -rf {0} && mv {0}.tmp {0}; }}".format(release, RELEASE_FILE_NAME,
+                                                                                                 prepare)
+    return "({0} && {1}); status=$?; rm -f {2}; exit $status".format(unpack, switch, pipes.quote(remoteArchive))
+
+#
+# Install the release releaseId (whose bundle is bundlePath) on the current host, as remoteDir. This must be
+# called from within a Fabric task. The bundle is only sent if the node doesn't already have the release. If
+# the bundle has already been put on the node (e.g. by fanout.distributeFile), stagedArchive is its path there,
+# and it's unpacked from there instead. If the node is running another release, only the files that differ
+# from it are sent (see projectsync.py). Return "unchanged" if it was already the current release, "switched"
+# if the node already had it, "patched" if only the differences were sent, "sent" if the bundle was sent, or
+# "staged" if it was unpacked from stagedArchive. If bundlePath is None, nothing is sent, and None is returned
+# if the node doesn't have the release. The release is linked to the project's sharedFiles (see
+# getInstallCommand).
+#
+def installRelease(releaseId, bundlePath, remoteDir, stagedArchive=None, sharedFiles=[]):
+    '''Make releaseId the current release of remoteDir on the current host, sending its bundle if necessary.'''
+    import fabricutils
+
+    if stagedArchive is not None:
+        fabricutils.run(getInstallCommand(releaseId, remoteDir, stagedArchive, sharedFiles))
+        return "staged"
+
+    baseRelease = None
+    baseManifest = None
+    for line in fabricutils.run(getInstallCommand(releaseId, remoteDir, sharedFiles=sharedFiles)).splitlines():
+        if line.startswith(PRESENT_MARKER):
+            return "unchanged" if line.split()[1:] == [RELEASES_DIR + "/" + releaseId] else "switched"
+        if line.startswith(CURRENT_MARKER):
+            baseRelease = ([name for name in line.split()[1:] if name.startswith(RELEASES_DIR + "/")] or [None])[0]
+        elif baseRelease is not None and line.startswith("{"):
+            try:
+                baseManifest = json.loads(line)
+            except ValueError:
+                pass
+    if bundlePath is None:
+        return None
+
+    #
+    # If the node has a release to start from, only send the files that differ from it.
+    #
+    remoteArchive = "/tmp/" + releaseId + ".tar.gz"
+    if baseManifest is not None:
+        with tarfile.open(bundlePath) as bundle:
+            manifest = json.load(bundle.extractfile(projectsync.MANIFEST_FILE_NAME))
+        (changedFiles, staleFiles) = projectsync.diffManifests(manifest, baseManifest)
+        archiveName = projectsync.buildArchive(bundlePath, changedFiles + [projectsync.MANIFEST_FILE_NAME], staleFiles)
+        try:
+            fabricutils.put(archiveName, remoteArchive)
+        finally:
+            os.remove(archiveName)
+        fabricutils.run(getInstallCommand(releaseId, remoteDir, remoteArchive, sharedFiles, baseRelease))
+        return "patched"
+
+    fabricutils.put(bundlePath, remoteArchive)
+    fabricutils.run(getInstallCommand(releaseId, remoteDir, remoteArchive, sharedFiles))
+    return "sent"
+
+def main(argv=None):
+    '''Build a release bundle of the Django project, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        djangoProj = parsedArgs.django_proj
+        if not os.path.isfile(os.path.join(djangoProj, "manage.py")):
+            raise Exception("Django project directory ({0}) doesn't contain manage.py".format(djangoProj))
+        (releaseId, bundlePath) = buildRelease(djangoProj, collectStatic=not parsedArgs.no_collect_static)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    with tarfile.open(bundlePath) as archive:
+        numFiles = len([member for member in archive.getmembers() if member.isfile()])
+    print "Release", releaseId, "of", djangoProj
+    print "- Bundle:", bundlePath
+    print "- Size: {0:.1f} KB, {1} files".format(os.path.getsize(bundlePath) / 1024.0, numFiles)
+
+if __name__ == '__main__':
+    main()
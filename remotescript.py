@@ -0,0 +1,125 @@
+#
+# Helper functions for running a phase's remote work as a single script. Rather than issuing each command
+# as a separate remote command (each with its own round-trip, and its own sudo start-up), a phase is
+# described as a declarative list of steps, which is compiled into one shell script, sent to the node and
+# run in a single round-trip. The script reports each step's exit status and timing, which are parsed back
+# out of its output. Each step's timing is also recorded as a span (see profiler.py).
+#
+import pipes, time
+
+from fabric import api
+
+# local modules
+import fabricutils, profiler
+
+# The prefix of the lines the compiled script writes to report the outcome of each step.
+STEP_MARKER = "@@LINKOVERFLOW-STEP"
+
+# The delimiter of the "here document" the script is sent in.
+SCRIPT_DELIMITER = "__LINKOVERFLOW_SCRIPT__"
+
+#
+# Describe a single step. The command is run with bash, in the directory cwd (relative to the home directory)
+# if provided, and as root if sudo is True. A background step is started detached from the session (with its
+# output redirected to logFile, or discarded), and succeeds as soon as it has been started.
+#
+def step(name, command, sudo=False, cwd=None, background=False, logFile="/dev/null"):
+    '''Return a step (a dictionary), for use in a list of steps passed to compileScript/runSteps.'''
+    return {'name': name, 'command': command, 'sudo': sudo, 'cwd': cwd, 'background': background, 'logFile': logFile}
+
+#
+# Compile a list of steps into a shell script. The steps are run in order, stopping at the first failure,
+# and each step writes a line of the form:
+#
+#   @@LINKOVERFLOW-STEP <index> <exit status> <start time> <end time>
+#
+# If every step needs root, the whole script is intended to be run with sudo (see runsAsRoot), so that
+# sudo is only started once; otherwise each root step is run with its own sudo.
+#
+def compileScript(steps):
+    '''Return the text of a shell script that runs each of the steps, reporting their outcomes.'''
+
+    asRoot = runsAsRoot(steps)
+    lines = ["__linkoverflow_now() { date +%s.%N; }"]
+    for (index, stepDict) in enumerate(steps):
+        command = stepDict['command']
+        if stepDict['cwd'] is not None:
+            command = "cd {0} && {1}".format(pipes.quote(stepDict['cwd']), command)
+        if stepDict['background']:
+            command = "(nohup bash -c {0} >> {1} 2>&1 </dev/null &)".format(pipes.quote(command), pipes.quote(stepDict['logFile']))
+        elif stepDict['sudo'] and not asRoot:
+            command = "sudo bash -c {0}".format(pipes.quote(command))
+        lines.append("__linkoverflow_start=$(__linkoverflow_now)")
+        lines.append("( {0} )".format(command))
+        lines.append("__linkoverflow_status=$?")
+        lines.append("echo \"{0} {1} $__linkoverflow_status $__linkoverflow_start $(__linkoverflow_now)\"".format(STEP_MARKER, index))
+        lines.append("[ $__linkoverflow_status -eq 0 ] || exit $__linkoverflow_status")
+    return "\n".join(lines) + "\n"
+
+def runsAsRoot(steps):
+    '''Return True if every step needs root (so the whole script should be run with sudo).'''
+    return len(steps) != 0 and all(stepDict['sudo'] for stepDict in steps)
+
+#
+# Parse the output of a compiled script, returning a list with a result for each step that was run (in
+# order), each of which is a dictionary containing the step's name, exitStatus, start (the time on the
+# remote host) and duration (in seconds). Any other output is ignored.
+#
+def parseStepResults(steps, output):
+    '''Return the list of per-step results reported in the script output.'''
+    results = []
+    for line in output.splitlines():
+        words = line.strip().split()
+        if len(words) != 5 or words[0] != STEP_MARKER:
+            continue
+        try:
+            (index, exitStatus, startTime, endTime) = (int(words[1]), int(words[2]), float(words[3]), float(words[4]))
+        except ValueError:
+            continue
+        results.append({'name': steps[index]['name'], 'exitStatus': exitStatus, 'duration': endTime - startTime,
+                        'start': startTime})
+    return results
+
+#
+# Run a list of steps on the current host, as a single remote command. This must be called from within a
+# Fabric task. Return the list of per-step results (see parseStepResults). If a step fails, raise
+# fabricutils.RemoteCommandError, naming the step that failed.
+#
+def runSteps(steps):
+    '''Run the steps on the current host in one round-trip, returning the per-step results.'''
+
+    #
+    # The script is sent as a "here document", so it's uploaded and run by the same command. Background
+    # steps must not be attached to a pseudo-terminal, or they'd be killed when the command completes.
+    #
+    shell = "sudo bash -s" if runsAsRoot(steps) else "bash -s"
+    command = "{0} <<'{1}'\n{2}{1}".format(shell, SCRIPT_DELIMITER, compileScript(steps))
+    pty = not any(stepDict['background'] for stepDict in steps)
+    startTime = time.time()
+    with api.settings(warn_only=True):
+        output = api.run(command, pty=pty)
+
+    #
+    # Record each step's timing. The remote clock may not agree with ours, so the steps are placed relative
+    # to the time we started the script.
+    #
+    results = parseStepResults(steps, output)
+    for result in results:
+        profiler.record(result['name'], "step", startTime + result['start'] - results[0]['start'], result['duration'],
+                        api.env.host, {'exitStatus': result['exitStatus']})
+    if output.failed:
+        if len(results) != 0 and results[-1]['exitStatus'] != 0:
+            failedStep = results[-1]['name']
+        else:
+            failedStep = steps[min(len(results), len(steps) - 1)]['name']
+        raise fabricutils.RemoteCommandError(failedStep, output.return_code, output.stderr or output)
+    return results
+
+#
+# Return a shell command that stops a process started by a background step (which wrote its process ID to
+# pidFile), if it's running, and waits for it to exit.
+#
+def getStopCommand(pidFile):
+    '''Return a shell command that stops the process whose ID is in pidFile, and waits for it to exit.'''
+    return ("if [ -f {0} ]; then pid=$(cat {0}); kill $pid 2>/dev/null; "
+            "for i in $(seq 30); do kill -0 $pid 2>/dev/null || break; sleep 1; done; rm -f {0}; fi").format(pidFile)
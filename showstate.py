@@ -1,70 +1,190 @@
-import sys, boto.ec2, os, argparse, ConfigParser
+import sys, os, argparse, json, time, hashlib
+
+# local modules (aws, and boto, are slow to import, so they're only imported once we need to query EC2)
+import config, journal
+
+# Constant: the number of instances we ask EC2 for in each request (EC2 allows between 5 and 1000).
+DEFAULT_PAGE_SIZE = 200
+
+# Constant: by default, results are cached for this many seconds, so repeated status checks are cheap.
+DEFAULT_CACHE_TTL = 30
 
 # This will create the command line argument parser and return it
 #
 def create_parser():
     defaultSettingsFile = os.path.expanduser("~/.aws.settings")
     parser = argparse.ArgumentParser(
-                        prog="showstate.py",
-                        usage="%(prog)s [-h] [--aws-settings <file>]",
-                        description="Tool for showing state of EC2 instances") 
+                        prog=config.getProgName("showstate.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--tag <key=value>] [--reservation-id <id>] "
+                            "[--state <state>] [--instance-type <type>] [--launch-id <id>] [--json] [--cache-ttl <seconds>] [--refresh]",
+                        description="Tool for showing state of EC2 instances")
     parser.add_argument('--aws-settings',
                         default=defaultSettingsFile,
                         help="Specify the location of the per-user AWS configuration "
                             "(default is '.aws.settings' in the user's home directory). These settings contain "
-                            "important keys and should be kept secret at all times.")   
+                            "important keys and should be kept secret at all times.")
+    parser.add_argument('--tag',
+                        action='append',
+                        default=[],
+                        help="Only show instances with the given tag value (may be repeated).")
+    parser.add_argument('--reservation-id',
+                        action='append',
+                        default=[],
+                        help="Only show instances in the given reservation (may be repeated).")
+    parser.add_argument('--state',
+                        action='append',
+                        default=[],
+                        help="Only show instances in the given state, e.g. running or stopped (may be repeated).")
+    parser.add_argument('--instance-type',
+                        action='append',
+                        default=[],
+                        help="Only show instances of the given type, e.g. t2.micro (may be repeated).")
+    parser.add_argument('--launch-id',
+                        action='append',
+                        default=[],
+                        help="Only show instances started by the given launch (as reported by launch.py).")
+    parser.add_argument('--json',
+                        action='store_true',
+                        help="Show each instance as a line of JSON, rather than as text.")
+    parser.add_argument('--cache-ttl',
+                        type=int,
+                        default=DEFAULT_CACHE_TTL,
+                        help="Reuse results from a previous run with the same filters, if they're no older than this "
+                            "many seconds (default is {0}, and 0 disables the cache).".format(DEFAULT_CACHE_TTL))
+    parser.add_argument('--refresh',
+                        action='store_true',
+                        help="Ignore any cached results (but still cache the new ones).")
     return parser
 
-# This will check the AWS settings file and return the dictionary
+# This will convert the command line arguments into a dictionary of EC2 filters, which EC2 applies
+# on its side (so we only receive the instances we're interested in)
 #
-def validateConfig():
-    parser = create_parser()
-    parsedArgs = parser.parse_args()
-    awsConfigDict = {}
-    try:
-        awsConfigParser = ConfigParser.RawConfigParser()
-        awsConfigParser.read(parsedArgs.aws_settings)
-        awsConfigDict['EC2_AccessKeyID'] = awsConfigParser.get("EC2", "AccessKeyID")
-        awsConfigDict['EC2_SecretAccessKey'] = awsConfigParser.get("EC2", "SecretAccessKey")
-        awsConfigDict['EC2_AvailabilityZone'] = awsConfigParser.get("EC2", "AvailabilityZone")
-
-    except (ConfigParser.Error) as mesg:
-        raise Exception("AWS settings file ({0}): {1}".format(parsedArgs.aws_settings, mesg))
+def buildFilters(parsedArgs):
+    filters = {}
+    for tag in parsedArgs.tag:
+        if "=" not in tag:
+            raise Exception("Invalid tag filter {0} (should be key=value)".format(tag))
+        (key, value) = tag.split("=", 1)
+        filters.setdefault("tag:" + key, []).append(value)
+    if len(parsedArgs.reservation_id) != 0:
+        filters['reservation-id'] = parsedArgs.reservation_id
+    if len(parsedArgs.state) != 0:
+        filters['instance-state-name'] = parsedArgs.state
+    if len(parsedArgs.instance_type) != 0:
+        filters['instance-type'] = parsedArgs.instance_type
+    if len(parsedArgs.launch_id) != 0:
+        filters['tag:' + journal.LAUNCH_ID_TAG] = parsedArgs.launch_id
+    return filters
 
-    return awsConfigDict        
+# This will fetch the instances matching the filters from EC2, one page at a time, and yield a dictionary
+# describing each instance as soon as its page arrives (so we never hold more than one page in memory)
+#
+def iterEC2Instances(ec2, filters=None, pageSize=DEFAULT_PAGE_SIZE):
+    import boto.exception
+    nextToken = None
+    while True:
+        try:
+            reservations = ec2.get_all_reservations(filters=filters or None, max_results=pageSize, next_token=nextToken)
+        except boto.exception.EC2ResponseError as mesg:
+            raise Exception("Unable to query EC2 instances.\nDetailed message from server was {0}".format(mesg))
+        for reservation in reservations:
+            for instance in reservation.instances:
+                yield {'id': instance.id,
+                       'ip_address': instance.ip_address,
+                       'private_ip_address': instance.private_ip_address,
+                       'state': instance.state,
+                       'instance_type': instance.instance_type,
+                       'image_id': instance.image_id,
+                       'launch_time': instance.launch_time,
+                       'reservation_id': reservation.id,
+                       'tags': dict(instance.tags)}
+        nextToken = reservations.next_token
+        if not nextToken:
+            return
 
 # This will get the ip address and state of each EC2 instance
 #
-def getEC2InstanceStates(accessKeyId, secretAccessKey, availabilityZone):
-    try:
-        ec2 = boto.ec2.connect_to_region(availabilityZone, aws_access_key_id=accessKeyId, aws_secret_access_key=secretAccessKey)
-    except boto.exception.EC2ResponseError as mesg:
-        raise Exception("Unable to connect to EC2")
-    
-    if ec2 is None:
-        raise Exception("Unable to connect to EC2")
+def getEC2InstanceStates(accessKeyId, secretAccessKey, availabilityZone, endpoint=None, filters=None):
+    import aws
+    ec2 = aws.connectEC2(accessKeyId, secretAccessKey, availabilityZone, endpoint)
 
     stateList = []
     ipList = []
-    instances = ec2.get_only_instances()
-    for instance in instances:
-        stateList.append(instance.state)
-        ipList.append(instance.ip_address)
+    for instance in iterEC2Instances(ec2, filters):
+        stateList.append(instance['state'])
+        ipList.append(instance['ip_address'])
 
     return (ipList, stateList)
 
-# Once we have a list of ip addresses and states, iterate over each one and display them to the user
+# The on-disk cache holds the results of a previous run, as one line of JSON per instance, in a file named
+# after a hash of the region, endpoint and filters. These return the cache file's name, and an iterator over
+# its instances (or None if there isn't a fresh enough cache)
 #
-try:
-    awsConfigDict = validateConfig()
-
-    (ipList, stateList) = getEC2InstanceStates(awsConfigDict['EC2_AccessKeyID'],
-                   awsConfigDict['EC2_SecretAccessKey'],
-                   awsConfigDict['EC2_AvailabilityZone'])
-except Exception as mesg:
-    print >>sys.stderr, "Error:", mesg
-    sys.exit(1)
-
-print "\nIP Address and State of all instances:\n"
-for x in range(1, len(ipList)):
-    print "\n", ipList[x], " - ", stateList[x], "\n"
+def getCacheFile(awsConfigDict, filters):
+    key = json.dumps([awsConfigDict['EC2_AvailabilityZone'], awsConfigDict['EC2_Endpoint'], filters], sort_keys=True)
+    return config.getStatePath("showstate-{0}.jsonl".format(hashlib.sha1(key).hexdigest()[:16]))
+
+def readCache(cacheFile, cacheTTL):
+    try:
+        if time.time() - os.stat(cacheFile).st_mtime > cacheTTL:
+            return None
+        inFile = open(cacheFile)
+    except (OSError, IOError):
+        return None
+    return (json.loads(line) for line in inFile)
+
+# This will pass the instances through, while also writing them to the cache file. The cache is only
+# replaced once all the instances have been written
+#
+def writeCache(cacheFile, instances):
+    with open(cacheFile + ".tmp", "w") as outFile:
+        for instance in instances:
+            outFile.write(json.dumps(instance, sort_keys=True) + "\n")
+            yield instance
+    os.rename(cacheFile + ".tmp", cacheFile)
+
+# This will display a single instance to the user, as text or as a line of JSON
+#
+def printInstance(instance, asJson):
+    if asJson:
+        print json.dumps(instance, sort_keys=True)
+    else:
+        print "{0:<20} {1:<16} {2:<14} {3:<12}".format(instance['id'], instance['ip_address'] or "-",
+                                                       instance['state'], instance['instance_type'])
+    sys.stdout.flush()
+
+# Stream each instance's ip address and state to the user, as soon as each page of results arrives
+#
+def main(argv=None):
+    '''Show the state of the EC2 instances, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        filters = buildFilters(parsedArgs)
+
+        instances = None
+        if parsedArgs.cache_ttl > 0:
+            cacheFile = getCacheFile(awsConfigDict, filters)
+            if not parsedArgs.refresh:
+                instances = readCache(cacheFile, parsedArgs.cache_ttl)
+        if instances is None:
+            import aws
+            ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'],
+                                 awsConfigDict['EC2_SecretAccessKey'],
+                                 awsConfigDict['EC2_AvailabilityZone'],
+                                 awsConfigDict['EC2_Endpoint'])
+            instances = iterEC2Instances(ec2, filters)
+            if parsedArgs.cache_ttl > 0:
+                instances = writeCache(cacheFile, instances)
+
+        if not parsedArgs.json:
+            print "\nIP Address and State of all instances:\n"
+            printInstance({'id': "Instance", 'ip_address': "IP Address", 'state': "State", 'instance_type': "Type"}, False)
+        for instance in instances:
+            printInstance(instance, parsedArgs.json)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
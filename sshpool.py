@@ -0,0 +1,183 @@
+#
+# A pool of persistent SSH sessions, shared by all of the Fabric tasks in a launch. Normally, Fabric runs
+# parallel tasks in a new process per host, so every phase (install Puppet, apply configuration, deploy,
+# run) pays for a fresh SSH connection and key exchange with every node. Instead, the pool keeps one
+# long-lived worker process per (user, host, key file), which opens its SSH connection once and runs every
+# subsequent task and file transfer for that host over it.
+#
+# Sessions that have been idle for longer than the idle timeout are closed (and are transparently re-opened
+# if they're needed again), and a connection that has dropped is re-established before the next task. If a
+# session ends before sending back a task's result (say it reached its idle timeout just as the task was sent),
+# the task is sent again, once, to a new session.
+#
+import os, select, multiprocessing
+
+from fabric import api, network, state
+
+# local modules
+import fabricutils
+
+# Constant: the default number of seconds a session may sit idle before it's closed.
+DEFAULT_IDLE_TIMEOUT = 300
+
+#
+# The worker process for a single session. It waits for (taskName, task, args, kwargs, envSettings) requests on
+# its end of the pipe, runs each one (via fabricutils.__hosttask__) and sends back the result, keeping the
+# SSH connection open between requests. A None request, or being idle for too long, ends the session.
+#
+def __sessionmain__(conn, user, host, keyFile, idleTimeout):
+    '''Private entry point for a session worker process.'''
+
+    api.env.user = user
+    api.env.key_filename = keyFile
+    api.env.host = host
+    api.env.host_string = "{0}@{1}".format(user, host)
+    try:
+        while conn.poll(idleTimeout):
+            request = conn.recv()
+            if request is None:
+                break
+            (taskName, task, args, kwargs, envSettings) = request
+
+            # if the connection has dropped since the last task, forget it so that Fabric reconnects.
+            if api.env.host_string in state.connections:
+                transport = state.connections[api.env.host_string].get_transport()
+                if transport is None or not transport.is_active():
+                    del state.connections[api.env.host_string]
+
+            with api.settings(**envSettings):
+                conn.send(fabricutils.__hosttask__(taskName, task, *args, **kwargs))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        network.disconnect_all()
+        conn.close()
+
+#
+# The launcher's handle on a single session worker process.
+#
+class HostSession(object):
+    '''A persistent SSH session with a single host, run in its own worker process.'''
+
+    def __init__(self, user, host, keyFile, idleTimeout):
+        self.host = host
+        (self.conn, childConn) = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=__sessionmain__, args=(childConn, user, host, keyFile, idleTimeout))
+        self.process.daemon = True
+        self.process.start()
+        childConn.close()
+
+    def isAlive(self):
+        '''Return True if the session can accept more requests (i.e. it hasn't been closed for being idle).'''
+        return self.process.is_alive()
+
+    def send(self, taskName, task, args, kwargs, envSettings):
+        '''Ask the session to run a task. The result must then be collected with receive().'''
+        self.conn.send((taskName, task, args, kwargs, envSettings))
+
+    def receive(self):
+        '''Return the result of the task sent to the session, or None if the session ended without sending it.'''
+        try:
+            return self.conn.recv()
+        except (EOFError, IOError):
+            self.process.join()
+            return None
+
+    def close(self):
+        '''End the session, closing its SSH connection.'''
+        if self.isAlive():
+            try:
+                self.conn.send(None)
+            except IOError:
+                pass
+        self.process.join()
+        self.conn.close()
+
+#
+# The pool of sessions, keyed by (user, host, key file). Once opened (see openPool), fabricutils.executeOnHosts
+# runs all of its tasks through the pool.
+#
+class SessionPool(object):
+    '''A pool of persistent SSH sessions, reused across all the phases of a launch.'''
+
+    def __init__(self, idleTimeout=DEFAULT_IDLE_TIMEOUT):
+        self.idleTimeout = idleTimeout
+        self.sessions = {}
+        self.ownerPid = os.getpid()
+
+    def isUsable(self):
+        '''Return True if the pool can be used from this process (sessions can't be shared with forked children).'''
+        return os.getpid() == self.ownerPid
+
+    def getSession(self, user, host, keyFile, reopen=False):
+        '''Return the session for (user, host, keyFile), opening a new one if there isn't a live session (or if
+        reopen is True).'''
+        key = (user, host, keyFile)
+        session = self.sessions.get(key)
+        if session is None or reopen or not session.isAlive():
+            if session is not None:
+                session.close()
+            session = HostSession(user, host, keyFile, self.idleTimeout)
+            self.sessions[key] = session
+        return session
+
+    def execute(self, taskName, task, keyFile, ipList, args, kwargs, poolSize):
+        '''Run a task on each host's session, with at most poolSize hosts busy at a time. Return the list of
+        per-host results (in the same order as ipList), in the same form as fabricutils.executeOnHosts.'''
+
+        envSettings = fabricutils.getSharedEnvSettings()
+        request = (taskName, task, args, kwargs, envSettings)
+        waiting = list(ipList)
+        running = {}
+        results = {}
+        retried = set()
+        while len(waiting) != 0 or len(running) != 0:
+            while len(waiting) != 0 and len(running) < poolSize:
+                session = self.__send__(waiting.pop(0), keyFile, request)
+                running[session.conn.fileno()] = session
+
+            (readable, writable, errors) = select.select(running.keys(), [], [])
+            for fileno in readable:
+                session = running.pop(fileno)
+                result = session.receive()
+                if result is None and session.host not in retried:
+                    retried.add(session.host)
+                    session = self.__send__(session.host, keyFile, request, reopen=True)
+                    running[session.conn.fileno()] = session
+                    continue
+                if result is None:
+                    result = {'host': session.host, 'succeeded': False, 'exitStatus': None, 'duration': 0.0,
+                              'outputTail': "SSH session terminated unexpectedly.", 'value': None}
+                results[session.host] = result
+        return [results[host] for host in ipList]
+
+    def __send__(self, host, keyFile, request, reopen=False):
+        '''Private helper: send the request to the host's session, and return the session. If the session has
+        already ended (so the request can't be sent), it's sent to a new session.'''
+        session = self.getSession(api.env.user, host, keyFile, reopen)
+        try:
+            session.send(*request)
+        except IOError:
+            session = self.getSession(api.env.user, host, keyFile, reopen=True)
+            session.send(*request)
+        return session
+
+    def close(self):
+        '''Close all the sessions in the pool.'''
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+
+#
+# Open a session pool and make fabricutils.executeOnHosts use it, until closePool() is called.
+#
+def openPool(idleTimeout=DEFAULT_IDLE_TIMEOUT):
+    '''Open a session pool, and route all subsequent Fabric tasks through it.'''
+    fabricutils.sessionPool = SessionPool(idleTimeout)
+    return fabricutils.sessionPool
+
+def closePool():
+    '''Close the current session pool (if any), and go back to Fabric's normal per-task connections.'''
+    if fabricutils.sessionPool is not None:
+        fabricutils.sessionPool.close()
+        fabricutils.sessionPool = None
@@ -0,0 +1,199 @@
+import unittest, autoscale, journal, lb
+
+# A backend whose metrics are set by the test, recording the changes the controller makes, with its own clock
+#
+class FakeBackend(object):
+
+    def __init__(self, numNodes):
+        self.nodes = ["10.0.0.{0}".format(index) for index in range(1, numNodes + 1)]
+        self.metrics = {'cpu': 0.5, 'latency': 0.2}
+        self.changes = []
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def listNodes(self):
+        return list(self.nodes)
+
+    def sampleMetrics(self, ipList):
+        return dict((ip, dict(self.metrics)) for ip in ipList)
+
+    def launchNodes(self, count):
+        added = ["10.0.1.{0}".format(len(self.changes) * 10 + index) for index in range(count)]
+        self.nodes += added
+        self.changes.append(("out", count))
+        return added
+
+    def terminateNodes(self, ipList):
+        self.nodes = [ip for ip in self.nodes if ip not in ipList]
+        self.changes.append(("in", ipList))
+
+class ValidateController(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeBackend(4)
+        self.controller = autoscale.AutoscaleController(self.backend, {'minNodes': 2, 'maxNodes': 10}, clock=self.backend)
+
+    def runSteps(self, count, interval=60):
+        records = []
+        for index in range(count):
+            records.append(self.controller.step())
+            self.backend.sleep(interval)
+        return records
+
+    def test_steady(self):
+        self.runSteps(20)
+        self.assertEqual(self.backend.changes, [])
+
+    def test_scale_out(self):
+
+        # A single overloaded sample isn't enough, and nodes are added in proportion to the overload
+        #
+        self.backend.metrics = {'cpu': 1.0, 'latency': 0.3}
+        records = self.runSteps(2)
+        self.assertEqual([record['action'] for record in records], [None, "out"])
+        self.assertEqual(self.backend.changes, [("out", 4)])
+
+        # Still overloaded, but the new nodes are given the cooldown to take their share
+        #
+        self.runSteps(4)
+        self.assertEqual(len(self.backend.changes), 1)
+        self.runSteps(2)
+        self.assertEqual(self.backend.changes, [("out", 4), ("out", 2)])
+
+        # Never beyond the maximum
+        #
+        self.runSteps(20)
+        self.assertEqual(len(self.backend.nodes), 10)
+
+    def test_latency_scale_out(self):
+        self.backend.metrics = {'cpu': None, 'latency': 2.0}
+        self.runSteps(2)
+        self.assertEqual(self.backend.changes, [("out", 6)])
+
+    def test_scale_in(self):
+        self.backend.nodes = ["10.0.0.{0}".format(index) for index in range(1, 9)]
+        self.backend.metrics = {'cpu': 0.1, 'latency': 0.05}
+        self.runSteps(4)
+        self.assertEqual(self.backend.changes, [])
+
+        # The most recently added nodes are removed, leaving enough to bring the CPU up to the middle of its band
+        #
+        self.runSteps(1)
+        self.assertEqual(self.backend.changes, [("in", ["10.0.0.{0}".format(index) for index in range(3, 9)])])
+
+        # Never below the minimum
+        #
+        self.runSteps(30)
+        self.assertEqual(self.backend.nodes, ["10.0.0.1", "10.0.0.2"])
+
+    def test_scale_in_cooldown(self):
+        self.backend.metrics = {'cpu': 1.0, 'latency': 1.0}
+        self.runSteps(2)
+        self.backend.metrics = {'cpu': 0.1, 'latency': 0.05}
+        records = self.runSteps(10)
+        self.assertEqual([record['action'] for record in records], [None] * 9 + ["in"])
+        self.assertEqual(records[-2]['reason'], "underused, but cooling down after the last change")
+        self.assertGreaterEqual(records[-1]['time'] - records[0]['time'], 600 - 60)
+
+    def test_hysteresis(self):
+
+        # Load swinging between the thresholds (and above the high threshold for single samples) leaves the fleet alone
+        #
+        for cpu in [0.5, 0.75, 0.4, 0.65, 0.35, 0.75, 0.5, 0.6] * 5:
+            self.backend.metrics = {'cpu': cpu, 'latency': 0.2}
+            self.runSteps(1)
+        self.assertEqual(self.backend.changes, [])
+
+    def test_below_minimum(self):
+        self.backend.nodes = []
+        self.backend.metrics = {'cpu': None, 'latency': None}
+        self.assertEqual(self.controller.step()['action'], "out")
+        self.assertEqual(self.backend.changes, [("out", 2)])
+        self.assertEqual(self.controller.step()['reason'], "no metrics")
+
+    def test_invalid_policy(self):
+        self.assertRaises(Exception, autoscale.AutoscaleController, self.backend, {'minNodes': 5, 'maxNodes': 2})
+        self.assertRaises(Exception, autoscale.AutoscaleController, self.backend, {'cpuLow': 0.8})
+
+class ValidateSimulation(unittest.TestCase):
+
+    def test_follows_load(self):
+
+        # The load rises to 20 nodes' worth, then falls back
+        #
+        fleet = autoscale.SimulatedFleet(2, autoscale.loadtest.getProfile(ramp="600:1400,3600:1400,600:100,3600:100"))
+        controller = autoscale.AutoscaleController(fleet, {'minNodes': 2, 'maxNodes': 40}, clock=fleet)
+        sizes = []
+        controller.run(4200, report=lambda record: sizes.append(record['nodes']))
+        self.assertTrue(20 <= sizes[-1] <= 40)
+        self.assertTrue(0.3 < fleet.sampleMetrics(fleet.listNodes()).values()[0]['cpu'] < 0.7)
+        controller.run(4200, report=lambda record: sizes.append(record['nodes']))
+        self.assertTrue(2 <= sizes[-1] <= 4)
+        self.assertEqual(len(fleet.terminated), fleet.numLaunched - sizes[-1])
+
+class ValidateMetrics(unittest.TestCase):
+
+    def test_cpu_utilization(self):
+        output = "cpu  100 0 100 700 100 0 0 0 0 0\ncpu  150 0 150 750 150 0 0 0 0 0\n"
+        self.assertEqual(autoscale.getCPUUtilization(output), 0.5)
+        self.assertEqual(autoscale.getCPUUtilization("garbled"), None)
+
+    def test_fleet_metrics(self):
+        metrics = {'10.0.0.1': {'cpu': 0.2, 'latency': None}, '10.0.0.2': {'cpu': 0.4, 'latency': None}}
+        (cpu, latency) = autoscale.getFleetMetrics(metrics)
+        self.assertAlmostEqual(cpu, 0.3)
+        self.assertIsNone(latency)
+        self.assertEqual(autoscale.getFleetMetrics({}), (None, None))
+
+# A stand-in for EC2, holding instances with the given tags, which applies the "tag-key" filter
+#
+class FakeInstance(object):
+    def __init__(self, number, tags):
+        (self.id, self.tags) = ("i-{0}".format(number), tags)
+        self.ip_address = self.private_ip_address = "10.0.0.{0}".format(number)
+        (self.state, self.instance_type, self.image_id) = ("running", "t2.micro", "ami-c7d092f7")
+        self.launch_time = "2015-01-0{0}T00:00:00.000Z".format(10 - number)
+
+class FakeEC2(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+    def get_all_reservations(self, filters=None, max_results=None, next_token=None):
+        reservation = type('Reservation', (object,), {'id': "r-1"})()
+        reservation.instances = [instance for instance in self.instances if set(instance.tags) & set(filters['tag-key'])]
+        return type('ResultSet', (list,), {'next_token': None})([reservation])
+
+class ValidateFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2 = FakeEC2([FakeInstance(1, {journal.LAUNCH_ID_TAG: "launch-1"}),
+                            FakeInstance(2, {journal.LAUNCH_ID_TAG: "launch-2"}),
+                            FakeInstance(3, {journal.LAUNCH_ID_TAG: "scale-1", autoscale.GROUP_TAG: "default"}),
+                            FakeInstance(4, {journal.LAUNCH_ID_TAG: "scale-2", autoscale.GROUP_TAG: "batch"}),
+                            FakeInstance(5, {lb.ROLE_TAG: lb.LOAD_BALANCER_ROLE}),
+                            FakeInstance(6, {"Name": "unrelated"})])
+
+    def getFleet(self, *args):
+        return [instance['id'] for instance in autoscale.findFleetInstances(self.ec2, *args)]
+
+    def test_whole_fleet(self):
+
+        # Nodes started by launch.py and by any autoscaling group, oldest first (as the load balancer sees them)
+        #
+        self.assertEqual(self.getFleet(), ["i-4", "i-3", "i-2", "i-1"])
+        self.assertEqual(lb.findBackends(self.ec2, exclude=["10.0.0.2"]), [("i-1", "10.0.0.1"), ("i-3", "10.0.0.3"), ("i-4", "10.0.0.4")])
+
+    def test_group(self):
+
+        # A group's fleet includes the nodes of launch.py, but not those of other groups
+        #
+        self.assertEqual(self.getFleet("default"), ["i-3", "i-2", "i-1"])
+        self.assertEqual(self.getFleet("default", ["launch-2"]), ["i-3", "i-2"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,63 @@
-import unittest, aws, test_utils, ConfigParser
+import unittest, aws, test_utils, ConfigParser, boto.exception, threading
+
+# Minimal stand-ins for the boto objects used by aws.waitForEC2Instances
+#
+class FakeStatus(object):
+    def __init__(self, instanceId, status):
+        self.id = instanceId
+        self.instance_status = type('InstanceStatus', (object,), {'status': status})()
+
+class FakeInstance(object):
+    def __init__(self, instanceId):
+        self.id = instanceId
+        self.ip_address = "10.0.0." + instanceId.split('-')[1]
+
+class FakeEC2(object):
+
+    # readyAfter maps each instance ID to the number of status polls it takes to become "ok"
+    #
+    def __init__(self, readyAfter):
+        self.readyAfter = readyAfter
+        self.statusCalls = []
+
+    def get_all_instance_status(self, instance_ids=None):
+        self.statusCalls.append(list(instance_ids))
+        polls = len(self.statusCalls)
+        return [FakeStatus(i, "ok" if polls >= self.readyAfter[i] else "initializing") for i in instance_ids]
+
+    def get_only_instances(self, instance_ids=None):
+        return [FakeInstance(i) for i in instance_ids]
+
+class FakeReservation(object):
+    def __init__(self, instances):
+        self.instances = instances
+
+class FakeLaunchEC2(object):
+
+    # capacity is the number of instances each zone can launch, and errors is a list of error codes
+    # returned by the first few run_instances requests
+    #
+    def __init__(self, capacity, errors=None):
+        self.capacity = capacity
+        self.errors = list(errors or [])
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get_key_pair(self, keyPairName):
+        return keyPairName
+
+    def run_instances(self, amiImage, min_count=1, max_count=1, instance_type=None, key_name=None, placement=None):
+        with self.lock:
+            self.requests.append((placement, max_count))
+            if len(self.errors) != 0:
+                raise boto.exception.EC2ResponseError(503, "Unavailable", "<Response><Errors><Error><Code>{0}</Code>"
+                                                      "</Error></Errors></Response>".format(self.errors.pop(0)))
+            count = min(max_count, self.capacity[placement])
+            if count < min_count:
+                raise boto.exception.EC2ResponseError(500, "Server Error", "<Response><Errors><Error><Code>"
+                                                      "InsufficientInstanceCapacity</Code></Error></Errors></Response>")
+            self.capacity[placement] -= count
+            return FakeReservation([FakeInstance("i-{0}".format(len(self.requests))) for i in range(count)])
 
 class ConfigSetup(unittest.TestCase):
 
@@ -77,7 +136,91 @@ class ValidateAWS(ConfigSetup):
         #
         ipList = aws.launchEC2Instances(self.accessKeyId, self.secretAccessKey, 2, self.availabilityZone, self.amiImage, self.instanceType, self.keyPairName)        
         self.assertIsNotNone(ipList)
-        
+
+class ValidateWaitForEC2Instances(unittest.TestCase):
+
+    def setUp(self):
+        # don't actually sleep between polls
+        #
+        self.savedSleep = aws.time.sleep
+        aws.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        aws.time.sleep = self.savedSleep
+
+    def test_instances_yielded_in_ready_order(self):
+
+        # The slowest instance is first in the reservation, but mustn't hold up the others
+        #
+        ec2 = FakeEC2({'i-1': 3, 'i-2': 1, 'i-3': 2})
+        instances = [FakeInstance('i-1'), FakeInstance('i-2'), FakeInstance('i-3')]
+        ready = [ip for (instance, ip) in aws.waitForEC2Instances(ec2, instances)]
+        self.assertEqual(ready, ['10.0.0.2', '10.0.0.3', '10.0.0.1'])
+
+    def test_one_status_request_per_tick(self):
+
+        # Every tick asks about all (and only) the pending instances in a single request
+        #
+        ec2 = FakeEC2({'i-1': 2, 'i-2': 1})
+        list(aws.waitForEC2Instances(ec2, [FakeInstance('i-1'), FakeInstance('i-2')]))
+        self.assertEqual(ec2.statusCalls, [['i-1', 'i-2'], ['i-1']])
+
+class ValidateStartEC2Instances(unittest.TestCase):
+
+    def setUp(self):
+        # don't actually sleep between retries
+        #
+        self.savedSleep = aws.time.sleep
+        aws.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        aws.time.sleep = self.savedSleep
+
+    def test_launched_in_chunks(self):
+        ec2 = FakeLaunchEC2({None: 1000})
+        instances = aws.startEC2Instances(ec2, 120, 'ami', 't2.micro', 'keys', chunkSize=50)
+        self.assertEqual(len(instances), 120)
+        self.assertEqual(ec2.requests, [(None, 50), (None, 50), (None, 20)])
+
+    def test_throttling_retried(self):
+        ec2 = FakeLaunchEC2({None: 10}, errors=["RequestLimitExceeded", "RequestLimitExceeded"])
+        instances = aws.startEC2Instances(ec2, 10, 'ami', 't2.micro', 'keys', bucket=aws.TokenBucket(1000))
+        self.assertEqual(len(instances), 10)
+        self.assertEqual(len(ec2.requests), 3)
+
+    def test_partial_capacity_keeps_launched_instances(self):
+
+        # Once capacity runs out, the retries are exhausted, and we're left with the instances we did get
+        #
+        ec2 = FakeLaunchEC2({None: 7})
+        instances = aws.startEC2Instances(ec2, 10, 'ami', 't2.micro', 'keys', chunkSize=5)
+        self.assertEqual(len(instances), 7)
+        self.assertEqual(len(ec2.requests), 2 + aws.MAX_RETRIES + 1)
+
+    def test_invalid_request_not_retried(self):
+        ec2 = FakeLaunchEC2({None: 10}, errors=["InvalidParameterValue"])
+        with self.assertRaisesRegexp(Exception, "Unable to launch EC2 instances*"):
+            aws.startEC2Instances(ec2, 10, 'ami', 't2.micro', 'keys')
+        self.assertEqual(len(ec2.requests), 1)
+
+    def test_shortfall_moved_to_other_zones(self):
+
+        # Zone "b" can only take 2 of its 5 instances, so the other 3 are launched in zone "a"
+        #
+        ec2 = FakeLaunchEC2({'a': 100, 'b': 2})
+        instances = aws.__startinzones__(lambda: ec2, 10, ['a', 'b'], 'ami', 't2.micro', 'keys', 50, aws.TokenBucket(1000))
+        self.assertEqual(len(instances), 10)
+        self.assertEqual(ec2.capacity, {'a': 92, 'b': 0})
+
+    def test_unused_zone_kept_in_rotation(self):
+
+        # Zone "c" gets no share of the first round, but is still used once "a" and "b" run out of capacity
+        #
+        ec2 = FakeLaunchEC2({'a': 0, 'b': 1, 'c': 100})
+        instances = aws.__startinzones__(lambda: ec2, 2, ['a', 'b', 'c'], 'ami', 't2.micro', 'keys', 50, aws.TokenBucket(1000))
+        self.assertEqual(len(instances), 2)
+        self.assertEqual(ec2.capacity, {'a': 0, 'b': 0, 'c': 99})
+
 if __name__ == '__main__':
     unittest.main()
                         
@@ -0,0 +1,38 @@
+import unittest, os, shutil, tempfile, config, benchmark, test_utils
+
+class ValidateBenchmark(unittest.TestCase):
+
+    # This will use a temporary state directory (for the project's release bundle)
+    #
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+
+    def test_phased_launch(self):
+
+        # Each node is connected to once (through the session pool), and takes 5 commands and 2 uploads
+        #
+        parsedArgs = benchmark.create_parser().parse_args(['--time-scale', '0.001'])
+        instanceConfigDict = config.readInstanceConfig(test_utils.getInstanceConfig())
+        projectDir = benchmark.createProject(3, 100)
+        try:
+            result = benchmark.runBenchmark(3, parsedArgs, instanceConfigDict, projectDir)
+        finally:
+            shutil.rmtree(os.path.dirname(projectDir))
+        self.assertEqual(result['provisioned'], 3)
+        self.assertEqual((result['sshConnections'], result['sshRoundTrips'], result['uploads']), (3, 21, 6))
+        self.assertEqual(result['ec2RequestsByType']['RunInstances'], 1)
+        self.assertGreaterEqual(result['simulatedTime'], parsedArgs.boot_time - parsedArgs.boot_jitter)
+
+    def test_findRegressions(self):
+        baseline = [{'nodes': 5, 'simulatedTime': 100.0, 'ec2Requests': 10, 'sshRoundTrips': 35}]
+        results = [{'nodes': 5, 'simulatedTime': 105.0, 'ec2Requests': 20, 'sshRoundTrips': 35},
+                   {'nodes': 50, 'simulatedTime': 500.0, 'ec2Requests': 40, 'sshRoundTrips': 350}]
+        self.assertEqual(benchmark.findRegressions(results, baseline), ["5 nodes: ec2Requests went from 10.0 to 20.0"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,4 @@
-import unittest, config, os, test_utils
+import unittest, config, os, test_utils, tempfile, shutil, stat
 
 class ConfigSetup(unittest.TestCase):
 
@@ -42,6 +42,11 @@ class ValidateConfig(ConfigSetup):
         self.assertEqual(parsedArgs.instance_config, confile_file)
         self.assertEqual(parsedArgs.django_proj, django_project_file)
         self.assertEqual(parsedArgs.num_servers, int(num_servers))
+        self.assertFalse(parsedArgs.no_collect_static)
+
+    def test_no_collect_static(self):
+        parsedArgs = self.parser.parse_args(args=['--no-collect-static', 'test_django_file', '1'])
+        self.assertTrue(parsedArgs.no_collect_static)
     
     def test_checkFileIsPrivate_no_file(self):        
         self.assertRegexpMatches(config.checkFileIsPrivate('filename'), '.*is missing.')
@@ -54,7 +59,100 @@ class ValidateConfig(ConfigSetup):
 
     def test_checkFileIsPrivate_valid(self):        
         self.assertIsNone(config.checkFileIsPrivate(self.defaultSettingsFile))
-        
+
+class ValidateProvisioningHash(unittest.TestCase):
+
+    # This will create a Puppet configuration file for the instance configuration to refer to
+    #
+    def setUp(self):
+        (fd, self.puppetFile) = tempfile.mkstemp(suffix=".pp")
+        os.write(fd, "package { 'python' : ensure => installed }\n")
+        os.close(fd)
+        self.instanceConfigDict = {'EC2_ImageID': 'ami-c7d092f7', 'EC2_InstanceType': 't2.micro',
+                                   'Puppet_PuppetURL': 'http://yum.puppetlabs.com/puppetlabs-release-el-7.noarch.rpm',
+                                   'Puppet_PuppetConfigFile': self.puppetFile}
+
+    def tearDown(self):
+        os.remove(self.puppetFile)
+
+    def test_hash_is_stable(self):
+        self.assertEqual(config.getProvisioningHash(self.instanceConfigDict), config.getProvisioningHash(dict(self.instanceConfigDict)))
+
+    def test_hash_ignores_instance_type(self):
+        originalHash = config.getProvisioningHash(self.instanceConfigDict)
+        self.instanceConfigDict['EC2_InstanceType'] = 't2.large'
+        self.assertEqual(config.getProvisioningHash(self.instanceConfigDict), originalHash)
+
+    def test_hash_changes(self):
+
+        # Changing the Puppet configuration, Puppet URL or base image must all change the hash
+        #
+        originalHash = config.getProvisioningHash(self.instanceConfigDict)
+        with open(self.puppetFile, "a") as puppetFile:
+            puppetFile.write("# changed\n")
+        puppetHash = config.getProvisioningHash(self.instanceConfigDict)
+        self.assertNotEqual(puppetHash, originalHash)
+        self.instanceConfigDict['Puppet_PuppetURL'] = 'http://example.com/puppet.rpm'
+        self.assertNotEqual(config.getProvisioningHash(self.instanceConfigDict), puppetHash)
+        self.instanceConfigDict['EC2_ImageID'] = 'ami-00000000'
+        self.assertNotEqual(config.getProvisioningHash(self.instanceConfigDict), puppetHash)
+
+class ValidateConfigCache(unittest.TestCase):
+
+    # This will use a temporary state directory, and an instance configuration file to read
+    #
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+        self.configFile = os.path.join(config.STATE_DIR, "instance.config")
+        with open(test_utils.getInstanceConfig()) as inFile:
+            self.configText = inFile.read()
+        with open(self.configFile, "w") as outFile:
+            outFile.write(self.configText)
+        self.reads = []
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+
+    def reader(self, fileName):
+        self.reads.append(fileName)
+        return {'Name': "value", 'Count': 3, 'Items': ["a", "b"], 'Missing': None}
+
+    def test_cached_until_changed(self):
+        first = config.readCachedConfig(self.configFile, self.reader)
+        second = config.readCachedConfig(self.configFile, self.reader)
+        self.assertEqual(len(self.reads), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(type(second['Name']), str)
+        self.assertEqual(type(second['Items'][0]), str)
+        self.assertEqual(stat.S_IMODE(os.stat(config.getStatePath(config.CONFIG_CACHE_NAME)).st_mode), 0600)
+
+        # changing the file (its size and modification time) means it's read again
+        #
+        with open(self.configFile, "a") as outFile:
+            outFile.write("\n# changed\n")
+        os.utime(self.configFile, (0, 0))
+        config.readCachedConfig(self.configFile, self.reader)
+        self.assertEqual(len(self.reads), 2)
+
+    def test_cache_ignored_unless_private(self):
+
+        # a cache that other users can read isn't trusted: the file is read again, and the cache replaced
+        #
+        config.readCachedConfig(self.configFile, self.reader)
+        cacheFile = config.getStatePath(config.CONFIG_CACHE_NAME)
+        os.chmod(cacheFile, 0644)
+        config.readCachedConfig(self.configFile, self.reader)
+        self.assertEqual(len(self.reads), 2)
+        self.assertEqual(stat.S_IMODE(os.stat(cacheFile).st_mode), 0600)
+
+    def test_instance_config_from_cache(self):
+        instanceConfigDict = config.readInstanceConfig(self.configFile)
+        self.assertEqual(config.readInstanceConfig(self.configFile), instanceConfigDict)
+        self.assertEqual(instanceConfigDict['EC2_InstanceType'], "t2.micro")
+        self.assertEqual(instanceConfigDict['Cache_URL'], None)
+
 if __name__ == '__main__':
     unittest.main()
             
\ No newline at end of file
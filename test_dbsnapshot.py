@@ -0,0 +1,171 @@
+import unittest, dbsnapshot, djangoutils, release, config, tempfile, shutil, os, subprocess
+
+# The settings of a project created by "django-admin.py startproject myproj" (the parts we look at)
+#
+SETTINGS = """import os
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    }
+}
+"""
+
+# A stand-in for manage.py, whose "migrate" adds to the database and counts the times it has been run
+#
+MANAGE = """open('db.sqlite3', 'a').write('m')
+open('migrations-run', 'a').write('x')
+"""
+
+class ValidateSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+        self.tempDir = tempfile.mkdtemp()
+        self.projectDir = os.path.join(self.tempDir, "myproj")
+        os.makedirs(os.path.join(self.projectDir, "myproj"))
+        os.makedirs(os.path.join(self.projectDir, "polls", "migrations"))
+        for (fileName, content) in [('manage.py', MANAGE), ('myproj/settings.py', SETTINGS), ('myproj/wsgi.py', ''),
+                                    ('polls/views.py', 'views = 1\n'), ('polls/migrations/0001_initial.py', 'initial = 1\n')]:
+            with open(os.path.join(self.projectDir, fileName), 'w') as outFile:
+                outFile.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+        shutil.rmtree(self.tempDir)
+
+    def writeFile(self, fileName, content):
+        with open(os.path.join(self.projectDir, fileName), 'w') as outFile:
+            outFile.write(content)
+
+    def getMigrationsRun(self):
+        migrationsRun = os.path.join(self.projectDir, 'migrations-run')
+        return len(open(migrationsRun).read()) if os.path.exists(migrationsRun) else 0
+
+    # The temporary directory stands in for the node's home directory, with the project directory linked to
+    # the shared database (as a release would be). Run a command there.
+    #
+    def runOnNode(self, command):
+        sharedDir = os.path.join(self.tempDir, os.path.dirname(release.getSharedPath("myproj", "db.sqlite3")))
+        if not os.path.isdir(sharedDir):
+            os.makedirs(sharedDir)
+            for name in dbsnapshot.getDatabaseFiles(self.projectDir):
+                os.symlink(os.path.join(sharedDir, name), os.path.join(self.projectDir, name))
+        subprocess.check_call(["bash", "-c", command], cwd=self.tempDir, stdout=open(os.devnull, "w"))
+
+    def readDatabase(self):
+        return open(os.path.join(self.tempDir, release.getSharedPath("myproj", "db.sqlite3"))).read()
+
+    def test_database_file(self):
+        self.assertEqual(dbsnapshot.getDatabaseFile(self.projectDir), "db.sqlite3")
+        self.writeFile('myproj/settings.py', SETTINGS.replace('sqlite3', 'postgresql_psycopg2'))
+        self.assertIsNone(dbsnapshot.getDatabaseFile(self.projectDir))
+
+    def test_migrations_hash(self):
+        migrationsHash = dbsnapshot.getMigrationsHash(self.projectDir)
+        self.writeFile('polls/views.py', 'views = 2\n')
+        self.assertEqual(dbsnapshot.getMigrationsHash(self.projectDir), migrationsHash)
+        self.writeFile('polls/migrations/0002_more.py', 'more = 1\n')
+        self.assertNotEqual(dbsnapshot.getMigrationsHash(self.projectDir), migrationsHash)
+
+    def test_migrate_once(self):
+
+        # The project directory stands in for the deployed project on a node
+        #
+        def migrate():
+            self.runOnNode(dbsnapshot.getMigrateCommand("myproj", release.getSharedPath("myproj", "db.sqlite3"),
+                                                        dbsnapshot.getMigrationsHash(self.projectDir)))
+
+        migrate()
+        migrate()
+        self.assertEqual(self.getMigrationsRun(), 1)
+        self.writeFile('polls/migrations/0002_more.py', 'more = 1\n')
+        migrate()
+        self.assertEqual(self.getMigrationsRun(), 2)
+
+    def test_install_snapshot(self):
+        migrationsHash = dbsnapshot.getMigrationsHash(self.projectDir)
+        snapshot = os.path.join(self.tempDir, "snapshot.sqlite3")
+        with open(snapshot, "w") as outFile:
+            outFile.write("migrated")
+
+        # A node without a database gets the snapshot (as the shared database the project is linked to), and
+        # then doesn't need to migrate
+        #
+        databasePath = release.getSharedPath("myproj", "db.sqlite3")
+        for command in [dbsnapshot.getInstallSnapshotCommand(databasePath, migrationsHash, snapshot),
+                        dbsnapshot.getMigrateCommand("myproj", databasePath, migrationsHash)]:
+            self.runOnNode(command)
+        self.assertEqual(open(os.path.join(self.projectDir, "db.sqlite3")).read(), "migrated")
+        self.assertTrue(os.path.islink(os.path.join(self.projectDir, "db.sqlite3")))
+        self.assertEqual(self.getMigrationsRun(), 0)
+        self.assertFalse(os.path.exists(snapshot))
+
+        # A node with a database keeps it
+        #
+        with open(snapshot, "w") as outFile:
+            outFile.write("another")
+        self.runOnNode(dbsnapshot.getInstallSnapshotCommand(databasePath, migrationsHash, snapshot))
+        self.assertEqual(self.readDatabase(), "migrated")
+
+    def test_local_snapshot(self):
+        self.assertIsNone(dbsnapshot.getSnapshot("keyFile", self.projectDir, [], "off"))
+        (migrationsHash, databaseFile, snapshotPath) = dbsnapshot.getSnapshot("keyFile", self.projectDir, [], "local")
+        self.assertEqual((migrationsHash, databaseFile), (dbsnapshot.getMigrationsHash(self.projectDir), "db.sqlite3"))
+        self.assertTrue(os.path.isfile(snapshotPath))
+        self.assertEqual(dbsnapshot.getSnapshot("keyFile", self.projectDir, [], "local")[2], snapshotPath)
+        self.assertFalse(os.path.exists(os.path.join(self.projectDir, "db.sqlite3")))
+
+    def test_redeploy_and_rollback(self):
+
+        # Deploy releases of the project (see release.py) to a directory standing in for a node's home directory,
+        # then migrate, as getRunProjectSteps does
+        #
+        homeDir = os.path.join(self.tempDir, "home")
+        os.mkdir(homeDir)
+        sharedFiles = dbsnapshot.getDatabaseFiles(self.projectDir)
+        def deploy():
+            (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+            remoteArchive = os.path.join(self.tempDir, "upload.tar.gz")
+            shutil.copy(bundlePath, remoteArchive)
+            for command in [release.getInstallCommand(releaseId, "myproj", remoteArchive, sharedFiles),
+                            djangoutils.getRunProjectSteps(self.projectDir)[0]['command']]:
+                subprocess.check_call(["bash", "-c", command], cwd=homeDir, stdout=open(os.devnull, "w"))
+            return releaseId
+        def readDatabase():
+            return open(os.path.join(homeDir, "myproj", "db.sqlite3")).read()
+
+        firstId = deploy()
+        with open(os.path.join(homeDir, "myproj", "db.sqlite3"), "a") as outFile:
+            outFile.write("d")
+        self.assertEqual(readDatabase(), "md")
+
+        # A redeploy without new migrations keeps the data and doesn't migrate; one with new migrations migrates
+        # the same database
+        #
+        self.writeFile('polls/views.py', 'views = 2\n')
+        deploy()
+        self.assertEqual(readDatabase(), "md")
+        self.writeFile('polls/migrations/0002_more.py', 'more = 1\n')
+        deploy()
+        self.assertEqual(readDatabase(), "mdm")
+        stampFile = os.path.join(homeDir, release.getSharedPath("myproj", sharedFiles[1]))
+        self.assertEqual(open(stampFile).read().strip(), dbsnapshot.getMigrationsHash(self.projectDir))
+
+        # Rolling back to the first release keeps the data too
+        #
+        subprocess.check_call(["bash", "-c", release.getInstallCommand(firstId, "myproj", sharedFiles=sharedFiles)],
+                              cwd=homeDir, stdout=open(os.devnull, "w"))
+        self.assertEqual(os.readlink(os.path.join(homeDir, "myproj")), "releases/" + firstId)
+        self.assertEqual(readDatabase(), "mdm")
+
+    def test_run_project_steps(self):
+        steps = djangoutils.getRunProjectSteps(self.projectDir, remoteSnapshot="/tmp/snapshot.sqlite3")
+        self.assertEqual([step['name'] for step in steps][:2], ["install database snapshot", "migrate database"])
+        self.assertIn(dbsnapshot.getMigrationsHash(self.projectDir), steps[1]['command'])
+
+if __name__ == '__main__':
+    unittest.main()
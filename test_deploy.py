@@ -0,0 +1,127 @@
+import unittest, deploy, aws, autoscale, journal, lb, warmpool, djangoutils, prober
+
+# A stand-in for EC2, holding running instances with the given tags (see showstate.iterEC2Instances)
+#
+class FakeEC2(object):
+    def __init__(self, tagsList):
+        self.instances = []
+        for (index, tags) in enumerate(tagsList):
+            instance = type('Instance', (object,), {'id': "i-{0}".format(index + 1), 'tags': tags, 'state': "running"})()
+            instance.ip_address = instance.private_ip_address = "10.0.0.{0}".format(index + 1)
+            (instance.instance_type, instance.image_id, instance.launch_time) = ("t2.micro", "ami-c7d092f7", "2015-01-01T00:00:00.000Z")
+            self.instances.append(instance)
+
+    def get_all_reservations(self, filters=None, max_results=None, next_token=None):
+        reservation = type('Reservation', (object,), {'id': "r-1"})()
+        reservation.instances = [instance for instance in self.instances if set(instance.tags) & set(filters['tag-key'])]
+        return type('ResultSet', (list,), {'next_token': None})([reservation])
+
+class ValidateDeploy(unittest.TestCase):
+
+    def setUp(self):
+        self.ipList = ["10.0.0.{0}".format(index) for index in range(1, 11)]
+
+    def test_plan_waves(self):
+        self.assertEqual([len(wave) for wave in deploy.planWaves(self.ipList)], [2, 2, 2, 2, 2])
+        self.assertEqual([len(wave) for wave in deploy.planWaves(self.ipList, 4)], [4, 4, 2])
+        self.assertEqual(deploy.planWaves(self.ipList[:1]), [self.ipList[:1]])
+        self.assertEqual(sum(deploy.planWaves(self.ipList, 3), []), self.ipList)
+        self.assertRaises(Exception, deploy.planWaves, self.ipList, 0)
+
+    def test_all_waves_succeed(self):
+        deployed = []
+        def deployWave(wave):
+            deployed.append(wave)
+            return {}
+        (updated, failures, skipped) = deploy.rollingDeploy(deploy.planWaves(self.ipList, 3), deployWave)
+        self.assertEqual(updated, self.ipList)
+        self.assertEqual(failures, {})
+        self.assertEqual(skipped, [])
+        self.assertEqual(len(deployed), 4)
+
+    def test_stops_after_too_many_failures(self):
+
+        # the second wave has two failures, which is more than allowed, so the last two waves are skipped
+        #
+        def deployWave(wave):
+            return dict((ip, "failed to restart") for ip in wave if ip in ["10.0.0.4", "10.0.0.5"])
+        (updated, failures, skipped) = deploy.rollingDeploy(deploy.planWaves(self.ipList, 3), deployWave, maxFailures=1)
+        self.assertEqual(updated, self.ipList[:3] + ["10.0.0.6"])
+        self.assertEqual(sorted(failures), ["10.0.0.4", "10.0.0.5"])
+        self.assertEqual(skipped, self.ipList[6:])
+
+    def test_tolerated_failures(self):
+        def deployWave(wave):
+            return dict((ip, "failed to deploy") for ip in wave if ip == "10.0.0.1")
+        (updated, failures, skipped) = deploy.rollingDeploy(deploy.planWaves(self.ipList, 5), deployWave, maxFailures=1)
+        self.assertEqual(len(updated), 9)
+        self.assertEqual(skipped, [])
+
+class ValidateWave(unittest.TestCase):
+
+    # Stand in for the deploy, restart and probe steps, recording the nodes each is run on
+    #
+    def setUp(self):
+        self.saved = (djangoutils.deployProject, djangoutils.runProject, prober.probeFleet)
+        self.values = {}
+        self.calls = []
+        def deployProject(keyFile, djangoProj, ipList, poolSize=None, fanoutSeeds=0, collectStatic=True):
+            self.calls.append(("deploy", list(ipList)))
+            return [{'host': ip, 'succeeded': True, 'value': self.values.get(ip, "sent")} for ip in ipList]
+        def runProject(keyFile, djangoProj, ipList, poolSize=None, instanceType=None, snapshotMode="off"):
+            self.calls.append(("restart", list(ipList)))
+            return [{'host': ip, 'succeeded': True, 'value': None} for ip in ipList]
+        def probeFleet(ipList, paths=None, readyTimeout=None, samples=0):
+            self.calls.append(("probe", list(ipList)))
+            return dict((ip, {'ready': True, 'error': None}) for ip in ipList)
+        (djangoutils.deployProject, djangoutils.runProject, prober.probeFleet) = (deployProject, runProject, probeFleet)
+
+    def tearDown(self):
+        (djangoutils.deployProject, djangoutils.runProject, prober.probeFleet) = self.saved
+
+    def test_unchanged_nodes_left_alone(self):
+        self.values = {"10.0.0.1": "unchanged", "10.0.0.2": "stopped"}
+        self.assertEqual(deploy.deployWave("key.pem", "myproj", ["10.0.0.1", "10.0.0.2", "10.0.0.3"]), {})
+        self.assertEqual(self.calls, [("deploy", ["10.0.0.1", "10.0.0.2", "10.0.0.3"]), ("restart", ["10.0.0.2", "10.0.0.3"]),
+                                      ("probe", ["10.0.0.2", "10.0.0.3"])])
+
+        # Deploying the same version again does nothing, but restarting still restarts
+        #
+        self.calls = []
+        self.values = {"10.0.0.1": "unchanged"}
+        self.assertEqual(deploy.deployWave("key.pem", "myproj", ["10.0.0.1"]), {})
+        self.assertEqual(self.calls, [("deploy", ["10.0.0.1"])])
+        self.calls = []
+        deploy.deployWave("key.pem", "myproj", ["10.0.0.1"], restartOnly=True)
+        self.assertEqual(self.calls, [("restart", ["10.0.0.1"]), ("probe", ["10.0.0.1"])])
+
+class ValidateTargets(unittest.TestCase):
+
+    # Find the nodes on a stand-in for EC2 holding the fleet's nodes, and instances outside it
+    #
+    def setUp(self):
+        self.savedConnect = aws.connectEC2
+        ec2 = FakeEC2([{journal.LAUNCH_ID_TAG: "launch-1", "Role": "web"},
+                       {journal.LAUNCH_ID_TAG: "scale-1", autoscale.GROUP_TAG: "default"},
+                       {journal.LAUNCH_ID_TAG: "scale-2", autoscale.GROUP_TAG: "batch"},
+                       {lb.ROLE_TAG: lb.LOAD_BALANCER_ROLE},
+                       {warmpool.POOL_TAG: "abc123"},
+                       {"Name": "unrelated", "Role": "web"}])
+        aws.connectEC2 = lambda *args: ec2
+        self.awsConfigDict = {'EC2_AccessKeyID': "key", 'EC2_SecretAccessKey': "secret",
+                              'EC2_AvailabilityZone': "us-east-1", 'EC2_Endpoint': None}
+
+    def tearDown(self):
+        aws.connectEC2 = self.savedConnect
+
+    def test_only_the_fleet(self):
+        self.assertEqual(deploy.findRunningInstances(self.awsConfigDict, "default"), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(deploy.findRunningInstances(self.awsConfigDict), ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+
+    def test_tags(self):
+        self.assertEqual(deploy.findRunningInstances(self.awsConfigDict, "default", tags=["Role=web"]), ["10.0.0.1"])
+        self.assertEqual(deploy.findRunningInstances(self.awsConfigDict, tags=["Role=web", "Role=db"]), ["10.0.0.1"])
+        self.assertRaises(Exception, deploy.findRunningInstances, self.awsConfigDict, tags=["Role"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest, djangoutils, tempfile, shutil, os, subprocess
+
+class ValidateRunProjectSteps(unittest.TestCase):
+
+    # This will create a project directory, as created by "django-admin.py startproject myproj"
+    #
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.projectDir = os.path.join(self.tempDir, "myproj")
+        os.makedirs(os.path.join(self.projectDir, "myproj"))
+        for fileName in ["manage.py", "myproj/wsgi.py"]:
+            open(os.path.join(self.projectDir, fileName), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_gunicorn_workers_limited_by_memory(self):
+        self.assertEqual(djangoutils.getWSGIApplication(self.projectDir), "myproj.wsgi:application")
+        self.assertEqual(djangoutils.getMaxWorkers('t2.micro'), 6)
+        self.assertIsNone(djangoutils.getMaxWorkers('unknown.type'))
+
+        steps = djangoutils.getRunProjectSteps(self.projectDir, 't2.micro')
+        self.assertEqual([step['name'] for step in steps], ["migrate database", "stop web server", "start web server"])
+        command = steps[2]['command']
+        self.assertIn("gunicorn --bind 0.0.0.0:8080", command)
+        self.assertIn("--keep-alive", command)
+        self.assertIn("--worker-class gthread --threads 4", command)
+        self.assertIn("myproj.wsgi:application", command)
+        self.assertTrue(steps[2]['background'])
+        self.assertTrue(steps[2]['logFile'].startswith(djangoutils.SERVER_LOG_DIR))
+
+        # the worker count is 2 per CPU plus one, but no more than the memory limit
+        #
+        workers = command.split("--workers ")[1].split(" --worker-class")[0]
+        output = subprocess.check_output(["bash", "-c", "echo " + workers, "bash"])
+        self.assertEqual(int(output), min(2 * int(subprocess.check_output(["nproc"])) + 1, 6))
+
+    def test_runserver_without_wsgi(self):
+        os.remove(os.path.join(self.projectDir, "myproj", "wsgi.py"))
+        self.assertIsNone(djangoutils.getWSGIApplication(self.projectDir))
+        self.assertIn("manage.py runserver --noreload", djangoutils.getRunProjectSteps(self.projectDir)[2]['command'])
+
+    def test_stop_server_without_pid_file(self):
+        pidFile = os.path.join(self.tempDir, "server.pid")
+        self.assertEqual(subprocess.call(["bash", "-c", djangoutils.getStopServerCommand(pidFile)]), 0)
+
+    def test_server_running(self):
+        pidFile = os.path.join(self.tempDir, "server.pid")
+        self.assertEqual(subprocess.check_output(["bash", "-c", djangoutils.getServerRunningCommand(pidFile)]), "")
+        with open(pidFile, "w") as outFile:
+            outFile.write(str(os.getpid()))
+        self.assertEqual(subprocess.check_output(["bash", "-c", djangoutils.getServerRunningCommand(pidFile)]).strip(), "yes")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest, fabricutils, sshpool, os, time
+from fabric import api
+
+# A task that succeeds on host "a", fails a remote command on host "b" and fails to connect on host "c"
+#
+def exampleTask(value):
+    if api.env.host == 'b':
+        raise fabricutils.RemoteCommandError('false', 3, 'first line\nsecond line')
+    if api.env.host == 'c':
+        raise SystemExit('Unable to connect')
+    return value
+
+# A task that reports which process it ran in
+#
+def processTask():
+    return os.getpid()
+
+class ValidateExecuteOnHosts(unittest.TestCase):
+
+    def test_results_per_host(self):
+
+        # One failing host mustn't hide the results of the others, and results are in ipList order
+        #
+        results = fabricutils.executeOnHosts(exampleTask, 'keyFile', ['c', 'a', 'b'], 'value', poolSize=2)
+        self.assertEqual([r['host'] for r in results], ['c', 'a', 'b'])
+        self.assertEqual([r['succeeded'] for r in results], [False, True, False])
+        self.assertEqual(results[1]['value'], 'value')
+        self.assertEqual(results[1]['exitStatus'], 0)
+
+    def test_remote_command_failure(self):
+
+        # The exit status and output of a failed remote command are preserved
+        #
+        results = fabricutils.executeOnHosts(exampleTask, 'keyFile', ['b'], 'value')
+        self.assertEqual(results[0]['exitStatus'], 3)
+        self.assertEqual(results[0]['outputTail'], 'first line\nsecond line')
+        self.assertRegexpMatches(fabricutils.formatFailure(results[0]), 'b: failed with exit status 3.*\n    first line')
+
+    def test_connection_failure(self):
+        results = fabricutils.executeOnHosts(exampleTask, 'keyFile', ['c'], 'value')
+        self.assertIsNone(results[0]['exitStatus'])
+        self.assertEqual(fabricutils.getFailures(results), results)
+
+class ValidateSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        sshpool.openPool(idleTimeout=0.5)
+
+    def tearDown(self):
+        sshpool.closePool()
+
+    def test_sessions_reused_across_tasks(self):
+
+        # Each host's tasks all run in that host's session, so its connection is reused
+        #
+        first = fabricutils.executeOnHosts(processTask, 'keyFile', ['a', 'b'])
+        second = fabricutils.executeOnHosts(processTask, 'keyFile', ['b', 'a'], poolSize=1)
+        self.assertEqual([r['value'] for r in first], [r['value'] for r in reversed(second)])
+        self.assertNotEqual(first[0]['value'], first[1]['value'])
+        self.assertNotEqual(first[0]['value'], os.getpid())
+
+    def test_results_per_host(self):
+        results = fabricutils.executeOnHosts(exampleTask, 'keyFile', ['c', 'a', 'b'], 'value')
+        self.assertEqual([r['succeeded'] for r in results], [False, True, False])
+        self.assertEqual(results[2]['exitStatus'], 3)
+
+    def test_idle_sessions_evicted(self):
+
+        # An idle session is closed, and a new one is opened when the host is next used
+        #
+        first = fabricutils.executeOnHosts(processTask, 'keyFile', ['a'])
+        time.sleep(1)
+        second = fabricutils.executeOnHosts(processTask, 'keyFile', ['a'])
+        self.assertTrue(second[0]['succeeded'])
+        self.assertNotEqual(first[0]['value'], second[0]['value'])
+
+    def test_session_ending_as_task_sent(self):
+
+        # A session that ends just as a task is sent to it (here, as it's idle) is reopened, and the task resent
+        #
+        first = fabricutils.executeOnHosts(processTask, 'keyFile', ['a'])
+        time.sleep(1)
+        savedIsAlive = sshpool.HostSession.isAlive
+        sshpool.HostSession.isAlive = lambda session: True
+        try:
+            second = fabricutils.executeOnHosts(processTask, 'keyFile', ['a'])
+        finally:
+            sshpool.HostSession.isAlive = savedIsAlive
+        self.assertTrue(second[0]['succeeded'])
+        self.assertNotEqual(first[0]['value'], second[0]['value'])
+
+if __name__ == '__main__':
+    unittest.main()
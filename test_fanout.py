@@ -0,0 +1,99 @@
+import unittest, fanout, remotescript, projectsync, tempfile, shutil, os, socket, subprocess, math
+
+class ValidatePlan(unittest.TestCase):
+
+    def test_planTree(self):
+        ipList = ["10.0.0.{0}".format(index) for index in range(20)]
+        plan = fanout.planTree(ipList, 2)
+        self.assertEqual(sorted(plan), sorted(ipList))
+        self.assertEqual([ip for ip in ipList if plan[ip][0] is None], ipList[:2])
+
+        # The number of nodes holding the file doubles with each transfer
+        #
+        self.assertEqual(max(fanout.getRound(plan, ip) for ip in ipList), 1 + int(math.ceil(math.log(20 / 2.0, 2))))
+
+        # Each node's peer (and the node its peer sent to before it) come before it, and each peer
+        # sends to one node at a time
+        #
+        for ip in ipList[2:]:
+            (peer, previous) = plan[ip]
+            self.assertLess(ipList.index(peer), ipList.index(ip))
+            if previous is not None:
+                self.assertEqual(plan[previous][0], peer)
+                self.assertLess(ipList.index(previous), ipList.index(ip))
+        self.assertEqual(plan[ipList[2]], (ipList[0], None))
+        self.assertEqual(plan[ipList[4]], (ipList[0], ipList[2]))
+        self.assertEqual(plan[ipList[6]], (ipList[2], None))
+
+    def test_small_fleet(self):
+        self.assertEqual(fanout.planTree(["10.0.0.1"], 3), {"10.0.0.1": (None, None)})
+        self.assertRaises(Exception, fanout.planTree, ["10.0.0.1"], 0)
+
+class ValidateDistribution(unittest.TestCase):
+
+    # This will create a directory standing in for the home directory of each node, and a file to distribute
+    #
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.fileName = "bundle.tar.gz"
+        self.localPath = os.path.join(self.tempDir, self.fileName)
+        with open(self.localPath, "wb") as outFile:
+            outFile.write(os.urandom(256 * 1024))
+        self.sha1 = projectsync.hashFile(self.localPath)
+        self.nodes = ["node{0}".format(index) for index in range(7)]
+        self.ports = {}
+        for node in self.nodes:
+            os.makedirs(os.path.join(self.tempDir, node, fanout.FANOUT_DIR))
+            unused = socket.socket()
+            unused.bind(("127.0.0.1", 0))
+            self.ports[node] = unused.getsockname()[1]
+            unused.close()
+
+    def tearDown(self):
+        processes = [subprocess.Popen(["bash", "-c", remotescript.getStopCommand(fanout.getStagedPath("server.pid"))],
+                                      cwd=os.path.join(self.tempDir, node)) for node in self.nodes]
+        for process in processes:
+            process.wait()
+        shutil.rmtree(self.tempDir)
+
+    def getUrl(self, node):
+        return "http://127.0.0.1:{0}/{1}".format(self.ports[node], self.fileName)
+
+    def test_distribute(self):
+
+        # Each node runs its steps at the same time, fetching from its peer (on 127.0.0.1, with its own port)
+        #
+        plan = fanout.planTree(self.nodes, 2)
+        processes = []
+        for node in self.nodes:
+            (peer, previous) = plan[node]
+            if peer is None:
+                shutil.copy(self.localPath, os.path.join(self.tempDir, node, fanout.getStagedPath(self.fileName + ".part")))
+                steps = fanout.getFetchSteps(self.fileName, self.sha1, port=self.ports[node])
+            else:
+                waitUrls = [self.getUrl(other) for other in [peer, previous] if other is not None]
+                steps = fanout.getFetchSteps(self.fileName, self.sha1, self.getUrl(peer), waitUrls, self.ports[node], timeout=30)
+            processes.append((steps, subprocess.Popen(["bash", "-c", remotescript.compileScript(steps)],
+                                                      cwd=os.path.join(self.tempDir, node), stdout=subprocess.PIPE)))
+        for (steps, process) in processes:
+            output = process.communicate()[0]
+            self.assertEqual(process.returncode, 0)
+            self.assertEqual(len(remotescript.parseStepResults(steps, output)), len(steps))
+
+        for node in self.nodes:
+            stagedPath = os.path.join(self.tempDir, node, fanout.getStagedPath(self.fileName))
+            self.assertEqual(projectsync.hashFile(stagedPath), self.sha1)
+            self.assertFalse(os.path.exists(stagedPath + ".part"))
+
+    def test_corrupt_file(self):
+        partPath = os.path.join(self.tempDir, "node0", fanout.getStagedPath(self.fileName + ".part"))
+        with open(partPath, "wb") as outFile:
+            outFile.write("corrupt")
+        steps = fanout.getFetchSteps(self.fileName, self.sha1, port=self.ports["node0"])
+        with open(os.devnull, "w") as devNull:
+            self.assertNotEqual(subprocess.call(["bash", "-c", remotescript.compileScript(steps)],
+                                                cwd=os.path.join(self.tempDir, "node0"), stdout=devNull, stderr=devNull), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tempDir, "node0", fanout.getStagedPath(self.fileName))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest, tempfile, shutil, config, journal
+
+class ValidateJournal(unittest.TestCase):
+
+    # Keep the journals in a temporary state directory
+    #
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+
+    def test_progress_survives_reload(self):
+        launchJournal = journal.createJournal("launch-1", "myproj", 2, "ami-1", "us-west-2")
+        launchJournal.recordStarted(['i-1', 'i-2'])
+        launchJournal.recordReady('i-1', '10.0.0.1')
+        launchJournal.recordReady('i-2', '10.0.0.2')
+        launchJournal.recordPhases('10.0.0.1', ["install Puppet", "apply Puppet configuration"])
+        launchJournal.recordPhaseResults("install Puppet", [{'host': '10.0.0.2', 'succeeded': True},
+                                                            {'host': '10.0.0.1', 'succeeded': True}])
+
+        launchJournal = journal.loadJournal("launch-1")
+        self.assertEqual(launchJournal.getInstanceIds(), ['i-1', 'i-2'])
+        self.assertEqual(launchJournal.state['NumServers'], 2)
+        self.assertTrue(launchJournal.hasCompleted('10.0.0.1', "apply Puppet configuration"))
+        self.assertEqual(launchJournal.state['Nodes']['i-1']['CompletedPhases'], ["install Puppet", "apply Puppet configuration"])
+
+    def test_remaining_phases(self):
+
+        # Only the phases after the failure are left, and the failure is recorded
+        #
+        launchJournal = journal.createJournal("launch-2", "myproj", 1, "ami-1", "us-west-2")
+        launchJournal.recordStarted(['i-1'])
+        launchJournal.recordReady('i-1', '10.0.0.1')
+        launchJournal.recordPhases('10.0.0.1', ["install Puppet"], "failed to apply Puppet configuration")
+        phases = [("install Puppet", None, None), ("apply Puppet configuration", None, None), ("deploy Django project", None, None)]
+        self.assertEqual([phase[0] for phase in launchJournal.getRemainingPhases('10.0.0.1', phases)],
+                         ["apply Puppet configuration", "deploy Django project"])
+        self.assertEqual(launchJournal.state['Nodes']['i-1']['Error'], "failed to apply Puppet configuration")
+
+    def test_missing_journal(self):
+        with self.assertRaisesRegexp(Exception, "There's no journal for launch"):
+            journal.loadJournal("no-such-launch")
+
+if __name__ == '__main__':
+    unittest.main()
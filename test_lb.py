@@ -0,0 +1,82 @@
+import unittest, lb, config, tempfile, shutil, os
+
+class ValidateHAProxyConfig(unittest.TestCase):
+
+    def test_backends(self):
+        configText = lb.getHAProxyConfig([("i-2", "10.0.0.2"), ("i-1", "10.0.0.1")], "/health")
+        lines = [line.strip() for line in configText.splitlines()]
+        self.assertEqual([line for line in lines if line.startswith("server ")],
+                         ["server i-1 10.0.0.1:8080 check", "server i-2 10.0.0.2:8080 check"])
+
+        # Least connections, active health checks, and connections to the nodes reused
+        #
+        for line in ["balance leastconn", "http-reuse safe", "option http-keep-alive", "bind *:80"]:
+            self.assertIn(line, lines)
+        self.assertTrue(any(line.startswith("option httpchk GET /health ") for line in lines))
+
+    def test_stable(self):
+
+        # The same fleet gives the same configuration (so HAProxy isn't reloaded needlessly)
+        #
+        backends = [("i-{0}".format(index), "10.0.0.{0}".format(index)) for index in range(20)]
+        self.assertEqual(lb.getHAProxyConfig(backends), lb.getHAProxyConfig(list(reversed(backends))))
+        self.assertNotEqual(lb.getHAProxyConfig(backends), lb.getHAProxyConfig(backends[1:]))
+
+    def test_no_backends(self):
+        self.assertIn("backend nodes", lb.getHAProxyConfig([]))
+        self.assertFalse(any(line.strip().startswith("server ") for line in lb.getHAProxyConfig([]).splitlines()))
+
+class ValidateStats(unittest.TestCase):
+
+    def test_parse(self):
+        output = ("# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,wretr,wredis,status\n"
+                  "web,FRONTEND,,,3,10,20000,120,0,0,0,0,0,,,,,OPEN\n"
+                  "nodes,i-1,0,0,2,5,,80,0,0,,0,,0,0,0,0,UP\n"
+                  "nodes,i-2,0,0,0,0,,40,0,0,,0,,0,0,0,0,DOWN\n"
+                  "nodes,BACKEND,0,0,2,5,2000,120,0,0,0,0,,0,0,0,0,UP\n")
+        self.assertEqual(lb.parseStats(output), [{'name': "i-1", 'status': "UP", 'current': 2, 'total': 80},
+                                                 {'name': "i-2", 'status': "DOWN", 'current': 0, 'total': 40}])
+        self.assertRaises(Exception, lb.parseStats, "Unknown command.")
+
+class ValidateSettings(unittest.TestCase):
+
+    # This will use a temporary state directory (for the configuration cache), and an instance configuration file
+    #
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+        self.tempDir = tempfile.mkdtemp()
+        self.configFile = os.path.join(self.tempDir, "instance.config")
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+        shutil.rmtree(self.tempDir)
+
+    def writeConfig(self, loadBalancer):
+        with open(self.configFile, "w") as outFile:
+            outFile.write("[EC2]\nImageID = ami-c7d092f7\nInstanceType = t2.small\n"
+                          "[Puppet]\nPuppetURL = http://example.com/puppet.rpm\nPuppetConfigFile = node.pp\n" + loadBalancer)
+
+    def test_defaults(self):
+        self.writeConfig("")
+        instanceConfigDict = config.readInstanceConfig(self.configFile)
+        self.assertFalse(instanceConfigDict['LoadBalancer_Enabled'])
+        self.assertEqual(instanceConfigDict['LoadBalancer_PuppetConfigFile'], "lb.pp")
+        self.assertEqual(instanceConfigDict['LoadBalancer_InstanceType'], "t2.small")
+        self.assertEqual(instanceConfigDict['LoadBalancer_HealthCheckPath'], "/")
+
+    def test_enabled(self):
+        self.writeConfig("[LoadBalancer]\nEnabled = true\nHealthCheckPath = /health\n")
+        instanceConfigDict = config.readInstanceConfig(self.configFile)
+        self.assertTrue(instanceConfigDict['LoadBalancer_Enabled'])
+        self.assertEqual(instanceConfigDict['LoadBalancer_HealthCheckPath'], "/health")
+
+    def test_invalid(self):
+        self.writeConfig("[LoadBalancer]\nEnabled = true\nPuppetConfigFile = missing.pp\n")
+        self.assertRaises(Exception, config.readInstanceConfig, self.configFile)
+        self.writeConfig("[LoadBalancer]\nEnabled = perhaps\n")
+        self.assertRaises(Exception, config.readInstanceConfig, self.configFile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest, subprocess, sys
+
+class ValidateCommandLine(unittest.TestCase):
+
+    # This will run linkoverflow.py in a new Python process, and return its output and the boto/Fabric
+    # modules it imported
+    #
+    def runCommand(self, arguments):
+        script = ("import sys, linkoverflow\n"
+                  "try:\n"
+                  "    linkoverflow.main({0!r})\n"
+                  "except SystemExit:\n"
+                  "    pass\n"
+                  "print sorted(name for name in sys.modules if name.split('.')[0] in ('boto', 'fabric'))\n").format(arguments)
+        output = subprocess.check_output([sys.executable, "-c", script], stderr=subprocess.STDOUT)
+        return (output, eval(output.strip().splitlines()[-1]))
+
+    def test_help_lists_commands(self):
+        (output, modules) = self.runCommand(["--help"])
+        for command in ["launch", "state", "validate", "deploy"]:
+            self.assertIn("  " + command, output)
+        self.assertEqual(modules, [])
+
+    def test_command_help_is_lazy(self):
+        for command in ["launch", "state", "build", "deploy", "reconcile", "probe", "loadtest", "autoscale", "lb",
+                        "warmpool", "bake", "artifacts"]:
+            (output, modules) = self.runCommand([command, "--help"])
+            self.assertIn("usage: linkoverflow.py " + command + " ", output)
+            self.assertEqual(modules, [])
+
+    def test_build_error(self):
+        (output, modules) = self.runCommand(["build", "missing-project"])
+        self.assertIn("Error: Django project directory (missing-project) doesn't contain manage.py", output)
+        self.assertEqual(modules, [])
+
+    def test_validate_error(self):
+        (output, modules) = self.runCommand(["validate", "--aws-settings", "missing.settings"])
+        self.assertIn("Error: AWS settings file (missing.settings) is missing.", output)
+        self.assertEqual(modules, [])
+
+if __name__ == '__main__':
+    unittest.main()
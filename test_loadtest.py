@@ -0,0 +1,178 @@
+import unittest, threading, tempfile, shutil, os, socket, SocketServer, BaseHTTPServer, loadtest, config
+
+# A web server (standing in for a node's Gunicorn) that keeps connections open, and answers "/" normally, "/chunked"
+# with a chunked response, and "/fail" with an error
+#
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # a handler is created for each connection (client addresses can be reused, so they're not counted)
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.client_address)
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write("5\r\nhello\r\n0\r\n\r\n")
+            return
+        body = "failed" if self.path == "/fail" else "ok"
+        self.send_response(500 if self.path == "/fail" else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class QuietHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, clientAddress):
+        pass
+
+class ValidateLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = QuietHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        self.server.requests = []
+        self.server.connections = []
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_request_mix(self):
+        profile = loadtest.getProfile(concurrency=4, duration=1)
+        mix = loadtest.getRequestMix(["/:3", "/chunked", "/fail"])
+        report = loadtest.runLoadTest(["127.0.0.1"], self.port, mix, profile, timeout=2)
+        (summary, fleet) = (report['nodes']["127.0.0.1"], report['fleet'])
+        self.assertGreater(summary['requests'], 20)
+        self.assertEqual(set(self.server.requests), set(["/", "/chunked", "/fail"]))
+        self.assertEqual(summary['errors'], summary['statuses']["500"])
+        self.assertEqual(summary['failures'], {})
+        self.assertTrue(0 < summary['errorRate'] < 0.5)
+        self.assertEqual(fleet['requests'], summary['requests'])
+        self.assertEqual(sum(count for (limit, count) in summary['histogram']), summary['requests'])
+        latency = summary['latency']
+        self.assertTrue(0 < latency['p50'] <= latency['p99'] <= latency['p999'] <= latency['max'])
+
+        # Each connection is reused for many requests
+        #
+        self.assertLess(len(self.server.connections), summary['requests'] / 5)
+        self.assertEqual(sum(second['requests'] for second in report['timeline']), summary['requests'])
+
+    def test_no_keep_alive(self):
+        report = loadtest.runLoadTest(["127.0.0.1"], self.port, None, loadtest.getProfile(2, 0.5), keepAlive=False, timeout=2)
+        summary = report['nodes']["127.0.0.1"]
+        self.assertGreater(summary['requests'], 5)
+        self.assertEqual(summary['errors'], 0)
+        self.assertGreaterEqual(len(self.server.connections), summary['requests'])
+
+    def test_processes(self):
+        report = loadtest.runLoadTest(["127.0.0.1"], self.port, None, loadtest.getProfile(4, 0.5), processes=2, timeout=2)
+        self.assertGreater(report['fleet']['requests'], 5)
+        self.assertEqual(report['fleet']['errors'], 0)
+
+    def test_node_down(self):
+
+        # Find a port that nothing is listening on
+        #
+        unused = socket.socket()
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+        unused.close()
+
+        summary = loadtest.runLoadTest(["127.0.0.1"], port, None, loadtest.getProfile(2, 0.2), timeout=1)['fleet']
+        self.assertGreater(summary['errors'], 0)
+        self.assertEqual(summary['errorRate'], 1.0)
+        self.assertIsNone(summary['latency'])
+        self.assertNotEqual(summary['failures'], {})
+
+class ValidateSettings(unittest.TestCase):
+
+    def test_request_mix(self):
+        self.assertEqual(loadtest.getRequestMix([]), [("GET", "/", 1.0)])
+        self.assertEqual(loadtest.getRequestMix(["/search?q=django:3", "post /vote:0.5", "/a:b"]),
+                         [("GET", "/search?q=django", 3.0), ("POST", "/vote", 0.5), ("GET", "/a:b", 1.0)])
+        self.assertRaises(Exception, loadtest.getRequestMix, ["index.html"])
+        self.assertRaises(Exception, loadtest.getRequestMix, ["/:0"])
+
+    def test_ramp(self):
+        profile = loadtest.getProfile(ramp="10:50,20:50,10:0")
+        self.assertEqual(profile, [(0.0, 0), (10.0, 50), (30.0, 50), (40.0, 0)])
+        self.assertEqual([loadtest.getConcurrency(profile, elapsed) for elapsed in [0, 5, 10, 25, 35, 40, 50]],
+                         [0, 25, 50, 50, 25, 0, 0])
+
+        # The load is split between workers, with any remainder going to the first
+        #
+        self.assertEqual([loadtest.getConcurrency(profile, 10, (index, 3)) for index in range(3)], [17, 17, 16])
+        self.assertEqual(loadtest.getProfile(4, 60), [(0.0, 4), (60.0, 4)])
+        self.assertRaises(Exception, loadtest.getProfile, ramp="10")
+        self.assertRaises(Exception, loadtest.getProfile, ramp="0:10")
+
+    def test_histogram(self):
+        result = loadtest.newNodeResult()
+        for index in range(1, 1001):
+            loadtest.recordRequest(result, 200, index / 1000.0, 100)
+        self.assertEqual(sum(result['histogram'].values()), 1000)
+
+        # Percentiles are accurate to within a bucket
+        #
+        for (fraction, expected) in [(0.50, 0.5), (0.99, 0.99), (0.999, 0.999)]:
+            value = loadtest.getHistogramPercentile(result['histogram'], fraction, result['maxLatency'])
+            self.assertTrue(expected <= value <= expected * 2 ** (1.0 / loadtest.HISTOGRAM_BUCKETS_PER_DOUBLING))
+        self.assertEqual(loadtest.getHistogramPercentile(result['histogram'], 1.0, result['maxLatency']), 1.0)
+
+        # Histograms from several workers add up
+        #
+        merged = loadtest.mergeNodeResults(loadtest.newNodeResult(), result)
+        loadtest.mergeNodeResults(merged, result)
+        self.assertEqual(merged['requests'], 2000)
+        self.assertEqual(loadtest.getHistogramPercentile(merged['histogram'], 0.5),
+                         loadtest.getHistogramPercentile(result['histogram'], 0.5))
+
+class ValidateReport(unittest.TestCase):
+
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+
+    def getReport(self, latency):
+        result = loadtest.newNodeResult()
+        for index in range(100):
+            loadtest.recordRequest(result, 200 if index else None, latency, 100, "Connection refused")
+        summary = loadtest.getSummary(result, 10.0)
+        return {'nodes': {'10.0.0.1': summary}, 'fleet': summary}
+
+    def test_report(self):
+        report = self.getReport(0.020)
+        lines = loadtest.formatReport(report).split("\n")
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split()[:4], ["10.0.0.1", "100", "10.0", "1"])
+        self.assertTrue(lines[2].startswith("all (1)"))
+
+        fileName = loadtest.saveReport(report)
+        self.assertEqual(os.path.dirname(fileName), config.getStatePath(loadtest.LOADTESTS_DIR))
+        self.assertEqual(loadtest.loadReport(fileName)['fleet']['requests'], 100)
+
+    def test_comparison(self):
+        lines = loadtest.formatComparison(self.getReport(0.020), self.getReport(0.010)).split("\n")
+        self.assertEqual(lines[1].split(), ["Req/s", "10.0", "10.0", "+0.0%"])
+        self.assertEqual(lines[3].split()[-1], "-50.0%")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest, threading, socket, BaseHTTPServer, prober
+
+# A web server that fails its first few requests (as if it were still starting up), then answers normally
+#
+class StartingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if len(self.server.requests) <= self.server.failures:
+            self.send_response(503)
+        else:
+            self.send_response(200)
+        self.end_headers()
+        self.wfile.write("ok")
+
+    def log_message(self, format, *args):
+        pass
+
+# The prober hangs up as soon as it has the status line, so don't report the server's broken pipes
+#
+class QuietHTTPServer(BaseHTTPServer.HTTPServer):
+
+    def handle_error(self, request, clientAddress):
+        pass
+
+class ValidateProber(unittest.TestCase):
+
+    def setUp(self):
+        self.server = QuietHTTPServer(("127.0.0.1", 0), StartingHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.retryDelay = prober.RETRY_INITIAL_DELAY
+        prober.RETRY_INITIAL_DELAY = 0.05
+
+    def tearDown(self):
+        prober.RETRY_INITIAL_DELAY = self.retryDelay
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_ready_node(self):
+        results = prober.probeFleet(["127.0.0.1"], self.port, ["/", "/health"], timeout=2, readyTimeout=5, samples=3)
+        result = results["127.0.0.1"]
+        self.assertTrue(result['ready'])
+        self.assertEqual(result['attempts'], 2)
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(len(result['latencies']), 6)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(self.server.requests[:4], ["/", "/health", "/", "/health"])
+
+    def test_retries_until_ready(self):
+        self.server.failures = 3
+        results = prober.probeFleet(["127.0.0.1"], self.port, timeout=2, readyTimeout=10, samples=1)
+        result = results["127.0.0.1"]
+        self.assertTrue(result['ready'])
+        self.assertEqual(result['attempts'], 4)
+        self.assertEqual(len(result['latencies']), 1)
+
+    def test_node_never_ready(self):
+
+        # Find a port that nothing is listening on
+        #
+        unused = socket.socket()
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+        unused.close()
+
+        results = prober.probeFleet(["127.0.0.1"], port, timeout=0.5, readyTimeout=0.5, samples=1)
+        result = results["127.0.0.1"]
+        self.assertFalse(result['ready'])
+        self.assertTrue(result['attempts'] >= 1)
+        self.assertNotEqual(result['error'], None)
+        self.assertEqual(result['latencies'], [])
+
+    def test_report(self):
+        results = {'10.0.0.1': {'ready': True, 'readyAfter': 2.5, 'attempts': 3, 'status': 200, 'error': None,
+                                'latencies': [0.010, 0.020, 0.030], 'errors': 0},
+                   '10.0.0.2': {'ready': False, 'readyAfter': None, 'attempts': 9, 'status': None,
+                                'error': "Connection refused", 'latencies': [], 'errors': 0}}
+        lines = prober.formatReport(results).split("\n")
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1].split(), ["10.0.0.1", "2.5", "3", "20.0", "30.0", "30.0", "0"])
+        self.assertEqual(lines[2].split()[:3], ["10.0.0.2", "no", "9"])
+        self.assertTrue(lines[2].endswith("Connection refused"))
+        self.assertTrue(lines[3].startswith("all (1/2)"))
+
+    def test_percentiles(self):
+        self.assertEqual(prober.getPercentiles([]), None)
+        self.assertEqual(prober.getPercentiles([float(value) for value in range(20, 0, -1)]), (10.0, 19.0, 20.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest, tempfile, shutil, os, json, profiler
+
+class ValidateProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        profiler.enable(os.path.join(self.tempDir, "spans"))
+
+    def tearDown(self):
+        profiler.spanDir = None
+        shutil.rmtree(self.tempDir)
+
+    def test_disabled_records_nothing(self):
+        profiler.spanDir = None
+        profiler.record("install Puppet", "task", 0.0, 1.0, "10.0.0.1")
+        self.assertEqual(profiler.collect(), [])
+
+    def test_summary(self):
+
+        # 20 hosts take 1..20 seconds each, so p50 is 10, p95 is 19, and the slowest is the last host
+        #
+        for index in range(1, 21):
+            profiler.record("install Puppet", "task", 100.0 + index, float(index), "10.0.0.{0}".format(index))
+        with profiler.span("launch EC2 instances", "launch") as args:
+            args['count'] = 20
+        spans = profiler.collect()
+        self.assertEqual(len(spans), 21)
+
+        rows = profiler.summarize(spans)
+        self.assertEqual([(row['category'], row['name']) for row in rows], [("launch", "launch EC2 instances"), ("task", "install Puppet")])
+        self.assertEqual((rows[1]['count'], rows[1]['p50'], rows[1]['p95'], rows[1]['max'], rows[1]['slowestHost']),
+                         (20, 10.0, 19.0, 20.0, "10.0.0.20"))
+        self.assertIn("install Puppet", profiler.formatSummary(rows))
+
+    def test_trace_has_a_track_per_host(self):
+        profiler.record("launch EC2 instances", "launch", 10.0, 5.0)
+        profiler.record("upload node.pp", "transfer", 12.0, 0.5, "10.0.0.2")
+        profiler.record("upload node.pp", "transfer", 11.0, 0.25, "10.0.0.1")
+        traceFile = os.path.join(self.tempDir, "trace.json")
+        profiler.writeTrace(profiler.collect(remove=True), traceFile)
+        self.assertFalse(profiler.isEnabled())
+
+        with open(traceFile) as inFile:
+            events = json.load(inFile)['traceEvents']
+        tracks = dict((event['args']['name'], event['tid']) for event in events if event['name'] == "thread_name")
+        self.assertEqual(tracks, {'launcher': 0, '10.0.0.1': 1, '10.0.0.2': 2})
+        spans = [(event['tid'], event['ts'], event['dur']) for event in events if event['ph'] == "X"]
+        self.assertEqual(spans, [(0, 0, 5000000), (1, 1000000, 250000), (2, 2000000, 500000)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest, projectsync, os, shutil, tempfile, tarfile
+
+class ProjectSetup(unittest.TestCase):
+
+    # This will create a small project directory to build manifests from
+    #
+    def setUp(self):
+        self.projectDir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.projectDir, 'app'))
+        for (fileName, content) in [('manage.py', 'print "manage"\n'), ('app/views.py', 'views = 1\n')]:
+            with open(os.path.join(self.projectDir, fileName), 'w') as outFile:
+                outFile.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.projectDir)
+
+class ValidateManifest(ProjectSetup):
+
+    def test_buildManifest(self):
+        manifest = projectsync.buildManifest(self.projectDir)
+        self.assertEqual(sorted(manifest), ['app/views.py', 'manage.py'])
+        self.assertEqual(manifest['manage.py']['sha1'], projectsync.hashFile(os.path.join(self.projectDir, 'manage.py')))
+
+    def test_diffManifests_first_sync(self):
+
+        # With no remote manifest, everything is sent and nothing is removed
+        #
+        manifest = projectsync.buildManifest(self.projectDir)
+        self.assertEqual(projectsync.diffManifests(manifest, {}), (['app/views.py', 'manage.py'], []))
+
+    def test_diffManifests_changed_and_stale(self):
+        remoteManifest = projectsync.buildManifest(self.projectDir)
+        with open(os.path.join(self.projectDir, 'app/views.py'), 'w') as outFile:
+            outFile.write('views = 2\n')
+        os.remove(os.path.join(self.projectDir, 'manage.py'))
+        os.chmod(os.path.join(self.projectDir, 'app'), 0700)
+
+        manifest = projectsync.buildManifest(self.projectDir)
+        self.assertEqual(projectsync.diffManifests(manifest, remoteManifest), (['app/views.py'], ['manage.py']))
+        self.assertEqual(projectsync.diffManifests(manifest, manifest), ([], []))
+
+    def test_buildArchive(self):
+
+        # The archive contains only the named files from the source archive, plus the list of stale files
+        #
+        (fd, sourceName) = tempfile.mkstemp(suffix=".tar.gz")
+        os.close(fd)
+        try:
+            with tarfile.open(sourceName, "w:gz") as source:
+                for name in ['manage.py', 'app']:
+                    source.add(os.path.join(self.projectDir, name), arcname=name)
+            archiveName = projectsync.buildArchive(sourceName, ['app/views.py'], ['old.py', 'app/old.py'])
+        finally:
+            os.remove(sourceName)
+        try:
+            with tarfile.open(archiveName) as archive:
+                self.assertEqual(sorted(archive.getnames()), [projectsync.STALE_FILE_NAME, 'app/views.py'])
+                self.assertEqual(archive.extractfile('app/views.py').read(), 'views = 1\n')
+                self.assertEqual(archive.extractfile(projectsync.STALE_FILE_NAME).read().splitlines(), ['old.py', 'app/old.py'])
+        finally:
+            os.remove(archiveName)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest, reconcile, fabricutils, tempfile, shutil, os, subprocess, time
+
+SPEC = {'Count': 3, 'ImageID': "ami-base", 'ImageIDs': ["ami-base", "ami-baked"], 'InstanceType': "t2.micro",
+        'PuppetHash': "p2", 'ReleaseID': "r2", 'Project': "myproj"}
+
+def getNode(number, **state):
+    node = {'id': "i-{0}".format(number), 'ip': "10.0.0.{0}".format(number), 'imageId': "ami-base", 'instanceType': "t2.micro",
+            'launchTime': "2015-01-0{0}T00:00:00.000Z".format(number), 'error': None, 'puppetHash': "p2",
+            'puppetInstalled': True, 'release': "r2", 'serving': True}
+    node.update(state)
+    return node
+
+class ValidatePlan(unittest.TestCase):
+
+    def test_in_sync(self):
+        graph = reconcile.planActions(SPEC, [getNode(1), getNode(2, imageId="ami-baked"), getNode(3)])
+        self.assertEqual(len(graph), 0)
+        self.assertEqual(reconcile.formatPlan(graph), "Nothing to do: the fleet is in the desired state.")
+
+    def test_only_needed_actions(self):
+        nodes = [getNode(1), getNode(2, puppetHash="p1"), getNode(3, puppetHash="p1", release="r1"), getNode(4, serving=False),
+                 getNode(5, instanceType="t2.small")]
+        graph = reconcile.planActions(dict(SPEC, Count=4), nodes)
+        self.assertEqual(sorted((action['id'], action['deps']) for action in graph.actions.values()),
+                         [("deploy:10.0.0.3", ["puppet:10.0.0.3"]), ("puppet:10.0.0.2", []), ("puppet:10.0.0.3", []),
+                          ("restart:10.0.0.2", ["puppet:10.0.0.2"]), ("restart:10.0.0.4", []), ("terminate:10.0.0.5", [])])
+        self.assertEqual(graph.getStage("deploy:10.0.0.3"), 2)
+        self.assertIn("instance type is t2.small", graph.actions["terminate:10.0.0.5"]['reason'])
+
+    def test_replace_after_launch(self):
+
+        # Nodes that can't be fixed in place are only terminated once their replacements are launched
+        #
+        nodes = [getNode(1), getNode(2, imageId="ami-old"), getNode(3, imageId="ami-old")]
+        graph = reconcile.planActions(SPEC, nodes)
+        self.assertEqual(graph.actions["launch"]['count'], 2)
+        self.assertEqual(graph.actions["terminate:10.0.0.2"]['deps'], ["launch"])
+        self.assertEqual(graph.actions["terminate:10.0.0.3"]['deps'], ["launch"])
+        self.assertEqual([line.split()[0] for line in reconcile.formatPlan(graph).splitlines()[1:]], ["1", "2", "2"])
+
+    def test_unknown_state(self):
+
+        # A node whose state couldn't be read is left alone, but counts towards the fleet's size
+        #
+        nodes = [getNode(1), getNode(2, imageId="ami-old"), getNode(3, error="Timed out", puppetHash=None, release=None)]
+        graph = reconcile.planActions(SPEC, nodes)
+        self.assertEqual(sorted(graph.actions), ["launch", "terminate:10.0.0.2"])
+        self.assertEqual(graph.actions["launch"]['count'], 1)
+        self.assertEqual(sorted(reconcile.planActions(dict(SPEC, Count=1), nodes).actions),
+                         ["terminate:10.0.0.1", "terminate:10.0.0.2"])
+
+    def test_unknown_state_surplus(self):
+
+        # Unknown nodes count towards the surplus too, so healthy nodes are terminated in their place
+        #
+        nodes = [getNode(index) for index in range(1, 6)] + [getNode(index, error="Timed out") for index in range(6, 8)]
+        graph = reconcile.planActions(dict(SPEC, Count=5), nodes)
+        self.assertEqual(len(graph), 2)
+        self.assertEqual(set(action['kind'] for action in graph.actions.values()), set([reconcile.TERMINATE]))
+        self.assertFalse([action for action in graph.actions.values() if action['host'] in ["10.0.0.6", "10.0.0.7"]])
+
+    def test_surplus(self):
+
+        # The nodes needing the most work are the ones terminated
+        #
+        nodes = [getNode(1, release="r1"), getNode(2), getNode(3), getNode(4), getNode(5, serving=False)]
+        graph = reconcile.planActions(SPEC, nodes)
+        self.assertEqual(sorted(graph.actions), ["terminate:10.0.0.1", "terminate:10.0.0.5"])
+        self.assertEqual(len(reconcile.planActions(dict(SPEC, Count=0), nodes)), 5)
+
+class ValidateRun(unittest.TestCase):
+
+    # Runners that take a little time, failing the actions on failedHosts
+    #
+    def getRunners(self, failedHosts=[]):
+        def runner(actions):
+            time.sleep(0.2)
+            return dict((action['id'], "failed" if action['host'] in failedHosts else None) for action in actions)
+        return dict((kind, runner) for kind in reconcile.ACTION_KINDS)
+
+    def test_dependencies_and_concurrency(self):
+        graph = reconcile.ActionGraph()
+        launch = graph.add(reconcile.LAUNCH, count=2)
+        puppet = graph.add(reconcile.PUPPET, "10.0.0.1")
+        deploy = graph.add(reconcile.DEPLOY, "10.0.0.1", deps=[puppet])
+        terminate = graph.add(reconcile.TERMINATE, "10.0.0.2", deps=[launch])
+        reported = []
+        self.assertTrue(graph.run(self.getRunners(), report=lambda action: reported.append(action['id'])))
+        self.assertEqual(sorted(reported), sorted([launch, puppet, deploy, terminate]))
+
+        # Independent actions run at the same time, and dependent ones after their dependencies
+        #
+        actions = graph.actions
+        self.assertLess(abs(actions[launch]['start'] - actions[puppet]['start']), 0.15)
+        self.assertGreaterEqual(actions[deploy]['start'], actions[puppet]['end'])
+        self.assertGreaterEqual(actions[terminate]['start'], actions[launch]['end'])
+        self.assertLess(actions[terminate]['end'] - actions[launch]['start'], 0.8)
+
+    def test_max_unavailable(self):
+        graph = reconcile.ActionGraph()
+        for number in range(1, 4):
+            graph.add(reconcile.RESTART, "10.0.0.{0}".format(number))
+        graph.add(reconcile.PUPPET, "10.0.0.4")
+        self.assertTrue(graph.run(self.getRunners(), maxUnavailable=2))
+        starts = sorted(action['start'] for action in graph.actions.values() if action['kind'] == reconcile.RESTART)
+        self.assertLess(starts[1] - starts[0], 0.15)
+        self.assertGreaterEqual(starts[2] - starts[0], 0.2)
+
+    def test_failure_skips_dependents(self):
+        graph = reconcile.ActionGraph()
+        puppet = graph.add(reconcile.PUPPET, "10.0.0.1")
+        deploy = graph.add(reconcile.DEPLOY, "10.0.0.1", deps=[puppet])
+        other = graph.add(reconcile.PUPPET, "10.0.0.2")
+        self.assertFalse(graph.run(self.getRunners(failedHosts=["10.0.0.1"])))
+        self.assertEqual([graph.actions[actionId]['state'] for actionId in [puppet, deploy, other]],
+                         ["failed", "skipped", "succeeded"])
+        self.assertRaises(Exception, graph.add, reconcile.RESTART, "10.0.0.3", deps=["restart:10.0.0.9"])
+
+class ValidateReadState(unittest.TestCase):
+
+    # Read the nodes' states with a stand-in for fabricutils.executeOnHosts, whose reads fail on the hosts in
+    # self.down (a number of times for each, or always)
+    #
+    def setUp(self):
+        self.savedExecute = fabricutils.executeOnHosts
+        fabricutils.executeOnHosts = self.executeOnHosts
+        self.calls = []
+        self.down = {}
+
+    def tearDown(self):
+        fabricutils.executeOnHosts = self.savedExecute
+
+    def executeOnHosts(self, task, keyFile, ipList, projectName, **kwargs):
+        self.calls.append(ipList)
+        results = []
+        for ip in ipList:
+            result = {'host': ip, 'succeeded': False, 'exitStatus': None, 'outputTail': "", 'value': None, 'duration': 0.0}
+            try:
+                if self.down.get(ip, 0) != 0:
+                    self.down[ip] -= 1
+                    raise Exception("Timed out")
+                result['value'] = reconcile.parseNodeState("{0} release=releases/r2\n".format(reconcile.STATE_MARKER))
+                result['succeeded'] = True
+            except Exception as mesg:
+                result['outputTail'] = str(mesg)
+            results.append(result)
+        return results
+
+    def test_read_fails(self):
+        nodes = [getNode(number, puppetHash=None, release=None) for number in range(1, 4)]
+        self.down = {"10.0.0.2": -1, "10.0.0.3": 1}
+        reconcile.readNodeStates("key.pem", nodes, "myproj")
+
+        # A failed read is retried, and a node that still can't be read is left alone
+        #
+        self.assertEqual(self.calls, [["10.0.0.1", "10.0.0.2", "10.0.0.3"], ["10.0.0.2", "10.0.0.3"]])
+        self.assertEqual([node['release'] for node in nodes], ["r2", None, "r2"])
+        self.assertEqual([node['error'] is None for node in nodes], [True, False, True])
+        self.assertIn("Timed out", nodes[1]['error'])
+        graph = reconcile.planActions(SPEC, nodes)
+        self.assertFalse(any(action['host'] == "10.0.0.2" for action in graph.actions.values()))
+        self.assertNotIn("launch", graph.actions)
+
+class ValidateNodeState(unittest.TestCase):
+
+    # Run the node state command in a directory standing in for the node's home directory
+    #
+    def setUp(self):
+        self.homeDir = tempfile.mkdtemp()
+        self.markerFile = os.path.join(self.homeDir, "puppet-config.sha1")
+        self.pidFile = os.path.join(self.homeDir, "server.pid")
+
+    def tearDown(self):
+        shutil.rmtree(self.homeDir)
+
+    def getState(self):
+        command = reconcile.getNodeStateCommand("myproj", self.markerFile, self.pidFile)
+        return reconcile.parseNodeState(subprocess.check_output(["bash", "-c", command], cwd=self.homeDir))
+
+    def test_new_node(self):
+        state = self.getState()
+        self.assertEqual((state['puppetHash'], state['release'], state['serving']), (None, None, False))
+
+    def test_provisioned_node(self):
+        with open(self.markerFile, "w") as outFile:
+            outFile.write("abc123\n")
+        os.makedirs(os.path.join(self.homeDir, "releases", "r2"))
+        os.symlink("releases/r2", os.path.join(self.homeDir, "myproj"))
+        with open(self.pidFile, "w") as outFile:
+            outFile.write("{0}\n".format(os.getpid()))
+        state = self.getState()
+        self.assertEqual((state['puppetHash'], state['release'], state['serving']), ("abc123", "r2", True))
+
+if __name__ == '__main__':
+    unittest.main()
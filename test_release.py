@@ -0,0 +1,209 @@
+import unittest, release, projectsync, config, tempfile, shutil, os, tarfile, subprocess, json
+
+class ReleaseSetup(unittest.TestCase):
+
+    # This will create a small project directory to build releases from, and a separate state directory
+    #
+    def setUp(self):
+        self.savedStateDir = config.STATE_DIR
+        config.STATE_DIR = tempfile.mkdtemp()
+        self.tempDir = tempfile.mkdtemp()
+        self.projectDir = os.path.join(self.tempDir, "myproj")
+        os.makedirs(os.path.join(self.projectDir, "myproj"))
+        for (fileName, content) in [('manage.py', 'print "manage"\n'), ('myproj/__init__.py', ''),
+                                    ('myproj/views.py', 'views = 1\n')]:
+            with open(os.path.join(self.projectDir, fileName), 'w') as outFile:
+                outFile.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(config.STATE_DIR)
+        config.STATE_DIR = self.savedStateDir
+        shutil.rmtree(self.tempDir)
+
+class ValidateBuild(ReleaseSetup):
+
+    def test_bundle_contents(self):
+        (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+        self.assertEqual(len(releaseId), release.RELEASE_ID_LENGTH)
+        with tarfile.open(bundlePath) as archive:
+            names = archive.getnames()
+            self.assertEqual(archive.extractfile(release.RELEASE_FILE_NAME).read().strip(), releaseId)
+        for name in ['manage.py', 'myproj/views.py', 'myproj/views.pyc', release.RELEASE_FILE_NAME, projectsync.MANIFEST_FILE_NAME]:
+            self.assertIn(name, names)
+
+    def test_content_addressed(self):
+        (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+        modifiedTime = os.path.getmtime(bundlePath)
+
+        # Compiled files left by running the project locally don't change the release
+        #
+        open(os.path.join(self.projectDir, 'myproj', 'views.pyc'), 'w').close()
+        os.utime(bundlePath, (modifiedTime - 10, modifiedTime - 10))
+        self.assertEqual(release.buildRelease(self.projectDir), (releaseId, bundlePath))
+        self.assertGreater(os.path.getmtime(bundlePath), modifiedTime - 10)
+
+        with open(os.path.join(self.projectDir, 'myproj', 'views.py'), 'w') as outFile:
+            outFile.write('views = 2\n')
+        self.assertNotEqual(release.buildRelease(self.projectDir)[0], releaseId)
+
+    def test_local_database_left_out(self):
+
+        # A database made by running the project locally is neither in the bundle nor part of the release ID
+        #
+        (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+        for name in ['db.sqlite3', 'db.sqlite3.migrated']:
+            with open(os.path.join(self.projectDir, name), 'w') as outFile:
+                outFile.write('local data\n')
+        self.assertEqual(release.buildRelease(self.projectDir)[0], releaseId)
+        os.remove(bundlePath)
+        with tarfile.open(release.buildRelease(self.projectDir)[1]) as archive:
+            self.assertFalse([name for name in archive.getnames() if 'sqlite3' in name])
+
+    def test_compile_error(self):
+        with open(os.path.join(self.projectDir, 'myproj', 'views.py'), 'w') as outFile:
+            outFile.write('def views(:\n')
+        self.assertRaises(Exception, release.buildRelease, self.projectDir)
+        self.assertEqual(os.listdir(config.getStatePath(release.RELEASES_DIR)), [])
+
+class ValidateInstall(ReleaseSetup):
+
+    # Run an install command in a directory standing in for the node's home directory
+    #
+    def install(self, releaseId, bundlePath=None, sharedFiles=[], baseRelease=None):
+        homeDir = os.path.join(self.tempDir, "home")
+        if not os.path.isdir(homeDir):
+            os.mkdir(homeDir)
+        remoteArchive = None
+        if bundlePath is not None:
+            remoteArchive = os.path.join(self.tempDir, "upload.tar.gz")
+            shutil.copy(bundlePath, remoteArchive)
+        command = release.getInstallCommand(releaseId, "myproj", remoteArchive, sharedFiles, baseRelease)
+        output = subprocess.check_output(["bash", "-c", command], cwd=homeDir)
+        if remoteArchive is not None:
+            self.assertFalse(os.path.exists(remoteArchive))
+        return (homeDir, output)
+
+    def test_install_and_switch(self):
+        (firstId, firstBundle) = release.buildRelease(self.projectDir)
+        (homeDir, output) = self.install(firstId)
+        self.assertEqual(output.split(), [release.CURRENT_MARKER])
+        self.assertFalse(os.path.exists(os.path.join(homeDir, "myproj")))
+
+        self.install(firstId, firstBundle)
+        self.assertEqual(os.readlink(os.path.join(homeDir, "myproj")), "releases/" + firstId)
+        self.assertTrue(os.path.isfile(os.path.join(homeDir, "myproj", "myproj", "views.pyc")))
+        self.assertEqual(self.install(firstId)[1].split(), [release.PRESENT_MARKER, "releases/" + firstId])
+
+        with open(os.path.join(self.projectDir, 'manage.py'), 'w') as outFile:
+            outFile.write('print "manage 2"\n')
+        (secondId, secondBundle) = release.buildRelease(self.projectDir)
+        self.install(secondId, secondBundle)
+        self.assertEqual(os.readlink(os.path.join(homeDir, "myproj")), "releases/" + secondId)
+
+        # Switching back to a release the node already has doesn't need the bundle
+        #
+        self.assertEqual(self.install(firstId)[1].split(), [release.PRESENT_MARKER, "releases/" + secondId])
+        self.assertEqual(os.readlink(os.path.join(homeDir, "myproj")), "releases/" + firstId)
+
+    def test_install_differences(self):
+        (firstId, firstBundle) = release.buildRelease(self.projectDir)
+        (homeDir, output) = self.install(firstId, firstBundle)
+
+        # A node without the release reports the one it's running, and that release's manifest
+        #
+        os.remove(os.path.join(self.projectDir, 'manage.py'))
+        with open(os.path.join(self.projectDir, 'myproj', 'views.py'), 'w') as outFile:
+            outFile.write('views = 2\n')
+        (secondId, secondBundle) = release.buildRelease(self.projectDir)
+        lines = self.install(secondId)[1].splitlines()
+        self.assertEqual(lines[0].split(), [release.CURRENT_MARKER, "releases/" + firstId])
+        self.assertEqual(json.loads(lines[1]), projectsync.buildManifest(os.path.join(homeDir, "myproj")))
+
+        # Only the changed files are sent, and the new release is the same as if the whole bundle had been
+        #
+        with tarfile.open(secondBundle) as archive:
+            manifest = json.load(archive.extractfile(projectsync.MANIFEST_FILE_NAME))
+        (changedFiles, staleFiles) = projectsync.diffManifests(manifest, json.loads(lines[1]))
+        self.assertEqual(staleFiles, ['manage.py', 'manage.pyc'])
+        self.assertNotIn('myproj/__init__.py', changedFiles)
+        archiveName = projectsync.buildArchive(secondBundle, changedFiles + [projectsync.MANIFEST_FILE_NAME], staleFiles)
+        try:
+            self.install(secondId, archiveName, baseRelease="releases/" + firstId)
+        finally:
+            os.remove(archiveName)
+        self.assertEqual(os.readlink(os.path.join(homeDir, "myproj")), "releases/" + secondId)
+        self.assertEqual(projectsync.buildManifest(os.path.join(homeDir, "myproj")), manifest)
+        self.assertFalse(os.path.exists(os.path.join(homeDir, "myproj", projectsync.STALE_FILE_NAME)))
+        self.assertTrue(os.path.isfile(os.path.join(homeDir, "releases", firstId, "manage.py")))
+
+    def readDatabase(self, homeDir):
+        with open(os.path.join(homeDir, "myproj", "db.sqlite3")) as inFile:
+            return inFile.read()
+
+    def test_shared_database(self):
+
+        # The database written through one release is the one every other release sees, including after a
+        # rollback to a release that still has a stale database of its own (from an older deploy)
+        #
+        sharedFiles = ["db.sqlite3", "db.sqlite3.migrated"]
+        (firstId, firstBundle) = release.buildRelease(self.projectDir)
+        (homeDir, output) = self.install(firstId, firstBundle, sharedFiles)
+        with open(os.path.join(homeDir, "myproj", "db.sqlite3"), "w") as outFile:
+            outFile.write("first")
+        self.assertEqual(os.readlink(os.path.join(homeDir, "releases", firstId, "db.sqlite3")),
+                         "../../" + release.getSharedPath("myproj", "db.sqlite3"))
+
+        with open(os.path.join(self.projectDir, 'manage.py'), 'w') as outFile:
+            outFile.write('print "manage 2"\n')
+        (secondId, secondBundle) = release.buildRelease(self.projectDir)
+        self.install(secondId, secondBundle, sharedFiles)
+        self.assertEqual(self.readDatabase(homeDir), "first")
+        with open(os.path.join(homeDir, "myproj", "db.sqlite3"), "a") as outFile:
+            outFile.write(" second")
+
+        stale = os.path.join(homeDir, "releases", firstId, "db.sqlite3")
+        os.remove(stale)
+        with open(stale, "w") as outFile:
+            outFile.write("stale")
+        self.install(firstId, sharedFiles=sharedFiles)
+        self.assertEqual(os.readlink(os.path.join(homeDir, "myproj")), "releases/" + firstId)
+        self.assertEqual(self.readDatabase(homeDir), "first second")
+
+    def test_unpack_existing_release(self):
+
+        # A bundle for a release the node already has (e.g. distributed by fanout.py) isn't unpacked over it
+        #
+        (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+        (homeDir, output) = self.install(releaseId, bundlePath)
+        open(os.path.join(homeDir, "myproj", "db.sqlite3"), "w").close()
+        self.install(releaseId, bundlePath)
+        self.assertTrue(os.path.isfile(os.path.join(homeDir, "releases", releaseId, "db.sqlite3")))
+
+    def test_replaces_unversioned_project(self):
+
+        # The database of a project deployed as a plain directory is moved into the shared directory
+        #
+        homeDir = os.path.join(self.tempDir, "home")
+        os.makedirs(os.path.join(homeDir, "myproj"))
+        with open(os.path.join(homeDir, "myproj", "db.sqlite3"), "w") as outFile:
+            outFile.write("data")
+
+        (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+        self.install(releaseId, bundlePath, ["db.sqlite3"])
+        self.assertTrue(os.path.islink(os.path.join(homeDir, "myproj")))
+        self.assertEqual(self.readDatabase(homeDir), "data")
+        self.assertTrue(os.path.isfile(os.path.join(homeDir, release.getSharedPath("myproj", "db.sqlite3"))))
+        self.assertEqual(len([name for name in os.listdir(os.path.join(homeDir, "releases")) if name.startswith("unversioned-")]), 1)
+
+    def test_prune_old_releases(self):
+        for version in range(release.KEEP_RELEASES + 2):
+            with open(os.path.join(self.projectDir, 'myproj', 'views.py'), 'w') as outFile:
+                outFile.write('views = {0}\n'.format(version))
+            (releaseId, bundlePath) = release.buildRelease(self.projectDir)
+            (homeDir, output) = self.install(releaseId, bundlePath)
+        releases = os.listdir(os.path.join(homeDir, "releases"))
+        self.assertEqual(len(releases), release.KEEP_RELEASES)
+        self.assertIn(releaseId, releases)
+
+if __name__ == '__main__':
+    unittest.main()
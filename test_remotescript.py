@@ -0,0 +1,40 @@
+import unittest, remotescript, subprocess
+
+class ValidateRemoteScript(unittest.TestCase):
+
+    # This will run a compiled script locally (as the remote node would), returning (exit status, output)
+    #
+    def runScript(self, steps):
+        process = subprocess.Popen(["bash", "-s"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate(remotescript.compileScript(steps))[0]
+        return (process.returncode, output)
+
+    def test_all_steps_succeed(self):
+        steps = [remotescript.step("first", "echo one"), remotescript.step("second", "true", cwd="/")]
+        (status, output) = self.runScript(steps)
+        self.assertEqual(status, 0)
+        results = remotescript.parseStepResults(steps, output)
+        self.assertEqual([(r['name'], r['exitStatus']) for r in results], [("first", 0), ("second", 0)])
+        self.assertTrue(all(r['duration'] >= 0 for r in results))
+
+    def test_stops_at_first_failure(self):
+
+        # The failing step's exit status is reported, and later steps aren't run
+        #
+        steps = [remotescript.step("first", "true"), remotescript.step("second", "exit 3"), remotescript.step("third", "true")]
+        (status, output) = self.runScript(steps)
+        self.assertEqual(status, 3)
+        results = remotescript.parseStepResults(steps, output)
+        self.assertEqual([(r['name'], r['exitStatus']) for r in results], [("first", 0), ("second", 3)])
+
+    def test_sudo_once_when_all_steps_need_root(self):
+        rootSteps = [remotescript.step("first", "yum install a", sudo=True), remotescript.step("second", "yum install b", sudo=True)]
+        self.assertTrue(remotescript.runsAsRoot(rootSteps))
+        self.assertNotIn("sudo", remotescript.compileScript(rootSteps))
+
+        mixedSteps = rootSteps + [remotescript.step("third", "ls")]
+        self.assertFalse(remotescript.runsAsRoot(mixedSteps))
+        self.assertEqual(remotescript.compileScript(mixedSteps).count("sudo bash -c"), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest, showstate
+
+# Minimal stand-ins for the boto objects used by showstate.iterEC2Instances
+#
+class FakeInstance(object):
+    def __init__(self, instanceId):
+        self.id = instanceId
+        self.ip_address = None
+        self.private_ip_address = None
+        self.state = "running"
+        self.instance_type = "t2.micro"
+        self.image_id = "ami-c7d092f7"
+        self.launch_time = "2015-01-01T00:00:00.000Z"
+        self.tags = {}
+
+class FakeReservation(object):
+    def __init__(self, reservationId, instanceIds):
+        self.id = reservationId
+        self.instances = [FakeInstance(i) for i in instanceIds]
+
+class FakeResultSet(list):
+    def __init__(self, reservations, nextToken):
+        list.__init__(self, reservations)
+        self.next_token = nextToken
+
+class FakeEC2(object):
+
+    # pages is the list of reservation lists returned, one per request
+    #
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def get_all_reservations(self, filters=None, max_results=None, next_token=None):
+        self.requests.append((filters, next_token))
+        page = int(next_token or 0)
+        nextToken = str(page + 1) if page + 1 < len(self.pages) else None
+        return FakeResultSet(self.pages[page], nextToken)
+
+class ValidateShowState(unittest.TestCase):
+
+    def test_buildFilters(self):
+        parsedArgs = showstate.create_parser().parse_args(['--tag', 'Name=web', '--tag', 'Name=db', '--state', 'running',
+                                                            '--instance-type', 't2.micro', '--reservation-id', 'r-1'])
+        self.assertEqual(showstate.buildFilters(parsedArgs), {'tag:Name': ['web', 'db'], 'instance-state-name': ['running'],
+                                                              'instance-type': ['t2.micro'], 'reservation-id': ['r-1']})
+
+    def test_buildFilters_invalid_tag(self):
+        parsedArgs = showstate.create_parser().parse_args(['--tag', 'Name'])
+        with self.assertRaisesRegexp(Exception, "Invalid tag filter"):
+            showstate.buildFilters(parsedArgs)
+
+    def test_iterEC2Instances_pages(self):
+
+        # Every page is fetched (passing along the next token), and instances are yielded lazily
+        #
+        ec2 = FakeEC2([[FakeReservation('r-1', ['i-1', 'i-2'])], [FakeReservation('r-2', ['i-3'])]])
+        instances = showstate.iterEC2Instances(ec2, {'instance-state-name': ['running']})
+        first = next(instances)
+        self.assertEqual((first['id'], first['reservation_id']), ('i-1', 'r-1'))
+        self.assertEqual(len(ec2.requests), 1)
+        self.assertEqual([i['id'] for i in instances], ['i-2', 'i-3'])
+        self.assertEqual(ec2.requests, [({'instance-state-name': ['running']}, None), ({'instance-state-name': ['running']}, '1')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest, warmpool, boto.exception
+
+class FakeInstance(object):
+    def __init__(self, instanceId, state, tags, instanceType="t2.micro"):
+        self.id = instanceId
+        self.state = state
+        self.tags = tags
+        self.instance_type = instanceType
+
+# A stand-in for EC2, which applies the filters used by the warm pool, and records the requests made (failing
+# the requests named in failures)
+#
+class FakePoolEC2(object):
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.requests = []
+        self.failures = []
+
+    def record(self, *request):
+        self.requests.append(request)
+        if request[0] in self.failures:
+            raise boto.exception.EC2ResponseError(503, "Unavailable", "")
+
+    def get_only_instances(self, filters=None):
+        matches = []
+        for instance in self.instances:
+            if instance.state not in filters['instance-state-name']:
+                continue
+            if 'tag-key' in filters and filters['tag-key'] not in instance.tags:
+                continue
+            if 'tag:' + warmpool.POOL_TAG in filters and instance.tags.get(warmpool.POOL_TAG) != filters['tag:' + warmpool.POOL_TAG]:
+                continue
+            if 'instance-type' in filters and instance.instance_type != filters['instance-type']:
+                continue
+            matches.append(instance)
+        return matches
+
+    def delete_tags(self, instanceIds, tags):
+        self.record("delete_tags", instanceIds, sorted(tags))
+
+    def create_tags(self, instanceIds, tags):
+        self.record("create_tags", instanceIds, tags)
+
+    def start_instances(self, instance_ids=None):
+        self.record("start_instances", instance_ids)
+
+    def stop_instances(self, instance_ids=None):
+        self.record("stop_instances", instance_ids)
+
+class ValidateWarmPool(unittest.TestCase):
+
+    def setUp(self):
+        ready = lambda provisioningHash: {warmpool.POOL_TAG: provisioningHash, warmpool.POOL_STATE_TAG: "ready"}
+        self.ec2 = FakePoolEC2([FakeInstance("i-1", "stopped", ready("abc")),
+                                FakeInstance("i-2", "stopped", ready("abc")),
+                                FakeInstance("i-3", "stopped", ready("abc")),
+                                FakeInstance("i-4", "running", {warmpool.POOL_TAG: "abc", warmpool.POOL_STATE_TAG: "provisioning"}),
+                                FakeInstance("i-5", "stopped", ready("old")),
+                                FakeInstance("i-6", "stopped", ready("abc"), "m4.large"),
+                                FakeInstance("i-7", "running", {"Name": "web"})])
+
+    def test_find_pool_instances(self):
+        self.assertEqual([i.id for i in warmpool.findPoolInstances(self.ec2)], ["i-1", "i-2", "i-3", "i-4", "i-5", "i-6"])
+        self.assertEqual([i.id for i in warmpool.findPoolInstances(self.ec2, "abc", "t2.micro")], ["i-1", "i-2", "i-3", "i-4"])
+
+    def test_claim_some(self):
+        instanceIds = warmpool.claimInstances(self.ec2, "abc", "t2.micro", 2, tags={"LinkOverflow:LaunchId": "launch-1"})
+        self.assertEqual(instanceIds, ["i-1", "i-2"])
+        self.assertEqual(self.ec2.requests, [("start_instances", ["i-1", "i-2"]),
+                                             ("create_tags", ["i-1", "i-2"], {"LinkOverflow:LaunchId": "launch-1"}),
+                                             ("delete_tags", ["i-1", "i-2"], [warmpool.POOL_TAG, warmpool.POOL_STATE_TAG])])
+
+    def test_claim_start_fails(self):
+
+        # members that can't be started keep their pool tags, so they're still in the pool
+        #
+        self.ec2.failures = ["start_instances"]
+        self.assertRaises(Exception, warmpool.claimInstances, self.ec2, "abc", "t2.micro", 2, tags={"LinkOverflow:LaunchId": "launch-1"})
+        self.assertEqual(self.ec2.requests, [("start_instances", ["i-1", "i-2"])])
+
+    def test_claim_tagging_fails(self):
+
+        # members that can't be tagged are stopped again, returning them to the pool
+        #
+        self.ec2.failures = ["create_tags"]
+        self.assertRaises(Exception, warmpool.claimInstances, self.ec2, "abc", "t2.micro", 2, tags={"LinkOverflow:LaunchId": "launch-1"})
+        self.assertEqual([request[0] for request in self.ec2.requests], ["start_instances", "create_tags", "stop_instances"])
+
+    def test_claim_more_than_pool(self):
+
+        # only the ready, stopped, members with the same hash and instance type can be claimed
+        #
+        self.assertEqual(warmpool.claimInstances(self.ec2, "abc", "t2.micro", 10), ["i-1", "i-2", "i-3"])
+
+    def test_claim_empty_pool(self):
+        self.assertEqual(warmpool.claimInstances(self.ec2, "xyz", "t2.micro", 3), [])
+        self.assertEqual(self.ec2.requests, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python2.7
+#
+# "warmpool.py" maintains a pool of instances that have already been provisioned (Puppet applied, and the
+# Django project deployed) and then stopped. Starting a stopped instance takes seconds, rather than the
+# minutes it takes to boot and provision a new one, so launch.py claims instances from the pool first, and
+# only launches new instances for the remainder. It then refills the pool in the background.
+#
+# Pool members are tagged with the provisioning hash (see config.getProvisioningHash), so an instance is only
+# ever claimed by a launch with the same Puppet configuration, Puppet URL, base image and instance type.
+# Members with a different hash (i.e. provisioned for an older configuration) are stale, and are terminated
+# when the pool is refilled or drained.
+#
+#   warmpool.py [--aws-settings <file>] [--instance-config <file>] [--size <n>] [--django-proj <dir>]
+#               (status | refill | drain)
+#
+import sys, os, argparse, fcntl, subprocess
+
+# local modules (the modules that use boto and Fabric are slow to import, so they're imported where they're used)
+import config, images
+
+# The tags on each pool member: its provisioning hash, and its state (provisioning, or ready to be claimed).
+POOL_TAG = "LinkOverflow:WarmPool"
+POOL_STATE_TAG = "LinkOverflow:WarmPoolState"
+
+# The provisioning phases (see pipeline.getPhases) that pool members have already completed when they're
+# claimed. The Django project is also deployed, but the launch still deploys it (which only sends the
+# release if it has changed since the member was provisioned), then runs it.
+PROVISIONED_PHASES = ["install Puppet", "apply Puppet configuration"]
+POOL_PHASES = PROVISIONED_PHASES + ["deploy Django project"]
+
+# The names of the lock file (so only one refill runs at a time) and the log of background refills, within
+# our local state directory.
+REFILL_LOCK_NAME = "warmpool.lock"
+REFILL_LOG_NAME = "warmpool.log"
+
+#
+# Return the boto instances in the pool (i.e. not yet terminated) for the given provisioning hash and
+# instance type, or all the pool members (of any configuration) if provisioningHash is None.
+#
+def findPoolInstances(ec2, provisioningHash=None, instanceType=None):
+    '''Return the list of warm pool members.'''
+    import boto.exception
+    filters = {'instance-state-name': ["pending", "running", "stopping", "stopped"]}
+    if provisioningHash is not None:
+        filters['tag:' + POOL_TAG] = provisioningHash
+    else:
+        filters['tag-key'] = POOL_TAG
+    if instanceType is not None:
+        filters['instance-type'] = instanceType
+    try:
+        return ec2.get_only_instances(filters=filters)
+    except boto.exception.EC2ResponseError as mesg:
+        raise Exception("Unable to query warm pool instances.\nDetailed message from server was {0}".format(mesg))
+
+#
+# Claim up to count members from the pool (for the given provisioning hash and instance type), start them,
+# and replace their pool tags with tags (e.g. the launch ID). Return the list of claimed instance IDs, which
+# may be shorter than count (or empty) if the pool doesn't have enough members.
+#
+# The pool tags are only removed once the members have started, so a member that can't be started (or
+# tagged) stays in the pool, rather than being left untagged where nothing will find it. If tagging fails
+# after the start, the members are stopped again, returning them to the pool.
+#
+# EC2 has no atomic way to claim an instance, so two launches claiming at the same moment could both pick the
+# same member. Starting an instance that's already starting is harmless, but both launches would then count
+# it, so launches sharing a pool shouldn't be run at the same time.
+#
+def claimInstances(ec2, provisioningHash, instanceType, count, tags=None):
+    '''Start up to count stopped pool members, and return their instance IDs.'''
+    import boto.exception
+    members = [instance for instance in findPoolInstances(ec2, provisioningHash, instanceType)
+               if instance.state == "stopped" and instance.tags.get(POOL_STATE_TAG) == "ready"]
+    instanceIds = sorted(instance.id for instance in members)[:count]
+    if len(instanceIds) == 0:
+        return []
+    try:
+        ec2.start_instances(instance_ids=instanceIds)
+    except boto.exception.EC2ResponseError as mesg:
+        raise Exception("Unable to start warm pool instances.\nDetailed message from server was {0}".format(mesg))
+    try:
+        if tags:
+            ec2.create_tags(instanceIds, tags)
+        ec2.delete_tags(instanceIds, {POOL_TAG: None, POOL_STATE_TAG: None})
+    except boto.exception.EC2ResponseError as mesg:
+        try:
+            ec2.stop_instances(instance_ids=instanceIds)
+        except boto.exception.EC2ResponseError:
+            pass
+        raise Exception("Unable to claim warm pool instances.\nDetailed message from server was {0}".format(mesg))
+    return instanceIds
+
+#
+# Bring the pool (for the current configuration) up to poolSize members: launch new instances, provision
+# them (with Puppet, unless there's a baked image, then deploying djangoProj if it's provided) and stop them.
+# Stale members (provisioned for another configuration) are terminated first. Instances that fail to
+# provision are terminated. Return the number of members added.
+#
+def refillPool(awsConfigDict, instanceConfigDict, poolSize, djangoProj=None):
+    '''Top up the warm pool to poolSize members, returning the number of members added.'''
+    import boto.exception, aws, pipeline, fabricutils
+
+    ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'],
+                         awsConfigDict['EC2_SecretAccessKey'],
+                         awsConfigDict['EC2_AvailabilityZone'],
+                         awsConfigDict['EC2_Endpoint'])
+    provisioningHash = config.getProvisioningHash(instanceConfigDict)
+    instanceType = instanceConfigDict['EC2_InstanceType']
+
+    members = findPoolInstances(ec2)
+    stale = [instance.id for instance in members
+             if instance.tags.get(POOL_TAG) != provisioningHash or instance.instance_type != instanceType]
+    if len(stale) != 0:
+        print "Terminating", len(stale), "stale warm pool instances:", " ".join(sorted(stale))
+        aws.terminateInstances(ec2, stale)
+    shortfall = poolSize - (len(members) - len(stale))
+    if shortfall <= 0:
+        return 0
+
+    #
+    # Launch the new members from the baked image, if there is one (so Puppet is already applied).
+    #
+    imageId = images.lookupImage(provisioningHash, awsConfigDict['EC2_AvailabilityZone'])
+    skipPuppet = imageId is not None and imageId != instanceConfigDict['EC2_ImageID']
+    if not skipPuppet:
+        imageId = instanceConfigDict['EC2_ImageID']
+    phases = [phase for phase in pipeline.getPhases(instanceConfigDict, djangoProj, skipPuppet)
+              if phase[0] in POOL_PHASES and (djangoProj is not None or phase[0] in PROVISIONED_PHASES)]
+
+    print "Adding", shortfall, "instances to the warm pool"
+    instances = aws.startEC2Instances(ec2, shortfall, imageId, instanceType, awsConfigDict['EC2_SSHKeyPair'],
+                                      chunkSize=instanceConfigDict['Fleet_ChunkSize'],
+                                      bucket=aws.TokenBucket(instanceConfigDict['Fleet_RequestRate']),
+                                      tags={POOL_TAG: provisioningHash, POOL_STATE_TAG: "provisioning"})
+    ready = dict((ipAddress, instance.id) for (instance, ipAddress) in aws.waitForEC2Instances(ec2, instances))
+    failed = [instance.id for instance in instances if instance.id not in ready.values()]
+
+    ipList = sorted(ready)
+    keyFile = awsConfigDict['EC2_SSHKeyPairFile']
+    for (phaseName, phase, argument) in phases:
+        if len(ipList) == 0:
+            break
+        for failure in fabricutils.getFailures(phase(keyFile, argument, ipList)):
+            print >>sys.stderr, "Error: failed to", phaseName, "on", fabricutils.formatFailure(failure)
+            ipList.remove(failure['host'])
+            failed.append(ready[failure['host']])
+
+    if len(failed) != 0:
+        aws.terminateInstances(ec2, failed)
+    provisioned = [ready[ipAddress] for ipAddress in ipList]
+    if len(provisioned) != 0:
+        try:
+            ec2.stop_instances(instance_ids=provisioned)
+            ec2.create_tags(provisioned, {POOL_STATE_TAG: "ready"})
+        except boto.exception.EC2ResponseError as mesg:
+            raise Exception("Unable to stop warm pool instances.\nDetailed message from server was {0}".format(mesg))
+    return len(provisioned)
+
+#
+# Refill the pool, unless another refill is already running (in which case, return None). This is what
+# "warmpool.py refill" runs, so that concurrent background refills don't overfill the pool.
+#
+def refillPoolOnce(awsConfigDict, instanceConfigDict, poolSize, djangoProj=None):
+    '''Refill the warm pool while holding the refill lock, returning the number of members added (or None).'''
+    with open(config.getStatePath(REFILL_LOCK_NAME), "w") as lockFile:
+        try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return None
+        return refillPool(awsConfigDict, instanceConfigDict, poolSize, djangoProj)
+
+#
+# Start "warmpool.py refill" as a detached background process, which outlives the caller (e.g. launch.py).
+# Its output is appended to the refill log, whose path is returned.
+#
+def startBackgroundRefill(awsSettingsFile, instanceConfigFile, djangoProj=None):
+    '''Start refilling the warm pool in the background, and return the path of its log file.'''
+    logFileName = config.getStatePath(REFILL_LOG_NAME)
+    command = [sys.executable, os.path.abspath(__file__.replace(".pyc", ".py")), "refill",
+               "--aws-settings", os.path.abspath(awsSettingsFile), "--instance-config", os.path.abspath(instanceConfigFile)]
+    if djangoProj is not None:
+        command += ["--django-proj", os.path.abspath(djangoProj)]
+    with open(logFileName, "a") as logFile:
+        subprocess.Popen(command, stdin=open(os.devnull), stdout=logFile, stderr=subprocess.STDOUT, close_fds=True,
+                         cwd=os.path.dirname(os.path.abspath(instanceConfigFile)), preexec_fn=os.setsid)
+    return logFileName
+
+# This will create the command line argument parser and return it
+#
+def create_parser():
+    defaultSettingsFile = os.path.expanduser("~/.aws.settings")
+    parser = argparse.ArgumentParser(
+                        prog=config.getProgName("warmpool.py"),
+                        usage="%(prog)s [-h] [--aws-settings <file>] [--instance-config <file>] [--size <n>] "
+                            "[--django-proj <dir>] (status | refill | drain)",
+                        description="Tool for maintaining a pool of provisioned, stopped, instances for launch.py to start")
+    parser.add_argument('command',
+                        choices=["status", "refill", "drain"],
+                        help="Show the pool's members, top the pool up to its size, or terminate all its members.")
+    parser.add_argument('--aws-settings',
+                        default=defaultSettingsFile,
+                        help="Specify the location of the per-user AWS configuration "
+                            "(default is '.aws.settings' in the user's home directory). These settings contain "
+                            "important keys and should be kept secret at all times.")
+    parser.add_argument('--instance-config',
+                        default='instance.config',
+                        help="Specify the location of the instance configuration file "
+                            "(default is 'instance.config' in the current directory)")
+    parser.add_argument('--size',
+                        type=int,
+                        help="The number of instances to keep in the pool (default is WarmPoolSize in instance.config).")
+    parser.add_argument('--django-proj',
+                        help="The Django project to deploy to new pool members (optional).")
+    return parser
+
+def main(argv=None):
+    '''Show, refill or drain the warm pool, given the command line arguments (sys.argv by default).'''
+    try:
+        parsedArgs = create_parser().parse_args(argv)
+        awsConfigDict = config.readAWSSettings(parsedArgs.aws_settings)
+        instanceConfigDict = config.readInstanceConfig(parsedArgs.instance_config)
+        poolSize = parsedArgs.size if parsedArgs.size is not None else instanceConfigDict['Fleet_WarmPoolSize']
+        if poolSize < 0:
+            raise Exception("Invalid warm pool size: {0}".format(poolSize))
+
+        if parsedArgs.command == "refill":
+            added = refillPoolOnce(awsConfigDict, instanceConfigDict, poolSize, parsedArgs.django_proj)
+            if added is None:
+                print "\nThe warm pool is already being refilled\n"
+            else:
+                print "\nAdded", added, "instances to the warm pool\n"
+            sys.exit(0)
+
+        import aws
+        ec2 = aws.connectEC2(awsConfigDict['EC2_AccessKeyID'],
+                             awsConfigDict['EC2_SecretAccessKey'],
+                             awsConfigDict['EC2_AvailabilityZone'],
+                             awsConfigDict['EC2_Endpoint'])
+        members = findPoolInstances(ec2)
+        if parsedArgs.command == "drain":
+            if len(members) != 0:
+                aws.terminateInstances(ec2, [instance.id for instance in members])
+            print "\nTerminated", len(members), "warm pool instances\n"
+            sys.exit(0)
+    except Exception as mesg:
+        print >>sys.stderr, "Error:", mesg
+        sys.exit(1)
+
+    provisioningHash = config.getProvisioningHash(instanceConfigDict)
+    print "\nWarm pool instances (target size {0}):\n".format(poolSize)
+    for instance in sorted(members, key=lambda instance: instance.id):
+        stale = instance.tags.get(POOL_TAG) != provisioningHash or instance.instance_type != instanceConfigDict['EC2_InstanceType']
+        print "{0:<20} {1:<10} {2:<13} {3}".format(instance.id, instance.state, instance.tags.get(POOL_STATE_TAG, "-"),
+                                                   "stale" if stale else "")
+
+if __name__ == '__main__':
+    main()